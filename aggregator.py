@@ -0,0 +1,464 @@
+#!/usr/bin/python
+
+###############
+### Imports ###
+###############
+
+import calendar
+import datetime
+import socket
+import time
+import traceback
+import pipeline
+
+
+#########################
+### Fleet aggregation ###
+#########################
+
+class fleetAggregator(object):
+    def __init__(self, lateness = 2, onGate = None, maxAhead = 60):
+        """
+        Merge time-aligned samples from many geigerInterface instances into fleet-wide series. Samples are keyed by site, detector and gate, where gate is the UNIX timestamp the gate ended at, so gates shorter than a second stay apart.
+        Gates are held open until the watermark passes them. The watermark trails the newest gate seen by lateness seconds, so samples up to lateness seconds out of order are merged and anything later is counted as late and dropped. onGate is called with each closed gate's results, including the flags of every sample in it combined.
+        Samples more than maxAhead seconds ahead of our own clock are counted as from the future and dropped, so one detector with its clock set wrong can't drag the watermark past everybody else's samples.
+        """
+
+        # How many seconds we hold gates open for stragglers, and how far ahead of our clock we take samples from.
+        self.__lateness = lateness
+        self.__maxAhead = maxAhead
+
+        # Where closed gates go.
+        self.__onGate = onGate
+
+        # Open gates. Each is a dictionary of per-site [sum, max, reporting, flags] lists plus the set of detectors we've seen for it.
+        self.__open = {}
+
+        # Every detector we've ever heard from, by site. Used to work out coverage.
+        self.__known = {}
+
+        # Newest gate we've seen, and the watermark: every gate before it is closed.
+        self.__maxGate = None
+        self.__watermark = None
+
+        # Counters.
+        self.stats = {'records': 0, 'late': 0, 'future': 0, 'duplicate': 0, 'gates': 0}
+
+    def ingest(self, site, detector, gate, counts, flags = 0):
+        """
+        Add one sample. gate is the UNIX timestamp the gate ended at, and flags are the sample's pipeline flags.
+        """
+
+        self.stats['records'] += 1
+
+        # Late data can't be merged any more.
+        if (self.__watermark is not None) and (gate < self.__watermark):
+            self.stats['late'] += 1
+            return
+
+        # Nor can data from a clock that's running ahead.
+        if gate > time.time() + self.__maxAhead:
+            self.stats['future'] += 1
+            return
+
+        # Remember the detector for coverage.
+        try:
+            self.__known[site].add(detector)
+        except KeyError:
+            self.__known[site] = set([detector])
+
+        # Find or open the gate.
+        try:
+            thisGate = self.__open[gate]
+        except KeyError:
+            thisGate = {'sites': {}, 'seen': set()}
+            self.__open[gate] = thisGate
+
+        # Only count each detector once per gate.
+        key = (site, detector)
+
+        if key in thisGate['seen']:
+            self.stats['duplicate'] += 1
+            return
+
+        thisGate['seen'].add(key)
+
+        # Update the site's sum, maximum, reporting count and flags.
+        try:
+            siteAcc = thisGate['sites'][site]
+            siteAcc[0] += counts
+            siteAcc[2] += 1
+            siteAcc[3] |= flags
+
+            if counts > siteAcc[1]:
+                siteAcc[1] = counts
+
+        except KeyError:
+            thisGate['sites'][site] = [counts, counts, 1, flags]
+
+        # Move the watermark if this is the newest gate.
+        if (self.__maxGate is None) or (gate > self.__maxGate):
+            self.__maxGate = gate
+            self.advance(gate - self.__lateness)
+
+        return
+
+    def advance(self, watermark):
+        """
+        Close every open gate before watermark. Call this with the current time less the lateness so a quiet fleet still produces output.
+        """
+
+        if (self.__watermark is not None) and (watermark <= self.__watermark):
+            return
+
+        self.__watermark = watermark
+
+        # Close gates oldest first.
+        for gate in sorted([g for g in self.__open if g < watermark]):
+            self.__emit(gate, self.__open.pop(gate))
+
+        return
+
+    def advanceTime(self, now = None):
+        """
+        Advance the watermark from the wall clock, now being a UNIX timestamp that defaults to the current time.
+        """
+
+        if now is None:
+            now = time.time()
+
+        self.advance(now - self.__lateness)
+
+        return
+
+    def flush(self):
+        """
+        Close every open gate.
+        """
+
+        if len(self.__open) > 0:
+            self.advance(max(self.__open) + 1.0)
+
+        return
+
+    def __emit(self, gate, thisGate):
+        """
+        Build the results for a closed gate and hand them to onGate.
+        """
+
+        sites = {}
+        fleetSum = 0
+        fleetMax = 0
+        fleetReporting = 0
+        fleetKnown = 0
+        fleetFlags = 0
+
+        for site in self.__known:
+            known = len(self.__known[site])
+            fleetKnown += known
+
+            try:
+                siteSum, siteMax, reporting, siteFlags = thisGate['sites'][site]
+            except KeyError:
+                # Nothing from this site at all.
+                siteSum, siteMax, reporting, siteFlags = (0, 0, 0, 0)
+
+            sites[site] = {'sum': siteSum, 'max': siteMax, 'reporting': reporting, 'coverage': float(reporting) / float(known), 'flags': siteFlags}
+
+            fleetSum += siteSum
+            fleetReporting += reporting
+            fleetFlags |= siteFlags
+
+            if siteMax > fleetMax:
+                fleetMax = siteMax
+
+        self.stats['gates'] += 1
+
+        if self.__onGate is not None:
+            self.__onGate({'gate': gate, 'sites': sites, 'fleet': {'sum': fleetSum, 'max': fleetMax, 'reporting': fleetReporting, 'coverage': float(fleetReporting) / float(max(fleetKnown, 1)), 'flags': fleetFlags}})
+
+        return
+
+
+def formatRecord(site, detector, gate, counts, flags = 0):
+    """
+    Build the wire format for one sample: a line with site, detector, gate, counts and flags separated by spaces, the gate to the millisecond. Site and detector names may not contain whitespace.
+    """
+
+    return "%s %s %.3f %d %d\n" %(site, detector, gate, counts, flags)
+
+
+def gateOf(dts):
+    """
+    Get the gate, the UNIX timestamp to the millisecond, of a naive UTC datetime.
+    """
+
+    return round(calendar.timegm(dts.utctimetuple()) + (dts.microsecond / 1e6), 3)
+
+
+##############
+### Server ###
+##############
+
+class aggregatorServer(object):
+    def __init__(self, aggregator, host = "127.0.0.1", port = 5335):
+        """
+        Receive sample datagrams on a UDP socket and feed them to a fleetAggregator. Each datagram holds one or more records as built by formatRecord(). Runs on an asyncio event loop.
+        """
+
+        self.__agg = aggregator
+        self.__host = host
+        self.__port = port
+        self.__transport = None
+
+        # Malformed records.
+        self.badRecords = 0
+
+    def connection_made(self, transport):
+        """
+        asyncio protocol callback. Asks for a large receive buffer so bursts from thousands of detectors at the top of each second aren't dropped.
+        """
+
+        self.__transport = transport
+
+        try:
+            transport.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except:
+            print("Failed to set aggregator receive buffer size: %s" %traceback.format_exc())
+
+    def connection_lost(self, exc):
+        """
+        asyncio protocol callback.
+        """
+
+        return
+
+    def error_received(self, exc):
+        """
+        asyncio protocol callback.
+        """
+
+        return
+
+    def datagram_received(self, data, addr):
+        """
+        Parse and ingest every record in a datagram.
+        """
+
+        for line in data.split(b"\n"):
+            if len(line) == 0:
+                continue
+
+            try:
+                site, detector, gate, counts, flags = line.split(b" ")
+                self.__agg.ingest(site.decode(), detector.decode(), float(gate), int(counts), int(flags))
+
+            except ValueError:
+                self.badRecords += 1
+
+        return
+
+    async def serve(self, tick = 1.0):
+        """
+        Listen until cancelled, advancing the aggregator's watermark from the wall clock every tick seconds.
+        """
+
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(lambda: self, local_addr = (self.__host, self.__port))
+
+        try:
+            while True:
+                await asyncio.sleep(tick)
+                self.__agg.advanceTime()
+
+        finally:
+            transport.close()
+
+
+#############
+### Stage ###
+#############
+
+class aggregatorSinkStage(pipeline.pipelineStage):
+    def __init__(self, site, detector, host = "127.0.0.1", port = 5335, name = "fleet"):
+        """
+        Pipeline stage that sends each gate's counts and the first data stage's flags to an aggregatorServer.
+        """
+
+        super(aggregatorSinkStage, self).__init__(name)
+
+        self.__site = site
+        self.__detector = detector
+        self.__addr = (host, port)
+
+        # Fire-and-forget UDP socket.
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def process(self, smpl):
+        """
+        Send this sample.
+        """
+
+        # Use the flags of the first stage that reported any.
+        flags = 0
+
+        for value in smpl.values():
+            if isinstance(value, dict) and ('flags' in value):
+                flags = value['flags']
+                break
+
+        try:
+            self.__sock.sendto(formatRecord(self.__site, self.__detector, gateOf(smpl['dts']), smpl['counts'], flags).encode(), self.__addr)
+
+        except:
+            print("Failed to send sample to aggregator: %s" %traceback.format_exc())
+
+        return
+
+    def finish(self, summary):
+        """
+        Close the socket.
+        """
+
+        self.__sock.close()
+
+        return
+
+
+#################
+### Benchmark ###
+#################
+
+def benchmark(detectors = 2000, gates = 20, sites = 10, port = 5336, batch = 50):
+    """
+    Measure aggregator throughput over loopback. detectors simulated counters spread over sites each send gates samples, batch records per datagram, with every gate's records shuffled to exercise the reordering buffer. Returns a dictionary of results.
+    """
+
+    import asyncio
+    import random
+
+    results = {'gates': []}
+
+    agg = fleetAggregator(lateness = 2, onGate = results['gates'].append)
+    server = aggregatorServer(agg, port = port)
+
+    async def bench():
+        loop = asyncio.get_running_loop()
+        transport, protocol = await loop.create_datagram_endpoint(lambda: server, local_addr = ("127.0.0.1", port))
+
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rnd = random.Random(1)
+        startGate = int(time.time())
+        sent = 0
+
+        startTime = time.time()
+
+        try:
+            for gate in range(startGate, startGate + gates):
+                records = [formatRecord("site%d" %(d % sites), "det%d" %d, gate, rnd.randrange(0, 100)) for d in range(detectors)]
+                rnd.shuffle(records)
+
+                for i in range(0, len(records), batch):
+                    sender.sendto(''.join(records[i:(i + batch)]).encode(), ("127.0.0.1", port))
+                    sent += len(records[i:(i + batch)])
+
+                    # Let the server drain its socket buffer.
+                    await asyncio.sleep(0)
+
+                # Wait for this gate's datagrams, giving up on any the kernel dropped.
+                drainUntil = time.time() + 1.0
+
+                while (agg.stats['records'] + server.badRecords < sent) and (time.time() < drainUntil):
+                    await asyncio.sleep(0.001)
+
+            agg.flush()
+
+        finally:
+            sender.close()
+            transport.close()
+
+        results['seconds'] = time.time() - startTime
+        results['records'] = agg.stats['records']
+        results['dropped'] = sent - agg.stats['records'] - server.badRecords
+
+    asyncio.run(bench())
+
+    results['recordsPerSec'] = results['records'] / results['seconds']
+    results['stats'] = agg.stats
+
+    return results
+
+
+#######################
+# Main execution body #
+#######################
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    # Set up command line interface.
+    parser = argparse.ArgumentParser(description = "Fleet aggregator for geiger counter instances", epilog = "Counters send samples with counter.py --fleet. Each closed gate is printed with per-site sums, maxima and coverage, the fraction of a site's known detectors that reported.")
+    parser.add_argument('--host', type = str, default = "127.0.0.1", help = 'Address to listen on.')
+    parser.add_argument('--port', type = int, default = 5335, help = 'UDP port to listen on.')
+    parser.add_argument('--lateness', type = float, default = 2, help = 'Seconds to wait for late samples. Defaults to 2.')
+    parser.add_argument('--max-ahead', type = int, default = 60, help = 'Drop samples with gates more than this many seconds ahead of our clock, from detectors with their clocks set wrong. Defaults to 60.')
+    parser.add_argument('--bench', type = int, default = None, help = 'Run a loopback throughput benchmark with this many simulated detectors and exit.')
+    parser.add_argument('--store', choices=['none', 'csv'], default='none', required = False, help = 'Store the fleet-wide sum in a given format.')
+    parser.add_argument('--out', type = str, required = False, default=None, help = 'Output file name. Only has an effect when "--store csv" is set.')
+    args = parser.parse_args()
+
+    if args.bench is not None:
+        res = benchmark(detectors = args.bench)
+        print("Merged %s records into %s gates in %s sec: %s records/sec." %(res['records'], len(res['gates']), round(res['seconds'], 3), round(res['recordsPerSec'])))
+        print("Late %s, from the future %s, duplicate %s, dropped by the kernel %s." %(res['stats']['late'], res['stats']['future'], res['stats']['duplicate'], res['dropped']))
+
+    else:
+        stg = None
+
+        if args.store == "csv":
+            import datalayer
+            stg = datalayer.datalayer('csv', 'fleet')
+
+            if args.out != None:
+                stg.setStorageProps({'fileName': args.out})
+
+        def printGate(res):
+            """
+            Print and store a closed gate.
+            """
+
+            dts = datetime.datetime.utcfromtimestamp(res['gate'])
+
+            print("--")
+            print("%s fleet: %s counts, max %s, coverage %s, flags %s" %(dts.strftime('%Y-%m-%d %H:%M:%S.%f UTC'), res['fleet']['sum'], res['fleet']['max'], round(res['fleet']['coverage'], 3), pipeline.parseFlags(res['fleet']['flags'])))
+
+            for site in sorted(res['sites']):
+                siteRes = res['sites'][site]
+                print("[%s] %s counts, max %s, coverage %s, flags %s" %(site, siteRes['sum'], siteRes['max'], round(siteRes['coverage'], 3), pipeline.parseFlags(siteRes['flags'])))
+
+            if stg is not None:
+                try:
+                    stg.storeDatapoint([dts, res['fleet']['sum'], res['fleet']['flags']])
+                except:
+                    print("Failed to store data point: %s" %traceback.format_exc())
+
+        agg = fleetAggregator(lateness = args.lateness, onGate = printGate, maxAhead = args.max_ahead)
+
+        try:
+            asyncio.run(aggregatorServer(agg, host = args.host, port = args.port).serve())
+
+        except KeyboardInterrupt:
+            print("Caught keyboard interrupt. Quitting.")
+
+        finally:
+            # Close the gates still open and get everything stored on disk.
+            agg.flush()
+
+            if stg is not None:
+                try:
+                    stg.close()
+                except:
+                    print("Failed to close data layer: %s" %traceback.format_exc())
@@ -0,0 +1,444 @@
+###############
+### Imports ###
+###############
+
+import collections
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+import traceback
+import pipeline
+
+
+#############
+### Rules ###
+#############
+
+class alarmRule(object):
+    def __init__(self, name, source = "counter", field = "cpm", holdoff = 0.0):
+        """
+        Template class for alarm rules. A rule watches field in the results of the source pipeline stage, or the raw gate counts if source is "counts", and is either raised or clear.
+        Once a rule clears it won't raise again until holdoff seconds have passed since it last raised. Override check().
+        """
+
+        self.name = name
+        self.source = source
+        self.field = field
+        self.holdoff = holdoff
+
+        # Are we raised, and when did we last raise?
+        self.active = False
+        self.lastRaised = None
+
+    def value(self, smpl):
+        """
+        Get the value this rule watches from a sample.
+        """
+
+        if self.source == "counts":
+            return float(smpl['counts'])
+
+        return smpl[self.source][self.field]
+
+    def check(self, value):
+        """
+        Return True if the rule should be raised for value, False if it should be clear, or None to keep the current state. Hysteresis goes here.
+        """
+
+        return None
+
+    def evaluate(self, smpl, now):
+        """
+        Evaluate the rule against a sample at monotonic time now. Returns "raised" or "cleared" if the state changed, otherwise None.
+        """
+
+        retVal = None
+
+        newState = self.check(self.value(smpl))
+
+        if (newState == True) and (self.active == False):
+            # Respect the hold-off timer.
+            if (self.lastRaised is None) or ((now - self.lastRaised) >= self.holdoff):
+                self.active = True
+                self.lastRaised = now
+                retVal = "raised"
+
+        elif (newState == False) and (self.active == True):
+            self.active = False
+            retVal = "cleared"
+
+        return retVal
+
+
+class thresholdRule(alarmRule):
+    def __init__(self, name, level, clear = None, **kwargs):
+        """
+        Raised when the value reaches level, cleared when it drops below clear, which defaults to level.
+        """
+
+        super(thresholdRule, self).__init__(name, **kwargs)
+
+        self.level = level
+
+        if clear is None:
+            clear = level
+
+        self.clear = clear
+
+    def check(self, value):
+        """
+        Threshold with hysteresis.
+        """
+
+        if value >= self.level:
+            return True
+
+        if value < self.clear:
+            return False
+
+        return None
+
+
+class rateRule(alarmRule):
+    def __init__(self, name, rise, window = 10, clear = None, **kwargs):
+        """
+        Raised when the value has gone up by at least rise over the last window samples, cleared when the rise over the window drops below clear, which defaults to half of rise.
+        """
+
+        super(rateRule, self).__init__(name, **kwargs)
+
+        self.rise = rise
+
+        if clear is None:
+            clear = rise / 2.0
+
+        self.clear = clear
+
+        # The last window + 1 values. The oldest drops off as each new one comes in.
+        self.__values = collections.deque(maxlen = window + 1)
+
+    def check(self, value):
+        """
+        Rate of change with hysteresis.
+        """
+
+        self.__values.append(value)
+
+        # Wait for a full window.
+        if len(self.__values) < self.__values.maxlen:
+            return None
+
+        delta = value - self.__values[0]
+
+        if delta >= self.rise:
+            return True
+
+        if delta < self.clear:
+            return False
+
+        return None
+
+
+class sustainedRule(alarmRule):
+    def __init__(self, name, level, duration = 10, clear = None, **kwargs):
+        """
+        Raised when the value has been at or above level for duration samples in a row, cleared as soon as it drops below clear, which defaults to level.
+        """
+
+        super(sustainedRule, self).__init__(name, **kwargs)
+
+        self.level = level
+        self.duration = duration
+
+        if clear is None:
+            clear = level
+
+        self.clear = clear
+
+        # Samples in a row at or above level.
+        self.__run = 0
+
+    def check(self, value):
+        """
+        Sustained level with hysteresis.
+        """
+
+        if value >= self.level:
+            self.__run += 1
+
+        else:
+            self.__run = 0
+
+        if self.__run >= self.duration:
+            return True
+
+        if value < self.clear:
+            return False
+
+        return None
+
+
+def parseRule(spec):
+    """
+    Build a rule from a command line spec: the kind (threshold, rate or sustained) followed by comma-separated key=value settings, e.g. "threshold,source=fast,level=1000,clear=800,holdoff=60". The rule name defaults to the kind.
+    """
+
+    parts = spec.split(',')
+    kind = parts[0]
+
+    settings = {}
+
+    for part in parts[1:]:
+        key, value = part.split('=', 1)
+        settings[key] = value
+
+    # Common settings.
+    kwargs = {'source': settings.pop('source', 'counter'), 'field': settings.pop('field', 'cpm'), 'holdoff': float(settings.pop('holdoff', 0))}
+    name = settings.pop('name', kind)
+
+    # Everything else is a number.
+    for key in settings:
+        settings[key] = float(settings[key])
+
+    if 'window' in settings:
+        settings['window'] = int(settings['window'])
+
+    if 'duration' in settings:
+        settings['duration'] = int(settings['duration'])
+
+    kwargs.update(settings)
+
+    if kind == "threshold":
+        retVal = thresholdRule(name, **kwargs)
+
+    elif kind == "rate":
+        retVal = rateRule(name, **kwargs)
+
+    elif kind == "sustained":
+        retVal = sustainedRule(name, **kwargs)
+
+    else:
+        raise ValueError("Unknown alarm rule %s." %kind)
+
+    return retVal
+
+
+def checkSources(rules, stageNames):
+    """
+    Make sure every rule watches one of the pipeline stages in stageNames, or the raw counts. Raises ValueError naming the first rule that doesn't, since otherwise it would only fail on the first sample.
+    """
+
+    for rule in rules:
+        if (rule.source != "counts") and (rule.source not in stageNames):
+            raise ValueError("Alarm rule %s watches stage %s, which isn't in the pipeline. Set its source to one of %s." %(rule.name, rule.source, ', '.join(list(stageNames) + ["counts"])))
+
+    return
+
+
+#################
+### Notifiers ###
+#################
+
+class callbackNotifier(object):
+    def __init__(self, callBack):
+        """
+        Call callBack with each alarm event.
+        """
+
+        self.__callBack = callBack
+
+    def notify(self, event):
+        """
+        Deliver an event.
+        """
+
+        self.__callBack(event)
+
+
+class socketNotifier(object):
+    def __init__(self, host = "127.0.0.1", port = 5336):
+        """
+        Send each alarm event as a one-line UDP datagram: rule name, state, value and the UTC time of the sample.
+        """
+
+        self.__addr = (host, port)
+        self.__sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def notify(self, event):
+        """
+        Deliver an event.
+        """
+
+        self.__sock.sendto(("%s %s %s %s\n" %(event['rule'], event['state'], event['value'], event['dts'].strftime('%Y-%m-%dT%H:%M:%S.%f'))).encode(), self.__addr)
+
+
+class execNotifier(object):
+    def __init__(self, command, timeout = 30):
+        """
+        Run a shell command for each alarm event. The event is passed in the GEIGER_ALARM_RULE, GEIGER_ALARM_STATE, GEIGER_ALARM_VALUE and GEIGER_ALARM_DTS environment variables.
+        """
+
+        self.__command = command
+        self.__timeout = timeout
+
+    def notify(self, event):
+        """
+        Deliver an event.
+        """
+
+        env = dict(os.environ)
+        env.update({'GEIGER_ALARM_RULE': event['rule'], 'GEIGER_ALARM_STATE': event['state'], 'GEIGER_ALARM_VALUE': str(event['value']), 'GEIGER_ALARM_DTS': event['dts'].strftime('%Y-%m-%d %H:%M:%S.%f')})
+
+        subprocess.run(self.__command, shell = True, env = env, timeout = self.__timeout)
+
+
+#############
+### Stage ###
+#############
+
+class alarmStage(pipeline.pipelineStage):
+    def __init__(self, rules, notifiers = None, name = "alarm", textOut = True):
+        """
+        Evaluate alarm rules on every sample. State changes are queued to a thread per notifier, so slow notifiers never hold up acquisition or each other.
+        Latency from the hardware poll returning to each notification being delivered is measured. Pulses can land anywhere in the gate, so the worst case from pulse to alarm is that plus one gate.
+        """
+
+        super(alarmStage, self).__init__(name)
+
+        self.__rules = rules
+        self.__textOut = textOut
+
+        # Latency stats in seconds.
+        self.__latCount = 0
+        self.__latSum = 0.0
+        self.__latMax = 0.0
+        self.__latLock = threading.Lock()
+
+        # Each notifier's event queue and thread.
+        self.__workers = []
+
+        if notifiers is not None:
+            for notifier in notifiers:
+                self.addNotifier(notifier)
+
+    def addNotifier(self, notifier):
+        """
+        Add a notifier. Anything with a notify(event) method will do. It gets its own thread.
+        """
+
+        events = queue.Queue()
+
+        thread = threading.Thread(target = self.__notifier, args = (notifier, events), name = "alarmNotifier")
+        thread.daemon = True
+        thread.start()
+
+        self.__workers.append((events, thread))
+
+        return
+
+    def __notifier(self, notifier, events):
+        """
+        Notifier thread. Delivers events to one notifier until it gets None.
+        """
+
+        while True:
+            event = events.get()
+
+            if event is None:
+                break
+
+            try:
+                notifier.notify(event)
+
+            except:
+                print("Alarm notifier failed: %s" %traceback.format_exc())
+
+            # How long since the gate was read?
+            latency = time.monotonic() - event['mono']
+
+            with self.__latLock:
+                self.__latCount += 1
+                self.__latSum += latency
+
+                if latency > self.__latMax:
+                    self.__latMax = latency
+
+        return
+
+    def process(self, smpl):
+        """
+        Evaluate every rule and queue any state changes.
+        """
+
+        now = smpl.get('mono', time.monotonic())
+        active = []
+
+        for rule in self.__rules:
+            change = rule.evaluate(smpl, now)
+
+            if change is not None:
+                value = rule.value(smpl)
+
+                event = {'rule': rule.name, 'state': change, 'value': value, 'dts': smpl['dts'], 'mono': now}
+
+                for events, thread in self.__workers:
+                    events.put(event)
+
+                if self.__textOut == True:
+                    print("ALARM %s %s at %s" %(rule.name, change, round(value, 3)))
+
+            if rule.active == True:
+                active.append(rule.name)
+
+        # Set our alarm flag.
+        if len(active) > 0:
+            self.flags = pipeline.setFlag(self.flags, pipeline.f_alarm, pipeline.f_alarm)
+        else:
+            self.flags = pipeline.setFlag(self.flags, pipeline.f_alarm, 0)
+
+        smpl[self.name] = {'active': active, 'flags': self.flags}
+
+        return
+
+    def checkSources(self, stageNames):
+        """
+        Make sure every rule watches one of the stages in stageNames, or the raw counts. Raises ValueError if not.
+        """
+
+        checkSources(self.__rules, stageNames)
+
+        return
+
+    def getLatency(self):
+        """
+        Get notification latency stats: the number of notifications delivered, counting each notifier, and mean and max seconds from poll to delivery.
+        """
+
+        with self.__latLock:
+            if self.__latCount > 0:
+                retVal = {'count': self.__latCount, 'mean': self.__latSum / self.__latCount, 'max': self.__latMax}
+            else:
+                retVal = {'count': 0, 'mean': None, 'max': None}
+
+        return retVal
+
+    def finish(self, summary):
+        """
+        Drain outstanding notifications, stop the notifiers and report latency.
+        """
+
+        for events, thread in self.__workers:
+            events.put(None)
+
+        for events, thread in self.__workers:
+            thread.join(10)
+
+        summary[self.name] = self.getLatency()
+
+        if (self.__textOut == True) and (summary[self.name]['count'] > 0):
+            print("[%s] %s notifications, poll to delivery mean %s ms, max %s ms (add up to one gate for pulse to alarm)." %(self.name, summary[self.name]['count'], round(summary[self.name]['mean'] * 1000.0, 3), round(summary[self.name]['max'] * 1000.0, 3)))
+
+        return
@@ -1,7 +1,152 @@
+import time
 import traceback
+import pipeline
 from hwInterface import counterIface
 
 
+class gateClock(object):
+	def __init__(self, nominal = 1.0, phaseGain = 0.1, freqGain = 0.01, latency = 0.0):
+		"""
+		Track the gates of a counter with its own clock, like the Arduino, against the host clock. Each gate's arrival time goes to update(), and a phase-locked loop fits the device's gate period and phase so we get corrected gate start and end times and a prediction of when the next gate ends.
+		phaseGain and freqGain set how hard the loop pulls towards phase and period errors, and latency is the expected delay from the end of a gate to the host seeing it.
+		"""
+		
+		self.__nominal = nominal
+		self.__phaseGain = phaseGain
+		self.__freqGain = freqGain
+		self.__latency = latency
+		
+		# Estimated end of the last gate and the gate period, in host seconds.
+		self.edge = None
+		self.period = nominal
+		
+		# Last gate sequence number from the device, if it sends them.
+		self.__lastSeq = None
+		
+		# Gates we noticed were missed or seen twice.
+		self.missed = 0
+		self.repeated = 0
+		
+		# How many gates the last update covered.
+		self.lastGates = 1
+	
+	def getDriftPpm(self):
+		"""
+		Get the device clock's drift against the host clock in parts per million.
+		"""
+		
+		return (self.period - self.__nominal) / self.__nominal * 1e6
+	
+	def update(self, arrival = None, seq = None, seqMod = 256):
+		"""
+		Account for a new gate. arrival is the host time it arrived, or None if we don't know, e.g. it was sitting in a buffer. seq is the device's gate sequence number, which wraps at seqMod, if it sends one.
+		Returns the corrected (start, end) of the gate as UNIX timestamps, or None if it's the same gate as last time.
+		"""
+		
+		# First gate. Take it as it comes.
+		if self.edge is None:
+			if arrival is None:
+				arrival = time.time()
+			
+			self.edge = arrival - self.__latency
+			self.__lastSeq = seq
+			
+			return (self.edge - self.period, self.edge)
+		
+		# How many gates since the last one?
+		if (seq is not None) and (self.__lastSeq is not None):
+			gates = (seq - self.__lastSeq) % seqMod
+			
+			if gates == 0:
+				# We've seen this one.
+				self.repeated += 1
+				
+				return None
+		
+		elif arrival is not None:
+			gates = max(1, int(round((arrival - self.__latency - self.edge) / self.period)))
+		
+		else:
+			gates = 1
+		
+		self.__lastSeq = seq
+		self.missed += gates - 1
+		self.lastGates = gates
+		
+		# Where we expected this gate to end.
+		predicted = self.edge + (gates * self.period)
+		
+		if arrival is not None:
+			# Steer phase and period towards what we saw.
+			err = (arrival - self.__latency) - predicted
+			
+			self.edge = predicted + (self.__phaseGain * err)
+			self.period += self.__freqGain * err / gates
+		
+		else:
+			# Free-run on our estimate.
+			self.edge = predicted
+		
+		return (self.edge - self.period, self.edge)
+	
+	def nextEdge(self):
+		"""
+		Get the predicted host time the next gate ends, or None before the first gate.
+		"""
+		
+		if self.edge is None:
+			return None
+		
+		return self.edge + self.period
+
+
+class wideCounter(object):
+	def __init__(self, bits = 32):
+		"""
+		Extend a free-running hardware counter that wraps at 2**bits, like the Arduino's cascaded SN74LV8154, into a 64-bit total. Deltas between readings are taken modulo 2**bits so they stay right when the counter wraps, as long as fewer than 2**(bits - 1) counts come in between readings.
+		A bigger jump can't be told apart from the counter going backwards, e.g. when the Arduino restarts, so it's taken to be a reset and flagged as an overflow.
+		"""
+		
+		self.__mod = 1 << bits
+		
+		# Last raw reading.
+		self.__last = None
+		
+		# 64-bit running total, and how many times we've wrapped or overflowed.
+		self.total = 0
+		self.wraps = 0
+		self.overflows = 0
+	
+	def update(self, raw):
+		"""
+		Add a raw counter reading. Returns the counts since the last reading and pipeline.f_counter flags, or None and no flags for the first reading.
+		"""
+		
+		flags = 0
+		
+		if self.__last is None:
+			self.__last = raw
+			
+			return (None, flags)
+		
+		delta = (raw - self.__last) % self.__mod
+		
+		if delta >= (self.__mod >> 1):
+			# Assume the counter restarted from zero.
+			delta = raw
+			flags |= pipeline.f_counter_overflow
+			self.overflows += 1
+		
+		elif raw < self.__last:
+			flags |= pipeline.f_counter_wrap
+			self.wraps += 1
+		
+		self.__last = raw
+		self.total = (self.total + delta) & 0xffffffffffffffff
+		
+		return (delta, flags)
+
+
 class arduSerHardware(counterIface):	
 	def setDebug(self, debugOn):
 		"""
@@ -62,7 +207,7 @@ class arduSerHardware(counterIface):
 		try:
 			self.__serialPort
 		
-		except NameError:
+		except AttributeError:
 			# Default to this because Arduinos show up as ttyACM0
 			self.__serialPort = '/dev/ttyACM0'
 			
@@ -75,7 +220,7 @@ class arduSerHardware(counterIface):
 		try:
 			self.__serialBaud
 		
-		except NameError:
+		except AttributeError:
 			# Which bus is this on?
 			self.__serialBaud = 115200
 			
@@ -93,7 +238,22 @@ class arduSerHardware(counterIface):
 		except:
 			raise
 		
+		# Track the Arduino's gates. A CPS line takes a couple of ms to cross the wire.
+		self.__clock = gateClock(latency = 0.003)
+		self.__gateTimes = None
+		self.__behind = False
+		
+		# Extend the Arduino's 32-bit total.
+		self.__wide = wideCounter()
+		self.__counterFlags = 0
+		
+		# Longest CPS line we've seen, for working out how many the serial buffer holds.
+		self.__lineBytes = 40
+		
 		return
+	
+	# Bytes of received data the kernel buffers for a serial port.
+	__ttyBuffer = 4096
 
 
 	def getConfig(self):
@@ -127,31 +287,137 @@ class arduSerHardware(counterIface):
 		# Keep going until we get a line we want...
 		while noLine:
 			try:
+				# Was there already a whole line waiting? If so we don't know when it arrived.
+				waiting = self.__ser.in_waiting
+				
 				# Wait for a line we're interested in...
-				thisLine = self.__ser.readline()
+				thisLine = self.__ser.readline().decode('ascii', 'replace')
+				
+				if waiting >= len(thisLine):
+					arrival = None
+				else:
+					arrival = time.time()
+				
+				# Lines left over from before we started aren't part of the run.
+				if (arrival is None) and (self.__clock.edge is None):
+					continue
 				
 				# See if we can find he CPS line.
 				foundAt = thisLine.find("CPS: ")
 				
 				# Nailed it!
 				if foundAt == 0:
-					# Got a CPM message.
-					noLine = False
+					self.__lineBytes = max(self.__lineBytes, len(thisLine))
+					
+					# Make sure we properly type-convert our counts per second. Newer firmware sends a gate sequence number too.
+					parts = thisLine.split()
+					
+					seq = None
+					
+					if len(parts) >= 4:
+						seq = int(parts[3])
+					
+					# Line the gate up with our clock, skipping it if we've already had it.
+					gateTimes = self.__clock.update(arrival, seq)
+					
+					if gateTimes is not None:
+						# Got a CPM message.
+						noLine = False
 			
 			except:
 				raise
 		
 		try:
-			# Make sure we properly type-convert our counts per second.
-			parts = thisLine.split(" ")
-			
 			# Try to grab the number coming across as an integer.
 			retVal = int(parts[1])
+			
+			self.__gateTimes = gateTimes
+			
+			# Newer firmware sends its free-running 32-bit total as well. The counts for the gate come from the Arduino, and we keep the 64-bit total, which includes any gates we missed.
+			if len(parts) >= 6:
+				delta, self.__counterFlags = self.__wide.update(int(parts[5]))
+			
+			# If we were behind we'll catch up on the next poll.
+			self.__behind = (arrival is None)
 		
 		except:
 			raise
 		
 		return retVal
+	
+	def pollBlock(self):
+		"""
+		Read every gate line waiting in the serial port's buffer, then wait in readline() for the next line to arrive so the gate clock stays locked to the Arduino. Lines the kernel buffered while we slept keep their own gates, timed from the gate clock.
+		"""
+		
+		counts = []
+		ends = []
+		gateLens = []
+		counterFlags = 0
+		
+		while True:
+			counts.append(self.poll())
+			ends.append(self.__gateTimes[1])
+			gateLens.append(self.__gateTimes[1] - self.__gateTimes[0])
+			counterFlags |= self.__counterFlags
+			
+			# Stop at the first line we saw arrive.
+			if self.__behind == False:
+				break
+		
+		self.__counterFlags = counterFlags
+		
+		return (counts, ends, gateLens)
+	
+	def getBufferSeconds(self):
+		"""
+		Get how many seconds of gate lines the kernel's serial buffer holds, leaving half of it spare.
+		"""
+		
+		return (self.__ttyBuffer // self.__lineBytes) * self.__clock.period / 2.0
+	
+	def getGateTimes(self):
+		"""
+		Get the start and end of the last polled gate on the host clock.
+		"""
+		
+		return self.__gateTimes
+	
+	def getNextPoll(self):
+		"""
+		Wake a little before the Arduino's next gate is due so readline() catches the line as it arrives. If the last line was already waiting for us, poll again straight away.
+		"""
+		
+		nextEdge = self.__clock.nextEdge()
+		
+		if nextEdge is None:
+			return None
+		
+		if self.__behind == True:
+			return time.time()
+		
+		return nextEdge - 0.05
+	
+	def getClock(self):
+		"""
+		Get the gateClock tracking the Arduino.
+		"""
+		
+		return self.__clock
+	
+	def getCounterFlags(self):
+		"""
+		Get the counter flags for the last gate.
+		"""
+		
+		return self.__counterFlags
+	
+	def getTotal(self):
+		"""
+		Get the 64-bit total count since we started.
+		"""
+		
+		return self.__wide.total
 
 	def cleanup(self):
 		"""
@@ -160,6 +426,7 @@ class arduSerHardware(counterIface):
 		
 		if self._debug == True:
 			print("Counter hardware cleanup...")
+			print("Gate period %s s (%s ppm), %s gates missed, %s repeated." %(round(self.__clock.period, 6), round(self.__clock.getDriftPpm(), 1), self.__clock.missed, self.__clock.repeated))
 		
 		try:
 			# Close the serial port.
@@ -234,12 +501,12 @@ class arduI2cHardware(counterIface):
 			import quick2wire.i2c as qI2c
 		
 		except:
-			raise RuntimeError("To interface with the Arduino 16-bit I2C counter please ensure the python library quick2wire is installed.")
+			raise RuntimeError("To interface with the Arduino I2C counter please ensure the python library quick2wire is installed.")
 		
 		try:
-			self.__myAddr
+			self.__i2cAddr
 		
-		except NameError:
+		except AttributeError:
 			self.__i2cAddr = 0x35
 			
 			if self._debug == True:
@@ -251,7 +518,7 @@ class arduI2cHardware(counterIface):
 		try:
 			self.__i2cBus
 		
-		except NameError:
+		except AttributeError:
 			# Which bus is this on?
 			self.__i2cBus = 1
 			
@@ -263,12 +530,26 @@ class arduI2cHardware(counterIface):
 		try:
 			# Set up I2C master.
 			self.__i2cMaster = qI2c.I2CMaster(self.__i2cBus)
+			self.__qI2c = qI2c
 		
 		except:
 			raise
 		
+		# Track the Arduino's gates. We see a new gate on the first poll after it ends, so on average half a retry late.
+		self.__clock = gateClock(latency = self.__retryDelay / 2.0)
+		self.__gateTimes = None
+		self.__lastSeq = None
+		
+		# Extend the Arduino's 32-bit total.
+		self.__wide = wideCounter()
+		self.__counterFlags = 0
+		
 		return
 	
+	# Seconds between polls while waiting for a new gate, and how long to wait at most.
+	__retryDelay = 0.01
+	__retryMax = 2.0
+	
 	def getConfig(self):
 		"""
 		Get current configuration of the hardware as a string.
@@ -303,20 +584,99 @@ class arduI2cHardware(counterIface):
 		if self._debug == True:
 			print("Poll counter hardware...")
 		
-		try:
-			# Get I2C transaction data.
-			counterReturn = self.__i2cMaster.transaction(self.__i2c.reading(self.__i2cAddr, 2))
+		giveUp = time.time() + self.__retryMax
 		
-		except:
-			raise
-		
-		try:
-			#TESTME: Actually test this when test hardware is set up.
-			counterBytes = bytearray(counterReturn[0])
+		# Poll until the gate sequence number moves on, so we know when the gate ended.
+		while True:
+			try:
+				# Get I2C transaction data.
+				counterReturn = self.__i2cMaster.transaction(self.__qI2c.reading(self.__i2cAddr, 5))
+				arrival = time.time()
 			
-			# Build the 16 bit integer from the counter bytes.
-			retVal = (counterBytes[0] << 8) | counterBytes[1]
-		except:
-			raise
+			except:
+				raise
+			
+			try:
+				#TESTME: Actually test this when test hardware is set up.
+				counterBytes = bytearray(counterReturn[0])
+				
+				# Build the 32 bit total from the counter bytes. The fifth byte is the gate sequence number.
+				total = (counterBytes[0] << 24) | (counterBytes[1] << 16) | (counterBytes[2] << 8) | counterBytes[3]
+				seq = counterBytes[4]
+			except:
+				raise
+			
+			# The gate that's there when we start ended at some time we don't know, so wait for the next one.
+			if self.__lastSeq is None:
+				self.__lastSeq = seq
+				self.__wide.update(total)
+			
+			elif seq != self.__lastSeq:
+				break
+			
+			if arrival >= giveUp:
+				# The Arduino's gone quiet. Flag the count so nobody trusts it.
+				if self._debug == True:
+					print("No new gate from the Arduino in %s sec." %self.__retryMax)
+				
+				self.__counterFlags = pipeline.f_counter_overflow
+				
+				# Stamp the empty gate on the host clock, from the end of the last gate we saw or when we started waiting.
+				if self.__gateTimes is not None:
+					self.__gateTimes = (self.__gateTimes[1], arrival)
+				
+				else:
+					self.__gateTimes = (giveUp - self.__retryMax, arrival)
+				
+				return retVal
+			
+			time.sleep(self.__retryDelay)
+		
+		self.__lastSeq = seq
+		self.__gateTimes = self.__clock.update(arrival, seq)
+		
+		# Counts since the last gate we saw, shared out if we missed some, with what doesn't share out evenly going in this gate.
+		delta, self.__counterFlags = self.__wide.update(total)
+		retVal = (delta // self.__clock.lastGates) + (delta % self.__clock.lastGates)
+		
+		return retVal
+	
+	def getGateTimes(self):
+		"""
+		Get the start and end of the last polled gate on the host clock.
+		"""
+		
+		return self.__gateTimes
+	
+	def getNextPoll(self):
+		"""
+		Start polling a little before the Arduino's next gate is due.
+		"""
+		
+		nextEdge = self.__clock.nextEdge()
+		
+		if nextEdge is None:
+			return None
+		
+		return nextEdge - 0.03
+	
+	def getClock(self):
+		"""
+		Get the gateClock tracking the Arduino.
+		"""
+		
+		return self.__clock
+	
+	def getCounterFlags(self):
+		"""
+		Get the counter flags for the last gate.
+		"""
+		
+		return self.__counterFlags
+	
+	def getTotal(self):
+		"""
+		Get the 64-bit total count since we started.
+		"""
 		
-		return retVal
\ No newline at end of file
+		return self.__wide.total
@@ -0,0 +1,228 @@
+###############
+### Imports ###
+###############
+
+import array
+import math
+import pipeline
+import traceback
+
+
+################
+### Baseline ###
+################
+
+class todBaseline(object):
+    def __init__(self, bins = 96, halfLife = 7.0, minDays = 1.0):
+        """
+        Learned time-of-day baseline. The day is split into bins, 15 minutes each by default, and each bin keeps an exponentially decayed mean and variance of the readings that fall in it, so a daily pattern such as radon building up overnight becomes the expected value. Old days fade with a half life of halfLife days.
+        Expected values are interpolated between the two nearest bin centres. A bin is ready once it has seen minDays days of readings.
+        Everything is in three arrays of bins doubles, and adding or scoring a reading is O(1).
+        """
+
+        self.__bins = bins
+        self.__binSeconds = 86400.0 / bins
+        self.__halfLife = halfLife
+        self.__minSeconds = minDays * self.__binSeconds
+
+        # Mean, variance and seconds of readings seen, by bin.
+        self.__mean = array.array('d', [0.0] * bins)
+        self.__var = array.array('d', [0.0] * bins)
+        self.__seconds = array.array('d', [0.0] * bins)
+
+    def __position(self, tod):
+        """
+        Get the two bins either side of tod, seconds since midnight, and how far tod is from the first towards the second.
+        """
+
+        pos = (tod / self.__binSeconds) - 0.5
+        first = math.floor(pos)
+
+        return (int(first) % self.__bins, int(first + 1) % self.__bins, pos - first)
+
+    def expect(self, tod):
+        """
+        Get the expected value and variance at tod, seconds since midnight, or None if the bins either side aren't ready yet.
+        """
+
+        lo, hi, frac = self.__position(tod)
+
+        if (self.__seconds[lo] < self.__minSeconds) or (self.__seconds[hi] < self.__minSeconds):
+            return None
+
+        return ((self.__mean[lo] * (1.0 - frac)) + (self.__mean[hi] * frac), (self.__var[lo] * (1.0 - frac)) + (self.__var[hi] * frac))
+
+    def add(self, tod, x, duration = 1.0, clip = None):
+        """
+        Add a reading x covering duration seconds at tod, seconds since midnight, to its bin. With clip set, readings more than clip standard deviations from the bin's mean are pulled in to clip standard deviations first, so anomalies don't teach the baseline that they're normal.
+        """
+
+        i = int(tod / self.__binSeconds) % self.__bins
+
+        self.__seconds[i] += duration
+
+        # Decay so a day's worth of readings in the bin halves the weight of older ones over halfLife days. Until there's that much history it's a plain average.
+        alpha = max(1.0 - (0.5 ** (duration / (self.__halfLife * self.__binSeconds))), duration / self.__seconds[i])
+
+        mean = self.__mean[i]
+        var = self.__var[i]
+
+        if (clip is not None) and (self.__seconds[i] > self.__minSeconds) and (var > 0.0):
+            sd = math.sqrt(var)
+            x = min(max(x, mean - (clip * sd)), mean + (clip * sd))
+
+        diff = x - mean
+        incr = alpha * diff
+
+        self.__mean[i] = mean + incr
+        self.__var[i] = (1.0 - alpha) * (var + (diff * incr))
+
+        return
+
+    def getState(self):
+        """
+        Get the bins for a checkpoint.
+        """
+
+        return {'bins': self.__bins, 'mean': self.__mean.tolist(), 'var': self.__var.tolist(), 'seconds': self.__seconds.tolist()}
+
+    def setState(self, state):
+        """
+        Restore bins from getState(). They must have been saved with the same number of bins.
+        """
+
+        if state['bins'] != self.__bins:
+            raise ValueError("Baseline has %s bins, not %s." %(state['bins'], self.__bins))
+
+        self.__mean = array.array('d', state['mean'])
+        self.__var = array.array('d', state['var'])
+        self.__seconds = array.array('d', state['seconds'])
+
+        return
+
+
+#############
+### Stage ###
+#############
+
+class baselineStage(pipeline.pipelineStage):
+    def __init__(self, source = None, name = "baseline", bins = 96, halfLife = 7.0, minDays = 1.0, zLimit = 4.0, stateFile = None, saveEvery = 300, textOut = True):
+        """
+        Anomaly scoring against a learned time-of-day baseline, see todBaseline. Each sample's rate, from the source stage if given or the raw counts otherwise, is scored as standard deviations from what's expected at that time of day, and the anomaly flag is set while the score is at least zLimit either way.
+        The score is 0 until the baseline is ready. To keep the baseline from one run to the next, give a stateFile: it's loaded now if it exists and saved every saveEvery samples and at the end of the run.
+        """
+
+        super(baselineStage, self).__init__(name)
+
+        self.__source = source
+        self.__zLimit = zLimit
+        self.__textOut = textOut
+        self.__baseline = todBaseline(bins = bins, halfLife = halfLife, minDays = minDays)
+
+        self.__ckpt = None
+        self.__saveEvery = saveEvery
+        self.__sinceSave = 0
+
+        # Anomalous samples this run.
+        self.__anomalies = 0
+
+        if stateFile is not None:
+            import checkpoint
+
+            self.__ckpt = checkpoint.checkpoint(stateFile)
+            state = self.__ckpt.load()
+
+            if state is not None:
+                self.__baseline.setState(state)
+
+    def process(self, smpl):
+        """
+        Score this sample against the baseline, then learn from it.
+        """
+
+        duration = smpl.get('gateLen', 1.0)
+
+        if self.__source is not None:
+            x = smpl[self.__source]['cps']
+        else:
+            x = float(smpl['counts']) / duration
+
+        dts = smpl['dts']
+        tod = (dts.hour * 3600.0) + (dts.minute * 60.0) + dts.second + (dts.microsecond / 1e6)
+
+        expected = self.__baseline.expect(tod)
+        oldFlags = self.flags
+
+        if (expected is not None) and (expected[1] > 0.0):
+            score = (x - expected[0]) / math.sqrt(expected[1])
+
+            if abs(score) >= self.__zLimit:
+                self.flags = self.flags | pipeline.f_anomaly
+                self.__anomalies += 1
+            else:
+                self.flags = self.flags & ~pipeline.f_anomaly
+
+            smpl[self.name] = {'score': score, 'expectedCpm': expected[0] * 60.0, 'ready': True, 'flags': self.flags}
+
+        else:
+            smpl[self.name] = {'score': 0.0, 'expectedCpm': None, 'ready': False, 'flags': self.flags}
+
+        if (self.__textOut == True) and (oldFlags != self.flags):
+            print("[%s] Readings are %s the time-of-day baseline (score %s)." %(self.name, "anomalous against" if (self.flags & pipeline.f_anomaly) else "back within", round(smpl[self.name]['score'], 3)))
+
+        self.__baseline.add(tod, x, duration, clip = self.__zLimit)
+
+        # Keep the baseline for the next run.
+        if self.__ckpt is not None:
+            self.__sinceSave += 1
+
+            if self.__sinceSave >= self.__saveEvery:
+                self.__save()
+
+        return
+
+    def __save(self):
+        """
+        Save the baseline to its file, reporting but not raising errors.
+        """
+
+        self.__sinceSave = 0
+
+        try:
+            self.__ckpt.save(self.__baseline.getState())
+        except:
+            print("Failed to save baseline: %s" %traceback.format_exc())
+
+        return
+
+    def getState(self):
+        """
+        Save the baseline and flags.
+        """
+
+        return {'baseline': self.__baseline.getState(), 'flags': self.flags}
+
+    def setState(self, state):
+        """
+        Restore the baseline and flags.
+        """
+
+        self.__baseline.setState(state['baseline'])
+        self.flags = state['flags']
+
+        return
+
+    def finish(self, summary):
+        """
+        Save the baseline and report how many samples were anomalous.
+        """
+
+        if self.__ckpt is not None:
+            self.__save()
+
+        summary[self.name] = {'anomalies': self.__anomalies}
+
+        if self.__textOut == True:
+            print("[%s] %s anomalous samples." %(self.name, self.__anomalies))
+
+        return
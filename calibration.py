@@ -0,0 +1,389 @@
+###############
+### Imports ###
+###############
+
+import json
+import math
+import pipeline
+import traceback
+
+
+###################
+### Calibration ###
+###################
+
+class calibration(object):
+    def __init__(self, profile, name = None):
+        """
+        A detector's calibration, from a profile dictionary such as one detector's entry in a profile file, see loadProfiles(). Count rates become dose rates in uSv/h in three steps:
+        Dead time: 'deadTime' is the tube's dead time in seconds and 'deadTimeModel' "nonparalyzable", the default, or "paralyzable". Measured rates are corrected up to true rates. Rates too high to correct are saturated, and are held at the highest rate that can be corrected, so their dose rate is a lower bound.
+        Response: 'response' turns true CPM, less 'background', the tube's own background in CPM, into uSv/h. {"type": "linear", "factor": f} is f uSv/h per CPM, {"type": "piecewise", "breaks": [...], "factors": [...]} uses factors[i] from breaks[i] CPM up to breaks[i + 1], and {"type": "table", "cpm": [...], "usvh": [...]} interpolates a measured response curve, carrying its end segments on past it. A plain 'factor' is short for a linear response.
+        Energy compensation: dose rates are multiplied by 'energyFactor', 1 by default, e.g. for an uncompensated tube measuring a different source from the one it was calibrated with.
+        Every method works on NumPy arrays as well as single values, so years of archived data convert in one go.
+        """
+
+        import numpy as np
+
+        self.name = name
+        self.__profile = profile
+
+        self.__deadTime = float(profile.get('deadTime', 0.0))
+        self.__paralyzable = (profile.get('deadTimeModel', "nonparalyzable") == "paralyzable")
+        self.__background = float(profile.get('background', 0.0))
+        self.__energyFactor = float(profile.get('energyFactor', 1.0))
+
+        if profile.get('deadTimeModel', "nonparalyzable") not in ("nonparalyzable", "paralyzable"):
+            raise ValueError("Unknown dead time model %s." %profile['deadTimeModel'])
+
+        if self.__deadTime < 0.0:
+            raise ValueError("Dead time can't be negative.")
+
+        # Highest measured rate in CPS we can correct: a non-paralyzable tube never counts 1 / deadTime, and a paralyzable one counts at most 1 / (e * deadTime). Keep a little way short of the non-paralyzable limit, where the correction blows up.
+        if self.__deadTime == 0.0:
+            self.__maxCps = math.inf
+        elif self.__paralyzable == True:
+            self.__maxCps = 1.0 / (math.e * self.__deadTime)
+        else:
+            self.__maxCps = 0.99 / self.__deadTime
+
+        if 'response' in profile:
+            response = profile['response']
+        elif 'factor' in profile:
+            response = {'type': "linear", 'factor': profile['factor']}
+        else:
+            raise ValueError("Calibration profile %s has no response." %name)
+
+        self.__responseType = response.get('type', "linear")
+
+        if self.__responseType == "linear":
+            self.__factor = float(response['factor'])
+
+        elif self.__responseType == "piecewise":
+            self.__breaks = np.asarray(response['breaks'], dtype = np.float64)
+            self.__factors = np.asarray(response['factors'], dtype = np.float64)
+
+            if (len(self.__breaks) != len(self.__factors)) or (len(self.__breaks) == 0) or np.any(np.diff(self.__breaks) <= 0.0):
+                raise ValueError("A piecewise response needs a factor for each of its breaks, in increasing order.")
+
+        elif self.__responseType == "table":
+            self.__tableCpm = np.asarray(response['cpm'], dtype = np.float64)
+            self.__tableUsvh = np.asarray(response['usvh'], dtype = np.float64)
+
+            if (len(self.__tableCpm) != len(self.__tableUsvh)) or (len(self.__tableCpm) < 2) or np.any(np.diff(self.__tableCpm) <= 0.0):
+                raise ValueError("A response table needs at least two points, in increasing order of CPM.")
+
+        else:
+            raise ValueError("Unknown response type %s." %self.__responseType)
+
+    def getProfile(self):
+        """
+        Get the profile we were made from.
+        """
+
+        return self.__profile
+
+    def saturated(self, cps):
+        """
+        Get whether measured rates in counts per second are too high to correct for dead time.
+        """
+
+        import numpy as np
+
+        return np.asarray(cps, dtype = np.float64) > self.__maxCps
+
+    def trueRate(self, cps):
+        """
+        Correct measured rates in counts per second for dead time. Saturated rates are corrected as if they were at the highest rate that can be.
+        """
+
+        import numpy as np
+
+        m = np.minimum(np.maximum(np.asarray(cps, dtype = np.float64), 0.0), self.__maxCps)
+        tau = self.__deadTime
+
+        if tau == 0.0:
+            return m
+
+        if self.__paralyzable == False:
+            return m / (1.0 - (m * tau))
+
+        # Solve m = n * exp(-n * tau) for the true rate n below 1 / tau. Newton's method from n = m climbs to the root without overshooting, since n - m * exp(n * tau) is concave.
+        n = m.copy()
+
+        for i in range(50):
+            grow = m * np.exp(n * tau)
+            step = (n - grow) / np.maximum(1.0 - (grow * tau), 1e-12)
+            n = np.minimum(n - step, 1.0 / tau)
+
+            if np.all(np.abs(step) <= 1e-9 * np.maximum(n, 1.0)):
+                break
+
+        return n
+
+    def response(self, cpm):
+        """
+        Turn true rates in CPM, after any background is taken off, into uSv/h before energy compensation.
+        """
+
+        import numpy as np
+
+        cpm = np.asarray(cpm, dtype = np.float64)
+
+        if self.__responseType == "linear":
+            return cpm * self.__factor
+
+        if self.__responseType == "piecewise":
+            return cpm * self.__factors[np.clip(np.searchsorted(self.__breaks, cpm, side = 'right') - 1, 0, len(self.__factors) - 1)]
+
+        # Interpolate the table, carrying the end segments on past it.
+        x = self.__tableCpm
+        y = self.__tableUsvh
+        lo = y[0] + ((cpm - x[0]) * (y[1] - y[0]) / (x[1] - x[0]))
+        hi = y[-1] + ((cpm - x[-1]) * (y[-1] - y[-2]) / (x[-1] - x[-2]))
+
+        return np.where(cpm < x[0], lo, np.where(cpm > x[-1], hi, np.interp(cpm, x, y)))
+
+    def doseRate(self, cps):
+        """
+        Turn measured rates in counts per second into dose rates in uSv/h.
+        """
+
+        import numpy as np
+
+        cpm = np.maximum((self.trueRate(cps) * 60.0) - self.__background, 0.0)
+
+        return self.response(cpm) * self.__energyFactor
+
+
+def loadProfiles(fileName):
+    """
+    Load calibration profiles from a JSON file: either one profile, see calibration, for every detector, or an object of profiles by detector name, e.g. "default" for the main tube and "counter1" or "tube1" for others. Returns a dictionary of calibration instances by detector name, with a lone profile under "default".
+    """
+
+    with open(fileName, 'r') as profileFile:
+        profiles = json.load(profileFile)
+
+    if ('response' in profiles) or ('factor' in profiles):
+        profiles = {'default': profiles}
+
+    return dict([(name, calibration(profile, name)) for name, profile in profiles.items()])
+
+
+def getCalibration(calibs, detector):
+    """
+    Get detector's calibration from loadProfiles()' result, or the "default" one if it hasn't got its own.
+    """
+
+    if detector in calibs:
+        return calibs[detector]
+
+    if 'default' in calibs:
+        return calibs['default']
+
+    raise ValueError("No calibration for %s and no default." %detector)
+
+
+#############
+### Stage ###
+#############
+
+class doseStage(pipeline.pipelineStage):
+    def __init__(self, calib, source = None, name = "dose", textOut = True):
+        """
+        Dose rate stage. Turns each sample's rate, from the source stage if given or the raw counts otherwise, into uSv/h with calib, a calibration instance, and keeps a running total dose. The raw counts give the best dead time correction, since averages of rates that need correcting aren't quite the rates of averages.
+        Saturated readings, too fast to correct for dead time, get the f_saturated flag and a dose rate that's a lower bound. That's the only flag we keep, so it can be stored with other stages' data points.
+        """
+
+        super(doseStage, self).__init__(name)
+
+        self.__calib = calib
+        self.__source = source
+        self.__textOut = textOut
+
+        # Run totals: dose in uSv, seconds, highest dose rate and saturated samples.
+        self.__doseUsv = 0.0
+        self.__seconds = 0.0
+        self.__maxUsvh = None
+        self.__saturated = 0
+
+    def process(self, smpl):
+        """
+        Convert this sample's rate.
+        """
+
+        duration = smpl.get('gateLen', 1.0)
+
+        if self.__source is not None:
+            cps = smpl[self.__source]['cps']
+        else:
+            cps = float(smpl['counts']) / duration
+
+        usvh = float(self.__calib.doseRate(cps))
+        saturated = bool(self.__calib.saturated(cps))
+
+        if saturated == True:
+            self.flags = self.flags | pipeline.f_saturated
+            self.__saturated += 1
+        else:
+            self.flags = self.flags & ~pipeline.f_saturated
+
+        self.__add(usvh * duration / 3600.0, duration, usvh)
+
+        smpl[self.name] = {'usvh': usvh, 'cpmTrue': float(self.__calib.trueRate(cps)) * 60.0, 'saturated': saturated, 'flags': self.flags}
+
+        return
+
+    def processBlock(self, blk):
+        """
+        Convert a block's rates in one go.
+        """
+
+        import numpy
+
+        n = blk['n']
+
+        if n == 0:
+            return
+
+        if self.__source is not None:
+            cps = numpy.asarray(blk[self.__source]['cps'], dtype = numpy.float64)
+        else:
+            cps = blk['counts'] / blk['gateLen']
+
+        usvh = self.__calib.doseRate(cps)
+        saturated = self.__calib.saturated(cps)
+        flags = numpy.where(saturated, self.flags | pipeline.f_saturated, self.flags & ~pipeline.f_saturated)
+
+        self.flags = int(flags[-1])
+        self.__saturated += int(saturated.sum())
+        self.__add(float((usvh * blk['gateLen']).sum()) / 3600.0, float(blk['gateLen'].sum()), float(usvh.max()))
+
+        blk[self.name] = {'usvh': usvh, 'cpmTrue': self.__calib.trueRate(cps) * 60.0, 'saturated': saturated, 'flags': flags}
+
+        return
+
+    def __add(self, doseUsv, seconds, maxUsvh):
+        """
+        Add to the run totals.
+        """
+
+        self.__doseUsv += doseUsv
+        self.__seconds += seconds
+
+        if (self.__maxUsvh is None) or (maxUsvh > self.__maxUsvh):
+            self.__maxUsvh = maxUsvh
+
+        return
+
+    def getState(self):
+        """
+        Save the run totals and flags.
+        """
+
+        return {'doseUsv': self.__doseUsv, 'seconds': self.__seconds, 'maxUsvh': self.__maxUsvh, 'saturated': self.__saturated, 'flags': self.flags}
+
+    def setState(self, state):
+        """
+        Restore the run totals and flags.
+        """
+
+        self.__doseUsv = state['doseUsv']
+        self.__seconds = state['seconds']
+        self.__maxUsvh = state['maxUsvh']
+        self.__saturated = state['saturated']
+        self.flags = state['flags']
+
+        return
+
+    def finish(self, summary):
+        """
+        Report the total dose and mean and highest dose rates over the run.
+        """
+
+        if self.__seconds > 0.0:
+            summary[self.name] = {'doseUsv': self.__doseUsv, 'meanUsvh': self.__doseUsv * 3600.0 / self.__seconds, 'maxUsvh': self.__maxUsvh, 'saturated': self.__saturated, 'seconds': self.__seconds, 'detector': self.__calib.name}
+
+            if self.__textOut == True:
+                print("[%s] Dose %s uSv in %s sec., mean %s uSv/h, max %s uSv/h, %s saturated samples." %(self.name, round(self.__doseUsv, 6), round(self.__seconds, 3), round(summary[self.name]['meanUsvh'], 4), round(self.__maxUsvh, 4), self.__saturated))
+
+        return
+
+
+############
+### Bulk ###
+############
+
+def convertSeries(calib, values, gateLen = None, units = 'cpm'):
+    """
+    Convert a whole series of stored rates to dose rates in uSv/h at once. values are in CPM, as the pipeline stores them, or counts per gate of gateLen seconds with units 'counts'. Returns the dose rates and whether each was saturated, as NumPy arrays.
+    """
+
+    import numpy as np
+
+    values = np.asarray(values, dtype = np.float64)
+
+    if units == 'cpm':
+        cps = values / 60.0
+    elif units == 'counts':
+        cps = values / (1.0 if gateLen is None else gateLen)
+    else:
+        raise ValueError("Unknown units %s." %units)
+
+    return (calib.doseRate(cps), calib.saturated(cps))
+
+
+#######################
+# Main execution body #
+#######################
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import datalayer
+
+    # Set up command line interface.
+    parser = argparse.ArgumentParser(description = "Convert stored geiger counter rates to dose rates", epilog = "Reads CSV files or journals written with --store, e.g. to reprocess an archive after a recalibration, and writes the dose rates in uSv/h in the same format, whatever the output file is called. Flags are kept where the input has them, and saturated readings get the saturated flag.")
+    parser.add_argument('profiles', help = 'JSON calibration profile file, see calibration.loadProfiles().')
+    parser.add_argument('file', help = 'CSV file or journal to convert.')
+    parser.add_argument('--detector', type = str, default = 'default', help = 'Detector whose calibration to use. Defaults to "default".')
+    parser.add_argument('--units', choices = ['cpm', 'counts'], default = 'cpm', help = 'What the stored values are: CPM, as pipeline stages store them, or counts per gate. Defaults to cpm.')
+    parser.add_argument('--gate', type = float, default = 1.0, help = 'Gate length in seconds for --units counts. Defaults to 1.')
+    parser.add_argument('--out', type = str, default = None, help = 'Write the dose rates to this file, a journal if the input is one and CSV otherwise.')
+    args = parser.parse_args()
+
+    calib = getCalibration(loadProfiles(args.profiles), args.detector)
+
+    tStart = time.monotonic()
+    ts, values, flags = datalayer.loadSeries(args.file)
+    tLoad = time.monotonic() - tStart
+
+    tStart = time.monotonic()
+    usvh, saturated = convertSeries(calib, values, args.gate, args.units)
+    tConvert = time.monotonic() - tStart
+
+    print("Converted %s readings in %s sec., loaded in %s sec." %(len(usvh), round(tConvert, 3), round(tLoad, 3)))
+
+    if len(usvh) > 0:
+        print("Mean %s uSv/h, max %s uSv/h, %s saturated." %(round(float(usvh.mean()), 4), round(float(usvh.max()), 4), int(saturated.sum())))
+
+    if args.out is not None:
+        import journal
+        import numpy as np
+
+        # Records stored without flags get them now.
+        if flags is not None:
+            flags = np.maximum(flags, 0)
+            flags = np.where(saturated, flags | pipeline.f_saturated, flags & ~pipeline.f_saturated)
+        elif saturated.any():
+            flags = np.where(saturated, pipeline.f_saturated, 0)
+
+        stg = datalayer.datalayer("journal" if journal.isJournal(args.file) else "csv", None)
+        stg.setStorageProps({'fileName': args.out})
+
+        try:
+            stg.storeBlock(ts, np.round(usvh, 6), flags)
+
+        except:
+            print("Failed to store dose rates: %s" %traceback.format_exc())
+
+        stg.close()
@@ -0,0 +1,98 @@
+###############
+### Imports ###
+###############
+
+import datetime
+import json
+import os
+
+
+##################
+### Checkpoint ###
+##################
+
+class checkpoint(object):
+    def __init__(self, fileName):
+        """
+        Crash-safe checkpoint file for measurement state. Each save writes a temporary file next to fileName, syncs it to disk and renames it over the old checkpoint, so after a power cut the file holds either the previous or the new state, never a mix.
+        """
+
+        self.__fileName = fileName
+        self.__tmpName = "%s.tmp" %fileName
+
+        # Timestamp format for datetimes in the state.
+        self.tsFormat = '%Y-%m-%d %H:%M:%S.%f'
+
+        # How many saves we've done.
+        self.saves = 0
+
+    def getFileName(self):
+        """
+        Get the checkpoint's file name.
+        """
+
+        return self.__fileName
+
+    def save(self, state):
+        """
+        Atomically replace the checkpoint with state, a JSON-serialisable dictionary.
+        """
+
+        try:
+            # Write and sync the new state.
+            with open(self.__tmpName, 'w') as tmpFile:
+                json.dump(state, tmpFile)
+                tmpFile.flush()
+                os.fsync(tmpFile.fileno())
+
+            # Swap it in.
+            os.replace(self.__tmpName, self.__fileName)
+
+            # Make sure the rename itself survives a power cut.
+            dirFd = os.open(os.path.dirname(os.path.abspath(self.__fileName)), os.O_RDONLY)
+
+            try:
+                os.fsync(dirFd)
+            finally:
+                os.close(dirFd)
+
+        except:
+            raise
+
+        self.saves += 1
+
+        return
+
+    def load(self):
+        """
+        Load the last saved state. Returns None if there's no checkpoint.
+        """
+
+        retVal = None
+
+        try:
+            with open(self.__fileName, 'r') as ckptFile:
+                retVal = json.load(ckptFile)
+
+        except (IOError, OSError):
+            # No checkpoint yet.
+            retVal = None
+
+        except:
+            raise
+
+        return retVal
+
+    def toStr(self, dts):
+        """
+        Convert a datetime to the string form we keep in checkpoints.
+        """
+
+        return dts.strftime(self.tsFormat)
+
+    def fromStr(self, dtsStr):
+        """
+        Convert a checkpoint timestamp string back to a datetime.
+        """
+
+        return datetime.datetime.strptime(dtsStr, self.tsFormat)
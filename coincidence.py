@@ -0,0 +1,280 @@
+###############
+### Imports ###
+###############
+
+import collections
+import itertools
+import math
+import pipeline
+
+
+###################
+### Coincidence ###
+###################
+
+def findCoincidences(pulses, window, minFold = 2):
+    """
+    Find coincidences between tubes from their pulse times. pulses is a list of sorted NumPy arrays of pulse times in seconds, one per tube. The tubes' pulses are merged into one sorted stream, and pulses less than window seconds apart are grouped, so a chain of close pulses is one group.
+    Returns the number of groups with pulses from at least minFold different tubes, and a list of the number of pulses per tube in groups with only that tube in them, the anti-coincidences.
+    """
+
+    import numpy
+
+    nTubes = len(pulses)
+    lens = [len(tubePulses) for tubePulses in pulses]
+
+    if sum(lens) == 0:
+        return (0, [0] * nTubes)
+
+    # Merge. A stable sort of sorted runs is a merge.
+    t = numpy.concatenate(pulses)
+    tube = numpy.repeat(numpy.arange(nTubes), lens)
+
+    order = numpy.argsort(t, kind = 'stable')
+    t = t[order]
+    tube = tube[order]
+
+    # A new group starts at every gap longer than the window. Each group gets a bit mask of the tubes in it.
+    starts = numpy.concatenate(([True], numpy.diff(t) > window))
+    masks = numpy.bitwise_or.reduceat(numpy.left_shift(1, tube), numpy.flatnonzero(starts))
+
+    fold = numpy.zeros(len(masks), dtype = numpy.int64)
+
+    for i in range(nTubes):
+        fold += (masks >> i) & 1
+
+    # Pulses in groups with one tube.
+    single = (fold == 1)[numpy.cumsum(starts) - 1]
+    anti = numpy.bincount(tube[single], minlength = nTubes)
+
+    return (int((fold >= minFold).sum()), anti.tolist())
+
+
+def gateCoincidences(counts, minFold = 2):
+    """
+    Find coincidences between tubes from their counts in short gates, for hardware that can't time pulses. counts is a NumPy array of counts with a row per tube and a column per gate, or just a row per tube for one gate.
+    Returns whether at least minFold tubes counted in each gate, and each tube's counts in gates where only it counted, the anti-coincidences.
+    """
+
+    import numpy
+
+    counts = numpy.asarray(counts)
+    fold = (counts > 0).sum(axis = 0)
+
+    return (fold >= minFold, numpy.where(fold == 1, counts, 0))
+
+
+def accidentalRate(rates, window, minFold = 2):
+    """
+    Expected rate of accidental coincidences of minFold tubes from uncorrelated pulses, for findCoincidences() with the given window, given each tube's rate in counts per second.
+    Any k tubes line up by chance at k * window^(k - 1) times the product of their rates, summed over every set of k tubes.
+    """
+
+    retVal = 0.0
+
+    for tubeRates in itertools.combinations(rates, minFold):
+        product = 1.0
+
+        for rate in tubeRates:
+            product *= rate
+
+        retVal += minFold * (window ** (minFold - 1)) * product
+
+    return retVal
+
+
+def gateAccidentalProb(rates, gateLen, minFold = 2):
+    """
+    Chance of at least minFold tubes counting in a gate of gateLen seconds by chance, for gateCoincidences(), given each tube's rate in counts per second.
+    """
+
+    # Distribution of the number of tubes that count, built up a tube at a time.
+    dist = [1.0]
+
+    for rate in rates:
+        p = 1.0 - math.exp(-rate * gateLen)
+        dist = [(dist[k] if k < len(dist) else 0.0) * (1.0 - p) + (dist[k - 1] * p if k > 0 else 0.0) for k in range(len(dist) + 1)]
+
+    return sum(dist[minFold:])
+
+
+#############
+### Stage ###
+#############
+
+class coincidenceStage(pipeline.pipelineStage):
+    def __init__(self, channels, window = 1e-5, minFold = 2, name = "coinc", pipe = None, textOut = True):
+        """
+        Coincidence counting between tubes on the hardware channels named in channels, e.g. 'counter0' and 'counter1' of a U3 or 'tube0' and 'tube1' of several Arduinos. Coincidences of at least minFold tubes reject local noise, which hits one tube at a time, and pick out cosmic showers.
+        With pulse times from the hardware's getEvents() pulses within window seconds of each other are coincident. Otherwise the gates are short and tubes counting in the same gate are coincident.
+        Accidental coincidences are estimated as we go, and the excess over them is what's really coincident. With pulse times they're expected from the tubes' singles rates. With gates they're counted as delayed coincidences, between each tube's gate and the gates a tube index before it of the others, which can't be really coincident, falling back to the singles rates for the first few gates. Each gate's coincidences are also fed to pipe, a pipeline.pipeline instance, if given, so they get the usual modes and storage.
+        """
+
+        super(coincidenceStage, self).__init__(name)
+
+        self.__channels = list(channels)
+        self.__window = window
+        self.__minFold = minFold
+        self.__pipe = pipe
+        self.__textOut = textOut
+
+        if len(self.__channels) < minFold:
+            raise ValueError("Need at least %s channels for %s-fold coincidences." %(minFold, minFold))
+
+        # Running totals.
+        self.__singles = [0] * len(self.__channels)
+        self.__anti = [0] * len(self.__channels)
+        self.__coinc = 0
+        self.__gates = 0
+        self.__liveTime = 0.0
+        self.__events = None
+
+        # Recent gates' counts, newest last, and delayed coincidences counted from them.
+        self.__recent = collections.deque(maxlen = len(self.__channels))
+        self.__delayed = 0
+        self.__delayedGates = 0
+
+        self.flags = pipeline.setFlag(self.flags, pipeline.f_mode, pipeline.f_mode_counter)
+
+    def process(self, smpl):
+        """
+        Count this gate's coincidences.
+        """
+
+        import numpy
+
+        events = smpl.get('events')
+        channels = smpl.get('channels')
+
+        gateLen = smpl.get('gateLen', 1.0)
+
+        if (events is not None) and all([channel in events for channel in self.__channels]):
+            singles = [len(events[channel]) for channel in self.__channels]
+            coinc, anti = findCoincidences([numpy.asarray(events[channel], dtype = numpy.float64) for channel in self.__channels], self.__window, self.__minFold)
+            self.__events = True
+
+        elif (channels is not None) and all([channel in channels for channel in self.__channels]):
+            singles = [channels[channel] for channel in self.__channels]
+            coinc, anti = gateCoincidences(singles, self.__minFold)
+            coinc = int(coinc)
+            anti = anti.tolist()
+            self.__events = False
+
+            # Tube i's counts from i gates ago.
+            self.__recent.append(singles)
+
+            if len(self.__recent) == self.__recent.maxlen:
+                self.__delayed += int(gateCoincidences([self.__recent[-1 - i][i] for i in range(len(self.__channels))], self.__minFold)[0])
+                self.__delayedGates += 1
+
+        else:
+            raise RuntimeError("The coincidence stage needs readings of channels %s from the hardware." %', '.join(self.__channels))
+
+        self.__coinc += coinc
+        self.__gates += 1
+        self.__liveTime += gateLen
+
+        for i in range(len(self.__channels)):
+            self.__singles[i] += singles[i]
+            self.__anti[i] += anti[i]
+
+        # Accidentals for a gate like this one at the singles rates so far.
+        accidentals = self.__accidentals(gateLen)
+
+        smpl[self.name] = {'counts': coinc, 'cps': coinc / gateLen, 'cpm': coinc * 60.0 / gateLen, 'accidentalCpm': accidentals * 60.0 / gateLen, 'excessCpm': (coinc - accidentals) * 60.0 / gateLen, 'anti': dict(zip(self.__channels, anti)), 'flags': self.flags}
+
+        # Feed the derived series on.
+        if self.__pipe is not None:
+            coincSmpl = {'dts': smpl['dts'], 'mono': smpl['mono'], 'counts': coinc, 'counterFlags': smpl.get('counterFlags', 0), 'gateLen': gateLen}
+
+            if 'gateStart' in smpl:
+                coincSmpl['gateStart'] = smpl['gateStart']
+                coincSmpl['gateEnd'] = smpl['gateEnd']
+
+            self.__pipe.process(coincSmpl)
+
+        return
+
+    def processBlock(self, blk):
+        """
+        Blocks don't carry each gate's channel readings or pulse times.
+        """
+
+        raise RuntimeError("The coincidence stage needs each gate's readings, so it can't be used with blocks.")
+
+    def __accidentals(self, gateLen):
+        """
+        Get the number of accidental coincidences expected in a gate of gateLen seconds.
+        """
+
+        if self.__liveTime <= 0.0:
+            return 0.0
+
+        rates = [float(singles) / self.__liveTime for singles in self.__singles]
+
+        if self.__events == True:
+            return accidentalRate(rates, self.__window, self.__minFold) * gateLen
+
+        if self.__delayedGates > 0:
+            return float(self.__delayed) / self.__delayedGates
+
+        return gateAccidentalProb(rates, gateLen, self.__minFold)
+
+    def getState(self):
+        """
+        Save the running totals and the derived series' pipeline.
+        """
+
+        return {'singles': self.__singles, 'anti': self.__anti, 'coinc': self.__coinc, 'gates': self.__gates, 'liveTime': self.__liveTime, 'events': self.__events, 'recent': list(self.__recent), 'delayed': self.__delayed, 'delayedGates': self.__delayedGates, 'pipe': self.__pipe.getState() if self.__pipe is not None else None}
+
+    def setState(self, state):
+        """
+        Restore the running totals and the derived series' pipeline.
+        """
+
+        self.__singles = list(state['singles'])
+        self.__anti = list(state['anti'])
+        self.__coinc = state['coinc']
+        self.__gates = state['gates']
+        self.__liveTime = state['liveTime']
+        self.__events = state['events']
+        self.__recent.clear()
+        self.__recent.extend(state['recent'])
+        self.__delayed = state['delayed']
+        self.__delayedGates = state['delayedGates']
+
+        if (self.__pipe is not None) and (state['pipe'] is not None):
+            self.__pipe.setState(state['pipe'])
+
+        return
+
+    def finish(self, summary):
+        """
+        Report the coincidences over the whole run against the accidentals expected over it.
+        """
+
+        if self.__gates > 0:
+            accidentals = self.__accidentals(self.__liveTime / self.__gates) * self.__gates
+            excess = self.__coinc - accidentals
+
+            summary[self.name] = {
+                'coinc': self.__coinc,
+                'accidentals': accidentals,
+                'excess': excess,
+                'significance': excess / math.sqrt(accidentals) if accidentals > 0.0 else None,
+                'cpm': self.__coinc * 60.0 / self.__liveTime,
+                'excessCpm': excess * 60.0 / self.__liveTime,
+                'singlesCpm': dict([(channel, singles * 60.0 / self.__liveTime) for channel, singles in zip(self.__channels, self.__singles)]),
+                'antiCpm': dict([(channel, anti * 60.0 / self.__liveTime) for channel, anti in zip(self.__channels, self.__anti)]),
+                'liveTime': self.__liveTime,
+                'pulseTimes': self.__events
+            }
+
+            if self.__textOut == True:
+                print("[%s] %s coincidences in %s sec. (%s CPM), %s accidental, excess %s CPM (%s sigma)." %(self.name, self.__coinc, round(self.__liveTime, 3), round(summary[self.name]['cpm'], 3), round(accidentals, 3), round(summary[self.name]['excessCpm'], 3), None if summary[self.name]['significance'] is None else round(summary[self.name]['significance'], 2)))
+                print("[%s] Singles CPM %s, anti-coincidence CPM %s." %(self.name, ', '.join(["%s %s" %(channel, round(cpm, 3)) for channel, cpm in summary[self.name]['singlesCpm'].items()]), ', '.join(["%s %s" %(channel, round(cpm, 3)) for channel, cpm in summary[self.name]['antiCpm'].items()])))
+
+        if self.__pipe is not None:
+            self.__pipe.finish()
+
+        return
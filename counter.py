@@ -4,38 +4,58 @@
 ### Imports ###
 ###############
 
+import contextlib
 import datetime
+import io
+import math
+import re
+import sys
 import time
 import traceback
 import datalayer
+import pipeline
+import streamstats
 
 class geigerInterface():
-    def __init__(self, hwPlatform, mode = "class", cps = False, flags = False, debug = False, quiet = False, time = 0, stg = None):
+    def __init__(self, hwPlatform, mode = "class", cps = False, flags = False, debug = False, quiet = False, time = 0, stg = None, presetCounts = None, presetPrecision = None):
         """
         Geiger counter interface class. Madatory arguments are mode and hwPlatform, which should be an instance or child object of counterIface.
+        time limits the measurement to a number of seconds, or a string such as "90", "5m", "2h" or "1h30m". presetCounts stops it once that many counts are in, and presetPrecision once the relative uncertainty of the mean count rate is at or below it, e.g. 0.01 for 1%. The measurement stops at whichever limit it hits first, in any mode.
         """
         
         # Constants and tunable parameters
         self.__c_ct_slow = 22            # Number of samples in slow mode.
         self.__c_ct_fast = 4             # Number of samples in fast mode.
+        self.__c_minPrecisionGates = 10  # Gates to wait for before checking a preset precision.
         
-        # Flags
-        self.f_accum          = 0x03   # Bit position of accumulator flags. 
-        self.f_accum_unk      = 0x00   # This flag means we don't have any accumulator info.
-        self.f_accum_accum    = 0x01   # This flag means we're still accumulating data.
-        self.f_accum_complete = 0x02   # This flag means we have a full sample to average from.
+        # Flags. The layout lives in pipeline so stages can share it.
+        self.f_accum          = pipeline.f_accum          # Bit position of accumulator flags.
+        self.f_accum_unk      = pipeline.f_accum_unk      # This flag means we don't have any accumulator info.
+        self.f_accum_accum    = pipeline.f_accum_accum    # This flag means we're still accumulating data.
+        self.f_accum_complete = pipeline.f_accum_complete # This flag means we have a full sample to average from.
         
-        self.f_trend          = 0x1c     # Bit position of the trend flag.
-        self.f_trend_unk      = 0x00     # Unknown trend.
-        self.f_trend_up       = 0x04     # Readings increasing.
-        self.f_trend_dn       = 0x08     # Readings decreasing.
-        self.f_trend_stable   = 0x10     # Readings stable
+        self.f_trend          = pipeline.f_trend          # Bit position of the trend flag.
+        self.f_trend_unk      = pipeline.f_trend_unk      # Unknown trend.
+        self.f_trend_up       = pipeline.f_trend_up       # Readings increasing.
+        self.f_trend_dn       = pipeline.f_trend_dn       # Readings decreasing.
+        self.f_trend_stable   = pipeline.f_trend_stable   # Readings stable
         
-        self.f_mode           = 0xe0     # Bit position of the mode flag. This is large because we want to support more modes in the future.
-        self.f_mode_fast      = 0x00     # Fast averaging mode.
-        self.f_mode_slow      = 0x20     # Slow averaging mode.
-        self.f_mode_counter   = 0x40     # Counter mode.
-        self.f_mode_scaler    = 0x80     # Scaler mode.
+        self.f_mode           = pipeline.f_mode           # Bit position of the mode flag. This is large because we want to support more modes in the future.
+        self.f_mode_fast      = pipeline.f_mode_fast      # Fast averaging mode.
+        self.f_mode_slow      = pipeline.f_mode_slow      # Slow averaging mode.
+        self.f_mode_counter   = pipeline.f_mode_counter   # Counter mode.
+        self.f_mode_scaler    = pipeline.f_mode_scaler    # Scaler mode.
+        self.f_mode_sprt      = pipeline.f_mode_sprt      # Sequential probability ratio test search mode.
+        
+        self.f_alarm          = pipeline.f_alarm          # Set while any alarm rule is raised.
+        
+        self.f_counter          = pipeline.f_counter          # Bit position of the hardware counter flags.
+        self.f_counter_wrap     = pipeline.f_counter_wrap     # The hardware counter wrapped during this gate.
+        self.f_counter_overflow = pipeline.f_counter_overflow # The hardware counter overflowed or reset, so the count can't be trusted.
+        
+        self.f_periodic       = pipeline.f_periodic       # Set while the counts have a significant periodic component.
+        self.f_anomaly        = pipeline.f_anomaly        # Set while readings are anomalous against the time-of-day baseline.
+        self.f_saturated      = pipeline.f_saturated      # Set while the count rate is too high to correct for dead time.
         
         # Set up storage:
         self.__stg = stg
@@ -58,16 +78,67 @@ class geigerInterface():
         self.__liveOutput = True # Do we dump data in real time?
         self.__runtime = 0 # How long have we been running?
         self.__accumCts = 0 # How many counts do we have?        
+        self.__scalerTime = 0.0 # How many seconds of gates has the scaler accumulated?
         self.__timed = False # Are we running in timed mode?
         self.__timeLimit = 0 # What is our time limit
+        self.__liveTime = 0.0 # Seconds measured so far, counting earlier runs of a resumed measurement.
+        self.__lastLiveTime = 0.0 # Seconds the last gate or block added to it.
+        self.__measCts = 0 # Counts measured so far, likewise.
+        self.__presetCounts = None # Stop at this many counts.
+        self.__presetPrecision = None # Stop at this relative uncertainty.
+        self.__stopReason = None # Which limit stopped the run, if any.
         self.__textOut = True # By default we are quiet.
         
         # Printed timestamp format.
         self.__tsFormat = '%Y-%m-%d %H:%M:%S.%f UTC'
         
+        # Timestamp format in getState().
+        self.__tsStateFormat = '%Y-%m-%d %H:%M:%S.%f'
+        
         # Set mdoe.
         self.__mode = mode
         
+        # Pipeline we're running, if any.
+        self.__pipeline = None
+        
+        # Sequential test used in sprt mode.
+        self.__sprt = None
+        
+        # In-memory history of readings, if we're keeping one.
+        self.__history = None
+        
+        # Start and end of the last gate on the host clock, if the hardware times its own gates.
+        self.__gateTimes = None
+        
+        # Shared memory ring buffer to publish readings to, if any.
+        self.__publisher = None
+        
+        # Pipelines for the hardware's other channels by channel name, the last reading of every channel, and the last gate's pulse times if the hardware has them.
+        self.__channelPipes = {}
+        self.__channels = None
+        self.__events = None
+        
+        # Statistics of counts per second over the whole run, whatever the mode.
+        self.__cpsStats = streamstats.streamStats()
+        
+        # Callback for the current mode, used by dispatch(), and the last reading it got.
+        self.__modeCallback = None
+        self.__lastReading = None
+        
+        # Checkpointing. We save every __ckptInterval gates, and __resumeState holds a loaded checkpoint until the run starts.
+        self.__ckpt = None
+        self.__ckptInterval = 10
+        self.__ckptGates = 0
+        self.__resumeState = None
+        
+        # Gaps in the measurement from restarts, as (last checkpoint, resume) datetime pairs.
+        self.__gaps = []
+        
+        # Run loop wakeups this run, and the monotonic time and voluntary context switches we started counting from.
+        self.__wakeups = 0
+        self.__wakeStart = None
+        self.__switchStart = None
+        
         # If we have activated counts per second set the flag.
         if cps == True:
             self.__cpsOn = True
@@ -85,10 +156,19 @@ class geigerInterface():
         if quiet == True:
             self.__textOut = False
         
-        # Timer?
-        if time > 0:
-            self.__timed = True
-            self.__timeLimit = time
+        # Timer? The CLI passes None when --time isn't given.
+        if time is not None:
+            self.__timeLimit = self.__parseTimeArg(time)
+            
+            if self.__timeLimit > 0:
+                self.__timed = True
+        
+        # Presets.
+        if (presetCounts is not None) and (presetCounts > 0):
+            self.__presetCounts = presetCounts
+        
+        if (presetPrecision is not None) and (presetPrecision > 0):
+            self.__presetPrecision = presetPrecision
         
         # Turn hardware text on/off.
         self.__hw.setTextOut(self.__textOut)
@@ -142,14 +222,28 @@ class geigerInterface():
     
     def __parseTimeArg(self, timeStr):
         """
-        Parse timer arguments. If we just see a number let's assume seconds. If there is an 'm' after the argument assume minutes.
+        Parse timer arguments. If we just see a number let's assume seconds. A number can be followed by 's', 'm' or 'h' for seconds, minutes or hours, and these can be combined, e.g. "1h30m".
         """
         
         # Number of seconds.
         retVal = 0
         
-        ### NOT YET IMPLEMENTED. NEEDS TO BE DONE!
+        # Plain numbers are seconds.
+        if isinstance(timeStr, (int, float)):
+            return float(timeStr)
+        
+        units = {'s': 1.0, 'm': 60.0, 'h': 3600.0}
+        number = r"(?:\d+(?:\.\d*)?|\.\d+)"
+        timeStr = timeStr.strip().lower()
+        
+        # The whole thing has to be numbers with units, where only the last may leave its unit off.
+        if re.match(r"^(?:%s\s*[smh]\s*)*%s\s*[smh]?$" %(number, number), timeStr) is None:
+            raise ValueError("Can't parse time %s. Use a number of seconds, optionally followed by s, m or h, e.g. 90, 5m or 1h30m." %timeStr)
         
+        parts = re.findall(r"(%s)\s*([smh]?)" %number, timeStr)
+        
+        for number, unit in parts:
+            retVal += float(number) * units[unit if unit != "" else 's']
         
         return retVal
     
@@ -165,17 +259,17 @@ class geigerInterface():
         
         
         try:
-            # Make sure we have no more than the specified number of samples.
-            del self.__samples[(smplBuffSz - 1):]
+            # Keep enough history for the longest window so switching modes doesn't start the average over.
+            del self.__samples[(max(smplBuffSz, self.__c_ct_slow, self.__c_ct_fast) - 1):]
             
             # Prepend this reading.
             self.__samples[:0] = [thisReading]
             
-            # Get the number of samples.
-            curCount = len(self.__samples)
+            # Get the number of samples we're averaging.
+            curCount = min(len(self.__samples), smplBuffSz)
             
             # Get our averages.
-            retVal = float(sum(self.__samples)) / float(curCount)
+            retVal = float(sum(self.__samples[:curCount])) / float(curCount)
             
             # Do we have a full buffer?
             if curCount == smplBuffSz:
@@ -273,9 +367,7 @@ class geigerInterface():
         try:
             # Accumulate new sample data.
             self.__accumCts += latestCount
-            
-            # Increment runtime counter.
-            self.__runtime += 1
+            self.__scalerTime += self.__gateLength()
         
         except:
             raise
@@ -283,6 +375,37 @@ class geigerInterface():
         return
 
 
+    def modeSprt(self, latestCount):
+        """
+        Search mode. Runs a sequential probability ratio test on every gate against the learned background and flags the trend as up as soon as the readings are elevated.
+        """
+        
+        try:
+            # Run the test.
+            smpl = {'dts': datetime.datetime.utcnow(), 'counts': latestCount, 'gateLen': self.__gateLength()}
+            self.__sprt.process(smpl)
+            
+            # Take the accumulator and trend flags from the test.
+            self.setFlag(self.f_accum, smpl['sprt']['flags'] & self.f_accum)
+            self.setFlag(self.f_trend, smpl['sprt']['flags'] & self.f_trend)
+            
+            # Print the things.
+            self.__liveCountPrint(latestCount)
+            
+            # If we have a storage mode set up store the raw counts, as counter mode does.
+            if self.__stg is not None:
+                # Store the things.
+                try:
+                    self.__stg.storeDatapoint([smpl['dts'], latestCount])
+                except:
+                    print("Failed to store data point: %s" %traceback.format_exc())
+        
+        except:
+            raise
+        
+        return
+    
+    
     def setFlag(self, whichFlag, whichValue):
         """
         Set a given flag to a given value.
@@ -311,314 +434,1635 @@ class geigerInterface():
         """
         Parse flags to a short string.
         """
-        # Blank return value.
-        retVal = ""
-        
-        try:
-            # Store flags as we parse them.
-            allFlags = []
-            
-            # Get the accumulator flag.
-            accFlag = self.__flags & self.f_accum
-            trendFlag = self.__flags & self.f_trend
-            modeFlag = self.__flags & self.f_mode
-            
-            # Complete set of readings?
-            if accFlag == self.f_accum_complete:
-                # Completed loading values into the accumulator.
-                allFlags.append('C')
-            elif accFlag == self.f_accum_accum:
-                # Still accumulating.
-                allFlags.append('A')
-            elif accFlag == self.f_accum_unk:
-                # Unknown.
-                allFlags.append('?')
-            else:
-                # Bad value.
-                allFlags.append('!')
-            
-            # Trend?
-            if (trendFlag) == self.f_trend_stable:
-                # Readings stable.
-                allFlags.append('S')
-            elif (trendFlag) == self.f_trend_up:
-                # Still accumulating.
-                allFlags.append('U')
-            elif (trendFlag) == self.f_trend_dn:
-                # Still accumulating.
-                allFlags.append('D')
-            elif (trendFlag) == self.f_trend_unk:
-                # Still accumulating.
-                allFlags.append('?')
-            else:
-                # Bad value.
-                allFlags.append('!')
-            
-            # Mode?
-            if modeFlag == self.f_mode_fast:
-                # Fast
-                allFlags.append('F')
-            elif modeFlag == self.f_mode_slow:
-                # Slow
-                allFlags.append('S')
-            elif modeFlag == self.f_mode_counter:
-                # Stream
-                allFlags.append('C')
-            elif modeFlag == self.f_mode_scaler:
-                # Roll
-                allFlags.append('L')
-            else:
-                # Bad value.
-                allFlags.append('!')
-            
-            # Build a nice string.
-            retVal = ''.join(allFlags)
-            
-        
-        except:
-            raise
         
-        # Return value.
-        return retVal
+        return pipeline.parseFlags(self.__flags)
     
     
-    def runCli(self):        
+    def __selectMode(self):
+        """
+        Set the mode flag for the configured CLI mode and return the matching mode callback.
+        """
+        
         # Select sample count based on mode.
         if self.__mode == "fast":
             # Fast mode
             self.setFlag(self.f_mode, self.f_mode_fast)
-                    
-            # Run with fast mode callback.
-            self.run(self.modeFast)
+            
+            # Use the fast mode callback.
+            retVal = self.modeFast
             
         elif self.__mode == "slow":
             # Slow mode.
             self.setFlag(self.f_mode, self.f_mode_slow)
             
-            # Run with slow mode callback.
-            self.run(self.modeSlow)
+            # Use the slow mode callback.
+            retVal = self.modeSlow
             
         elif self.__mode == "counter":
             # Counter mode
             self.setFlag(self.f_mode, self.f_mode_counter)
             
-            # Run with counter mode callback.
-            self.run(self.modeCounter)
+            # Use the counter mode callback.
+            retVal = self.modeCounter
         
         elif self.__mode == "scaler":
             # Scaler mode. Keeps adding counts until the program is killed.
             self.setFlag(self.f_mode, self.f_mode_scaler)
             
-            # Run with scaler mode callback.
-            self.run(self.modeScaler)
+            # Use the scaler mode callback.
+            retVal = self.modeScaler
+        
+        elif self.__mode == "sprt":
+            # Search mode.
+            self.setFlag(self.f_mode, self.f_mode_sprt)
+            
+            # Set up the test unless we're resuming one.
+            if self.__sprt is None:
+                self.__sprt = pipeline.sprtStage(textOut = self.__textOut)
+            
+            # Run with search mode callback.
+            retVal = self.modeSprt
         
         else:
             # This straight up shouldn't have happened. Crash and burn.
-            raise RuntimeError("Invalid mode specified. Should be a string containing one of the following for CLI mode: fast, slow, stream, roll")
+            raise RuntimeError("Invalid mode specified. Should be a string containing one of the following for CLI mode: fast, slow, counter, scaler, sprt")
+        
+        return retVal
     
     
-    def run(self, callBack):
+    def setMode(self, mode):
         """
-        Run the counter. Every time a sample is taken the callback method is called.
+        Switch to a different mode. This can be done while running through dispatch(), and keeps the sample history, scaler totals and hardware session.
         """
         
-        # Flag keeprunning as true.
-        self.__keepRunning = True
+        oldMode = self.__mode
+        self.__mode = mode
         
         try:
-            # Set up our hardware interface.
-            self.__hw.setup()
-            
-            # Get config.
-            devConfig = self.__hw.getConfig()
-            
-            if self.__textOut == True:
-                print("Counter hardware platform is %s." %devConfig['desc'])
-            
-            if self.__debugOn == True:
-                print("Hardware config information:\n%s" %devConfig['config'])
+            self.__modeCallback = self.__selectMode()
+        
+        except:
+            # Keep running in the old mode.
+            self.__mode = oldMode
+            raise
+        
+        return
+    
+    
+    def setWindows(self, fast = None, slow = None):
+        """
+        Change the number of samples averaged in fast and slow mode.
+        """
+        
+        if fast is not None:
+            if fast < 1:
+                raise ValueError("Fast window must be at least 1 sample.")
             
-            # When are we starting?
-            self.__dtsStart = datetime.datetime.utcnow()
+            self.__c_ct_fast = fast
+        
+        if slow is not None:
+            if slow < 1:
+                raise ValueError("Slow window must be at least 1 sample.")
             
-            # In case we bomb out make sure we have some sort of end DTS.
-            self.__dtsEnd = self.__dtsStart
+            self.__c_ct_slow = slow
+        
+        return
+    
+    
+    def resetScaler(self):
+        """
+        Zero the scaler's total counts and time.
+        """
+        
+        self.__accumCts = 0
+        self.__scalerTime = 0.0
+        
+        return
+    
+    
+    def setStorage(self, stg):
+        """
+        Set the datalayer data points are stored in, or None to stop storing them.
+        """
+        
+        self.__stg = stg
+        
+        return
+    
+    
+    def getStorage(self):
+        """
+        Get the datalayer data points are stored in, or None if we aren't storing them.
+        """
+        
+        return self.__stg
+    
+    
+    def getStatus(self):
+        """
+        Get a summary of what we're doing right now as a JSON-serialisable dictionary.
+        """
+        
+        retVal = {
+            'mode': self.__mode,
+            'flags': self.__flags,
+            'flagStr': self.parseFlags(),
+            'windows': {'fast': self.__c_ct_fast, 'slow': self.__c_ct_slow},
+            'lastReading': self.__lastReading,
+            'fastAvgCpm': None,
+            'slowAvgCpm': None,
+            'scaler': {'counts': self.__accumCts, 'time': self.__scalerTime},
+            'storing': (self.__stg is not None),
+            'dtsStart': self.__dtsStart.strftime(self.__tsStateFormat),
+            'cpsStats': self.__cpsStats.getSummary(),
+            'channels': self.__channels,
+            'wakeups': self.getWakeups()
+        }
+        
+        # Averages over the current windows from the sample history.
+        if len(self.__samples) > 0:
+            fastSamples = self.__samples[:self.__c_ct_fast]
+            slowSamples = self.__samples[:self.__c_ct_slow]
             
-            if self.__textOut == True:
-                # Print start time
-                print("Start time: %s" %self.__dtsStart.strftime(self.__tsFormat))
+            retVal['fastAvgCpm'] = round(float(sum(fastSamples)) / float(len(fastSamples)) * 60.0, 3)
+            retVal['slowAvgCpm'] = round(float(sum(slowSamples)) / float(len(slowSamples)) * 60.0, 3)
+        
+        return retVal
+    
+    
+    def dispatch(self, latestCount):
+        """
+        Callback that hands each reading to the current mode. Use this with run() or arun() when the mode may change while running.
+        """
+        
+        try:
+            self.__lastReading = latestCount
             
-            while self.__keepRunning:
-                try:
-                    # Measure for 1 second
-                    time.sleep(1)
-                    
-                    # Snag counter results.
-                    thisReading = self.__hw.poll()
-                    
-                    # Execute our callback with the current reading.
-                    callBack(thisReading)
-                    
-                    # If we're in timed mode make sure we haven't exceeded our runtime.
-                    if self.__timed == True:
-                        # If we've hit our time limit this cycle stop the loop.
-                        if self.__runtime == self.__timeLimit:
-                            self.__keepRunning = False
-                
-                except:
-                    # Stop the loop.
-                    self.__keepRunning = False
-                    
-                    # Pass the exception up the stack.
-                    raise
+            # Pick up the constructor's mode if nobody's called setMode().
+            if self.__modeCallback is None:
+                self.__modeCallback = self.__selectMode()
             
-            # When are we starting?
-            self.__dtsEnd = datetime.datetime.utcnow()
+            # Fast and slow modes keep the history, but the other modes don't use it, so keep it up to date here.
+            if self.__mode not in ("fast", "slow"):
+                del self.__samples[(max(self.__c_ct_slow, self.__c_ct_fast) - 1):]
+                self.__samples[:0] = [latestCount]
             
-            # Stop the harware counter.
-            self.__hw.stop()
+            self.__modeCallback(latestCount)
         
         except:
             raise
         
-        finally:
-            if self.__textOut == True:
-                print("Run statistics:")
-                
-                # Print start time
-                print("Start time: %s" %self.__dtsStart.strftime(self.__tsFormat))
-                
-                # Print end time
-                print("End time: %s" %self.__dtsEnd.strftime(self.__tsFormat))
-                
-                # Store the things.
-                ### NOT YET IMPLEMENTED.
-                
-                # If we're in rolling mode make sure we give final stats after the program is killed.
-                if (self.__flags & self.f_mode) == self.f_mode_scaler:
-                    # Make sure we don't divide by zero.
-                    if self.__runtime > 0:
-                        # Average counts over our run time...
-                        avgCts = float(self.__accumCts) / float(self.__runtime)
-                        
-                        # CPS -> CPM.
-                        finalCpm = avgCts * 60.0
-                        
-                        # If we have a storage mode set up...
-                        if self.__stg is not None:
-                            # Store the things.
-                            try:
-                                self.__stg.storeDatapoint([datetime.datetime.utcnow(), finalCpm])
-                            except:
-                                print("Failed to store data point: %s" %traceback.format_exc())
-                        
-                        print("Total counts %s in %s sec." %(self.__accumCts, self.__runtime))
-                        print("Avg CPM over %s sec: %s" %(self.__runtime, round(finalCpm, 3)))
-                        
-                        # If we want stats in counts per second as well...
-                        if self.__cpsOn == True:
-                            print("Avg CPS over %s sec: %s" %(self.__runtime, round(avgCts, 3)))
-                        
-                    #else:
-                        #raise RuntimeError("We ran for < 1 sec., not averaging data.")
-                
-            try:
-                # Clean up the hardware interface.
-                self.__hw.cleanup()
-            
-            except:
-                raise
+        return
     
-
-#######################
-# Main execution body #
-#######################
-
-if __name__ == "__main__":
-    import argparse
-
-    # Set up command line interface.
-    parser = argparse.ArgumentParser(description = "Geiger counter interface", epilog = "Fast mode averages counts over a 4 second period, and slow mode averages counts over a 22 second period. This is modeled from the Ludlum model 3 geiger counter. It is intended that this program get support for storing data to files.  KNOWN ISSUES: The arduser hardware can have delays between readings and output as high as two seconds due to the way timing works. The ardui2c hardware type has not yet been tested.")
-    parser.add_argument('--accumulate', action='store_true', help = 'Keep a sum of all detected counts.')
-    parser.add_argument('--cps', action='store_true', help = 'Show live counts per second.')
-    parser.add_argument('--hw', choices=['dummy', 'random', 'u3', 'arduser', 'ardui2c'], required = True, help = 'Set counter hardware platform. The choices are "u3" for a LabJack U3, "arduser" for an Arduino-based counter connected via serial port, "ardui2c" for an Arduino-based counter on an I2C bus, "dummy" which does nothing, and "random" which generates random numbers.')
-    parser.add_argument('--debug', action='store_true', help = 'Debug')
-    parser.add_argument('--flags', action='store_true', help = 'Display flags.')
-    parser.add_argument('--mode', choices=['fast', 'slow', 'counter', 'scaler'], required = True, help = 'Set mode option. Fast averages samples over 4 sec., Slow averages samples over 22 sec. Counter mode implies --cps and does not average. Scaler mode keeps adding an average as long as it runs, and dumps stats at the end. Scaler mode also implies --quiet.')
-    parser.add_argument('--time', type = int, help = 'Time in seconds to run.')
-    parser.add_argument('--store', choices=['none', 'csv'], default='none', required = False, help = 'Store output data in a given format.')
-    parser.add_argument('--out', type = str, required = False, default=None, help = 'Output file name. Only has an effect when "--store csv" is set, and will clobber the existing file if it exists.')
-    parser.add_argument('--quiet', action='store_true', help = 'Minimal command line output.')
-    args = parser.parse_args()
     
-    if args.quiet == False:
-        print("Measurement starting, mode is %s" %args.mode)
+    def dispatchBlock(self, blk):
+        """
+        Callback for runBlocks() and arunBlocks() that hands each reading in a block to the current mode in turn, for the modes that work a gate at a time. Each reading's gate times are set first so the modes see its gate length.
+        """
+        
+        for latestCount, ts, gateLen in zip(blk['counts'].tolist(), blk['ts'].tolist(), blk['gateLen'].tolist()):
+            self.__gateTimes = (ts - gateLen, ts)
+            self.dispatch(latestCount)
+        
+        return
     
-    # Which hardware platform do we have?
-    if args.hw == "u3":
-        # We have a LabJack U3.
-        import u3Hardware
-        hwPlat = u3Hardware.u3Hardware()
     
-    elif args.hw == "arduser":
-        # We have an Arduino attached via serial interface.
-        import arduHardware
-        hwPlat = arduHardware.arduSerHardware()
+    def runCli(self):
+        """
+        Run the counter in the mode given to the constructor.
+        """
         
-        # Set the serial port properties.
-        hwPlat.setSerialProps('/dev/ttyACM0', baud = 115200)
+        # Run with the callback for our mode.
+        self.run(self.__selectMode())
     
-    elif args.hw == "ardui2c":
-        # We have an Arduino attached via I2C bus.
-        import arduHardware
-        hwPlat = arduHardware.arduI2cHardware()
-        
-        # Set the I2C bus properties. Both of these are defaults. 
-        hwPlat.setI2cProps(i2cBusID = 1, targetI2cAddr = 0x35)
     
-    elif args.hw == "dummy":
-        # We have a dummy class that will just read zeroes.
-        import hwInterface
-        hwPlat = hwInterface.counterIface()
+    async def arunCli(self):
+        """
+        Asyncio version of runCli(). The hardware platform must be an asyncCounterIface such as hwInterface.asyncHwAdapter.
+        """
+        
+        # Run with the callback for our mode.
+        await self.arun(self.__selectMode())
     
-    elif args.hw == "random":
-        # Use the random number generator.
-        import rndHardware
-        hwPlat = rndHardware.rndHardware()
     
-    if args.store == "csv":
-        # We want to store our results ina CSV file.
+    def __pipelineCallback(self, latestCount):
+        """
+        Feed a reading to our pipeline.
+        """
+        
         try:
-            # Import and create data layer.
-            import datalayer
-            stg = datalayer.datalayer('csv', None)
+            self.__pipeline(latestCount, self.__gateTimes, self.__flags & self.f_counter, self.__channels, self.__events)
         
         except:
-            print("Failed to create data layer: %s" %traceback.format_exc())
+            raise
         
-        # Did we specify an output file name?
-        if args.out != None:
-            try:
-                # Set data layer storage properties.
-                stg.setStorageProps({'fileName': args.out})
-            
-            except:
-                print("Failed to set file name: %s" %traceback.format_exc())
+        return
     
-    else:
-        # We're not doing storage so flag it.
-        stg = None
     
-    try:
-        # Set up geiger counter object.
-        ctr = geigerInterface(hwPlat, args.mode, cps = args.cps, flags = args.flags, debug = args.debug, quiet = args.quiet, time = args.time, stg = stg)
+    def runPipeline(self, pipe):
+        """
+        Run the counter feeding every reading to pipe, a pipeline.pipeline instance. Every stage sees the same hw.poll() result for each gate.
+        """
         
-        # Run the geiger counter.
-        ctr.runCli()
+        self.__pipeline = pipe
+        
+        self.run(self.__pipelineCallback)
     
-    except KeyboardInterrupt:
-        print("Caught keyboard interrupt. Quitting.")
     
-    except:
-        tb = traceback.format_exc()
-        print("Caught unhandled exception:\n%s" %tb)
\ No newline at end of file
+    async def arunPipeline(self, pipe):
+        """
+        Asyncio version of runPipeline().
+        """
+        
+        self.__pipeline = pipe
+        
+        await self.arun(self.__pipelineCallback)
+    
+    
+    def runPipelineBlocks(self, pipe, interval = 1.0, tickless = False):
+        """
+        Run the counter a block of gates at a time, see runBlocks(), feeding every block to pipe, a pipeline.pipeline instance.
+        """
+        
+        self.__pipeline = pipe
+        
+        self.runBlocks(pipe.processBlock, interval, tickless)
+    
+    
+    async def arunPipelineBlocks(self, pipe, interval = 1.0, tickless = False):
+        """
+        Asyncio version of runPipelineBlocks().
+        """
+        
+        self.__pipeline = pipe
+        
+        await self.arunBlocks(pipe.processBlock, interval, tickless)
+    
+    
+    def stop(self):
+        """
+        Ask a running run() or arun() loop to stop after the current sample.
+        """
+        
+        self.__keepRunning = False
+        
+        return
+    
+    
+    def setHistory(self, store):
+        """
+        Record every reading with its time and flags in store, a history.historyStore, so recent history can be queried while running.
+        """
+        
+        self.__history = store
+        
+        return
+    
+    
+    def getHistory(self):
+        """
+        Get our history store, or None if we aren't keeping one.
+        """
+        
+        return self.__history
+    
+    
+    def setPublisher(self, ring):
+        """
+        Publish every reading with its time and flags to ring, a shmRing.shmRing, for local readers in other processes.
+        """
+        
+        self.__publisher = ring
+        
+        return
+    
+    
+    def __gateLength(self):
+        """
+        Get the length in seconds of the gate being handled, from its gate times if the hardware keeps them, otherwise one second.
+        """
+        
+        retVal = 1.0
+        
+        if (self.__gateTimes is not None) and (self.__gateTimes[1] > self.__gateTimes[0]):
+            retVal = float(self.__gateTimes[1] - self.__gateTimes[0])
+        
+        return retVal
+    
+    
+    def __runRecord(self, thisReading):
+        """
+        Add a reading to the run time, totals and statistics, and to the history and ring buffer if we're keeping them.
+        """
+        
+        # Count the gate towards our run time, whatever the mode.
+        self.__runtime += 1
+        self.__measCts += thisReading
+        
+        # Scale by the gate's measured length.
+        gateLen = self.__gateLength()
+        self.__cpsStats.add(thisReading / gateLen)
+        
+        self.__liveTime += gateLen
+        self.__lastLiveTime = gateLen
+        
+        if (self.__history is None) and (self.__publisher is None):
+            return
+        
+        if self.__gateTimes is not None:
+            # Use the end of the gate.
+            ts = self.__gateTimes[1]
+        else:
+            ts = time.time()
+        
+        if self.__history is not None:
+            self.__history.append(ts, thisReading, self.__flags & 0xffff)
+        
+        if self.__publisher is not None:
+            self.__publisher.publish(ts, thisReading, self.__flags)
+        
+        return
+    
+    
+    def __runRecordBlock(self, blk):
+        """
+        Add a block of readings from pipeline.makeBlock() to the run time, totals and statistics, and to the history and ring buffer if we're keeping them.
+        """
+        
+        self.__runtime += blk['n']
+        self.__measCts += int(blk['counts'].sum())
+        self.__lastLiveTime = float(blk['gateLen'].sum())
+        self.__liveTime += self.__lastLiveTime
+        self.__cpsStats.addMany(blk['counts'] / blk['gateLen'])
+        
+        if self.__history is not None:
+            for ts, counts in zip(blk['ts'].tolist(), blk['counts'].tolist()):
+                self.__history.append(ts, counts, self.__flags & 0xffff)
+        
+        if self.__publisher is not None:
+            for ts, counts in zip(blk['ts'].tolist(), blk['counts'].tolist()):
+                self.__publisher.publish(ts, counts, self.__flags)
+        
+        return
+    
+    
+    def addChannelPipeline(self, channel, pipe):
+        """
+        Feed the readings of one of the hardware's other channels, e.g. 'counter1' or 'ain0' from a LabJack U3, to pipe, a pipeline.pipeline instance, each gate. With blocks only the latest reading of the channel is fed, once per block.
+        """
+        
+        self.__channelPipes[channel] = pipe
+        
+        return
+    
+    
+    def __runChannels(self):
+        """
+        Feed the readings of other channels to their pipelines.
+        """
+        
+        for channel, pipe in self.__channelPipes.items():
+            if (self.__channels is None) or (channel not in self.__channels):
+                raise RuntimeError("The hardware has no channel %s." %channel)
+            
+            pipe(self.__channels[channel], self.__gateTimes)
+        
+        return
+    
+    
+    def setCheckpoint(self, ckpt, interval = 10):
+        """
+        Periodically save measurement state to ckpt, a checkpoint.checkpoint instance, every interval gates and at the end of the run.
+        """
+        
+        self.__ckpt = ckpt
+        self.__ckptInterval = interval
+        
+        return
+    
+    
+    def resume(self):
+        """
+        Load the last checkpoint so the next run continues that measurement. Returns True if there was a checkpoint to resume from.
+        """
+        
+        retVal = False
+        
+        if self.__ckpt is None:
+            raise RuntimeError("Can't resume without a checkpoint. Call setCheckpoint() first.")
+        
+        try:
+            self.__resumeState = self.__ckpt.load()
+        
+        except:
+            raise
+        
+        if self.__resumeState is not None:
+            # Make sure we're picking up the same kind of measurement.
+            if self.__resumeState['mode'] != self.__mode:
+                raise RuntimeError("Checkpoint is for mode %s, not %s." %(self.__resumeState['mode'], self.__mode))
+            
+            retVal = True
+        
+        return retVal
+    
+    
+    def getState(self):
+        """
+        Get all measurement state as a JSON-serialisable dictionary: mode, flags, averaging buffer, scaler totals, run start time, gaps and pipeline stage state.
+        """
+        
+        retVal = {
+            'mode': self.__mode,
+            'flags': self.__flags,
+            'samples': self.__samples,
+            'accumCts': self.__accumCts,
+            'runtime': self.__runtime,
+            'scalerTime': self.__scalerTime,
+            'liveTime': self.__liveTime,
+            'measCts': self.__measCts,
+            'dtsStart': self.__dtsStart.strftime(self.__tsStateFormat),
+            'saved': datetime.datetime.utcnow().strftime(self.__tsStateFormat),
+            'gaps': [[gapStart.strftime(self.__tsStateFormat), gapEnd.strftime(self.__tsStateFormat)] for gapStart, gapEnd in self.__gaps],
+            'cpsStats': self.__cpsStats.getState()
+        }
+        
+        if self.__pipeline is not None:
+            retVal['stages'] = self.__pipeline.getState()
+        
+        if len(self.__channelPipes) > 0:
+            retVal['channelStages'] = dict([(channel, pipe.getState()) for channel, pipe in self.__channelPipes.items()])
+        
+        if self.__sprt is not None:
+            retVal['sprt'] = self.__sprt.getState()
+        
+        return retVal
+    
+    
+    def __saveCheckpoint(self):
+        """
+        Save our state to the checkpoint, reporting but not raising errors so a full disk doesn't stop the measurement.
+        """
+        
+        try:
+            self.__ckpt.save(self.getState())
+        
+        except:
+            print("Failed to save checkpoint: %s" %traceback.format_exc())
+        
+        return
+    
+    
+    def __runCheckpoint(self, gates = 1):
+        """
+        Save a checkpoint if we're due one. Called after every gate, or every block of gates.
+        """
+        
+        if self.__ckpt is not None:
+            self.__ckptGates += gates
+            
+            if self.__ckptGates >= self.__ckptInterval:
+                self.__ckptGates = 0
+                self.__saveCheckpoint()
+        
+        return
+    
+    
+    def __runResume(self):
+        """
+        Restore state from a loaded checkpoint and record the gap since it was saved.
+        """
+        
+        state = self.__resumeState
+        self.__resumeState = None
+        
+        # Restore mode state.
+        self.__flags = state['flags']
+        self.__samples = list(state['samples'])
+        self.__accumCts = state['accumCts']
+        self.__runtime = state['runtime']
+        self.__scalerTime = float(state.get('scalerTime', state.get('scalerGates', state['runtime'])))
+        self.__liveTime = state.get('liveTime', float(state['runtime']))
+        self.__measCts = state.get('measCts', 0)
+        self.__dtsStart = datetime.datetime.strptime(state['dtsStart'], self.__tsStateFormat)
+        self.__gaps = [(datetime.datetime.strptime(gapStart, self.__tsStateFormat), datetime.datetime.strptime(gapEnd, self.__tsStateFormat)) for gapStart, gapEnd in state['gaps']]
+        
+        if 'cpsStats' in state:
+            self.__cpsStats.setState(state['cpsStats'])
+        
+        if (self.__pipeline is not None) and ('stages' in state):
+            self.__pipeline.setState(state['stages'])
+        
+        for channel, pipe in self.__channelPipes.items():
+            if channel in state.get('channelStages', {}):
+                pipe.setState(state['channelStages'][channel])
+        
+        if (self.__sprt is not None) and ('sprt' in state):
+            self.__sprt.setState(state['sprt'])
+        
+        # We lost everything between the last save and now.
+        self.__gaps.append((datetime.datetime.strptime(state['saved'], self.__tsStateFormat), datetime.datetime.utcnow()))
+        
+        if self.__textOut == True:
+            print("Resuming measurement started %s after a %s sec. gap." %(self.__dtsStart.strftime(self.__tsFormat), round((self.__gaps[-1][1] - self.__gaps[-1][0]).total_seconds(), 3)))
+        
+        return
+    
+    
+    def __runStart(self, devConfig):
+        """
+        Report the hardware configuration and record the start of a run. Called by run() and arun() once the hardware is set up.
+        """
+        
+        if self.__textOut == True:
+            print("Counter hardware platform is %s." %devConfig['desc'])
+        
+        if self.__debugOn == True:
+            print("Hardware config information:\n%s" %devConfig['config'])
+        
+        if self.__resumeState is not None:
+            # Pick up where the last run left off.
+            self.__runResume()
+        
+        else:
+            # When are we starting?
+            self.__dtsStart = datetime.datetime.utcnow()
+            self.__liveTime = 0.0
+            self.__measCts = 0
+        
+        self.__stopReason = None
+        
+        # Count wakeups from here.
+        self.__wakeups = 0
+        self.__wakeStart = time.monotonic()
+        self.__switchStart = self.__getSwitches()
+        
+        # In case we bomb out make sure we have some sort of end DTS.
+        self.__dtsEnd = datetime.datetime.utcnow()
+        
+        if self.__textOut == True:
+            # Print start time
+            print("Start time: %s" %self.__dtsStart.strftime(self.__tsFormat))
+        
+        return
+    
+    
+    def __getSwitches(self):
+        """
+        Get the number of times the process has given up the CPU to wait, or None where the OS doesn't say.
+        """
+        
+        try:
+            import resource
+        
+        except ImportError:
+            return None
+        
+        return resource.getrusage(resource.RUSAGE_SELF).ru_nvcsw
+    
+    
+    def getWakeups(self):
+        """
+        Get how often we've woken up this run, to check a low-power run keeps to its budget: 'wakeups', the times the run loop woke, and 'switches', the times the process slept and woke for any reason including waiting in a read, each also per hour. switches are None where the OS doesn't count them.
+        """
+        
+        if self.__wakeStart is None:
+            return None
+        
+        hours = max(time.monotonic() - self.__wakeStart, 1e-6) / 3600.0
+        switches = self.__getSwitches()
+        
+        if (switches is not None) and (self.__switchStart is not None):
+            switches -= self.__switchStart
+        else:
+            switches = None
+        
+        return {'wakeups': self.__wakeups, 'perHour': self.__wakeups / hours, 'switches': switches, 'switchesPerHour': None if switches is None else switches / hours}
+    
+    
+    def getRelUncertainty(self):
+        """
+        Get the relative uncertainty (one standard error over the mean) of the mean count rate so far, or None if we can't tell yet. This is the larger of the Poisson counting error and the spread we've actually seen between gates, so a noisy detector doesn't finish early.
+        """
+        
+        cpsStats = self.__cpsStats.getSummary()
+        
+        if (self.__measCts == 0) or (cpsStats['stdDev'] is None) or (cpsStats['mean'] <= 0):
+            return None
+        
+        return max(1.0 / math.sqrt(self.__measCts), cpsStats['stdDev'] / math.sqrt(cpsStats['n']) / cpsStats['mean'])
+    
+    
+    def __runLimitCheck(self):
+        """
+        Stop the loop if we've hit our time limit or one of our presets.
+        """
+        
+        # If we're in timed mode make sure we haven't exceeded our runtime. The limit is on the time measured, summed over the gates, so it holds however fast the hardware delivers them, and a resumed measurement only gets what it has left. Stop if that's nearer to the limit than another gate or block would be.
+        if (self.__timed == True) and (self.__liveTime >= (self.__timeLimit - (self.__lastLiveTime / 2.0))):
+            self.__stopReason = "Time limit of %s sec. reached." %round(self.__timeLimit, 3)
+        
+        # Enough counts?
+        elif (self.__presetCounts is not None) and (self.__measCts >= self.__presetCounts):
+            self.__stopReason = "Preset count of %s reached." %self.__presetCounts
+        
+        # Precise enough? Wait for a few gates so we have some idea of the spread.
+        elif (self.__presetPrecision is not None) and (self.__runtime >= self.__c_minPrecisionGates):
+            relUnc = self.getRelUncertainty()
+            
+            if (relUnc is not None) and (relUnc <= self.__presetPrecision):
+                self.__stopReason = "Preset precision of %s%% reached." %round(self.__presetPrecision * 100.0, 3)
+        
+        if self.__stopReason is not None:
+            self.__keepRunning = False
+        
+        return
+    
+    
+    def __runStats(self):
+        """
+        Print run statistics and store the final scaler reading. Called when run() or arun() finishes.
+        """
+        
+        if self.__textOut == True:
+            print("Run statistics:")
+            
+            # Print start time
+            print("Start time: %s" %self.__dtsStart.strftime(self.__tsFormat))
+            
+            # Print end time
+            print("End time: %s" %self.__dtsEnd.strftime(self.__tsFormat))
+            
+            # Print any gaps from restarts.
+            for gapStart, gapEnd in self.__gaps:
+                print("Gap: %s to %s (%s sec.)" %(gapStart.strftime(self.__tsFormat), gapEnd.strftime(self.__tsFormat), round((gapEnd - gapStart).total_seconds(), 3)))
+            
+            # Print CPS statistics.
+            cpsStats = self.__cpsStats.getSummary()
+            
+            if cpsStats['n'] > 0:
+                print("CPS over %s gates: mean %s, std. dev. %s, min %s, max %s, median %s, p95 %s, p99 %s" %(cpsStats['n'], round(cpsStats['mean'], 3), None if cpsStats['stdDev'] is None else round(cpsStats['stdDev'], 3), round(cpsStats['min'], 3), round(cpsStats['max'], 3), round(cpsStats['p50'], 3), round(cpsStats['p95'], 3), round(cpsStats['p99'], 3)))
+            
+            relUnc = self.getRelUncertainty()
+            
+            if relUnc is not None:
+                print("Total counts %s in %s sec., relative uncertainty of the mean %s%%" %(self.__measCts, round(self.__liveTime, 3), round(relUnc * 100.0, 3)))
+            
+            # How often did we wake up?
+            wakeups = self.getWakeups()
+            
+            if wakeups is not None:
+                if wakeups['switches'] is not None:
+                    print("Wakeups: %s (%s per hour), %s context switches (%s per hour)." %(wakeups['wakeups'], round(wakeups['perHour'], 1), wakeups['switches'], round(wakeups['switchesPerHour'], 1)))
+                else:
+                    print("Wakeups: %s (%s per hour)." %(wakeups['wakeups'], round(wakeups['perHour'], 1)))
+            
+            # Why did we stop?
+            if self.__stopReason is not None:
+                print(self.__stopReason)
+        
+        # Store a summary of the run.
+        if self.__stg is not None:
+            try:
+                self.__stg.storeSummary({
+                    'mode': self.__mode,
+                    'dtsStart': self.__dtsStart.strftime(self.__tsStateFormat),
+                    'dtsEnd': self.__dtsEnd.strftime(self.__tsStateFormat),
+                    'gaps': [[gapStart.strftime(self.__tsStateFormat), gapEnd.strftime(self.__tsStateFormat)] for gapStart, gapEnd in self.__gaps],
+                    'cps': self.__cpsStats.getSummary(),
+                    'counts': self.__measCts,
+                    'liveTime': self.__liveTime,
+                    'relUncertainty': self.getRelUncertainty(),
+                    'wakeups': self.getWakeups(),
+                    'stopReason': self.__stopReason
+                })
+            
+            except:
+                print("Failed to store run summary: %s" %traceback.format_exc())
+        
+        # Save our final state so the measurement can still be resumed.
+        if self.__ckpt is not None:
+            self.__saveCheckpoint()
+        
+        # Let pipeline stages report and store their final results.
+        if self.__pipeline is not None:
+            self.__pipeline.finish()
+        
+        for pipe in self.__channelPipes.values():
+            pipe.finish()
+        
+        # Report time to detect in search mode.
+        if self.__sprt is not None:
+            self.__sprt.finish({})
+        
+        if self.__textOut == True:
+            # Store the things.
+            ### NOT YET IMPLEMENTED.
+            
+            # If we're in rolling mode make sure we give final stats after the program is killed.
+            if (self.__flags & self.f_mode) == self.f_mode_scaler:
+                # Make sure we don't divide by zero.
+                if self.__scalerTime > 0:
+                    # Average counts over our run time...
+                    avgCts = float(self.__accumCts) / self.__scalerTime
+                    
+                    # CPS -> CPM.
+                    finalCpm = avgCts * 60.0
+                    
+                    # If we have a storage mode set up...
+                    if self.__stg is not None:
+                        # Store the things.
+                        try:
+                            self.__stg.storeDatapoint([datetime.datetime.utcnow(), finalCpm])
+                        except:
+                            print("Failed to store data point: %s" %traceback.format_exc())
+                    
+                    print("Total counts %s in %s sec." %(self.__accumCts, round(self.__scalerTime, 3)))
+                    print("Avg CPM over %s sec: %s" %(round(self.__scalerTime, 3), round(finalCpm, 3)))
+                    
+                    # If we want stats in counts per second as well...
+                    if self.__cpsOn == True:
+                        print("Avg CPS over %s sec: %s" %(round(self.__scalerTime, 3), round(avgCts, 3)))
+                    
+                #else:
+                    #raise RuntimeError("We ran for < 1 sec., not averaging data.")
+        
+        # Make sure everything we stored is on disk.
+        if self.__stg is not None:
+            try:
+                self.__stg.flush()
+            except:
+                print("Failed to flush data: %s" %traceback.format_exc())
+        
+        return
+    
+    
+    def run(self, callBack):
+        """
+        Run the counter. Every time a sample is taken the callback method is called.
+        """
+        
+        # Flag keeprunning as true.
+        self.__keepRunning = True
+        
+        try:
+            # Set up our hardware interface.
+            self.__hw.setup()
+            
+            # Get config and record our start.
+            self.__runStart(self.__hw.getConfig())
+            
+            while self.__keepRunning:
+                try:
+                    # Measure for 1 second, or until the hardware's next gate if it keeps its own time.
+                    nextPoll = self.__hw.getNextPoll()
+                    
+                    if nextPoll is None:
+                        time.sleep(1)
+                    else:
+                        time.sleep(max(0.0, nextPoll - time.time()))
+                    
+                    self.__wakeups += 1
+                    
+                    # Snag counter results.
+                    thisReading = self.__hw.poll()
+                    self.__gateTimes = self.__hw.getGateTimes()
+                    self.setFlag(self.f_counter, self.__hw.getCounterFlags())
+                    self.__channels = self.__hw.getChannels()
+                    self.__events = self.__hw.getEvents()
+                    
+                    # Execute our callback with the current reading.
+                    callBack(thisReading)
+                    
+                    # Other channels go to their own pipelines.
+                    self.__runChannels()
+                    
+                    # Keep the reading in our history.
+                    self.__runRecord(thisReading)
+                    
+                    # Make sure we haven't exceeded our runtime.
+                    self.__runLimitCheck()
+                    
+                    # Save our state if we're due.
+                    self.__runCheckpoint()
+                
+                except:
+                    # Stop the loop.
+                    self.__keepRunning = False
+                    
+                    # Pass the exception up the stack.
+                    raise
+            
+            # When are we starting?
+            self.__dtsEnd = datetime.datetime.utcnow()
+            
+            # Stop the harware counter.
+            self.__hw.stop()
+        
+        except:
+            raise
+        
+        finally:
+            # Dump our stats.
+            self.__runStats()
+            
+            try:
+                # Clean up the hardware interface.
+                self.__hw.cleanup()
+            
+            except:
+                raise
+    
+    
+    async def arun(self, callBack):
+        """
+        Asyncio version of run(). The hardware platform must be an asyncCounterIface, such as a synchronous backend wrapped in hwInterface.asyncHwAdapter. The callback may be a plain function or a coroutine function.
+        Gates are scheduled against the event loop clock so many counters can share one loop without drifting.
+        """
+        
+        # Imported here so the synchronous run() doesn't need asyncio.
+        import asyncio
+        
+        # Flag keeprunning as true.
+        self.__keepRunning = True
+        
+        try:
+            # Set up our hardware interface.
+            await self.__hw.setup()
+            
+            # Get config and record our start.
+            self.__runStart(await self.__hw.getConfig())
+            
+            # Gates are one second apart on the loop's monotonic clock.
+            loop = asyncio.get_running_loop()
+            nextGate = loop.time()
+            
+            while self.__keepRunning:
+                try:
+                    # Measure for 1 second, or until the hardware's next gate if it keeps its own time.
+                    nextPoll = self.__hw.getNextPoll()
+                    
+                    if nextPoll is None:
+                        nextGate += 1.0
+                        await asyncio.sleep(max(0.0, nextGate - loop.time()))
+                    
+                    else:
+                        await asyncio.sleep(max(0.0, nextPoll - time.time()))
+                        nextGate = loop.time()
+                    
+                    self.__wakeups += 1
+                    
+                    # Snag counter results.
+                    thisReading = await self.__hw.poll()
+                    self.__gateTimes = self.__hw.getGateTimes()
+                    self.setFlag(self.f_counter, self.__hw.getCounterFlags())
+                    self.__channels = self.__hw.getChannels()
+                    self.__events = self.__hw.getEvents()
+                    
+                    # Execute our callback with the current reading, waiting on it if it's a coroutine.
+                    cbRet = callBack(thisReading)
+                    
+                    if asyncio.iscoroutine(cbRet):
+                        await cbRet
+                    
+                    # Other channels go to their own pipelines.
+                    self.__runChannels()
+                    
+                    # Keep the reading in our history.
+                    self.__runRecord(thisReading)
+                    
+                    # Make sure we haven't exceeded our runtime.
+                    self.__runLimitCheck()
+                    
+                    # Save our state if we're due.
+                    self.__runCheckpoint()
+                
+                except:
+                    # Stop the loop.
+                    self.__keepRunning = False
+                    
+                    # Pass the exception up the stack.
+                    raise
+            
+            # When are we starting?
+            self.__dtsEnd = datetime.datetime.utcnow()
+            
+            # Stop the harware counter.
+            await self.__hw.stop()
+        
+        except:
+            raise
+        
+        finally:
+            # Dump our stats.
+            self.__runStats()
+            
+            try:
+                # Clean up the hardware interface.
+                await self.__hw.cleanup()
+            
+            except:
+                raise
+    
+    
+    def __trimBlock(self, blk):
+        """
+        Cut a block off at the gate a timed run stops at, as __runLimitCheck() would have stopped gate by gate, so a big block doesn't run past the time limit.
+        """
+        
+        if (self.__timed == False) or (blk['n'] == 0):
+            return blk
+        
+        import numpy
+        
+        liveTime = self.__liveTime + numpy.cumsum(blk['gateLen'])
+        done = numpy.flatnonzero(liveTime >= (self.__timeLimit - (blk['gateLen'] / 2.0)))
+        
+        if len(done) == 0:
+            return blk
+        
+        n = int(done[0]) + 1
+        
+        for key in ('counts', 'ts', 'gateLen'):
+            blk[key] = blk[key][:n]
+        
+        blk['n'] = n
+        
+        return blk
+    
+    
+    def __ticklessInterval(self, interval):
+        """
+        Cut a tickless run's wakeup budget down to how long the hardware can hold finished gates for, so none are lost between wakeups.
+        """
+        
+        bufferSeconds = self.__hw.getBufferSeconds()
+        
+        if (bufferSeconds is None) or (bufferSeconds >= interval):
+            return interval
+        
+        if self.__textOut == True:
+            if bufferSeconds > 0.0:
+                print("The hardware holds %s sec. of gates, so waking every %s sec. rather than %s." %(round(bufferSeconds, 3), round(bufferSeconds, 3), interval))
+            else:
+                print("The hardware doesn't hold finished gates, so waking for every gate.")
+        
+        return bufferSeconds
+    
+    
+    @contextlib.contextmanager
+    def __heldOutput(self, hold):
+        """
+        Context that holds on to everything printed in it and writes it out in one go at the end, if hold is True, so a block's output is one write rather than one per line.
+        """
+        
+        if hold == False:
+            yield
+            return
+        
+        outBuf = io.StringIO()
+        
+        try:
+            with contextlib.redirect_stdout(outBuf):
+                yield
+        
+        finally:
+            sys.stdout.write(outBuf.getvalue())
+            sys.stdout.flush()
+    
+    
+    def runBlocks(self, callBack, interval = 1.0, tickless = False):
+        """
+        Run the counter a block of gates at a time. Every interval seconds, or at the hardware's next gate if that's later, or every second for hardware that doesn't time its own gates, every gate that's finished is fetched with the hardware's pollBlock() and the callback is called once with the block, a pipeline.makeBlock() dictionary. With short gates or hardware that buffers readings this saves the per-gate overhead of run(). An interval of 0 fetches gates as soon as the hardware has them.
+        With tickless True this is a low-wakeup run for battery and solar powered nodes. interval is the wakeup budget, cut down to what the hardware can hold without losing gates, see its getBufferSeconds(), and what's printed for each block is written out at once. Each gate still gets its own reading. getWakeups() says how well we kept to the budget.
+        Run limits are checked after each block, so a run may go up to a block past them.
+        """
+        
+        # Flag keeprunning as true.
+        self.__keepRunning = True
+        
+        try:
+            # Set up our hardware interface.
+            self.__hw.setup()
+            
+            # Get config and record our start.
+            self.__runStart(self.__hw.getConfig())
+            
+            if tickless == True:
+                interval = self.__ticklessInterval(interval)
+            
+            nextWake = time.monotonic()
+            
+            while self.__keepRunning:
+                try:
+                    # Wait for the next block, or the hardware's next gate if it's later. Hardware that doesn't time its own gates counts from one poll to the next, so it's polled once a second.
+                    nextPoll = self.__hw.getNextPoll()
+                    
+                    if nextPoll is None:
+                        nextWake += 1.0
+                        wait = nextWake - time.monotonic()
+                    
+                    else:
+                        nextWake += interval
+                        wait = max(nextWake - time.monotonic(), nextPoll - time.time())
+                    
+                    time.sleep(max(0.0, wait))
+                    nextWake = max(nextWake, time.monotonic())
+                    self.__wakeups += 1
+                    
+                    # Snag counter results.
+                    counts, ends, gateLens = self.__hw.pollBlock()
+                    blk = self.__trimBlock(pipeline.makeBlock(counts, ends, gateLens, self.__hw.getCounterFlags()))
+                    
+                    if blk['n'] == 0:
+                        continue
+                    
+                    self.__gateTimes = (blk['ts'][-1] - blk['gateLen'][-1], blk['ts'][-1])
+                    self.setFlag(self.f_counter, blk['counterFlags'])
+                    
+                    # In tickless mode what's printed for the block is written out at once.
+                    with self.__heldOutput(tickless):
+                        # Execute our callback with the block.
+                        callBack(blk)
+                        
+                        # Other channels go to their own pipelines.
+                        self.__channels = self.__hw.getChannels()
+                        self.__runChannels()
+                        
+                        # Keep the readings in our history.
+                        self.__runRecordBlock(blk)
+                        
+                        # Make sure we haven't exceeded our runtime.
+                        self.__runLimitCheck()
+                        
+                        # Save our state if we're due.
+                        self.__runCheckpoint(blk['n'])
+                
+                except:
+                    # Stop the loop.
+                    self.__keepRunning = False
+                    
+                    # Pass the exception up the stack.
+                    raise
+            
+            # When are we starting?
+            self.__dtsEnd = datetime.datetime.utcnow()
+            
+            # Stop the harware counter.
+            self.__hw.stop()
+        
+        except:
+            raise
+        
+        finally:
+            # Dump our stats.
+            self.__runStats()
+            
+            try:
+                # Clean up the hardware interface.
+                self.__hw.cleanup()
+            
+            except:
+                raise
+    
+    
+    async def arunBlocks(self, callBack, interval = 1.0, tickless = False):
+        """
+        Asyncio version of runBlocks(). The hardware platform must be an asyncCounterIface, and the callback may be a plain function or a coroutine function.
+        """
+        
+        # Imported here so the synchronous run() doesn't need asyncio.
+        import asyncio
+        
+        # Flag keeprunning as true.
+        self.__keepRunning = True
+        
+        try:
+            # Set up our hardware interface.
+            await self.__hw.setup()
+            
+            # Get config and record our start.
+            self.__runStart(await self.__hw.getConfig())
+            
+            if tickless == True:
+                interval = self.__ticklessInterval(interval)
+            
+            loop = asyncio.get_running_loop()
+            nextWake = loop.time()
+            
+            while self.__keepRunning:
+                try:
+                    # Wait for the next block, or the hardware's next gate if it's later. Hardware that doesn't time its own gates counts from one poll to the next, so it's polled once a second.
+                    nextPoll = self.__hw.getNextPoll()
+                    
+                    if nextPoll is None:
+                        nextWake += 1.0
+                        wait = nextWake - loop.time()
+                    
+                    else:
+                        nextWake += interval
+                        wait = max(nextWake - loop.time(), nextPoll - time.time())
+                    
+                    await asyncio.sleep(max(0.0, wait))
+                    nextWake = max(nextWake, loop.time())
+                    self.__wakeups += 1
+                    
+                    # Snag counter results.
+                    counts, ends, gateLens = await self.__hw.pollBlock()
+                    blk = self.__trimBlock(pipeline.makeBlock(counts, ends, gateLens, self.__hw.getCounterFlags()))
+                    
+                    if blk['n'] == 0:
+                        continue
+                    
+                    self.__gateTimes = (blk['ts'][-1] - blk['gateLen'][-1], blk['ts'][-1])
+                    self.setFlag(self.f_counter, blk['counterFlags'])
+                    
+                    # In tickless mode what's printed for the block is written out at once.
+                    with self.__heldOutput(tickless):
+                        # Execute our callback with the block, waiting on it if it's a coroutine.
+                        cbRet = callBack(blk)
+                        
+                        if asyncio.iscoroutine(cbRet):
+                            await cbRet
+                        
+                        # Other channels go to their own pipelines.
+                        self.__channels = self.__hw.getChannels()
+                        self.__runChannels()
+                        
+                        # Keep the readings in our history.
+                        self.__runRecordBlock(blk)
+                        
+                        # Make sure we haven't exceeded our runtime.
+                        self.__runLimitCheck()
+                        
+                        # Save our state if we're due.
+                        self.__runCheckpoint(blk['n'])
+                
+                except:
+                    # Stop the loop.
+                    self.__keepRunning = False
+                    
+                    # Pass the exception up the stack.
+                    raise
+            
+            # When are we starting?
+            self.__dtsEnd = datetime.datetime.utcnow()
+            
+            # Stop the harware counter.
+            await self.__hw.stop()
+        
+        except:
+            raise
+        
+        finally:
+            # Dump our stats.
+            self.__runStats()
+            
+            try:
+                # Clean up the hardware interface.
+                await self.__hw.cleanup()
+            
+            except:
+                raise
+    
+
+#######################
+# Main execution body #
+#######################
+
+if __name__ == "__main__":
+    import argparse
+
+    # Set up command line interface.
+    parser = argparse.ArgumentParser(description = "Geiger counter interface", epilog = "Fast mode averages counts over a 4 second period, and slow mode averages counts over a 22 second period. This is modeled from the Ludlum model 3 geiger counter. It is intended that this program get support for storing data to files.  The arduser and ardui2c hardware keep their own gate time, so readings are scheduled to the Arduino's gates and timestamped with the gate's end on the host clock. KNOWN ISSUES: The ardui2c hardware type has not yet been tested.")
+    parser.add_argument('--accumulate', action='store_true', help = 'Keep a sum of all detected counts.')
+    parser.add_argument('--cps', action='store_true', help = 'Show live counts per second.')
+    parser.add_argument('--hw', choices=['dummy', 'random', 'sim', 'u3', 'arduser', 'ardui2c'], required = True, help = 'Set counter hardware platform. The choices are "u3" for a LabJack U3, "arduser" for an Arduino-based counter connected via serial port, "ardui2c" for an Arduino-based counter on an I2C bus, "dummy" which does nothing, "random" which generates random numbers, and "sim" which simulates a detector with Poisson counts, see the --sim options.')
+    parser.add_argument('--debug', action='store_true', help = 'Debug')
+    parser.add_argument('--flags', action='store_true', help = 'Display flags.')
+    parser.add_argument('--mode', choices=['fast', 'slow', 'counter', 'scaler', 'sprt'], required = False, help = 'Set mode option. Fast averages samples over 4 sec., Slow averages samples over 22 sec. Counter mode implies --cps and does not average. Scaler mode keeps adding an average as long as it runs, and dumps stats at the end. Scaler mode also implies --quiet. Sprt mode learns the background over 22 sec. and then tests every sample, flagging the trend as up as soon as readings are statistically elevated.')
+    parser.add_argument('--pipeline', type = str, required = False, default = None, help = 'Run several modes together on one stream instead of --mode. Comma-separated list of stages from fast, slow, counter, scaler, sprt, value, health, periodic, baseline, dose and trend, e.g. "fast,slow,trend,scaler". Trend follows the first fast or slow stage before it. Health checks that the counts are Poisson and flags bursty or stuck detectors. Periodic flags periodic interference, see --periodic-periods. Baseline learns the background for each time of day and scores each sample in standard deviations from it, scoring the first fast or slow stage before it or the raw counts, see the --baseline options. Alarms can watch the score with source=baseline,field=score. Dose converts the first fast or slow stage before it, or the raw counts, to uSv/h with the --calibration profile, and flags rates too high to correct for dead time. Value passes readings through unchanged, for analog channels. With "--store csv" each stage gets its own file, named after --out with the stage name added, and with health, periodic or baseline in the pipeline each data point is stored with its flags.')
+    parser.add_argument('--periodic-periods', type = str, required = False, default = None, help = 'Comma-separated periods in gates for the periodic stage to watch. Defaults to "10,60,300,900".')
+    parser.add_argument('--baseline-file', type = str, default = None, help = 'Keep the baseline stage\'s learned background in this file from one run to the next. Channel pipelines keep theirs in files named after it with the channel added.')
+    parser.add_argument('--baseline-half-life', type = float, default = 7.0, help = 'Half life in days of the baseline stage\'s memory of past days. Defaults to 7.')
+    parser.add_argument('--baseline-bins', type = int, default = 96, help = 'Number of time-of-day bins the baseline stage splits the day into. Defaults to 96, 15 minutes each.')
+    parser.add_argument('--baseline-z', type = float, default = 4.0, help = 'Anomaly score, in standard deviations, at which the baseline stage flags readings as anomalous. Defaults to 4.')
+    parser.add_argument('--calibration', type = str, default = None, help = 'JSON file of calibration profiles for the dose stage: response (linear, piecewise or a lookup table), dead time and energy compensation, for every detector or by detector name. Channel pipelines use the profile named after their channel, falling back to "default". See calibration.py, which also converts archives in bulk.')
+    parser.add_argument('--calibration-detector', type = str, default = 'default', help = 'Calibration profile for the main pipeline\'s dose stage. Defaults to "default".')
+    parser.add_argument('--time', type = str, help = 'Time to measure for, in seconds or with a unit of s, m or h, e.g. 90, 5m or 1h30m, summed over the gates as the hardware times them. Works in every mode.')
+    parser.add_argument('--block', type = float, default = None, help = 'Fetch finished gates from the hardware in blocks every this many seconds, and process each block at once. Counter, fast, slow, scaler and storage pipeline stages work on whole blocks, which cuts the overhead of short gates. 0 fetches gates as soon as the hardware has them.')
+    parser.add_argument('--tickless', type = float, default = None, help = 'Low-wakeup mode for battery and solar powered nodes, e.g. 60 for a wakeup a minute. Like --block, but this many seconds is a wakeup budget: gates are left in the hardware\'s buffer, the serial port\'s for arduser, and fetched together, each gate keeping its own reading, output is written a block at a time, and wakeups per hour are reported at the end. Hardware that can\'t hold gates that long is woken as often as it needs.')
+    parser.add_argument('--preset-counts', type = int, default = None, help = 'Stop once this many counts are in.')
+    parser.add_argument('--preset-precision', type = float, default = None, help = 'Stop once the relative uncertainty of the mean count rate is at or below this, e.g. 0.01 for 1%%. Uses the larger of the Poisson counting error and the spread seen between gates.')
+    parser.add_argument('--store', choices=['none', 'csv', 'journal'], default='none', required = False, help = 'Store output data in a given format. "journal" keeps data in memory and commits it to a checksummed, block-aligned journal every --commit-interval seconds, which is far easier on SD cards than csv and loses at most one interval of data on a power cut. Read it with journal.py.')
+    parser.add_argument('--out', type = str, required = False, default=None, help = 'Output file name. Only has an effect when "--store csv" or "--store journal" is set. A CSV file will be clobbered if it exists, a journal is recovered and appended to.')
+    parser.add_argument('--commit-interval', type = float, required = False, default = 30.0, help = 'Seconds between journal commits with "--store journal". Defaults to 30.')
+    parser.add_argument('--quiet', action='store_true', help = 'Minimal command line output.')
+    parser.add_argument('--fleet', type = str, required = False, default = None, help = 'Send every sample to a fleet aggregator at host:port over UDP. Needs --pipeline.')
+    parser.add_argument('--site', type = str, required = False, default = 'default', help = 'Site name to report to the fleet aggregator.')
+    parser.add_argument('--detector', type = str, required = False, default = None, help = 'Detector name to report to the fleet aggregator. Defaults to the host name.')
+    parser.add_argument('--alarm', type = str, action = 'append', default = [], help = 'Add an alarm rule. Needs --pipeline. Rules are a kind of threshold, rate or sustained followed by comma-separated settings: source (a pipeline stage or "counts"), field, level, clear, rise, window, duration, holdoff and name, e.g. "threshold,source=fast,level=1000,clear=800,holdoff=60" or "rate,source=slow,rise=300,window=10". May be given more than once.')
+    parser.add_argument('--alarm-exec', type = str, required = False, default = None, help = 'Shell command to run when an alarm is raised or cleared. Details are passed in GEIGER_ALARM_* environment variables.')
+    parser.add_argument('--alarm-socket', type = str, required = False, default = None, help = 'Send alarm events to host:port as UDP datagrams.')
+    parser.add_argument('--checkpoint', type = str, required = False, default = None, help = 'Periodically save measurement state to this file so it survives a crash or power cut.')
+    parser.add_argument('--checkpoint-every', type = int, required = False, default = 10, help = 'Number of samples between checkpoints. Defaults to 10.')
+    parser.add_argument('--resume', action='store_true', help = 'Continue the measurement saved in the --checkpoint file, recording the gap since it was saved.')
+    parser.add_argument('--daemon', type = str, required = False, default = None, help = 'Run as a daemon taking commands on a UNIX control socket at this path, so modes, windows and storage can be changed without restarting. Implies --asyncio and needs --mode. Use daemon.py to send commands.')
+    parser.add_argument('--history', type = int, required = False, default = 0, help = 'Keep this many of the latest readings in memory, about 12 bytes each, for queries such as the daemon history command. 86400 holds a day.')
+    parser.add_argument('--asyncio', action='store_true', help = 'Run the counter on an asyncio event loop, polling the hardware from an executor.')
+    parser.add_argument('--shm', type = str, required = False, default = None, help = 'Publish every reading to a shared memory ring buffer with this name for local readers, see shmRing.shmRingReader.')
+    parser.add_argument('--shm-size', type = int, required = False, default = 3600, help = 'Number of readings the shared memory ring buffer holds, 24 bytes each. Defaults to 3600.')
+    parser.add_argument('--sim-background', type = float, default = 0.5, help = 'Simulator background rate in counts per second. Defaults to 0.5.')
+    parser.add_argument('--sim-profile', type = str, action = 'append', default = [], help = 'Add a simulated source on top of the background, with times in seconds from the start and rates in counts per second: "step,start=60,rate=20[,end=120]" or "ramp,start=60,end=120,rate=20". May be given more than once.')
+    parser.add_argument('--sim-dead-time', type = float, default = 0.0, help = 'Simulated detector dead time in seconds, e.g. 0.0001.')
+    parser.add_argument('--sim-faults', type = float, default = 0.0, help = 'Chance per gate of a simulated fault: a dropout, a noise burst or a stuck counter.')
+    parser.add_argument('--u3-counters', type = str, default = "0", help = 'Comma-separated U3 counters to enable, 0 and/or 1. The first is the main reading. Defaults to 0.')
+    parser.add_argument('--u3-ain', type = str, default = None, help = 'Comma-separated U3 analog inputs to read every gate as well, in the same USB round trip, each optionally followed by a colon and a scale factor for its voltage, e.g. "0:1000,30" for a high voltage divider on AIN0 and the internal temperature sensor (30).')
+    parser.add_argument('--u3-fake', action='store_true', help = 'Use the fakeU3 stand-in instead of a real U3, for testing.')
+    parser.add_argument('--channel', type = str, action = 'append', default = [], help = 'Run a pipeline on another hardware channel, given as the channel then = then stages as for --pipeline, e.g. "counter1=counter,health" for a second tube on a U3 or "ain0=value" for HV telemetry. Needs --pipeline. With "--store csv" the stage files are named after the channel too. May be given more than once.')
+    parser.add_argument('--coinc', type = str, default = None, help = 'Count coincidences between tubes on these comma-separated hardware channels, e.g. "counter0,counter1" on a U3 with --u3-counters 0,1, or "tube0,tube1" with several --ard-dev devices or --sim-tubes. Uses pulse times if the hardware has them and short gates otherwise, and reports the excess over accidental coincidences at the end. Needs --pipeline, and can\'t be used with --block.')
+    parser.add_argument('--coinc-window', type = float, default = 1e-5, help = 'Coincidence window in seconds for hardware with pulse times. Defaults to 0.00001.')
+    parser.add_argument('--coinc-fold', type = int, default = 2, help = 'Number of tubes that make a coincidence. Defaults to 2.')
+    parser.add_argument('--coinc-stages', type = str, default = "counter", help = 'Stages as for --pipeline to run on the coincidence counts. With "--store csv" the stage files are named after coinc too. Defaults to counter.')
+    parser.add_argument('--ard-dev', type = str, default = "/dev/ttyACM0", help = 'Serial device of the arduser hardware. Give several, comma-separated, to read several counters together as channels tube0, tube1 and so on. Defaults to /dev/ttyACM0.')
+    parser.add_argument('--sim-tubes', type = int, default = 1, help = 'Number of simulated tubes, read as channels tube0, tube1 and so on. The first is the main reading.')
+    parser.add_argument('--sim-shower-rate', type = float, default = 0.0, help = 'Rate in counts per second of simulated cosmic showers that hit every tube at once.')
+    parser.add_argument('--sim-events', action = 'store_true', help = 'Simulate the time of every pulse as well as the counts.')
+    parser.add_argument('--sim-seed', type = int, default = None, help = 'Seed the simulator for a reproducible run.')
+    parser.add_argument('--sim-speed', type = float, default = 1.0, help = 'Run the simulator this many times faster than real time, or 0 for as fast as possible. Timestamps follow the simulated clock.')
+    args = parser.parse_args()
+    
+    # We need exactly one of --mode or --pipeline.
+    if (args.mode is None) == (args.pipeline is None):
+        parser.error("Specify exactly one of --mode or --pipeline.")
+    
+    # The daemon switches between the single modes.
+    if (args.daemon is not None) and (args.mode is None):
+        parser.error("--daemon needs --mode.")
+    
+    if args.daemon is not None:
+        args.asyncio = True
+    
+    # Tickless runs are block runs with a wakeup budget.
+    if (args.tickless is not None) and (args.block is not None):
+        parser.error("--tickless can't be used with --block.")
+    
+    if args.tickless is not None:
+        args.block = args.tickless
+    
+    # The daemon polls a gate at a time.
+    if (args.daemon is not None) and (args.block is not None):
+        parser.error("--block and --tickless can't be used with --daemon.")
+    
+    # Coincidences are counted a gate at a time in a pipeline.
+    if (args.coinc is not None) and ((args.pipeline is None) or (args.block is not None)):
+        parser.error("--coinc needs --pipeline and can't be used with --block or --tickless.")
+    
+    # Dose stages need calibrations.
+    if (args.calibration is None) and ("dose" in ','.join([args.pipeline or "", args.coinc_stages] + [channelSpec.split('=', 1)[-1] for channelSpec in args.channel]).split(',')):
+        parser.error("The dose stage needs --calibration.")
+    
+    # Resuming needs a checkpoint file.
+    if (args.resume == True) and (args.checkpoint is None):
+        parser.error("--resume needs --checkpoint.")
+    
+    # Fleet output is a pipeline stage.
+    if (args.fleet is not None) and (args.pipeline is None):
+        parser.error("--fleet needs --pipeline.")
+    
+    # So are alarms, and every rule has to watch a stage in the pipeline.
+    if len(args.alarm) > 0:
+        if args.pipeline is None:
+            parser.error("--alarm needs --pipeline.")
+        
+        import alarms
+        
+        try:
+            alarms.checkSources([alarms.parseRule(spec) for spec in args.alarm], args.pipeline.split(','))
+        
+        except ValueError as e:
+            parser.error("--alarm: %s" %e)
+    
+    # And pipelines on other channels.
+    if (len(args.channel) > 0) and (args.pipeline is None):
+        parser.error("--channel needs --pipeline.")
+    
+    if args.quiet == False:
+        if args.pipeline is None:
+            print("Measurement starting, mode is %s" %args.mode)
+        else:
+            print("Measurement starting, pipeline is %s" %args.pipeline)
+    
+    # Which hardware platform do we have?
+    if args.hw == "u3":
+        # We have a LabJack U3.
+        import u3Hardware
+        hwPlat = u3Hardware.u3Hardware()
+        
+        # Analog inputs, with scale factors if given.
+        u3Ain = []
+        u3Scales = {}
+        
+        if args.u3_ain is not None:
+            for ainSpec in args.u3_ain.split(','):
+                ainParts = ainSpec.split(':')
+                u3Ain.append(int(ainParts[0]))
+                
+                if len(ainParts) > 1:
+                    u3Scales[int(ainParts[0])] = float(ainParts[1])
+        
+        if args.u3_fake == True:
+            import fakeU3
+            u3Module = fakeU3
+        else:
+            u3Module = None
+        
+        hwPlat.setU3Props(counters = [int(counter) for counter in args.u3_counters.split(',')], ain = u3Ain, scales = u3Scales, u3Module = u3Module)
+    
+    elif args.hw == "arduser":
+        # We have an Arduino attached via serial interface, or several.
+        import arduHardware
+        
+        ardPlats = []
+        
+        for ardDev in args.ard_dev.split(','):
+            ardPlat = arduHardware.arduSerHardware()
+            
+            # Set the serial port properties.
+            ardPlat.setSerialProps(ardDev, baud = 115200)
+            ardPlats.append(ardPlat)
+        
+        if len(ardPlats) == 1:
+            hwPlat = ardPlats[0]
+        
+        else:
+            import multiHardware
+            hwPlat = multiHardware.multiHardware()
+            hwPlat.setMultiProps(ardPlats)
+    
+    elif args.hw == "ardui2c":
+        # We have an Arduino attached via I2C bus.
+        import arduHardware
+        hwPlat = arduHardware.arduI2cHardware()
+        
+        # Set the I2C bus properties. Both of these are defaults. 
+        hwPlat.setI2cProps(i2cBusID = 1, targetI2cAddr = 0x35)
+    
+    elif args.hw == "dummy":
+        # We have a dummy class that will just read zeroes.
+        import hwInterface
+        hwPlat = hwInterface.counterIface()
+    
+    elif args.hw == "random":
+        # Use the random number generator.
+        import rndHardware
+        hwPlat = rndHardware.rndHardware()
+    
+    elif args.hw == "sim":
+        # Simulate a detector.
+        import simHardware
+        hwPlat = simHardware.simHardware()
+        hwPlat.setSimProps(background = args.sim_background, profile = [simHardware.parseProfile(spec) for spec in args.sim_profile], deadTime = args.sim_dead_time, faultRate = args.sim_faults, seed = args.sim_seed, speed = args.sim_speed, tubes = args.sim_tubes, showerRate = args.sim_shower_rate, events = args.sim_events)
+    
+    # Every data layer we create, so they can all be closed at the end of the run.
+    stores = []
+    
+    if (args.store != "none") and (args.pipeline is not None):
+        # Each pipeline stage gets its own CSV file or journal, so storage is set up when the pipeline is built.
+        import datalayer
+        import os
+        
+        def stgFactory(stageName):
+            """
+            Create a data layer for one pipeline stage.
+            """
+            
+            stageStg = datalayer.datalayer(args.store, stageName)
+            
+            if args.store == "journal":
+                stageStg.setStorageProps({'commitInterval': args.commit_interval})
+            
+            # Did we specify an output file name?
+            if args.out != None:
+                outRoot, outExt = os.path.splitext(args.out)
+                stageStg.setStorageProps({'fileName': "%s-%s%s" %(outRoot, stageName, outExt)})
+            
+            stores.append(stageStg)
+            
+            return stageStg
+        
+        # The run summary gets stored alongside the stage files.
+        stg = stgFactory("run")
+    
+    elif args.store != "none":
+        # We want to store our results ina CSV file or journal.
+        try:
+            # Import and create data layer.
+            import datalayer
+            stg = datalayer.datalayer(args.store, None)
+            stores.append(stg)
+            
+            if args.store == "journal":
+                stg.setStorageProps({'commitInterval': args.commit_interval})
+        
+        except:
+            print("Failed to create data layer: %s" %traceback.format_exc())
+        
+        # Did we specify an output file name?
+        if args.out != None:
+            try:
+                # Set data layer storage properties.
+                stg.setStorageProps({'fileName': args.out})
+            
+            except:
+                print("Failed to set file name: %s" %traceback.format_exc())
+    
+    else:
+        # We're not doing storage so flag it.
+        stg = None
+    
+    if args.asyncio == True:
+        # Wrap the synchronous hardware so it can be awaited.
+        import hwInterface
+        hwPlat = hwInterface.asyncHwAdapter(hwPlat)
+    
+    # Shared memory ring buffer, if we're publishing one.
+    ring = None
+    
+    try:
+        # Set up geiger counter object.
+        ctr = geigerInterface(hwPlat, args.mode, cps = args.cps, flags = args.flags, debug = args.debug, quiet = args.quiet, time = args.time, stg = stg, presetCounts = args.preset_counts, presetPrecision = args.preset_precision)
+        
+        # Publish readings to local readers?
+        if args.shm is not None:
+            import shmRing
+            ring = shmRing.shmRing(args.shm, capacity = args.shm_size)
+            ctr.setPublisher(ring)
+        
+        # Keep history in memory?
+        if args.history > 0:
+            import history
+            ctr.setHistory(history.historyStore(args.history))
+        
+        # Set up checkpoints.
+        if args.checkpoint is not None:
+            import checkpoint
+            ctr.setCheckpoint(checkpoint.checkpoint(args.checkpoint), interval = args.checkpoint_every)
+            
+            if args.resume == True:
+                if ctr.resume() == False:
+                    print("No checkpoint in %s, starting a new measurement." %args.checkpoint)
+        
+        # Run the geiger counter.
+        if args.pipeline is not None:
+            # Build the pipeline from the stage list.
+            if args.store == "none":
+                stgFactory = None
+            
+            if args.periodic_periods is not None:
+                periods = [int(period) for period in args.periodic_periods.split(',')]
+            else:
+                periods = None
+            
+            def baselineProps(channel = None):
+                """
+                Get the baseline stage settings for the main pipeline or a channel's.
+                """
+                
+                retVal = {'bins': args.baseline_bins, 'halfLife': args.baseline_half_life, 'zLimit': args.baseline_z}
+                
+                if args.baseline_file is not None:
+                    if channel is None:
+                        retVal['stateFile'] = args.baseline_file
+                    else:
+                        import os
+                        baselineRoot, baselineExt = os.path.splitext(args.baseline_file)
+                        retVal['stateFile'] = "%s-%s%s" %(baselineRoot, channel, baselineExt)
+                
+                return retVal
+            
+            # Calibrations for dose stages.
+            if args.calibration is not None:
+                import calibration
+                calibs = calibration.loadProfiles(args.calibration)
+            
+            def calibFor(detector, stageNames):
+                """
+                Get the calibration for a pipeline's dose stage, if it has one.
+                """
+                
+                if "dose" not in stageNames:
+                    return None
+                
+                return calibration.getCalibration(calibs, detector)
+            
+            # Set up alarms.
+            alarm = None
+            
+            if len(args.alarm) > 0:
+                import alarms
+                
+                alarmNotifiers = []
+                
+                if args.alarm_exec is not None:
+                    alarmNotifiers.append(alarms.execNotifier(args.alarm_exec))
+                
+                if args.alarm_socket is not None:
+                    alarmHost, alarmPort = args.alarm_socket.rsplit(':', 1)
+                    alarmNotifiers.append(alarms.socketNotifier(alarmHost, int(alarmPort)))
+                
+                alarm = alarms.alarmStage([alarms.parseRule(spec) for spec in args.alarm], notifiers = alarmNotifiers, textOut = (args.quiet == False))
+            
+            pipe = pipeline.buildPipeline(args.pipeline.split(','), cpsOn = args.cps, flagsOn = args.flags, textOut = (args.quiet == False), stgFactory = stgFactory, periods = periods, baselineProps = baselineProps(), calib = calibFor(args.calibration_detector, args.pipeline.split(',')), alarm = alarm)
+            
+            # Pipelines on other channels, quiet and with their own storage.
+            for channelSpec in args.channel:
+                channel, channelStages = channelSpec.split('=', 1)
+                
+                def channelStg(stageName, channel = channel):
+                    """
+                    Create a CSV data layer for one stage of a channel's pipeline.
+                    """
+                    
+                    return stgFactory("%s-%s" %(channel, stageName))
+                
+                
+                ctr.addChannelPipeline(channel, pipeline.buildPipeline(channelStages.split(','), textOut = False, stgFactory = channelStg if stgFactory is not None else None, periods = periods, baselineProps = baselineProps(channel), calib = calibFor(channel, channelStages.split(','))))
+            
+            # Coincidences between tubes, with the usual modes and storage on the coincidence counts.
+            if args.coinc is not None:
+                import coincidence
+                
+                def coincStg(stageName):
+                    """
+                    Create a data layer for one stage of the coincidence pipeline.
+                    """
+                    
+                    return stgFactory("coinc-%s" %stageName)
+                
+                coincPipe = pipeline.buildPipeline(args.coinc_stages.split(','), textOut = False, stgFactory = coincStg if stgFactory is not None else None, periods = periods, baselineProps = baselineProps("coinc"), calib = calibFor("coinc", args.coinc_stages.split(',')))
+                pipe.addStage(coincidence.coincidenceStage(args.coinc.split(','), window = args.coinc_window, minFold = args.coinc_fold, pipe = coincPipe, textOut = (args.quiet == False)))
+            
+            # Send samples to a fleet aggregator?
+            if args.fleet is not None:
+                import aggregator
+                import socket
+                
+                fleetHost, fleetPort = args.fleet.rsplit(':', 1)
+                
+                if args.detector is None:
+                    args.detector = socket.gethostname()
+                
+                pipe.addStage(aggregator.aggregatorSinkStage(args.site, args.detector, host = fleetHost, port = int(fleetPort)))
+            
+            if (args.asyncio == True) and (args.block is not None):
+                import asyncio
+                asyncio.run(ctr.arunPipelineBlocks(pipe, args.block, tickless = (args.tickless is not None)))
+            
+            elif args.asyncio == True:
+                import asyncio
+                asyncio.run(ctr.arunPipeline(pipe))
+            
+            elif args.block is not None:
+                ctr.runPipelineBlocks(pipe, args.block, tickless = (args.tickless is not None))
+            
+            else:
+                ctr.runPipeline(pipe)
+        
+        elif args.daemon is not None:
+            import asyncio
+            import daemon
+            asyncio.run(daemon.runDaemon(ctr, args.daemon, textOut = (args.quiet == False)))
+        
+        elif (args.asyncio == True) and (args.block is not None):
+            import asyncio
+            asyncio.run(ctr.arunBlocks(ctr.dispatchBlock, args.block, tickless = (args.tickless is not None)))
+        
+        elif args.asyncio == True:
+            import asyncio
+            asyncio.run(ctr.arunCli())
+        
+        elif args.block is not None:
+            ctr.runBlocks(ctr.dispatchBlock, args.block, tickless = (args.tickless is not None))
+        
+        else:
+            ctr.runCli()
+    
+    except KeyboardInterrupt:
+        print("Caught keyboard interrupt. Quitting.")
+    
+    except:
+        tb = traceback.format_exc()
+        print("Caught unhandled exception:\n%s" %tb)
+    
+    finally:
+        # Take the ring buffer down.
+        if ring is not None:
+            ring.close()
+        
+        # Flush and close whatever we stored to.
+        for store in stores:
+            try:
+                store.close()
+            except:
+                print("Failed to close data layer: %s" %traceback.format_exc())
@@ -0,0 +1,263 @@
+###############
+### Imports ###
+###############
+
+import json
+import os
+import signal
+import time
+import traceback
+
+
+######################
+### Control server ###
+######################
+
+class controlServer(object):
+    def __init__(self, ctr, textOut = True):
+        """
+        Control socket for a geigerInterface running as a daemon. Clients send one command per line and get one line of JSON back with "ok" and either "result" or "error". Commands:
+        state - get the counter's status.
+        mode <fast|slow|counter|scaler|sprt> - switch modes.
+        reset - zero the scaler.
+        window <fast|slow> <samples> - change an averaging window.
+        store start [file name] - start storing data points to a CSV file.
+        store stop - stop storing data points.
+        history [seconds] - count statistics over the last seconds, or all the history we have. Needs counter.py --history.
+        plot [seconds] [points] [lttb|minmax] - the last seconds of history, or all of it, downsampled to about points points, 2000 by default, for plotting. Needs counter.py --history.
+        stop - stop the daemon.
+        """
+
+        self.__ctr = ctr
+        self.__textOut = textOut
+
+        # Downsampler for plot commands, set up on the first one.
+        self.__downsampler = None
+
+    def command(self, line):
+        """
+        Run one command line and return the result.
+        """
+
+        args = line.split()
+
+        if len(args) == 0:
+            raise ValueError("Empty command.")
+
+        cmd = args[0]
+        retVal = None
+
+        if cmd == "state":
+            retVal = self.__ctr.getStatus()
+
+        elif cmd == "mode":
+            self.__ctr.setMode(args[1])
+            retVal = self.__ctr.getStatus()
+
+        elif cmd == "reset":
+            self.__ctr.resetScaler()
+
+        elif cmd == "window":
+            if args[1] == "fast":
+                self.__ctr.setWindows(fast = int(args[2]))
+
+            elif args[1] == "slow":
+                self.__ctr.setWindows(slow = int(args[2]))
+
+            else:
+                raise ValueError("Window must be fast or slow.")
+
+        elif cmd == "store":
+            if args[1] == "start":
+                import datalayer
+                stg = datalayer.datalayer('csv', None)
+
+                if len(args) > 2:
+                    stg.setStorageProps({'fileName': args[2]})
+
+                self.__swapStorage(stg)
+
+            elif args[1] == "stop":
+                self.__swapStorage(None)
+
+            else:
+                raise ValueError("Store takes start or stop.")
+
+        elif cmd == "history":
+            store = self.__ctr.getHistory()
+
+            if store is None:
+                raise ValueError("Not keeping history.")
+
+            if len(args) > 1:
+                retVal = store.query(start = time.time() - float(args[1]))
+            else:
+                retVal = store.query()
+
+        elif cmd == "plot":
+            store = self.__ctr.getHistory()
+
+            if store is None:
+                raise ValueError("Not keeping history.")
+
+            if self.__downsampler is None:
+                import downsample
+                self.__downsampler = downsample.downsampler()
+                self.__downsampler.addHistory("counts", store)
+
+            points = int(args[2]) if len(args) > 2 else 2000
+
+            if len(args) > 1:
+                # Line the start up with the resolution so buckets don't shift between repeated plots of a moving window.
+                seconds = float(args[1])
+                resolution = seconds / points
+                start = (time.time() - seconds) // resolution * resolution
+            else:
+                start = None
+
+            retVal = self.__downsampler.query("counts", start = start, points = points, method = args[3] if len(args) > 3 else 'lttb')
+
+        elif cmd == "stop":
+            self.__ctr.stop()
+
+        else:
+            raise ValueError("Unknown command %s." %cmd)
+
+        if self.__textOut == True:
+            print("Control command: %s" %line.strip())
+
+        return retVal
+
+    def __swapStorage(self, stg):
+        """
+        Store data points in stg from the next gate on, or stop storing them if it's None, and flush and close the datalayer we were storing to.
+        """
+
+        oldStg = self.__ctr.getStorage()
+        self.__ctr.setStorage(stg)
+
+        if oldStg is not None:
+            oldStg.close()
+
+        return
+
+    async def handle(self, reader, writer):
+        """
+        asyncio stream handler for one client connection.
+        """
+
+        try:
+            while True:
+                line = await reader.readline()
+
+                if len(line) == 0:
+                    break
+
+                try:
+                    reply = {'ok': True, 'result': self.command(line.decode())}
+
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e)}
+
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+
+        except ConnectionError:
+            # Client went away.
+            pass
+
+        finally:
+            writer.close()
+
+        return
+
+
+async def runDaemon(ctr, sockPath, textOut = True):
+    """
+    Run ctr, a geigerInterface with an asyncCounterIface hardware platform, until it's stopped, taking commands on a UNIX socket at sockPath. The hardware is set up once, and mode switches, window changes and storage changes happen between gates.
+    SIGTERM and SIGINT stop the daemon like the stop command, so the hardware is cleaned up, storage is closed and the socket is removed.
+    """
+
+    import asyncio
+
+    ctrl = controlServer(ctr, textOut = textOut)
+
+    # Clear out a socket left behind by a crash.
+    if os.path.exists(sockPath):
+        os.unlink(sockPath)
+
+    server = await asyncio.start_unix_server(ctrl.handle, path = sockPath)
+
+    # Stop cleanly when we're told to go away.
+    loop = asyncio.get_running_loop()
+
+    for sigNum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sigNum, ctr.stop)
+
+    try:
+        await ctr.arun(ctr.dispatch)
+
+    finally:
+        for sigNum in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sigNum)
+
+        server.close()
+
+        # Close whatever a store command left us storing to.
+        stg = ctr.getStorage()
+
+        if stg is not None:
+            try:
+                stg.close()
+            except:
+                print("Failed to close data layer: %s" %traceback.format_exc())
+
+        try:
+            os.unlink(sockPath)
+        except:
+            print("Failed to remove control socket: %s" %traceback.format_exc())
+
+
+def sendCommand(sockPath, line):
+    """
+    Send a command to a running daemon and return its decoded reply.
+    """
+
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        sock.connect(sockPath)
+        sock.sendall((line.strip() + "\n").encode())
+
+        reply = b""
+
+        while not reply.endswith(b"\n"):
+            chunk = sock.recv(4096)
+
+            if len(chunk) == 0:
+                break
+
+            reply += chunk
+
+    finally:
+        sock.close()
+
+    return json.loads(reply.decode())
+
+
+#######################
+# Main execution body #
+#######################
+
+if __name__ == "__main__":
+    import argparse
+
+    # Set up command line interface.
+    parser = argparse.ArgumentParser(description = "Send a command to a geiger counter daemon started with counter.py --daemon.")
+    parser.add_argument('--socket', type = str, default = "/tmp/geigerInterface.sock", help = 'Control socket path.')
+    parser.add_argument('command', nargs = '+', help = 'Command, e.g. state, "mode slow", reset, "window fast 6", "store start out.csv", "store stop", "history 3600", "plot 86400 2000 minmax" or stop.')
+    args = parser.parse_args()
+
+    print(json.dumps(sendCommand(args.socket, ' '.join(args.command)), indent = 2, sort_keys = True))
@@ -3,6 +3,8 @@
 ###############
 
 import datetime
+import json
+import os
 
 ###############
 ### Imports ###
@@ -20,24 +22,34 @@ class datalayer:
         
         # Set parameters as needed.
         if storageMode == "csv":
-            # Create a default file name in case we don't have one specified.
-            self.__fileName = "geiger-%s.csv" %datetime.datetime.utcnow().strftime("%Y-%m-%d_%H:%M:%S")
+            # Create a default file name in case we don't have one specified. Include the counter mode if we have one so several data layers can run side by side.
+            if counterMode is None:
+                self.__fileName = "geiger-%s.csv" %datetime.datetime.utcnow().strftime("%Y-%m-%d_%H:%M:%S")
+            else:
+                self.__fileName = "geiger-%s-%s.csv" %(counterMode, datetime.datetime.utcnow().strftime("%Y-%m-%d_%H:%M:%S"))
             self.__file = None # Don't open the file for appending yet... we might change the file name before storing a data point.
+        
+        elif storageMode == "journal":
+            # As for CSV, but a journal file, see journal.py.
+            if counterMode is None:
+                self.__fileName = "geiger-%s.journal" %datetime.datetime.utcnow().strftime("%Y-%m-%d_%H:%M:%S")
+            else:
+                self.__fileName = "geiger-%s-%s.journal" %(counterMode, datetime.datetime.utcnow().strftime("%Y-%m-%d_%H:%M:%S"))
+            self.__journal = None # Don't open the journal yet either.
+            self.__commitInterval = 30.0
+            self.__blockSize = 4096
     
     def __del__(self):
         """
         Destructor.
         """
         
-        # If we are storing a CSV file...
-        if self.__stgMode == 'file':
-            try:
-                # Make our best effort to close said file...
-                self.__file.close()
-            except:
-                # Don't care if the file can't be closed.
-                None
-            
+        # Make our best effort to flush and close whatever we're storing to.
+        try:
+            self.close()
+        except:
+            # Don't care if it can't be closed.
+            None
     
     def __appendCsv(self, dataPoint):
         """
@@ -50,15 +62,60 @@ class datalayer:
                 # Create file object.
                 self.__file = open(self.__fileName, 'a')
             
-            # Append the entry to the file.
-            self.__file.write("\"%s\", %s\n" %(dataPoint[0].strftime("%Y-%m-%d %H:%M:%S"), dataPoint[1]))
+            # Append the entry to the file, with flags if we have them.
+            if len(dataPoint) > 2:
+                self.__file.write("\"%s\", %s, 0x%x\n" %(dataPoint[0].strftime("%Y-%m-%d %H:%M:%S"), dataPoint[1], dataPoint[2]))
+            else:
+                self.__file.write("\"%s\", %s\n" %(dataPoint[0].strftime("%Y-%m-%d %H:%M:%S"), dataPoint[1]))
+        
+        except:
+            raise
+    
+    def __appendCsvBlock(self, ts, values, flags):
+        """
+        Append a block of data points to the CSV file in one write.
+        """
+        
+        import numpy
+        
+        try:
+            # If we don't have a file to work with yet open it for writing.
+            if self.__file == None:
+                # Create file object.
+                self.__file = open(self.__fileName, 'a')
+            
+            # Whole seconds, as the single data point format has.
+            stamps = [stamp.replace('T', ' ') for stamp in numpy.datetime_as_string(numpy.floor(numpy.asarray(ts)).astype(numpy.int64).astype('datetime64[s]'))]
+            
+            if flags is not None:
+                self.__file.write(''.join(["\"%s\", %s, 0x%x\n" %row for row in zip(stamps, numpy.asarray(values).tolist(), numpy.asarray(flags).tolist())]))
+            else:
+                self.__file.write(''.join(["\"%s\", %s\n" %row for row in zip(stamps, numpy.asarray(values).tolist())]))
         
         except:
             raise
     
+    def __openJournal(self):
+        """
+        Open the journal if it isn't open yet, recovering what's already in it.
+        """
+        
+        import journal
+        
+        if self.__journal is None:
+            self.__journal = journal.journal(self.__fileName, commitInterval = self.__commitInterval, blockSize = self.__blockSize)
+            
+            jnlStats = self.__journal.getStats()
+            
+            # Let people know if a power cut cost us the end of the journal.
+            if jnlStats['discardedBytes'] > 0:
+                print("Recovered %s records from %s, discarded %s bytes of damaged tail." %(jnlStats['recoveredRecords'], self.__fileName, jnlStats['discardedBytes']))
+        
+        return self.__journal
+    
     def setStorageProps(self, properties):
         """
-        Set data storage properties.
+        Set data storage properties. In journal mode commitInterval, the most seconds of data a power cut can lose, and blockSize, the size frames are padded to, may be set as well as fileName.
         """
         
         # Are we in csv mode?
@@ -68,10 +125,47 @@ class datalayer:
                 self.__fileName = properties['fileName']
             except:
                 None
+        
+        elif self.__stgMode == "journal":
+            if 'fileName' in properties:
+                self.__fileName = properties['fileName']
+            
+            if 'commitInterval' in properties:
+                self.__commitInterval = float(properties['commitInterval'])
+            
+            if 'blockSize' in properties:
+                self.__blockSize = int(properties['blockSize'])
+    
+    def __appendSummary(self, summary):
+        """
+        Append a run summary as a line of JSON to a file next to the CSV file or journal, named after it with -summary.jsonl on the end.
+        """
+        
+        try:
+            summaryFileName = "%s-summary.jsonl" %os.path.splitext(self.__fileName)[0]
+            
+            with open(summaryFileName, 'a') as summaryFile:
+                summaryFile.write("%s\n" %json.dumps(summary, sort_keys = True))
+        
+        except:
+            raise
+    
+    def storeSummary(self, summary):
+        """
+        Store a run summary record, a JSON-serialisable dictionary, once at the end of a run.
+        """
+        
+        # If we're in CSV or journal mode the summary goes beside the data.
+        if self.__stgMode in ("csv", "journal"):
+            try:
+                self.__appendSummary(summary)
+            
+            except:
+                raise
     
     def storeDatapoint(self, dataPoint):
         """
-        Store a given datapoint. Accepts a tuple with a date and a count.
+        Store a given datapoint. Accepts a tuple with a date and a count, and optionally the flags for the data point.
         """
         
         # If we're in CSV mode attempt to add a line to the CSV file.
@@ -81,4 +175,91 @@ class datalayer:
                 self.__appendCsv(dataPoint)
             
             except:
-                raise
\ No newline at end of file
+                raise
+        
+        # In journal mode queue it for the next commit.
+        elif self.__stgMode == "journal":
+            self.__openJournal().append((dataPoint[0] - datetime.datetime(1970, 1, 1)).total_seconds(), dataPoint[1], dataPoint[2] if len(dataPoint) > 2 else None)
+    
+    def storeBlock(self, ts, values, flags = None):
+        """
+        Store a block of data points at once. ts are UNIX timestamps, values the values and flags, if given, the flags for each data point, all arrays of the same length.
+        """
+        
+        # If we're in CSV mode attempt to add the lines to the CSV file.
+        if self.__stgMode == "csv":
+            # Give it a shot...
+            try:
+                self.__appendCsvBlock(ts, values, flags)
+            
+            except:
+                raise
+        
+        elif self.__stgMode == "journal":
+            self.__openJournal().appendMany(ts, values, flags)
+    
+    def flush(self):
+        """
+        Make sure everything stored so far is on disk, e.g. at the end of a run.
+        """
+        
+        if (self.__stgMode == "csv") and (self.__file is not None):
+            self.__file.flush()
+        
+        elif (self.__stgMode == "journal") and (self.__journal is not None):
+            self.__journal.commit()
+    
+    def close(self):
+        """
+        Flush and close whatever we're storing to.
+        """
+        
+        if (self.__stgMode == "csv") and (self.__file is not None):
+            self.__file.close()
+            self.__file = None
+        
+        elif (self.__stgMode == "journal") and (self.__journal is not None):
+            self.__journal.close()
+            self.__journal = None
+
+
+def loadCsv(fileName):
+    """
+    Load a CSV file written by a datalayer, lines of "YYYY-MM-DD HH:MM:SS", value[, 0xflags], as NumPy arrays of UNIX timestamps, values and flags. Lines stored without flags get -1, as journals do. Blank lines are skipped.
+    """
+    
+    import numpy
+    
+    stamps = []
+    values = []
+    flags = []
+    
+    with open(fileName, 'r') as csvFile:
+        for line in csvFile:
+            fields = line.split(',')
+            
+            if len(fields) < 2:
+                continue
+            
+            stamps.append(fields[0].strip().strip('"'))
+            values.append(float(fields[1]))
+            flags.append(int(fields[2], 16) if len(fields) > 2 else -1)
+    
+    ts = numpy.array(stamps, dtype = 'datetime64[s]').astype(numpy.int64).astype(numpy.float64)
+    
+    return (ts, numpy.array(values, dtype = numpy.float64), numpy.array(flags, dtype = numpy.int64))
+
+
+def loadSeries(fileName):
+    """
+    Load a series stored by a datalayer from a CSV file or a journal, told apart by the journal's frame magic rather than the file name, as NumPy arrays of UNIX timestamps, values and flags. Data points stored without flags get -1.
+    """
+    
+    import journal
+    
+    if journal.isJournal(fileName):
+        recs, skipped = journal.readJournal(fileName)
+        
+        return (recs['ts'], recs['value'], recs['flags'])
+    
+    return loadCsv(fileName)
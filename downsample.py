@@ -0,0 +1,344 @@
+###############
+### Imports ###
+###############
+
+import collections
+import os
+
+
+##################
+### Algorithms ###
+##################
+
+def minMax(ts, values, points):
+    """
+    Downsample to about points points by keeping the minimum and maximum of each of points / 2 equal buckets, in time order, so every spike survives. ts and values are NumPy arrays. Returns the indices of the points to keep.
+    """
+
+    import numpy as np
+
+    n = len(values)
+    buckets = max(1, points // 2)
+
+    if n <= points:
+        return np.arange(n)
+
+    # Pad to whole buckets by repeating the last value, which can't change any bucket's minimum or maximum.
+    size = -(-n // buckets)
+    padded = np.pad(values, (0, (size * buckets) - n), mode = 'edge').reshape(buckets, size)
+
+    starts = np.arange(buckets) * size
+    lo = np.minimum(starts + padded.argmin(axis = 1), n - 1)
+    hi = np.minimum(starts + padded.argmax(axis = 1), n - 1)
+
+    return np.unique(np.concatenate((lo, hi)))
+
+
+def lttb(ts, values, points, preselect = 4):
+    """
+    Downsample to points points with Largest-Triangle-Three-Buckets: the first and last points are kept, and from each bucket in between the point making the largest triangle with the point kept from the bucket before and the average of the bucket after, which keeps the shape of the series as the eye sees it. ts and values are NumPy arrays. Returns the indices of the points to keep.
+    LTTB picks a point at a time, so for long series minMax() first cuts them down to preselect times points points, as in MinMaxLTTB. The bucket averages and each bucket's triangle areas are done with NumPy.
+    """
+
+    import numpy as np
+
+    n = len(values)
+
+    if n <= points:
+        return np.arange(n)
+
+    if points < 3:
+        return np.array([0, n - 1])[:max(points, 0)]
+
+    # Preselect the candidates.
+    if (preselect is not None) and (n > preselect * points):
+        cand = minMax(ts, values, preselect * points)
+    else:
+        cand = np.arange(n)
+
+    m = len(cand)
+
+    if m <= points:
+        return cand
+
+    x = ts[cand].astype(np.float64)
+    y = values[cand].astype(np.float64)
+
+    # Buckets for the points between the first and the last.
+    edges = np.linspace(1, m - 1, points - 1).astype(np.int64)
+    edges[-1] = m - 1
+
+    # Average of each bucket, and the last point after the last bucket.
+    counts = np.diff(edges)
+    avgX = np.append(np.add.reduceat(x[:-1], edges[:-1]) / np.maximum(counts, 1), x[-1])
+    avgY = np.append(np.add.reduceat(y[:-1], edges[:-1]) / np.maximum(counts, 1), y[-1])
+
+    retVal = np.empty(points, dtype = np.int64)
+    retVal[0] = 0
+    retVal[-1] = m - 1
+
+    aX = x[0]
+    aY = y[0]
+
+    for b in range(points - 2):
+        lo = edges[b]
+        hi = max(edges[b + 1], lo + 1)
+        cX = avgX[b + 1]
+        cY = avgY[b + 1]
+
+        # Twice the triangle areas, which pick the same point.
+        area = np.abs(((aX - cX) * (y[lo:hi] - aY)) - ((aX - x[lo:hi]) * (cY - aY)))
+        best = lo + int(area.argmax())
+
+        retVal[b + 1] = best
+        aX = x[best]
+        aY = y[best]
+
+    return cand[retVal]
+
+
+methods = {'lttb': lttb, 'minmax': minMax}
+
+
+###############
+### Sources ###
+###############
+
+class historySource(object):
+    def __init__(self, store):
+        """
+        Downsampling source over a history.historyStore, the live history. Values are the gate counts.
+        """
+
+        self.__store = store
+
+    def getVersion(self):
+        """
+        Get something that changes whenever the data does.
+        """
+
+        return self.__store.getAppended()
+
+    def getSeries(self, start = None, end = None):
+        """
+        Get timestamps and values with start <= timestamp < end, and the oldest and newest timestamps held.
+        """
+
+        ts, counts, flags = self.__store.arrays(start, end)
+
+        if len(self.__store) > 0:
+            return (ts, counts, self.__store.get(0)[0], self.__store.get(-1)[0])
+
+        return (ts, counts, None, None)
+
+
+class archiveSource(object):
+    def __init__(self, fileName):
+        """
+        Downsampling source over a file stored by datalayer, a CSV file or a journal, see datalayer.loadSeries(). The file is read again when it changes.
+        """
+
+        self.__fileName = fileName
+        self.__loaded = None
+        self.__ts = None
+        self.__values = None
+
+    def getVersion(self):
+        """
+        Get the file's size and modification time, which change whenever it's appended to.
+        """
+
+        try:
+            fileStat = os.stat(self.__fileName)
+
+        except OSError:
+            return None
+
+        return (fileStat.st_size, fileStat.st_mtime_ns)
+
+    def getSeries(self, start = None, end = None):
+        """
+        Get timestamps and values with start <= timestamp < end, and the oldest and newest timestamps in the file.
+        """
+
+        import numpy as np
+
+        version = self.getVersion()
+
+        if version != self.__loaded:
+            if version is None:
+                self.__ts = np.zeros(0)
+                self.__values = np.zeros(0)
+
+            else:
+                import datalayer
+
+                self.__ts, self.__values, flags = datalayer.loadSeries(self.__fileName)
+
+            self.__loaded = version
+
+        first = 0 if start is None else np.searchsorted(self.__ts, start, side = 'left')
+        last = len(self.__ts) if end is None else np.searchsorted(self.__ts, end, side = 'left')
+
+        if len(self.__ts) > 0:
+            return (self.__ts[first:last], self.__values[first:last], self.__ts[0], self.__ts[-1])
+
+        return (self.__ts, self.__values, None, None)
+
+
+###################
+### Downsampler ###
+###################
+
+class downsampler(object):
+    def __init__(self, maxEntries = 64):
+        """
+        Downsampling service for plotting long histories. Detectors are registered with a source, their live history or a stored file, and queries for a time range and a number of points are answered with LTTB or min/max downsampling.
+        Results are cached by detector, range, number of points and method, for up to maxEntries results. New data only invalidates results whose range it could fall in, since data is only ever added at the end: a cached range that ends by the newest data there was when it was worked out, and starts after the oldest data still held, can't change.
+        """
+
+        self.__sources = {}
+        self.__cache = collections.OrderedDict()
+        self.__maxEntries = maxEntries
+
+        # Cache statistics.
+        self.hits = 0
+        self.misses = 0
+
+    def addHistory(self, detector, store):
+        """
+        Serve detector's live history from store, a history.historyStore.
+        """
+
+        self.__sources[detector] = historySource(store)
+
+        return
+
+    def addArchive(self, detector, fileName):
+        """
+        Serve detector's data from a file stored by datalayer.
+        """
+
+        self.__sources[detector] = archiveSource(fileName)
+
+        return
+
+    def getDetectors(self):
+        """
+        Get the names of the detectors we serve.
+        """
+
+        return list(self.__sources.keys())
+
+    def query(self, detector, start = None, end = None, points = 2000, method = 'lttb'):
+        """
+        Get detector's data with start <= timestamp < end, where either can be None for an open end, downsampled to at most about points points with method, 'lttb' or 'minmax'.
+        Returns a dictionary with lists of timestamps 'ts' and values 'values', the number of points in the range 'n', and whether it came from the cache 'cached'.
+        """
+
+        if detector not in self.__sources:
+            raise ValueError("Unknown detector %s." %detector)
+
+        if method not in methods:
+            raise ValueError("Unknown downsampling method %s." %method)
+
+        source = self.__sources[detector]
+        key = (detector, start, end, points, method)
+        version = source.getVersion()
+
+        if key in self.__cache:
+            entry = self.__cache[key]
+
+            if self.__stillValid(entry, version, source, start, end):
+                self.__cache.move_to_end(key)
+                self.hits += 1
+
+                retVal = dict(entry['result'])
+                retVal['cached'] = True
+
+                return retVal
+
+            del self.__cache[key]
+
+        self.misses += 1
+
+        ts, values, oldest, newest = source.getSeries(start, end)
+        keep = methods[method](ts, values, points)
+
+        result = {'ts': ts[keep].tolist(), 'values': values[keep].tolist(), 'n': len(ts), 'method': method}
+
+        self.__cache[key] = {'result': result, 'version': version, 'oldest': oldest, 'newest': newest}
+
+        while len(self.__cache) > self.__maxEntries:
+            self.__cache.popitem(last = False)
+
+        retVal = dict(result)
+        retVal['cached'] = False
+
+        return retVal
+
+    def __stillValid(self, entry, version, source, start, end):
+        """
+        Check a cached result still holds.
+        """
+
+        if entry['version'] == version:
+            return True
+
+        # Open-ended ranges take in new data.
+        if (start is None) or (end is None) or (entry['newest'] is None):
+            return False
+
+        # New data lands at or after the newest data there was, so only matters if the range goes past it. Data can also age out of a live history.
+        if end > entry['newest']:
+            return False
+
+        ts, values, oldest, newest = source.getSeries(end, end)
+
+        return (oldest is not None) and ((oldest == entry['oldest']) or (oldest <= start))
+
+    def getStats(self):
+        """
+        Get cache statistics.
+        """
+
+        return {'entries': len(self.__cache), 'hits': self.hits, 'misses': self.misses}
+
+
+#######################
+# Main execution body #
+#######################
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    # Set up command line interface.
+    parser = argparse.ArgumentParser(description = "Downsample a stored geiger counter series for plotting", epilog = "Reads CSV files or journals written with --store. Min/max keeps every spike, LTTB keeps the shape with fewer points.")
+    parser.add_argument('file', help = 'CSV file or journal to read.')
+    parser.add_argument('--points', type = int, default = 2000, help = 'Number of points to keep. Defaults to 2000.')
+    parser.add_argument('--method', choices = sorted(methods.keys()), default = 'lttb', help = 'Downsampling method. Defaults to lttb.')
+    parser.add_argument('--start', type = float, default = None, help = 'Start of the range as a UNIX timestamp.')
+    parser.add_argument('--end', type = float, default = None, help = 'End of the range as a UNIX timestamp.')
+    parser.add_argument('--csv', type = str, default = None, help = 'Write the downsampled points to this CSV file.')
+    args = parser.parse_args()
+
+    ds = downsampler()
+    ds.addArchive(args.file, args.file)
+
+    tStart = time.monotonic()
+    res = ds.query(args.file, start = args.start, end = args.end, points = args.points, method = args.method)
+    tFirst = time.monotonic() - tStart
+
+    tStart = time.monotonic()
+    ds.query(args.file, start = args.start, end = args.end, points = args.points, method = args.method)
+    tCached = time.monotonic() - tStart
+
+    print("%s points down to %s with %s in %s sec., %s sec. cached." %(res['n'], len(res['ts']), args.method, round(tFirst, 3), round(tCached, 6)))
+
+    if args.csv is not None:
+        import datetime
+
+        with open(args.csv, 'w') as csvFile:
+            for ts, value in zip(res['ts'], res['values']):
+                csvFile.write("\"%s\", %s\n" %(datetime.datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), value))
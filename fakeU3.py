@@ -0,0 +1,210 @@
+###############
+### Imports ###
+###############
+
+import math
+import random
+import time
+
+
+#########################
+### Feedback commands ###
+#########################
+
+class Counter0(object):
+    def __init__(self, Reset = False):
+        """
+        Stand-in for u3.Counter0: read counter 0, resetting it if Reset is True.
+        """
+
+        self.counter = 0
+        self.reset = Reset
+
+
+class Counter1(object):
+    def __init__(self, Reset = False):
+        """
+        Stand-in for u3.Counter1.
+        """
+
+        self.counter = 1
+        self.reset = Reset
+
+
+class AIN(object):
+    def __init__(self, PositiveChannel, NegativeChannel = 31, LongSettling = False, QuickSample = False):
+        """
+        Stand-in for u3.AIN: read an analog input, single-ended by default.
+        """
+
+        self.positiveChannel = PositiveChannel
+        self.negativeChannel = NegativeChannel
+
+
+###############
+### Fake U3 ###
+###############
+
+# Nominal calibration constants, as LabJackPython uses before reading the device's own.
+lvSESlope = 0.000037231
+hvSlope = 0.000314
+hvOffset = -10.3
+tempSlope = 0.013021
+
+
+class U3(object):
+    # Settings for U3 objects created by code that calls U3() itself, e.g. u3Hardware. Change them before that happens.
+    defaults = {'rates': {0: 0.5, 1: 0.5}, 'volts': {}, 'tempK': 298.15, 'isHV': False, 'seed': None}
+
+    def __init__(self, rates = None, volts = None, tempK = None, isHV = None, seed = None):
+        """
+        Stand-in for LabJackPython's u3.U3 for testing without a device. The counters count Poisson pulses at rates counts per second, by counter, since they were last reset, and analog inputs read volts, by channel, with the internal temperature sensor reading tempK.
+        feedbackCalls counts getFeedback() calls, each of which would be one USB round trip on a real U3.
+        """
+
+        self.rates = rates if rates is not None else dict(U3.defaults['rates'])
+        self.volts = volts if volts is not None else dict(U3.defaults['volts'])
+        self.tempK = tempK if tempK is not None else U3.defaults['tempK']
+        self.isHV = isHV if isHV is not None else U3.defaults['isHV']
+
+        self.__rng = random.Random(seed if seed is not None else U3.defaults['seed'])
+
+        # Enabled counters and when each was last reset.
+        self.__enabled = {0: False, 1: False}
+        self.__since = {0: time.time(), 1: time.time()}
+        self.__counts = {0: 0, 1: 0}
+
+        self.feedbackCalls = 0
+        self.closed = False
+
+    def configIO(self, EnableCounter0 = None, EnableCounter1 = None, TimerCounterPinOffset = None, FIOAnalog = None, **kwargs):
+        """
+        Enable the counters we're asked to.
+        """
+
+        if EnableCounter0 is not None:
+            self.__enabled[0] = EnableCounter0
+
+        if EnableCounter1 is not None:
+            self.__enabled[1] = EnableCounter1
+
+        return {'EnableCounter0': self.__enabled[0], 'EnableCounter1': self.__enabled[1], 'TimerCounterPinOffset': TimerCounterPinOffset, 'FIOAnalog': FIOAnalog}
+
+    def configU3(self):
+        """
+        Describe the fake device.
+        """
+
+        return {'DeviceName': "U3-HV" if self.isHV else "U3-LV", 'SerialNumber': 0, 'Fake': True}
+
+    def __poisson(self, mean):
+        """
+        Draw a Poisson count, by inversion for small means and a rounded normal for large ones.
+        """
+
+        if mean > 100.0:
+            return max(0, int(round(self.__rng.gauss(mean, math.sqrt(mean)))))
+
+        retVal = 0
+        p = math.exp(-mean)
+        s = p
+        u = self.__rng.random()
+
+        while u > s:
+            retVal += 1
+            p *= mean / retVal
+            s += p
+
+        return retVal
+
+    def __readCounter(self, counter, reset):
+        """
+        Count pulses up to now, and reset if asked.
+        """
+
+        if self.__enabled[counter] == False:
+            raise RuntimeError("Counter%s isn't enabled." %counter)
+
+        now = time.time()
+        self.__counts[counter] += self.__poisson(self.rates.get(counter, 0.0) * (now - self.__since[counter]))
+        self.__since[counter] = now
+
+        retVal = self.__counts[counter] & 0xffffffff
+
+        if reset == True:
+            self.__counts[counter] = 0
+
+        return retVal
+
+    def __readAin(self, channel):
+        """
+        Get the raw 16-bit reading for an analog input.
+        """
+
+        if channel == 30:
+            return int(round(self.tempK / tempSlope))
+
+        volts = self.volts.get(channel, 0.0)
+
+        if self.isHV and (channel < 4):
+            bits = (volts - hvOffset) / hvSlope
+        else:
+            bits = volts / lvSESlope
+
+        return max(0, min(65535, int(round(bits))))
+
+    def getFeedback(self, *commandlist):
+        """
+        Run a list of feedback commands in one go, returning a result per command.
+        """
+
+        self.feedbackCalls += 1
+
+        # Like the real thing, take a list too.
+        if (len(commandlist) == 1) and isinstance(commandlist[0], list):
+            commandlist = commandlist[0]
+
+        retVal = []
+
+        for command in commandlist:
+            if isinstance(command, (Counter0, Counter1)):
+                retVal.append(self.__readCounter(command.counter, command.reset))
+            elif isinstance(command, AIN):
+                retVal.append(self.__readAin(command.positiveChannel))
+            else:
+                raise ValueError("Unsupported feedback command %s." %command)
+
+        return retVal
+
+    def binaryToCalibratedAnalogVoltage(self, bits, isLowVoltage = True, isSingleEnded = True, isSpecialSetting = False, channelNumber = 0):
+        """
+        Convert a raw analog reading to volts with the nominal calibration.
+        """
+
+        if isLowVoltage == False:
+            return (bits * hvSlope) + hvOffset
+
+        return bits * lvSESlope
+
+    def binaryToCalibratedAnalogTemperature(self, bytesTemperature):
+        """
+        Convert a raw temperature sensor reading to kelvin.
+        """
+
+        return tempSlope * float(bytesTemperature)
+
+    def reset(self, hardReset = False):
+        """
+        Nothing to reset.
+        """
+
+        return
+
+    def close(self):
+        """
+        Note that we've been closed.
+        """
+
+        self.closed = True
+
+        return
@@ -7,13 +7,16 @@ Wiring setup:
 
 Geiger counter optoisoloator output connected to pin 1 of the SN74LV8154.
 
+The SN74LV8154's two 16-bit counters are cascaded into one 32-bit counter: pin 1 CLKA is tied to pin 2 CLKB, and pin 9 _RCOA_ is connected to pin 8 _CLKBEN_.
+The counter runs freely and is never cleared after start up. Each gate we latch and read all 32 bits, and the counts for the gate are the difference from the last gate, which stays right across the counter wrapping.
+
 The collector of the optoisolator is connected to +5v.
 The emitter of the optoisoloator is pulled low by a 3.3K resistor and is tied to pin 1 of the SN74LV8154.
 
 Arduino -> SN74LV8154 pin connections:
 +5v -> 20 VCC
-+5v -> 5 _GBL_
-+5v -> 6 _GBU_
+A0  -> 5 _GBL_
+A1  -> 6 _GBU_
 GND -> 10 GND
 D2  -> 3 _GAL_
 D3  -> 4 _GAU_
@@ -50,6 +53,8 @@ D13 -> 12 Data bus (MSB)
 // Control pins.
 int galPin  = 2;
 int gauPin  = 3;
+int gblPin  = A0;
+int gbuPin  = A1;
 int rclkPin = 4;
 int cclrPin = 5;
 
@@ -58,7 +63,16 @@ int digitalBusPin = 6; // Bus starts at D6
 int digitalBusLen = 8; // 8-bit bus.
 
 // Store counts per second.
-unsigned int currentCount = 0;
+unsigned long currentCount = 0;
+
+// Free-running 32-bit count at the end of the last gate.
+unsigned long currentTotal = 0;
+
+// Gate sequence number, so the host can spot missed or repeated gates. Wraps at 255.
+uint8_t gateSeq = 0;
+
+// When the current gate started, in ms.
+unsigned long gateStart = 0;
 
 // Clear the counter IC's buffer.
 void counterClear() {
@@ -94,42 +108,40 @@ uint8_t readDigitalBus() {
   return retVal;
 }
 
-// Get the counter data.
-unsigned int counterGetSample() {
-  // Set up a 16-bit return value.
-  unsigned int retVal = 0;
-  unsigned int msb = 0;
-  unsigned int lsb = 0;
-  
-  // Get the 8 bits containing LSB.
-  digitalWrite(galPin, LOW);
-  digitalWrite(gauPin, HIGH);
+// Read one byte of the counter by pulling its gate pin low.
+uint8_t counterGetByte(int gatePin) {
+  uint8_t retVal = 0;
+  
+  digitalWrite(gatePin, LOW);
   //delay(1);
   
   // Get the bits from the digital bus.
-  lsb = readDigitalBus();
+  retVal = readDigitalBus();
   
-  // Get the 8 bits containing MSB.
-  digitalWrite(galPin, HIGH);
-  digitalWrite(gauPin, LOW);
-  //delay(1);
+  digitalWrite(gatePin, HIGH);
   
-  // Get the bits from the digital bus.
-  msb = readDigitalBus();
+  return retVal;
+}
+
+// Get the counter data.
+unsigned long counterGetSample() {
+  // Set up a 32-bit return value.
+  unsigned long retVal = 0;
   
-  // Set IDGAF mode again.
+  // Make sure every byte is off the bus.
   digitalWrite(galPin, HIGH);
   digitalWrite(gauPin, HIGH);
+  digitalWrite(gblPin, HIGH);
+  digitalWrite(gbuPin, HIGH);
   
-  // Concat MSB and LSB.
-  retVal = (msb << 8) | lsb;
+  // Get the bytes from LSB to MSB.
+  retVal = (unsigned long)counterGetByte(galPin);
+  retVal |= (unsigned long)counterGetByte(gauPin) << 8;
+  retVal |= (unsigned long)counterGetByte(gblPin) << 16;
+  retVal |= (unsigned long)counterGetByte(gbuPin) << 24;
   
   #ifdef debugOn
-  Serial.print("LSB:   0x");
-  Serial.println(lsb, HEX); 
-  Serial.print("MSB:   0x");
-  Serial.println(msb, HEX);
-  Serial.print("16BIT: 0x");
+  Serial.print("32BIT: 0x");
   Serial.println(retVal, HEX);
   #endif
   
@@ -137,12 +149,18 @@ unsigned int counterGetSample() {
 }
 
 #ifdef isI2CSlave
-// Send counts back.
+// Send the free-running total back, the host works out the counts per gate.
 void i2cTxData() {
-  // Send MSB
-  Wire.write(currentCount >> 8);
-  // Send LSB
-  Wire.write(currentCount & 0xff);
+  uint8_t txBuf[5];
+  
+  // The total MSB first, then the gate sequence number, in one write.
+  txBuf[0] = (uint8_t)(currentTotal >> 24);
+  txBuf[1] = (uint8_t)(currentTotal >> 16);
+  txBuf[2] = (uint8_t)(currentTotal >> 8);
+  txBuf[3] = (uint8_t)(currentTotal & 0xff);
+  txBuf[4] = gateSeq;
+  
+  Wire.write(txBuf, 5);
 
   return;
 }
@@ -168,6 +186,14 @@ void setup() {
   pinMode(gauPin, OUTPUT);
   digitalWrite(gauPin, HIGH);
   
+  // GBL pin
+  pinMode(gblPin, OUTPUT);
+  digitalWrite(gblPin, HIGH);
+  
+  // GBU pin
+  pinMode(gbuPin, OUTPUT);
+  digitalWrite(gbuPin, HIGH);
+  
   // RCLK pin
   pinMode(rclkPin, OUTPUT);
   digitalWrite(rclkPin, HIGH);
@@ -181,22 +207,42 @@ void setup() {
     // Set target to input.
     digitalWrite(digitalBusPin + i, INPUT);
   }
+  
+  // Start counting from zero.
+  counterClear();
+  
+  // First gate starts now.
+  gateStart = millis();
 }
 
 void loop() {
-  // Clear the counter.
-  counterClear();
+  unsigned long thisTotal = 0;
+  
+  // Wait until 1 second after the last gate started, so the time spent reading and printing doesn't stretch the gate period.
+  gateStart += 1000;
   
-  // Wait 1 second.
-  delay(1000);
+  while((long)(millis() - gateStart) < 0) {
+    // Spin.
+  }
   
   // Load counter data into registers.
   counterLoadSample();
   
-  // Read the registers, update global counts.
-  currentCount = counterGetSample();
-    
+  // Read the registers. Unsigned subtraction gives the right count when the counter wraps.
+  thisTotal = counterGetSample();
+  
+  // Update global counts without the I2C handler seeing them half done.
+  noInterrupts();
+  currentCount = thisTotal - currentTotal;
+  currentTotal = thisTotal;
+  gateSeq++;
+  interrupts();
+  
   Serial.print("CPS: ");
-  Serial.println(currentCount);
+  Serial.print(currentCount);
+  Serial.print(" SEQ: ");
+  Serial.print(gateSeq);
+  Serial.print(" TOT: ");
+  Serial.println(currentTotal);
   Serial.println("--");
 }
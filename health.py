@@ -0,0 +1,301 @@
+###############
+### Imports ###
+###############
+
+import collections
+import math
+import pipeline
+
+
+#################
+### Histogram ###
+#################
+
+class countHistogram(object):
+    def __init__(self, window = None):
+        """
+        Streaming histogram of per-gate counts. With window set it covers the last window gates, otherwise every gate since it was created. Adding a gate is O(1), and running sums are kept so the mean and variance are O(1) too.
+        """
+
+        self.__window = window
+
+        # Gates in the window, oldest first. Only needed when sliding.
+        if window is not None:
+            self.__gates = collections.deque()
+
+        # Count value -> number of gates with that count.
+        self.bins = {}
+
+        # Running sums of counts and counts squared, and the number of gates.
+        self.n = 0
+        self.__sum = 0
+        self.__sumSq = 0
+
+    def add(self, counts):
+        """
+        Add one gate's counts, dropping the oldest gate if the window is full.
+        """
+
+        self.bins[counts] = self.bins.get(counts, 0) + 1
+        self.n += 1
+        self.__sum += counts
+        self.__sumSq += counts * counts
+
+        if self.__window is not None:
+            self.__gates.append(counts)
+
+            if len(self.__gates) > self.__window:
+                old = self.__gates.popleft()
+
+                self.bins[old] -= 1
+
+                if self.bins[old] == 0:
+                    del self.bins[old]
+
+                self.n -= 1
+                self.__sum -= old
+                self.__sumSq -= old * old
+
+        return
+
+    def mean(self):
+        """
+        Mean counts per gate.
+        """
+
+        return float(self.__sum) / float(self.n)
+
+    def variance(self):
+        """
+        Sample variance of counts per gate.
+        """
+
+        return (float(self.__sumSq) - (float(self.__sum) * float(self.__sum) / float(self.n))) / float(self.n - 1)
+
+    def getState(self):
+        """
+        Get the histogram contents for a checkpoint.
+        """
+
+        retVal = {'bins': [[k, v] for k, v in self.bins.items()], 'n': self.n, 'sum': self.__sum, 'sumSq': self.__sumSq}
+
+        if self.__window is not None:
+            retVal['gates'] = list(self.__gates)
+
+        return retVal
+
+    def setState(self, state):
+        """
+        Restore histogram contents from getState().
+        """
+
+        self.bins = dict([(k, v) for k, v in state['bins']])
+        self.n = state['n']
+        self.__sum = state['sum']
+        self.__sumSq = state['sumSq']
+
+        if self.__window is not None:
+            self.__gates = collections.deque(state['gates'])
+
+        return
+
+
+#############
+### Tests ###
+#############
+
+def chi2Z(chi2, dof):
+    """
+    Convert a chi-square statistic with dof degrees of freedom to a standard normal z score using the Wilson-Hilferty approximation. Large positive values mean too much spread, large negative values too little.
+    """
+
+    k = float(dof)
+
+    return (((chi2 / k) ** (1.0 / 3.0)) - (1.0 - (2.0 / (9.0 * k)))) / math.sqrt(2.0 / (9.0 * k))
+
+
+def dispersionTest(hist):
+    """
+    Poisson index of dispersion test. Returns the dispersion index (variance / mean, 1 for Poisson counts) and its z score, or (None, None) if there isn't enough data to test.
+    """
+
+    if (hist.n < 10) or (hist.mean() <= 0.0):
+        return (None, None)
+
+    index = hist.variance() / hist.mean()
+
+    # (n - 1) * index is chi-square with n - 1 degrees of freedom for Poisson counts.
+    return (index, chi2Z((hist.n - 1) * index, hist.n - 1))
+
+
+def poissonFitTest(hist, minExpected = 5.0):
+    """
+    Chi-square goodness of fit of the histogram to a Poisson distribution with the same mean. Neighbouring bins are merged until each expects at least minExpected gates. Returns the chi-square z score, or None if there aren't enough bins to test.
+    """
+
+    if (hist.n < 10) or (hist.mean() <= 0.0):
+        return None
+
+    mean = hist.mean()
+    lo = min(hist.bins)
+    hi = max(hist.bins)
+
+    def pmf(k):
+        """
+        Poisson probability of k counts, done in logs so large means don't underflow.
+        """
+
+        return math.exp((k * math.log(mean)) - mean - math.lgamma(k + 1))
+
+    # Everything below the lowest count we've seen goes in the first bin.
+    lowTail = sum([pmf(k) for k in range(0, lo)])
+
+    merged = []
+    observed = 0.0
+    expected = lowTail * hist.n
+    seen = lowTail
+
+    for k in range(lo, hi + 1):
+        observed += hist.bins.get(k, 0)
+        expected += pmf(k) * hist.n
+        seen += pmf(k)
+
+        if expected >= minExpected:
+            merged.append([observed, expected])
+            observed = 0.0
+            expected = 0.0
+
+    # The upper tail and any leftovers go in the last bin.
+    expected += max(1.0 - seen, 0.0) * hist.n
+
+    if len(merged) > 0:
+        merged[-1][0] += observed
+        merged[-1][1] += expected
+
+    # Fitting the mean costs a degree of freedom.
+    dof = len(merged) - 2
+
+    if dof < 1:
+        return None
+
+    chi2 = sum([((o - e) * (o - e)) / e for o, e in merged])
+
+    return chi2Z(chi2, dof)
+
+
+#############
+### Stage ###
+#############
+
+class healthStage(pipeline.pipelineStage):
+    def __init__(self, name = "health", window = 300, interval = 60, zLimit = 4.0, textOut = True):
+        """
+        Detector health check. Keeps streaming histograms of gate counts over the last window gates and the whole run, and every interval gates tests the sliding window for Poisson statistics.
+        Counts more spread out than Poisson (bursts, noise pickup) flag the detector as bursty, and counts less spread out than Poisson (stuck counter, repeated values) flag it as stuck, when the dispersion or goodness of fit z score is beyond zLimit.
+        """
+
+        super(healthStage, self).__init__(name)
+
+        self.__sliding = countHistogram(window)
+        self.__cumulative = countHistogram()
+        self.__interval = interval
+        self.__zLimit = zLimit
+        self.__textOut = textOut
+
+        # Gates since the last test and the last test results.
+        self.__sinceTest = 0
+        self.__last = {'dispersion': None, 'dispersionZ': None, 'fitZ': None}
+
+    def __test(self):
+        """
+        Test the sliding window and set our health flag.
+        """
+
+        index, dispZ = dispersionTest(self.__sliding)
+        fitZ = poissonFitTest(self.__sliding)
+
+        self.__last = {'dispersion': index, 'dispersionZ': dispZ, 'fitZ': fitZ}
+
+        oldFlags = self.flags
+
+        if dispZ is None:
+            # Not enough data, or no counts at all.
+            self.flags = pipeline.setFlag(self.flags, pipeline.f_health, pipeline.f_health_unk)
+
+        elif dispZ > self.__zLimit:
+            self.flags = pipeline.setFlag(self.flags, pipeline.f_health, pipeline.f_health_bursty)
+
+        elif dispZ < -self.__zLimit:
+            self.flags = pipeline.setFlag(self.flags, pipeline.f_health, pipeline.f_health_stuck)
+
+        elif (fitZ is not None) and (fitZ > self.__zLimit):
+            # Right spread but the wrong shape, which is usually bursts too.
+            self.flags = pipeline.setFlag(self.flags, pipeline.f_health, pipeline.f_health_bursty)
+
+        else:
+            self.flags = pipeline.setFlag(self.flags, pipeline.f_health, pipeline.f_health_ok)
+
+        if (self.__textOut == True) and (oldFlags != self.flags):
+            print("[%s] Detector health is now %s (dispersion %s, z %s, fit z %s)." %(self.name, self.getHealthStr(), None if index is None else round(index, 3), None if dispZ is None else round(dispZ, 3), None if fitZ is None else round(fitZ, 3)))
+
+        return
+
+    def getHealthStr(self):
+        """
+        Get our health as a word.
+        """
+
+        return {pipeline.f_health_unk: "unknown", pipeline.f_health_ok: "ok", pipeline.f_health_bursty: "bursty", pipeline.f_health_stuck: "stuck"}[self.flags & pipeline.f_health]
+
+    def process(self, smpl):
+        """
+        Add the gate to the histograms and test if we're due.
+        """
+
+        self.__sliding.add(smpl['counts'])
+        self.__cumulative.add(smpl['counts'])
+
+        self.__sinceTest += 1
+
+        if self.__sinceTest >= self.__interval:
+            self.__sinceTest = 0
+            self.__test()
+
+        smpl[self.name] = {'health': self.getHealthStr(), 'flags': self.flags}
+        smpl[self.name].update(self.__last)
+
+        return
+
+    def getState(self):
+        """
+        Save the histograms and flags.
+        """
+
+        return {'sliding': self.__sliding.getState(), 'cumulative': self.__cumulative.getState(), 'sinceTest': self.__sinceTest, 'flags': self.flags}
+
+    def setState(self, state):
+        """
+        Restore the histograms and flags.
+        """
+
+        self.__sliding.setState(state['sliding'])
+        self.__cumulative.setState(state['cumulative'])
+        self.__sinceTest = state['sinceTest']
+        self.flags = state['flags']
+
+        return
+
+    def finish(self, summary):
+        """
+        Report the whole-run dispersion.
+        """
+
+        index, dispZ = dispersionTest(self.__cumulative)
+        fitZ = poissonFitTest(self.__cumulative)
+
+        summary[self.name] = {'health': self.getHealthStr(), 'dispersion': index, 'dispersionZ': dispZ, 'fitZ': fitZ}
+
+        if (self.__textOut == True) and (index is not None):
+            print("[%s] Whole run dispersion index %s (z %s), Poisson fit z %s." %(self.name, round(index, 3), round(dispZ, 3), None if fitZ is None else round(fitZ, 3)))
+
+        return
@@ -0,0 +1,317 @@
+###############
+### Imports ###
+###############
+
+import array
+
+
+#####################
+### History store ###
+#####################
+
+class historyStore(object):
+    def __init__(self, capacity = 86400, blockSize = 256):
+        """
+        Bounded in-memory history of per-gate counts, timestamps and flags. Samples go into a ring of packed arrays, about 12 bytes per gate including block summaries, or roughly 1 MB for a day of 1 second gates, and the oldest samples are overwritten once it's full.
+        The ring is split into blocks of blockSize samples, and each block keeps its minimum, maximum, sum and a small log-scale histogram, so windowed queries only look at raw samples in the partial blocks at each end of the window.
+        """
+
+        # Round the capacity up to whole blocks.
+        if (blockSize < 1) or (blockSize > 65535):
+            raise ValueError("Block size must be between 1 and 65535 samples.")
+
+        self.__blockSize = blockSize
+        self.__nBlocks = max(1, (capacity + blockSize - 1) // blockSize)
+        self.__capacity = self.__nBlocks * blockSize
+
+        # Per-sample data. Times are milliseconds since the start of the sample's block.
+        self.__counts = array.array('I', bytes(4 * self.__capacity))
+        self.__flags = array.array('H', bytes(2 * self.__capacity))
+        self.__times = array.array('I', bytes(4 * self.__capacity))
+
+        # Per-block summaries.
+        self.__blockBase = array.array('d', bytes(8 * self.__nBlocks))
+        self.__blockMin = array.array('I', bytes(4 * self.__nBlocks))
+        self.__blockMax = array.array('I', bytes(4 * self.__nBlocks))
+        self.__blockSum = array.array('d', bytes(8 * self.__nBlocks))
+        self.__blockHist = array.array('H', bytes(2 * self.__nBlocks * self.histBins))
+
+        # Index of the next sample. Sample i lives in slot i % capacity.
+        self.__next = 0
+
+    # Bins in each block histogram. Counts are binned on a log scale with 8 bins per doubling, so percentiles from the histograms are within about 9% of the true value.
+    histBins = 256
+
+    @staticmethod
+    def histBin(counts):
+        """
+        Get the block histogram bin for a count.
+        """
+
+        if counts < 8:
+            return counts
+
+        # 8 bins per power of two above 8.
+        exp = counts.bit_length() - 1
+
+        return min(8 + ((exp - 3) * 8) + ((counts >> (exp - 3)) & 0x7), historyStore.histBins - 1)
+
+    @staticmethod
+    def binValue(binNo):
+        """
+        Get a representative count for a block histogram bin: the middle of the bin.
+        """
+
+        if binNo < 8:
+            return float(binNo)
+
+        exp = ((binNo - 8) // 8) + 3
+        low = (1 << exp) + (((binNo - 8) % 8) << (exp - 3))
+
+        return low + ((1 << (exp - 3)) - 1) / 2.0
+
+    def __len__(self):
+        """
+        Number of samples held.
+        """
+
+        return self.__next - self.__oldest()
+
+    def getSizeBytes(self):
+        """
+        Memory used by the sample and block arrays.
+        """
+
+        return sum([a.itemsize * len(a) for a in (self.__counts, self.__flags, self.__times, self.__blockBase, self.__blockMin, self.__blockMax, self.__blockSum, self.__blockHist)])
+
+    def append(self, ts, counts, flags = 0):
+        """
+        Add a sample. ts is a UNIX timestamp. If the clock steps backwards the sample is held at the previous sample's time, so the times stay in order for searching.
+        """
+
+        i = self.__next
+
+        if i > 0:
+            ts = max(ts, self.__time(i - 1))
+
+        slot = i % self.__capacity
+        block = (i // self.__blockSize) % self.__nBlocks
+
+        if (i % self.__blockSize) == 0:
+            # New block, overwriting the oldest one once we've wrapped.
+            self.__blockBase[block] = ts
+            self.__blockMin[block] = counts
+            self.__blockMax[block] = counts
+            self.__blockSum[block] = 0.0
+
+            histStart = block * self.histBins
+
+            for b in range(histStart, histStart + self.histBins):
+                self.__blockHist[b] = 0
+
+        self.__counts[slot] = counts
+        self.__flags[slot] = flags
+        self.__times[slot] = min(int(round((ts - self.__blockBase[block]) * 1000.0)), 0xFFFFFFFF)
+
+        if counts < self.__blockMin[block]:
+            self.__blockMin[block] = counts
+
+        if counts > self.__blockMax[block]:
+            self.__blockMax[block] = counts
+
+        self.__blockSum[block] += counts
+        self.__blockHist[(block * self.histBins) + self.histBin(counts)] += 1
+
+        self.__next += 1
+
+        return
+
+    def __time(self, i):
+        """
+        Get the timestamp of sample i.
+        """
+
+        return self.__blockBase[(i // self.__blockSize) % self.__nBlocks] + (self.__times[i % self.__capacity] / 1000.0)
+
+    def __oldest(self):
+        """
+        Index of the oldest sample we still hold. Once we've wrapped, the oldest block shares its summary with the newest, so what's left of it is dropped.
+        """
+
+        return max(0, -(-(self.__next - self.__capacity) // self.__blockSize) * self.__blockSize)
+
+    def __findIndex(self, ts):
+        """
+        Get the index of the first sample at or after ts.
+        """
+
+        lo = self.__oldest()
+        hi = self.__next
+
+        # Binary search on sample times.
+        while lo < hi:
+            mid = (lo + hi) // 2
+
+            if self.__time(mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return lo
+
+    def get(self, i):
+        """
+        Get sample i, counting back from the newest when negative, as a (timestamp, counts, flags) tuple.
+        """
+
+        if i < 0:
+            i = self.__next + i
+        else:
+            i = self.__oldest() + i
+
+        if (i < self.__oldest()) or (i >= self.__next):
+            raise IndexError("History index out of range.")
+
+        return (self.__time(i), self.__counts[i % self.__capacity], self.__flags[i % self.__capacity])
+
+    def getAppended(self):
+        """
+        Get the number of samples ever appended, which changes whenever the history does.
+        """
+
+        return self.__next
+
+    def arrays(self, start = None, end = None):
+        """
+        Get samples with start <= timestamp < end, where either can be None for an open end, as NumPy arrays of timestamps, counts and flags, oldest first. This works on the packed arrays directly, so it's quick for long histories.
+        """
+
+        import numpy
+
+        if start is None:
+            first = self.__oldest()
+        else:
+            first = self.__findIndex(start)
+
+        if end is None:
+            last = self.__next
+        else:
+            last = self.__findIndex(end)
+
+        idx = numpy.arange(first, max(first, last), dtype = numpy.int64)
+        slots = idx % self.__capacity
+
+        blockBase = numpy.frombuffer(self.__blockBase, dtype = numpy.float64)
+        ts = blockBase[(idx // self.__blockSize) % self.__nBlocks] + (numpy.frombuffer(self.__times, dtype = numpy.uint32)[slots] / 1000.0)
+
+        return (ts, numpy.frombuffer(self.__counts, dtype = numpy.uint32)[slots], numpy.frombuffer(self.__flags, dtype = numpy.uint16)[slots])
+
+    def latest(self, n):
+        """
+        Get the newest n samples, oldest first, as (timestamp, counts, flags) tuples.
+        """
+
+        n = min(n, len(self))
+
+        return [self.get(i) for i in range(-n, 0)]
+
+    def query(self, start = None, end = None, percentiles = (50, 95, 99), exact = False):
+        """
+        Get count statistics for samples with start <= timestamp < end, where either can be None for an open end: n, min, max, mean and the given percentiles.
+        Whole blocks in the window are answered from their summaries, so percentiles are approximate unless exact is True, which sorts the raw samples instead.
+        """
+
+        if start is None:
+            first = self.__oldest()
+        else:
+            first = self.__findIndex(start)
+
+        if end is None:
+            last = self.__next
+        else:
+            last = self.__findIndex(end)
+
+        retVal = {'n': max(0, last - first), 'min': None, 'max': None, 'mean': None, 'percentiles': {}}
+
+        if last <= first:
+            return retVal
+
+        lo = None
+        hi = None
+        total = 0.0
+
+        # Raw samples in the window and block histograms to merge for percentiles.
+        raw = []
+        hist = [0] * self.histBins
+
+        i = first
+
+        while i < last:
+            block = (i // self.__blockSize) % self.__nBlocks
+            blockStart = i - (i % self.__blockSize)
+            blockEnd = blockStart + self.__blockSize
+
+            if (i == blockStart) and (blockEnd <= last) and (exact == False):
+                # Whole block, use the summary.
+                if (lo is None) or (self.__blockMin[block] < lo):
+                    lo = self.__blockMin[block]
+
+                if (hi is None) or (self.__blockMax[block] > hi):
+                    hi = self.__blockMax[block]
+
+                total += self.__blockSum[block]
+
+                histStart = block * self.histBins
+                hist = [a + b for a, b in zip(hist, self.__blockHist[histStart:(histStart + self.histBins)])]
+
+                i = blockEnd
+
+            else:
+                # Part of a block, use the raw samples.
+                stop = min(blockEnd, last)
+
+                for j in range(i, stop):
+                    raw.append(self.__counts[j % self.__capacity])
+
+                i = stop
+
+        if len(raw) > 0:
+            if (lo is None) or (min(raw) < lo):
+                lo = min(raw)
+
+            if (hi is None) or (max(raw) > hi):
+                hi = max(raw)
+
+            total += sum(raw)
+
+        retVal['min'] = lo
+        retVal['max'] = hi
+        retVal['mean'] = total / float(retVal['n'])
+
+        if exact == True:
+            # Sort everything.
+            raw.sort()
+
+            for p in percentiles:
+                retVal['percentiles'][p] = raw[min(len(raw) - 1, int(p / 100.0 * len(raw)))]
+
+        else:
+            # Merge the raw samples into the block histograms and walk them.
+            for c in raw:
+                hist[self.histBin(c)] += 1
+
+            cumulative = 0
+            wanted = sorted(percentiles)
+            b = 0
+
+            for p in wanted:
+                rank = min(retVal['n'] - 1, int(p / 100.0 * retVal['n']))
+
+                while cumulative + hist[b] <= rank:
+                    cumulative += hist[b]
+                    b += 1
+
+                # Keep the answer inside what we've actually seen.
+                retVal['percentiles'][p] = min(max(self.binValue(b), lo), hi)
+
+        return retVal
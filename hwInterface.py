@@ -92,4 +92,197 @@ class counterIface(object):
 			print("Punt: Counter hardware cleanup...")
 		
 		return
+	
+	def getGateTimes(self):
+		"""
+		Get the start and end of the last polled gate as host UNIX timestamps, or None if the hardware doesn't know. Hardware that times its own gates overrides this.
+		"""
+		
+		return None
+	
+	def getNextPoll(self):
+		"""
+		Get the host UNIX timestamp the next poll should happen at, or None to poll once a second. Hardware that times its own gates overrides this so the run loop follows its cadence.
+		"""
+		
+		return None
+	
+	def getCounterFlags(self):
+		"""
+		Get the pipeline.f_counter flags for the last poll, e.g. when the hardware counter wrapped or overflowed. Hardware that can tell overrides this.
+		"""
+		
+		return 0
+	
+	def getChannels(self):
+		"""
+		Get the last poll's reading of every channel as a dictionary by channel name, or None for hardware with only the one counter. Hardware that reads several counters or analog inputs at once overrides this.
+		"""
+		
+		return None
+	
+	def getEvents(self):
+		"""
+		Get the arrival times of the pulses counted in the last poll's gate as sorted NumPy arrays of host UNIX timestamps by channel name, named as in getChannels() or 'counter' for hardware with only the one counter, or None if the hardware doesn't time pulses. Hardware that timestamps pulses overrides this.
+		"""
+		
+		return None
+	
+	def getBufferSeconds(self):
+		"""
+		Get how many seconds of finished gates the hardware holds for pollBlock() between polls without losing any, or None if there's no limit. By default pollBlock() is one poll(), which only has the gate that ended last, so this is 0. Hardware that buffers readings overrides this.
+		"""
+		
+		return 0.0
+	
+	def pollBlock(self):
+		"""
+		Poll every gate that has finished since the last poll as a block: a tuple of sequences of counts, gate end UNIX timestamps and gate lengths in seconds, oldest first. The block may be empty.
+		Hardware that buffers readings overrides this to hand over everything it has at once. By default this is one poll().
+		"""
+		
+		import time
+		
+		counts = self.poll()
+		gateTimes = self.getGateTimes()
+		
+		if gateTimes is None:
+			return ([counts], [time.time()], [1.0])
+		
+		return ([counts], [gateTimes[1]], [gateTimes[1] - gateTimes[0]])
+
+
 
+class asyncCounterIface(counterIface):
+	def __init__(self):
+		"""
+		Template class to communicate with counter hardware from an asyncio event loop. Methods that talk to the hardware are awaitable, the rest are as in counterIface. Override methods that the hardware requires.
+		"""
+		
+		super(asyncCounterIface, self).__init__()
+	
+	async def setup(self):
+		"""
+		Set up and configure counter hardware interface
+		"""
+		
+		if self._debug == True:
+			print("Punt: Set up counter hardware...")
+		
+		return
+	
+	async def getConfig(self):
+		"""
+		Get current configuration of the hardware as a string.
+		"""
+		
+		return "No hardware present."
+	
+	async def start(self):
+		"""
+		Start the hardware counter.
+		"""
+		
+		if self._debug == True:
+			print("Punt: Start counter hardware...")
+		
+		return
+	
+	async def poll(self):
+		"""
+		Poll the counter.
+		"""
+		
+		if self._debug == True:
+			print("Punt: Poll counter hardware...")
+		
+		return 0
+	
+	async def stop(self):
+		"""
+		Stop the hardware counter.
+		"""
+		
+		if self._debug == True:
+			print("Punt: Stop counter hardware...")
+		
+		return
+	
+	async def cleanup(self):
+		"""
+		Do any necessary cleanup on the hardware counter before shutting down.
+		"""
+		
+		if self._debug == True:
+			print("Punt: Counter hardware cleanup...")
+		
+		return
+	
+	async def pollBlock(self):
+		"""
+		Poll every gate that has finished since the last poll as a block: a tuple of sequences of counts, gate end UNIX timestamps and gate lengths in seconds, oldest first. The block may be empty.
+		Hardware that buffers readings overrides this to hand over everything it has at once. By default this is one poll().
+		"""
+		
+		import time
+		
+		counts = await self.poll()
+		gateTimes = self.getGateTimes()
+		
+		if gateTimes is None:
+			return ([counts], [time.time()], [1.0])
+		
+		return ([counts], [gateTimes[1]], [gateTimes[1] - gateTimes[0]])
+
+
+class asyncHwAdapter(object):
+	# Methods that talk to the hardware and can block. These are awaitable on the adapter. Everything else is passed straight through.
+	blockingMethods = ('setup', 'getConfig', 'start', 'poll', 'stop', 'cleanup', 'pollBlock')
+	
+	def __init__(self, hwPlatform, executor = None):
+		"""
+		Wrap a synchronous counterIface instance such as u3Hardware, arduSerHardware, arduI2cHardware or rndHardware so it can be used as an asyncCounterIface. The blocking methods become coroutines that run in executor, which defaults to the event loop's default executor, and any other attribute is the wrapped object's own, so new hardware hooks need no changes here.
+		Blocking calls for one wrapped device are made one at a time under a lock, so the wrapped object never sees them run concurrently.
+		"""
+		
+		# The synchronous hardware object, the executor we run it in and the lock that keeps its calls in turn.
+		self.__hw = hwPlatform
+		self.__executor = executor
+		self.__lock = None
+	
+	async def __inExecutor(self, method, *args):
+		"""
+		Run a blocking hardware method in our executor, one at a time, and return its result.
+		"""
+		
+		# Imported here so the synchronous classes don't depend on asyncio.
+		import asyncio
+		import functools
+		
+		# Created on first use so it belongs to the running loop.
+		if self.__lock is None:
+			self.__lock = asyncio.Lock()
+		
+		async with self.__lock:
+			retVal = await asyncio.get_running_loop().run_in_executor(self.__executor, functools.partial(method, *args))
+		
+		return retVal
+	
+	def __getattr__(self, name):
+		"""
+		Get an attribute of the wrapped hardware, as a coroutine function running in our executor if it's one of the blocking methods.
+		"""
+		
+		# Our own attributes aren't there yet while we're being set up.
+		if name.startswith("_asyncHwAdapter__"):
+			raise AttributeError(name)
+		
+		attr = getattr(self.__hw, name)
+		
+		if name not in self.blockingMethods:
+			return attr
+		
+		async def blockingCall(*args):
+			return await self.__inExecutor(attr, *args)
+		
+		return blockingCall
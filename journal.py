@@ -0,0 +1,341 @@
+###############
+### Imports ###
+###############
+
+import datetime
+import os
+import struct
+import time
+import zlib
+
+
+##############
+### Layout ###
+##############
+
+# Frame header: magic, layout version, frame sequence number, record count, frame length including padding, and a CRC-32 of the rest of the header and the records.
+frameFormat = "<4sIQIII"
+frameMagic = b"GGJ1"
+frameVersion = 1
+frameHdrSize = struct.calcsize(frameFormat)
+
+# Records: UNIX timestamp, value, and flags or -1 for none.
+recFormat = "<ddq"
+recSize = struct.calcsize(recFormat)
+
+
+def recordDtype():
+    """
+    Get a NumPy dtype matching the record layout.
+    """
+
+    import numpy
+
+    return numpy.dtype([('ts', '<f8'), ('value', '<f8'), ('flags', '<i8')])
+
+
+def frameCrc(hdr, payload):
+    """
+    Get the CRC-32 of a frame header, without its CRC field, and its records.
+    """
+
+    return zlib.crc32(payload, zlib.crc32(hdr[:(frameHdrSize - 4)]))
+
+
+def parseHeader(hdr, offset, fileSize, lastSeq = None):
+    """
+    Unpack a frame header read from offset in a file of fileSize bytes, as (seq, count, frameLen, crc), or None if it isn't a complete frame following frame lastSeq.
+    """
+
+    if len(hdr) < frameHdrSize:
+        return None
+
+    magic, version, seq, count, frameLen, crc = struct.unpack(frameFormat, hdr)
+
+    if (magic != frameMagic) or (version != frameVersion):
+        return None
+
+    if (frameLen < frameHdrSize + (count * recSize)) or ((offset + frameLen) > fileSize):
+        return None
+
+    if (lastSeq is not None) and (seq != lastSeq + 1):
+        return None
+
+    return (seq, count, frameLen, crc)
+
+
+###############
+### Journal ###
+###############
+
+class journal(object):
+    def __init__(self, fileName, commitInterval = 30.0, blockSize = 4096):
+        """
+        Append-only journal of data points, made to be kind to SD cards. Records are held in memory and group-committed every commitInterval seconds as one frame: a checksummed header and the records, padded to a whole number of blockSize-byte blocks so writes stay block aligned, written with one write() and made durable with one fsync(). A power cut loses at most the records since the last commit.
+        Opening an existing journal recovers it. Frames are only ever added after earlier ones are on disk, so damage from a power cut can only be at the end: frames there that are incomplete or fail their checksum are cut off, and new frames carry on after the last good one.
+        """
+
+        self.fileName = fileName
+
+        self.__commitInterval = commitInterval
+        self.__blockSize = blockSize
+
+        # Records waiting for the next commit, as packed bytes, and how many there are.
+        self.__pending = []
+        self.__pendingCount = 0
+        self.__lastCommit = time.monotonic()
+
+        self.__stats = {'frames': 0, 'records': 0, 'commits': 0, 'fsyncs': 0, 'bytesWritten': 0, 'recoveredFrames': 0, 'recoveredRecords': 0, 'discardedBytes': 0}
+
+        self.__fd = os.open(fileName, os.O_RDWR | os.O_CREAT, 0o644)
+
+        try:
+            self.__recover()
+
+        except:
+            os.close(self.__fd)
+            raise
+
+    def __recover(self):
+        """
+        Find the last good frame, cut off anything after it and get ready to append.
+        """
+
+        fileSize = os.fstat(self.__fd).st_size
+
+        # Walk the frame headers. This reads a few bytes per frame, not the whole journal.
+        frames = []
+        offset = 0
+        lastSeq = None
+
+        while True:
+            hdrInfo = parseHeader(os.pread(self.__fd, frameHdrSize, offset), offset, fileSize, lastSeq)
+
+            if hdrInfo is None:
+                break
+
+            frames.append((offset, hdrInfo))
+            lastSeq = hdrInfo[0]
+            offset += hdrInfo[2]
+
+        # Check the checksums from the end back until one's good.
+        while len(frames) > 0:
+            frameOffset, (seq, count, frameLen, crc) = frames[-1]
+            hdr = os.pread(self.__fd, frameHdrSize, frameOffset)
+            payload = os.pread(self.__fd, count * recSize, frameOffset + frameHdrSize)
+
+            if frameCrc(hdr, payload) == crc:
+                break
+
+            frames.pop()
+
+        if len(frames) > 0:
+            frameOffset, (seq, count, frameLen, crc) = frames[-1]
+            end = frameOffset + frameLen
+            self.__seq = seq + 1
+        else:
+            end = 0
+            self.__seq = 0
+
+        self.__stats['recoveredFrames'] = len(frames)
+        self.__stats['recoveredRecords'] = sum([frameInfo[1] for frameOffset, frameInfo in frames])
+        self.__stats['discardedBytes'] = fileSize - end
+
+        # Cut off the torn tail.
+        if end < fileSize:
+            os.ftruncate(self.__fd, end)
+            os.fsync(self.__fd)
+            self.__stats['fsyncs'] += 1
+
+        self.__offset = end
+
+        return
+
+    def getStats(self):
+        """
+        Get counts of what we've done: frames and records written, commits, fsyncs and bytes written, and what recovery found.
+        """
+
+        return dict(self.__stats)
+
+    def append(self, ts, value, flags = None):
+        """
+        Add a data point with a UNIX timestamp, committing if we're due.
+        """
+
+        self.__pending.append(struct.pack(recFormat, ts, value, -1 if flags is None else flags))
+        self.__pendingCount += 1
+
+        self.__maybeCommit()
+
+        return
+
+    def appendMany(self, ts, values, flags = None):
+        """
+        Add arrays of data points at once, committing if we're due.
+        """
+
+        import numpy
+
+        recs = numpy.empty(len(ts), dtype = recordDtype())
+        recs['ts'] = ts
+        recs['value'] = values
+        recs['flags'] = -1 if flags is None else flags
+
+        self.__pending.append(recs.tobytes())
+        self.__pendingCount += len(recs)
+
+        self.__maybeCommit()
+
+        return
+
+    def __maybeCommit(self):
+        """
+        Commit if it's been commitInterval seconds since the last commit.
+        """
+
+        if (time.monotonic() - self.__lastCommit) >= self.__commitInterval:
+            self.commit()
+
+        return
+
+    def commit(self):
+        """
+        Write the waiting records as a frame and make sure they're on disk.
+        """
+
+        self.__lastCommit = time.monotonic()
+
+        if self.__pendingCount == 0:
+            return
+
+        payload = b''.join(self.__pending)
+
+        # Pad to whole blocks.
+        frameLen = frameHdrSize + len(payload)
+        frameLen += (-frameLen) % self.__blockSize
+
+        hdr = struct.pack(frameFormat, frameMagic, frameVersion, self.__seq, self.__pendingCount, frameLen, 0)
+        hdr = hdr[:(frameHdrSize - 4)] + struct.pack("<I", frameCrc(hdr, payload))
+
+        frame = hdr + payload + bytes(frameLen - frameHdrSize - len(payload))
+
+        # Write it all, even if the OS takes it in pieces.
+        written = 0
+
+        while written < len(frame):
+            written += os.pwrite(self.__fd, frame[written:], self.__offset + written)
+
+        os.fsync(self.__fd)
+
+        self.__offset += frameLen
+        self.__seq += 1
+
+        self.__stats['frames'] += 1
+        self.__stats['records'] += self.__pendingCount
+        self.__stats['commits'] += 1
+        self.__stats['fsyncs'] += 1
+        self.__stats['bytesWritten'] += frameLen
+
+        self.__pending = []
+        self.__pendingCount = 0
+
+        return
+
+    def close(self):
+        """
+        Commit anything waiting and close the journal.
+        """
+
+        if self.__fd is None:
+            return
+
+        try:
+            self.commit()
+
+        finally:
+            os.close(self.__fd)
+            self.__fd = None
+
+        return
+
+
+###############
+### Reading ###
+###############
+
+def isJournal(fileName):
+    """
+    Check whether a file is a journal by the magic at the start of its first frame, whatever it's called.
+    """
+
+    with open(fileName, 'rb') as journalFile:
+        return journalFile.read(len(frameMagic)) == frameMagic
+
+
+def readJournal(fileName):
+    """
+    Read every good frame of a journal, oldest first. Returns a NumPy structured array of records with recordDtype(), and the number of frames skipped because they failed their checksum. Reading stops at the first frame that isn't complete.
+    """
+
+    import numpy
+
+    with open(fileName, 'rb') as journalFile:
+        buf = journalFile.read()
+
+    parts = []
+    skipped = 0
+    offset = 0
+    lastSeq = None
+
+    while True:
+        hdr = buf[offset:(offset + frameHdrSize)]
+        hdrInfo = parseHeader(hdr, offset, len(buf), lastSeq)
+
+        if hdrInfo is None:
+            break
+
+        seq, count, frameLen, crc = hdrInfo
+        payload = buf[(offset + frameHdrSize):(offset + frameHdrSize + (count * recSize))]
+
+        if frameCrc(hdr, payload) == crc:
+            parts.append(numpy.frombuffer(payload, dtype = recordDtype()))
+        else:
+            skipped += 1
+
+        lastSeq = seq
+        offset += frameLen
+
+    if len(parts) > 0:
+        return (numpy.concatenate(parts), skipped)
+
+    return (numpy.zeros(0, dtype = recordDtype()), skipped)
+
+
+#######################
+# Main execution body #
+#######################
+
+if __name__ == "__main__":
+    import argparse
+
+    # Set up command line interface.
+    parser = argparse.ArgumentParser(description = "Read a geiger counter journal", epilog = "Checks a journal written with --store journal and optionally converts it to the CSV format --store csv writes.")
+    parser.add_argument('file', help = 'Journal file to read.')
+    parser.add_argument('--csv', type = str, default = None, help = 'Write the records to this CSV file.')
+    args = parser.parse_args()
+
+    recs, skipped = readJournal(args.file)
+
+    print("%s records, %s damaged frames skipped." %(len(recs), skipped))
+
+    if len(recs) > 0:
+        print("First %s, last %s UTC." %(datetime.datetime.utcfromtimestamp(recs['ts'][0]), datetime.datetime.utcfromtimestamp(recs['ts'][-1])))
+
+    if args.csv is not None:
+        with open(args.csv, 'w') as csvFile:
+            for ts, value, flags in recs.tolist():
+                if flags >= 0:
+                    csvFile.write("\"%s\", %s, 0x%x\n" %(datetime.datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), value, flags))
+                else:
+                    csvFile.write("\"%s\", %s\n" %(datetime.datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), value))
@@ -0,0 +1,200 @@
+###############
+### Imports ###
+###############
+
+import os
+import tempfile
+import time
+import counter
+import datalayer
+import hwInterface
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+def rssBytes():
+    """
+    Get our resident set size in bytes. Uses /proc on Linux, and falls back to the peak RSS elsewhere.
+    """
+
+    try:
+        with open("/proc/self/statm", 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    except (IOError, OSError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+#################
+### Load test ###
+#################
+
+async def runStep(detectors, gateTime = 1.0, duration = 10.0, mode = "counter", store = "none", deadline = None, background = 0.5):
+    """
+    Run detectors simulated counters through geigerInterface on this event loop for duration seconds, each with its own simHardware in real time, and return how well we kept up.
+    A gate is late when it's finished processing more than deadline seconds, a quarter of a gate by default, after the gate ended. Detectors are started spread over one gate so they don't all poll at once.
+    store is the datalayer storage mode for every detector, none, csv or journal, with files in a temporary directory.
+    """
+
+    import asyncio
+
+    if deadline is None:
+        deadline = gateTime / 4.0
+
+    loop = asyncio.get_running_loop()
+    baseRss = rssBytes()
+
+    # Per-gate lateness in seconds.
+    lateness = []
+
+    with tempfile.TemporaryDirectory(prefix = "geigerLoad") as outDir:
+        ctrs = []
+
+        for i in range(detectors):
+            hw = simHardware.simHardware()
+            hw.setSimProps(background = background, seed = i, gateTime = gateTime, speed = 1.0, blockSize = int(duration / gateTime) + 16)
+
+            stg = None
+
+            if store != "none":
+                stg = datalayer.datalayer(store, mode)
+                stg.setStorageProps({'fileName': os.path.join(outDir, "det%d.%s" %(i, store))})
+
+            ctr = counter.geigerInterface(hwInterface.asyncHwAdapter(hw), mode = mode, quiet = True, stg = stg)
+            ctrs.append((ctr, hw))
+
+        def makeCallback(ctr, hw):
+            """
+            Hand readings to the counter's mode and time how late each gate finishes.
+            """
+
+            def callBack(latestCount):
+                ctr.dispatch(latestCount)
+                lateness.append(time.time() - hw.getGateTimes()[1])
+
+            return callBack
+
+        async def runOne(i, ctr, hw):
+            """
+            Start one detector at its place in the gate.
+            """
+
+            await asyncio.sleep(i * gateTime / detectors)
+            await ctr.arun(makeCallback(ctr, hw))
+
+        # Stop everything after the run, noting our memory and CPU use while it's all still live.
+        usage = {}
+
+        def stopAll():
+            usage['rss'] = rssBytes()
+            usage['cpu'] = time.process_time()
+            usage['wall'] = time.time()
+
+            for ctr, hw in ctrs:
+                ctr.stop()
+
+        startCpu = time.process_time()
+        startWall = time.time()
+
+        loop.call_later(gateTime + duration, stopAll)
+
+        await asyncio.gather(*[runOne(i, ctr, hw) for i, (ctr, hw) in enumerate(ctrs)])
+
+        # Close the data layers so everything's on disk before we measure it.
+        for ctr, hw in ctrs:
+            if ctr.getStorage() is not None:
+                ctr.getStorage().close()
+
+        storedBytes = sum([os.path.getsize(os.path.join(outDir, f)) for f in os.listdir(outDir)])
+
+    seconds = usage['wall'] - startWall
+    late = len([l for l in lateness if l > deadline])
+
+    retVal = {
+        'detectors': detectors,
+        'gates': len(lateness),
+        'late': late,
+        'lateFraction': float(late) / max(len(lateness), 1),
+        'p99Lateness': sorted(lateness)[int(0.99 * (len(lateness) - 1))] if len(lateness) > 0 else None,
+        'cpuCores': (usage['cpu'] - startCpu) / seconds,
+        'bytesPerDetector': float(usage['rss'] - baseRss) / detectors,
+        'storedBytesPerSec': storedBytes / seconds,
+        'storedPointsPerSec': len(lateness) / seconds if store != "none" else 0.0,
+    }
+
+    return retVal
+
+
+def stepProcess(detectors, kwargs):
+    """
+    Run one step on a fresh event loop. This is run in its own process so every step starts from the same memory use.
+    """
+
+    import asyncio
+
+    return asyncio.run(runStep(detectors, **kwargs))
+
+
+def loadTest(start = 100, factor = 2.0, maxDetectors = 100000, maxLate = 0.01, textOut = True, **kwargs):
+    """
+    Ramp the number of simulated detectors from start, multiplying by factor each step, until more than maxLate of the gates in a step are late or we reach maxDetectors. kwargs go to runStep().
+    Each step runs on one event loop, so mostly on one core, in a new process. Returns the results of every step, and the largest number of detectors we kept up with and that step's results.
+    """
+
+    import concurrent.futures
+
+    retVal = {'steps': [], 'maxDetectors': None, 'maxStep': None}
+
+    detectors = start
+
+    while detectors <= maxDetectors:
+        with concurrent.futures.ProcessPoolExecutor(max_workers = 1) as pool:
+            res = pool.submit(stepProcess, detectors, kwargs).result()
+
+        retVal['steps'].append(res)
+
+        if textOut == True:
+            print("%s detectors: %s of %s gates late (%s%%), p99 lateness %s ms, CPU %s cores, %s KB/detector, stored %s points/sec, %s KB/sec." %(detectors, res['late'], res['gates'], round(res['lateFraction'] * 100.0, 2), None if res['p99Lateness'] is None else round(res['p99Lateness'] * 1000.0, 1), round(res['cpuCores'], 3), round(res['bytesPerDetector'] / 1024.0, 1), round(res['storedPointsPerSec']), round(res['storedBytesPerSec'] / 1024.0, 1)))
+
+        if res['lateFraction'] > maxLate:
+            break
+
+        retVal['maxDetectors'] = detectors
+        retVal['maxStep'] = res
+
+        detectors = int(detectors * factor)
+
+    return retVal
+
+
+#######################
+# Main execution body #
+#######################
+
+if __name__ == "__main__":
+    import argparse
+
+    # Set up command line interface.
+    parser = argparse.ArgumentParser(description = "Load test for a geiger counter gateway", epilog = "Runs simulated detectors through geigerInterface on one asyncio event loop on localhost, ramping the number of detectors until gates are late, to find how many a gateway core can keep up with.")
+    parser.add_argument('--start', type = int, default = 100, help = 'Number of detectors in the first step. Defaults to 100.')
+    parser.add_argument('--factor', type = float, default = 2.0, help = 'Multiply the number of detectors by this each step. Defaults to 2.')
+    parser.add_argument('--max', type = int, default = 100000, help = 'Stop ramping at this many detectors.')
+    parser.add_argument('--gate', type = float, default = 1.0, help = 'Gate time in seconds. Defaults to 1.')
+    parser.add_argument('--duration', type = float, default = 10.0, help = 'Seconds to run each step for. Defaults to 10.')
+    parser.add_argument('--mode', choices=['fast', 'slow', 'counter', 'scaler', 'sprt'], default = 'counter', help = 'Counter mode for every detector. Defaults to counter.')
+    parser.add_argument('--store', choices=['none', 'csv', 'journal'], default='none', help = 'Store every detector\'s data in a given format, in a temporary directory.')
+    parser.add_argument('--deadline', type = float, default = None, help = 'Seconds after a gate ends it must be processed by. Defaults to a quarter of a gate.')
+    parser.add_argument('--max-late', type = float, default = 0.01, help = 'Fraction of late gates that counts as not keeping up. Defaults to 0.01.')
+    args = parser.parse_args()
+
+    res = loadTest(start = args.start, factor = args.factor, maxDetectors = args.max, maxLate = args.max_late, gateTime = args.gate, duration = args.duration, mode = args.mode, store = args.store, deadline = args.deadline)
+
+    if res['maxDetectors'] is None:
+        print("Couldn't keep up with %s detectors." %args.start)
+
+    else:
+        print("Kept up with %s detectors on one event loop using %s cores of CPU, %s KB/detector." %(res['maxDetectors'], round(res['maxStep']['cpuCores'], 3), round(res['maxStep']['bytesPerDetector'] / 1024.0, 1)))
@@ -0,0 +1,178 @@
+###############
+### Imports ###
+###############
+
+from hwInterface import counterIface
+
+
+###############################
+### Several counters as one ###
+###############################
+
+class multiHardware(counterIface):
+	def setMultiProps(self, hwPlatforms, names = None):
+		"""
+		Read several counter hardware platforms together, e.g. two Arduinos each with a tube, as channels of one. hwPlatforms is a list of counterIface instances, and names their channel names, 'tube0', 'tube1' and so on by default.
+		The first platform is the main reading and sets the gate times and poll cadence. The others are polled straight after it, so their gates line up as well as the hardware allows.
+		"""
+		
+		if names is None:
+			names = ["tube%s" %i for i in range(len(hwPlatforms))]
+		
+		if len(names) != len(hwPlatforms):
+			raise ValueError("Need a name for each hardware platform.")
+		
+		self.__hwPlatforms = list(hwPlatforms)
+		self.__names = list(names)
+		self.__readings = None
+		
+		return
+	
+	def setDebug(self, debugOn):
+		"""
+		Enable or disable debugging on every platform.
+		"""
+		
+		super(multiHardware, self).setDebug(debugOn)
+		
+		for hwPlatform in self.__hwPlatforms:
+			hwPlatform.setDebug(debugOn)
+		
+		return
+	
+	def setTextOut(self, textOut):
+		"""
+		Turn text output on or off on every platform.
+		"""
+		
+		super(multiHardware, self).setTextOut(textOut)
+		
+		for hwPlatform in self.__hwPlatforms:
+			hwPlatform.setTextOut(textOut)
+		
+		return
+	
+	def setup(self):
+		"""
+		Set up every platform.
+		"""
+		
+		for hwPlatform in self.__hwPlatforms:
+			hwPlatform.setup()
+		
+		return
+	
+	def getConfig(self):
+		"""
+		Get every platform's config.
+		"""
+		
+		return {"desc": "Several counters", "config": dict([(name, hwPlatform.getConfig()) for name, hwPlatform in zip(self.__names, self.__hwPlatforms)])}
+	
+	def start(self):
+		"""
+		Start every platform.
+		"""
+		
+		for hwPlatform in self.__hwPlatforms:
+			hwPlatform.start()
+		
+		return
+	
+	def poll(self):
+		"""
+		Poll every platform, returning the main one's reading.
+		"""
+		
+		self.__readings = [hwPlatform.poll() for hwPlatform in self.__hwPlatforms]
+		
+		return self.__readings[0]
+	
+	def stop(self):
+		"""
+		Stop every platform.
+		"""
+		
+		for hwPlatform in self.__hwPlatforms:
+			hwPlatform.stop()
+		
+		return
+	
+	def cleanup(self):
+		"""
+		Clean up every platform, even if one fails.
+		"""
+		
+		for hwPlatform in self.__hwPlatforms:
+			try:
+				hwPlatform.cleanup()
+			
+			except:
+				if self._debug == True:
+					print("Failed to clean up %s." %hwPlatform)
+		
+		return
+	
+	def getGateTimes(self):
+		"""
+		Get the main platform's gate times.
+		"""
+		
+		return self.__hwPlatforms[0].getGateTimes()
+	
+	def getNextPoll(self):
+		"""
+		Follow the main platform's cadence.
+		"""
+		
+		return self.__hwPlatforms[0].getNextPoll()
+	
+	def getCounterFlags(self):
+		"""
+		Combine every platform's counter flags, since a bad count on any of them spoils comparisons between them.
+		"""
+		
+		retVal = 0
+		
+		for hwPlatform in self.__hwPlatforms:
+			retVal |= hwPlatform.getCounterFlags()
+		
+		return retVal
+	
+	def getChannels(self):
+		"""
+		Get every platform's reading by name, plus any channels of their own as the name, a dash and the channel.
+		"""
+		
+		if self.__readings is None:
+			return None
+		
+		retVal = dict(zip(self.__names, self.__readings))
+		
+		for name, hwPlatform in zip(self.__names, self.__hwPlatforms):
+			channels = hwPlatform.getChannels()
+			
+			if channels is not None:
+				for channel, value in channels.items():
+					retVal["%s-%s" %(name, channel)] = value
+		
+		return retVal
+	
+	def getEvents(self):
+		"""
+		Get the pulse times of every platform that has them, named as in getChannels(), or None if none do.
+		"""
+		
+		retVal = {}
+		
+		for name, hwPlatform in zip(self.__names, self.__hwPlatforms):
+			events = hwPlatform.getEvents()
+			
+			if events is not None:
+				for channel, pulses in events.items():
+					retVal[name if channel == 'counter' else "%s-%s" %(name, channel)] = pulses
+		
+		if len(retVal) == 0:
+			return None
+		
+		return retVal
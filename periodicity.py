@@ -0,0 +1,386 @@
+###############
+### Imports ###
+###############
+
+import math
+import health
+import pipeline
+
+
+######################
+### Loading series ###
+######################
+
+def loadSeries(fileName):
+    """
+    Load a series stored by datalayer in CSV, lines of "YYYY-MM-DD HH:MM:SS", value[, flags], as NumPy arrays of UNIX timestamps and values.
+    The fixed-width timestamps and plain decimal values are parsed a column at a time, so months of 1 Hz data load in seconds. Anything else in the value column is parsed line by line.
+    """
+
+    import numpy as np
+
+    with open(fileName, 'rb') as csvFile:
+        buf = np.frombuffer(csvFile.read(), dtype = np.uint8)
+
+    # Line boundaries, ignoring a missing newline at the end and blank lines.
+    ends = np.flatnonzero(buf == ord('\n'))
+
+    if (len(buf) > 0) and (buf[-1] != ord('\n')):
+        ends = np.append(ends, len(buf))
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    keep = (ends - starts) > 23
+    starts = starts[keep]
+    ends = ends[keep]
+
+    # Timestamp digits sit at fixed offsets after the opening quote. Work a column at a time so we never hold more than a few arrays the length of the series.
+    def field(offset, width):
+        retVal = np.zeros(len(starts), dtype = np.int64)
+
+        for k in range(width):
+            retVal = (retVal * 10) + (buf[starts + (offset + k)] - ord('0'))
+
+        return retVal
+
+    months = ((field(1, 4) - 1970) * 12) + (field(6, 2) - 1)
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + (field(9, 2) - 1)
+    ts = (days * 86400) + (field(12, 2) * 3600) + (field(15, 2) * 60) + field(18, 2)
+
+    # The value runs from after '", ' to the next comma or the end of the line.
+    valStarts = starts + 23
+    commas = np.flatnonzero(buf == ord(','))
+    valEnds = np.minimum(np.append(commas, len(buf))[np.searchsorted(commas, valStarts)], ends)
+
+    # Drop a carriage return or trailing spaces.
+    while True:
+        last = buf[np.maximum(valEnds - 1, 0)]
+        trim = (valEnds > valStarts) & ((last == ord('\r')) | (last == ord(' ')))
+
+        if not trim.any():
+            break
+
+        valEnds = valEnds - trim
+
+    lengths = valEnds - valStarts
+
+    # Plain decimals, digits with at most one point, as an integer and the number of digits after the point.
+    mantissa = np.zeros(len(starts), dtype = np.int64)
+    decimals = np.zeros(len(starts), dtype = np.int64)
+    seenDot = np.zeros(len(starts), dtype = bool)
+    plain = (lengths > 0) & (lengths <= 18)
+
+    for k in range(int(lengths.max()) if len(lengths) > 0 else 0):
+        inField = (k < lengths)
+        c = buf[np.minimum(valStarts + k, len(buf) - 1)]
+
+        isDigit = inField & (c >= ord('0')) & (c <= ord('9'))
+        isDot = inField & (c == ord('.'))
+
+        plain &= ~(inField & ~isDigit & ~isDot) & ~(isDot & seenDot)
+
+        mantissa = np.where(isDigit, (mantissa * 10) + (c.astype(np.int64) - ord('0')), mantissa)
+        decimals += (isDigit & seenDot)
+        seenDot |= isDot
+
+    values = mantissa / (10.0 ** decimals)
+
+    # Anything unusual, e.g. exponents or signs, the slow way.
+    for i in np.flatnonzero(~plain):
+        values[i] = float(buf[valStarts[i]:valEnds[i]].tobytes())
+
+    return (ts.astype(np.float64), values)
+
+
+def regularize(ts, values, gateTime = None):
+    """
+    Put a series on a regular grid of gateTime seconds, the most common spacing by default, for spectral analysis. Gaps are filled with the mean so they add no periodic content.
+    Returns the gridded values, the gate time and the fraction of the grid that had data.
+    """
+
+    import numpy as np
+
+    if gateTime is None:
+        spacing = np.diff(ts)
+        spacing = spacing[spacing > 0]
+        gateTime = float(np.median(spacing)) if len(spacing) > 0 else 1.0
+
+    idx = np.round((ts - ts[0]) / gateTime).astype(np.int64)
+    grid = np.full(int(idx[-1]) + 1, values.mean())
+    grid[idx] = values
+
+    # Grid points with data.
+    seen = np.zeros(len(grid), dtype = bool)
+    seen[idx] = True
+
+    return (grid, gateTime, seen.mean())
+
+
+################
+### Spectra ###
+################
+
+def welch(values, gateTime = 1.0, segment = 16384, overlap = 0.5):
+    """
+    Welch power spectral density of a regular series: the mean of Hann-windowed periodograms of overlapping segments. Returns frequencies in Hz, the density and the number of segments averaged.
+    All the segments are transformed in one call, so this takes seconds for months of 1 Hz data.
+    """
+
+    import numpy as np
+
+    segment = min(segment, len(values))
+    step = max(1, int(segment * (1.0 - overlap)))
+    nSeg = 1 + ((len(values) - segment) // step)
+
+    window = np.hanning(segment)
+    scale = 1.0 / (gateTime ** -1 * (window * window).sum())
+
+    # One row per segment, without copying the series.
+    segs = np.lib.stride_tricks.as_strided(values, shape = (nSeg, segment), strides = (values.strides[0] * step, values.strides[0]), writeable = False)
+
+    psd = np.zeros((segment // 2) + 1)
+
+    # Transform a batch of segments at a time to bound memory.
+    for first in range(0, nSeg, 256):
+        batch = segs[first:(first + 256)]
+        batch = (batch - batch.mean(axis = 1)[:, None]) * window
+        psd += (np.abs(np.fft.rfft(batch, axis = 1)) ** 2).sum(axis = 0)
+
+    psd *= scale / nSeg
+
+    # One-sided.
+    psd[1:-1] *= 2.0
+
+    return (np.fft.rfftfreq(segment, gateTime), psd, nSeg)
+
+
+def findPeaks(freqs, psd, nSeg, zLimit = 6.0, top = 10):
+    """
+    Find spectral peaks standing out from the noise floor. For counts without periodic content the Welch density is flat, and each bin is chi-square with 2 * nSeg degrees of freedom around the floor, which we take from the median.
+    Returns up to top peaks as dictionaries of period in seconds, frequency, power relative to the floor and z score, strongest first.
+    """
+
+    import numpy as np
+
+    dof = 2 * nSeg
+
+    # Median of chi-square over its degrees of freedom, by Wilson-Hilferty.
+    floor = np.median(psd[1:]) / ((1.0 - (2.0 / (9.0 * dof))) ** 3)
+    ratio = psd / floor
+
+    retVal = []
+
+    # Local maxima above the limit, skipping DC.
+    for i in range(1, len(psd) - 1):
+        if (psd[i] >= psd[i - 1]) and (psd[i] >= psd[i + 1]):
+            z = health.chi2Z(ratio[i] * dof, dof)
+
+            if z >= zLimit:
+                # Fit a parabola to the log power around the peak to place it between bins.
+                a, b, c = np.log(psd[(i - 1):(i + 2)])
+                shift = 0.5 * (a - c) / (a - (2.0 * b) + c) if (a - (2.0 * b) + c) < 0.0 else 0.0
+                freq = freqs[i] + (shift * (freqs[1] - freqs[0]))
+
+                retVal.append({'period': 1.0 / freq, 'freq': freq, 'ratio': ratio[i], 'z': z})
+
+    retVal.sort(key = lambda peak: peak['z'], reverse = True)
+
+    return retVal[:top]
+
+
+################
+### Goertzel ###
+################
+
+class goertzel(object):
+    def __init__(self, period, blockSize = None, threshold = 9.2, minBlock = 1800):
+        """
+        Incremental Goertzel detector for one period, in gates. Each sample costs a few multiplications. At the end of every block of blockSize gates it compares the power at that period with the power white counting noise would give.
+        The block is a whole number of periods, by default at least 4 and at least minBlock gates, so a constant background adds nothing. Longer blocks find weaker components but take longer to notice them. The power ratio is exponentially distributed for noise, so the default threshold of 9.2 is a 1 in 10,000 false alarm chance per block.
+        """
+
+        if blockSize is None:
+            blockSize = int(period * max(4, math.ceil(float(minBlock) / period)))
+
+        self.period = period
+        self.blockSize = blockSize
+        self.threshold = threshold
+
+        # Use the nearest bin so the block holds whole cycles.
+        self.__bin = max(1, int(round(blockSize / float(period))))
+        self.__coeff = 2.0 * math.cos(2.0 * math.pi * self.__bin / blockSize)
+
+        # Goertzel state and block sums for the noise estimate.
+        self.__s1 = 0.0
+        self.__s2 = 0.0
+        self.__n = 0
+        self.__sum = 0.0
+        self.__sumSq = 0.0
+
+        # Last block's power ratio, and whether it was significant.
+        self.ratio = None
+        self.significant = False
+
+    def add(self, x):
+        """
+        Add a sample. Returns True if this finished a block.
+        """
+
+        s0 = x + (self.__coeff * self.__s1) - self.__s2
+        self.__s2 = self.__s1
+        self.__s1 = s0
+
+        self.__n += 1
+        self.__sum += x
+        self.__sumSq += x * x
+
+        if self.__n < self.blockSize:
+            return False
+
+        power = (self.__s1 * self.__s1) + (self.__s2 * self.__s2) - (self.__coeff * self.__s1 * self.__s2)
+        variance = (self.__sumSq - (self.__sum * self.__sum / self.__n)) / (self.__n - 1)
+
+        # Noise gives N * variance / 2 on average for each of the real and imaginary parts.
+        if variance > 0.0:
+            self.ratio = power / (self.__n * variance)
+        else:
+            self.ratio = 0.0
+
+        self.significant = (self.ratio >= self.threshold)
+
+        self.__s1 = 0.0
+        self.__s2 = 0.0
+        self.__n = 0
+        self.__sum = 0.0
+        self.__sumSq = 0.0
+
+        return True
+
+    def getState(self):
+        """
+        Get our state for a checkpoint.
+        """
+
+        return {'s1': self.__s1, 's2': self.__s2, 'n': self.__n, 'sum': self.__sum, 'sumSq': self.__sumSq, 'ratio': self.ratio, 'significant': self.significant}
+
+    def setState(self, state):
+        """
+        Restore state from getState().
+        """
+
+        self.__s1 = state['s1']
+        self.__s2 = state['s2']
+        self.__n = state['n']
+        self.__sum = state['sum']
+        self.__sumSq = state['sumSq']
+        self.ratio = state['ratio']
+        self.significant = state['significant']
+
+        return
+
+
+class periodicStage(pipeline.pipelineStage):
+    def __init__(self, periods = (10, 60, 300, 900), name = "periodic", threshold = 9.2, minBlock = 1800, textOut = True):
+        """
+        Watch for periodic interference at each of periods, in gates, with a Goertzel detector, and set the periodic flag while any of them finds a significant component in its last block. threshold and minBlock are as for goertzel.
+        """
+
+        super(periodicStage, self).__init__(name)
+
+        self.__detectors = [goertzel(period, threshold = threshold, minBlock = minBlock) for period in periods]
+        self.__textOut = textOut
+
+        # Strongest ratio seen at each period.
+        self.__maxRatio = dict([(period, None) for period in periods])
+
+    def process(self, smpl):
+        """
+        Feed the gate to every detector.
+        """
+
+        changed = False
+
+        for det in self.__detectors:
+            if det.add(smpl['counts']) == True:
+                changed = True
+
+                if (self.__maxRatio[det.period] is None) or (det.ratio > self.__maxRatio[det.period]):
+                    self.__maxRatio[det.period] = det.ratio
+
+        found = [det.period for det in self.__detectors if det.significant == True]
+
+        if changed == True:
+            oldFlags = self.flags
+
+            if len(found) > 0:
+                self.flags = pipeline.setFlag(self.flags, pipeline.f_periodic, pipeline.f_periodic)
+            else:
+                self.flags = pipeline.setFlag(self.flags, pipeline.f_periodic, 0)
+
+            if (self.__textOut == True) and (oldFlags != self.flags):
+                if len(found) > 0:
+                    print("[%s] Periodic component at %s gates." %(self.name, ', '.join([str(period) for period in found])))
+                else:
+                    print("[%s] Periodic component gone." %self.name)
+
+        smpl[self.name] = {'periodic': found, 'ratios': dict([(det.period, det.ratio) for det in self.__detectors]), 'flags': self.flags}
+
+        return
+
+    def getState(self):
+        """
+        Save the detectors and flags.
+        """
+
+        return {'detectors': [det.getState() for det in self.__detectors], 'flags': self.flags}
+
+    def setState(self, state):
+        """
+        Restore the detectors and flags.
+        """
+
+        for det, detState in zip(self.__detectors, state['detectors']):
+            det.setState(detState)
+
+        self.flags = state['flags']
+
+        return
+
+    def finish(self, summary):
+        """
+        Report the strongest component seen at each period.
+        """
+
+        summary[self.name] = {'maxRatio': dict(self.__maxRatio)}
+
+        if self.__textOut == True:
+            print("[%s] Strongest power ratio by period: %s" %(self.name, ', '.join(["%s: %s" %(period, None if ratio is None else round(ratio, 2)) for period, ratio in sorted(self.__maxRatio.items())])))
+
+        return
+
+
+#######################
+# Main execution body #
+#######################
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    # Set up command line interface.
+    parser = argparse.ArgumentParser(description = "Look for periodic interference in a stored count series.", epilog = "Reads a CSV file written with --store csv, computes a Welch spectrum and lists the peaks that stand out from counting noise.")
+    parser.add_argument('file', help = 'CSV file to analyse.')
+    parser.add_argument('--segment', type = int, default = 16384, help = 'Welch segment length in gates. Longer segments resolve longer periods more finely. Defaults to 16384.')
+    parser.add_argument('--z', type = float, default = 6.0, help = 'Z score a peak needs to be listed. Defaults to 6.')
+    parser.add_argument('--top', type = int, default = 10, help = 'Most peaks to list. Defaults to 10.')
+    args = parser.parse_args()
+
+    startTime = time.time()
+
+    ts, values = loadSeries(args.file)
+    grid, gateTime, coverage = regularize(ts, values)
+    freqs, psd, nSeg = welch(grid, gateTime = gateTime, segment = args.segment)
+
+    print("%s samples, %s sec. gates, %s%% coverage, %s segments, %s sec." %(len(values), round(gateTime, 3), round(coverage * 100.0, 2), nSeg, round(time.time() - startTime, 3)))
+
+    for peak in findPeaks(freqs, psd, nSeg, zLimit = args.z, top = args.top):
+        print("Period %s sec. (%s Hz): %s times the noise floor, z %s" %(round(peak['period'], 2), round(peak['freq'], 6), round(peak['ratio'], 2), round(peak['z'], 1)))
@@ -0,0 +1,1174 @@
+###############
+### Imports ###
+###############
+
+import datetime
+import math
+import time
+import traceback
+
+
+#############
+### Flags ###
+#############
+
+# Flag layout shared by geigerInterface and every pipeline stage.
+f_accum          = 0x03   # Bit position of accumulator flags.
+f_accum_unk      = 0x00   # This flag means we don't have any accumulator info.
+f_accum_accum    = 0x01   # This flag means we're still accumulating data.
+f_accum_complete = 0x02   # This flag means we have a full sample to average from.
+
+f_trend          = 0x1c     # Bit position of the trend flag.
+f_trend_unk      = 0x00     # Unknown trend.
+f_trend_up       = 0x04     # Readings increasing.
+f_trend_dn       = 0x08     # Readings decreasing.
+f_trend_stable   = 0x10     # Readings stable
+
+f_mode           = 0xe0     # Bit position of the mode flag. This is large because we want to support more modes in the future.
+f_mode_fast      = 0x00     # Fast averaging mode.
+f_mode_slow      = 0x20     # Slow averaging mode.
+f_mode_counter   = 0x40     # Counter mode.
+f_mode_scaler    = 0x80     # Scaler mode.
+f_mode_sprt      = 0x60     # Sequential probability ratio test search mode.
+
+f_alarm          = 0x100    # Set while any alarm rule is raised.
+
+f_health         = 0x600    # Bit position of the detector health flag.
+f_health_unk     = 0x000    # Health not tested yet.
+f_health_ok      = 0x200    # Counts look Poisson.
+f_health_bursty  = 0x400    # Counts more spread out than Poisson, e.g. bursts or noise.
+f_health_stuck   = 0x600    # Counts less spread out than Poisson, e.g. a stuck counter.
+
+f_counter          = 0x1800 # Bit position of the hardware counter flags. Both can be set.
+f_counter_wrap     = 0x0800 # The hardware counter wrapped during this gate. The count is still good.
+f_counter_overflow = 0x1000 # The hardware counter overflowed or reset, so the count for this gate can't be trusted.
+
+f_periodic       = 0x2000   # Set while the counts have a significant periodic component, e.g. interference.
+
+f_anomaly        = 0x4000   # Set while readings are anomalous against the learned time-of-day baseline.
+
+f_saturated      = 0x8000   # Set while the count rate is too high to correct for dead time, so the dose rate is a lower bound.
+
+
+def setFlag(flags, whichFlag, whichValue):
+    """
+    Return flags with the field whichFlag set to whichValue.
+    """
+
+    return ((~whichFlag) & flags) | whichValue
+
+
+def parseFlags(flags):
+    """
+    Parse flags to a short string.
+    """
+
+    # Store flags as we parse them.
+    allFlags = []
+
+    # Get the accumulator flag.
+    accFlag = flags & f_accum
+    trendFlag = flags & f_trend
+    modeFlag = flags & f_mode
+
+    # Complete set of readings?
+    if accFlag == f_accum_complete:
+        # Completed loading values into the accumulator.
+        allFlags.append('C')
+    elif accFlag == f_accum_accum:
+        # Still accumulating.
+        allFlags.append('A')
+    elif accFlag == f_accum_unk:
+        # Unknown.
+        allFlags.append('?')
+    else:
+        # Bad value.
+        allFlags.append('!')
+
+    # Trend?
+    if (trendFlag) == f_trend_stable:
+        # Readings stable.
+        allFlags.append('S')
+    elif (trendFlag) == f_trend_up:
+        # Readings increasing.
+        allFlags.append('U')
+    elif (trendFlag) == f_trend_dn:
+        # Readings decreasing.
+        allFlags.append('D')
+    elif (trendFlag) == f_trend_unk:
+        # Unknown.
+        allFlags.append('?')
+    else:
+        # Bad value.
+        allFlags.append('!')
+
+    # Mode?
+    if modeFlag == f_mode_fast:
+        # Fast
+        allFlags.append('F')
+    elif modeFlag == f_mode_slow:
+        # Slow
+        allFlags.append('S')
+    elif modeFlag == f_mode_counter:
+        # Stream
+        allFlags.append('C')
+    elif modeFlag == f_mode_scaler:
+        # Roll
+        allFlags.append('L')
+    elif modeFlag == f_mode_sprt:
+        # Sequential test
+        allFlags.append('Q')
+    else:
+        # Bad value.
+        allFlags.append('!')
+
+    # Alarm? Only shown when raised so the usual three-letter string doesn't change.
+    if (flags & f_alarm) == f_alarm:
+        allFlags.append('X')
+
+    # Unhealthy detector? Likewise only shown when there's a problem.
+    if (flags & f_health) == f_health_bursty:
+        allFlags.append('B')
+    elif (flags & f_health) == f_health_stuck:
+        allFlags.append('K')
+
+    # Count we can't trust?
+    if (flags & f_counter_overflow) == f_counter_overflow:
+        allFlags.append('O')
+
+    # Periodic interference?
+    if (flags & f_periodic) == f_periodic:
+        allFlags.append('P')
+
+    # Anomalous for the time of day?
+    if (flags & f_anomaly) == f_anomaly:
+        allFlags.append('N')
+
+    # Too fast for the dead time correction?
+    if (flags & f_saturated) == f_saturated:
+        allFlags.append('T')
+
+    # Build a nice string.
+    return ''.join(allFlags)
+
+
+##############
+### Blocks ###
+##############
+
+def makeBlock(counts, ends, gateLens, counterFlags = 0):
+    """
+    Build a block of gates from a hardware platform's pollBlock() result: counts, gate end UNIX timestamps and gate lengths in seconds. A block is the batch version of a sample dictionary. 'counts', 'ts' and 'gateLen' are NumPy arrays with 'n' gates in them, 'counterFlags' and 'mono' cover the whole block, and each stage puts its results in the block under its name with one value per gate for each field.
+    """
+
+    import numpy
+
+    counts = numpy.asarray(counts, dtype = numpy.int64)
+
+    return {'n': len(counts), 'counts': counts, 'ts': numpy.asarray(ends, dtype = numpy.float64), 'gateLen': numpy.asarray(gateLens, dtype = numpy.float64), 'counterFlags': counterFlags, 'mono': time.monotonic()}
+
+
+def blockValue(value, i, n):
+    """
+    Get gate i's value of a block field, or the field itself if it covers the whole block.
+    """
+
+    if (hasattr(value, '__len__')) and (not isinstance(value, (str, dict))) and (len(value) == n):
+        value = value[i]
+
+        # Plain Python values, so stages see the same types as without blocks.
+        if hasattr(value, 'item'):
+            value = value.item()
+
+    return value
+
+
+def blockRow(blk, i):
+    """
+    Get gate i of a block as a sample dictionary, with the results of the stages that have seen the block, for stages that handle one sample at a time.
+    """
+
+    n = blk['n']
+    smpl = {'dts': datetime.datetime.utcfromtimestamp(blk['ts'][i])}
+
+    for key, value in blk.items():
+        if key == 'ts':
+            continue
+
+        if isinstance(value, dict):
+            smpl[key] = dict([(field, blockValue(fieldValue, i, n)) for field, fieldValue in value.items()])
+        else:
+            smpl[key] = blockValue(value, i, n)
+
+    return smpl
+
+
+def blockResults(rows):
+    """
+    Turn a stage's per-sample result dictionaries, None where it had no result, into one result dictionary for the block: a NumPy array for each numeric field, otherwise a list.
+    """
+
+    import numpy
+
+    fields = []
+
+    for row in rows:
+        if row is not None:
+            fields = list(row.keys())
+            break
+
+    retVal = {}
+
+    for field in fields:
+        values = [row.get(field) if row is not None else None for row in rows]
+
+        if all([isinstance(value, (bool, int, float)) for value in values]):
+            retVal[field] = numpy.asarray(values)
+        else:
+            retVal[field] = values
+
+    return retVal
+
+
+##############
+### Stages ###
+##############
+
+class pipelineStage(object):
+    def __init__(self, name):
+        """
+        Template class for a pipeline stage. Each stage gets every sample in order, keeps its own flags, and puts its results in the sample under its name. Override the methods the stage needs.
+        """
+
+        # Stage name, used as the key for our results in each sample.
+        self.name = name
+
+        # This stage's flags.
+        self.flags = f_accum_unk | f_trend_unk
+
+    def process(self, smpl):
+        """
+        Handle one sample. smpl is a dictionary with at least 'dts' and 'counts', plus the results of earlier stages.
+        """
+
+        return
+
+    def processBlock(self, blk):
+        """
+        Handle a block of gates from makeBlock(). By default each gate goes through process() in turn, so every stage works with blocks. Stages that can work on whole arrays override this.
+        """
+
+        rows = []
+
+        for i in range(blk['n']):
+            smpl = blockRow(blk, i)
+            self.process(smpl)
+            rows.append(smpl.get(self.name))
+
+        if any([row is not None for row in rows]):
+            blk[self.name] = blockResults(rows)
+
+        return
+
+    def finish(self, summary):
+        """
+        Called once when the run ends. summary is a dictionary shared by all stages, and each stage may add its final results under its name.
+        """
+
+        return
+
+    def getState(self):
+        """
+        Get the stage's state for a checkpoint as a JSON-serialisable value, or None if the stage has nothing worth saving.
+        """
+
+        return None
+
+    def setState(self, state):
+        """
+        Restore state returned by getState().
+        """
+
+        return
+
+
+class counterStage(pipelineStage):
+    def __init__(self, name = "counter"):
+        """
+        Counter stage. Passes each gate's counts through without averaging.
+        """
+
+        super(counterStage, self).__init__(name)
+
+        # Set our mode.
+        self.flags = setFlag(self.flags, f_mode, f_mode_counter)
+
+    def process(self, smpl):
+        """
+        Report the raw counts for this gate, as a rate per second of gate time.
+        """
+
+        cps = float(smpl['counts']) / smpl.get('gateLen', 1.0)
+
+        # Pass on the hardware's opinion of the count.
+        self.flags = setFlag(self.flags, f_counter, smpl.get('counterFlags', 0))
+
+        smpl[self.name] = {'cps': cps, 'cpm': cps * 60.0, 'avg': False, 'n': 1, 'flags': self.flags}
+
+        return
+
+    def processBlock(self, blk):
+        """
+        Report the raw counts for a block of gates, as rates per second of gate time.
+        """
+
+        import numpy
+
+        n = blk['n']
+        cps = blk['counts'] / blk['gateLen']
+
+        self.flags = setFlag(self.flags, f_counter, blk['counterFlags'])
+
+        blk[self.name] = {'cps': cps, 'cpm': cps * 60.0, 'avg': numpy.zeros(n, dtype = bool), 'n': numpy.ones(n, dtype = numpy.int64), 'flags': numpy.full(n, self.flags)}
+
+        return
+
+
+class valueStage(pipelineStage):
+    def __init__(self, name = "value"):
+        """
+        Value stage. Passes each reading through as it is, for channels that aren't counts, e.g. a high voltage supply or temperature reading.
+        """
+
+        super(valueStage, self).__init__(name)
+
+    def process(self, smpl):
+        """
+        Report the reading.
+        """
+
+        smpl[self.name] = {'value': smpl['counts'], 'flags': self.flags}
+
+        return
+
+
+class averagerStage(pipelineStage):
+    def __init__(self, name, window, modeFlag):
+        """
+        Buffered averaging stage holding up to window samples. This is what fast and slow mode do. modeFlag is the f_mode value we report.
+        """
+
+        super(averagerStage, self).__init__(name)
+
+        # Number of samples to average and the samples themselves, newest first, with their gate lengths.
+        self.__window = window
+        self.__samples = []
+        self.__gateLens = []
+
+        # Set our mode.
+        self.flags = setFlag(self.flags, f_mode, modeFlag)
+
+    def process(self, smpl):
+        """
+        Add the sample to the buffer and report the buffer's count rate, its counts over the time its gates cover, like processBlock().
+        """
+
+        # Make sure we have no more than the specified number of samples.
+        del self.__samples[(self.__window - 1):]
+        del self.__gateLens[(self.__window - 1):]
+
+        # Prepend this reading.
+        self.__samples[:0] = [smpl['counts']]
+        self.__gateLens[:0] = [smpl.get('gateLen', 1.0)]
+
+        # Get the number of samples.
+        curCount = len(self.__samples)
+
+        # Get our averages.
+        avgCt = float(sum(self.__samples)) / float(sum(self.__gateLens))
+
+        # Do we have a full buffer?
+        if curCount == self.__window:
+            self.flags = setFlag(self.flags, f_accum, f_accum_complete)
+
+        else:
+            self.flags = setFlag(self.flags, f_accum, f_accum_accum)
+
+        smpl[self.name] = {'cps': avgCt, 'cpm': avgCt * 60.0, 'avg': True, 'n': curCount, 'flags': self.flags}
+
+        return
+
+    def processBlock(self, blk):
+        """
+        Report the buffer's count rate after each gate of a block, from running sums of counts and gate lengths over the buffer and the block.
+        """
+
+        import numpy
+
+        n = blk['n']
+
+        # Buffer, oldest first, then the new gates.
+        allCounts = numpy.concatenate((numpy.asarray(self.__samples[::-1], dtype = numpy.int64), blk['counts']))
+        allGateLens = numpy.concatenate((numpy.asarray(self.__gateLens[::-1], dtype = numpy.float64), blk['gateLen']))
+        sums = numpy.concatenate(([0], numpy.cumsum(allCounts)))
+        times = numpy.concatenate(([0.0], numpy.cumsum(allGateLens)))
+
+        # Each gate averages over up to window samples ending with it.
+        end = len(self.__samples) + numpy.arange(1, n + 1)
+        curCount = numpy.minimum(self.__window, end)
+        avgCt = (sums[end] - sums[end - curCount]) / (times[end] - times[end - curCount])
+
+        flags = numpy.where(curCount == self.__window, setFlag(self.flags, f_accum, f_accum_complete), setFlag(self.flags, f_accum, f_accum_accum))
+
+        # Keep the newest window samples, newest first.
+        self.__samples = allCounts[::-1][:self.__window].tolist()
+        self.__gateLens = allGateLens[::-1][:self.__window].tolist()
+
+        if n > 0:
+            self.flags = int(flags[-1])
+
+        blk[self.name] = {'cps': avgCt, 'cpm': avgCt * 60.0, 'avg': numpy.ones(n, dtype = bool), 'n': curCount, 'flags': flags}
+
+        return
+
+    def getState(self):
+        """
+        Save the averaging buffer and flags.
+        """
+
+        return {'samples': self.__samples, 'gateLens': self.__gateLens, 'flags': self.flags}
+
+    def setState(self, state):
+        """
+        Restore the averaging buffer and flags. States saved before gate lengths were kept get one second gates.
+        """
+
+        self.__samples = list(state['samples'])[:self.__window]
+        self.__gateLens = list(state.get('gateLens', [1.0] * len(self.__samples)))[:self.__window]
+        self.flags = state['flags']
+
+        return
+
+
+class scalerStage(pipelineStage):
+    def __init__(self, name = "scaler", textOut = True, cpsOn = False):
+        """
+        Scaler stage. Keeps adding counts for the whole run and reports the total and average at the end. The average is the total counts over the total time the gates cover.
+        """
+
+        super(scalerStage, self).__init__(name)
+
+        # Running totals of counts, gates and gate time.
+        self.__accumCts = 0
+        self.__runtime = 0
+        self.__liveTime = 0.0
+
+        # Output settings for the final report.
+        self.__textOut = textOut
+        self.__cpsOn = cpsOn
+
+        # Set our mode.
+        self.flags = setFlag(self.flags, f_mode, f_mode_scaler)
+
+    def process(self, smpl):
+        """
+        Accumulate this gate's counts.
+        """
+
+        # Accumulate new sample data.
+        self.__accumCts += smpl['counts']
+
+        # Increment runtime counters.
+        self.__runtime += 1
+        self.__liveTime += smpl.get('gateLen', 1.0)
+
+        # Average so far.
+        avgCts = float(self.__accumCts) / self.__liveTime
+
+        smpl[self.name] = {'cps': avgCts, 'cpm': avgCts * 60.0, 'avg': True, 'n': self.__runtime, 'total': self.__accumCts, 'flags': self.flags}
+
+        return
+
+    def processBlock(self, blk):
+        """
+        Accumulate a block of gates, reporting the running totals and average after each one.
+        """
+
+        import numpy
+
+        n = blk['n']
+
+        if n == 0:
+            return
+
+        totals = self.__accumCts + numpy.cumsum(blk['counts'])
+        runtimes = self.__runtime + numpy.arange(1, n + 1)
+        liveTimes = self.__liveTime + numpy.cumsum(blk['gateLen'])
+        avgCts = totals / liveTimes
+
+        self.__accumCts = int(totals[-1])
+        self.__runtime = int(runtimes[-1])
+        self.__liveTime = float(liveTimes[-1])
+
+        blk[self.name] = {'cps': avgCts, 'cpm': avgCts * 60.0, 'avg': numpy.ones(n, dtype = bool), 'n': runtimes, 'total': totals, 'flags': numpy.full(n, self.flags)}
+
+        return
+
+    def getState(self):
+        """
+        Save the running totals.
+        """
+
+        return {'accumCts': self.__accumCts, 'runtime': self.__runtime, 'liveTime': self.__liveTime}
+
+    def setState(self, state):
+        """
+        Restore the running totals. States saved before gate time was kept get one second gates.
+        """
+
+        self.__accumCts = state['accumCts']
+        self.__runtime = state['runtime']
+        self.__liveTime = state.get('liveTime', float(state['runtime']))
+
+        return
+
+    def finish(self, summary):
+        """
+        Report the total counts and average over the run.
+        """
+
+        # Make sure we don't divide by zero.
+        if self.__liveTime > 0:
+            # Average counts over our run time...
+            avgCts = float(self.__accumCts) / self.__liveTime
+
+            # CPS -> CPM.
+            finalCpm = avgCts * 60.0
+
+            summary[self.name] = {'dts': datetime.datetime.utcnow(), 'cps': avgCts, 'cpm': finalCpm, 'total': self.__accumCts, 'n': self.__runtime, 'liveTime': self.__liveTime}
+
+            if self.__textOut == True:
+                print("[%s] Total counts %s in %s sec." %(self.name, self.__accumCts, round(self.__liveTime, 3)))
+                print("[%s] Avg CPM over %s sec: %s" %(self.name, round(self.__liveTime, 3), round(finalCpm, 3)))
+
+                # If we want stats in counts per second as well...
+                if self.__cpsOn == True:
+                    print("[%s] Avg CPS over %s sec: %s" %(self.name, round(self.__liveTime, 3), round(avgCts, 3)))
+
+        return
+
+
+class trendStage(pipelineStage):
+    def __init__(self, source, name = "trend", lag = 4, sigmas = 2.0):
+        """
+        Trend stage. Compares the average from the source stage against its value lag samples ago and flags the readings as rising, falling or stable. A change smaller than sigmas standard deviations of the Poisson counting error is stable.
+        """
+
+        super(trendStage, self).__init__(name)
+
+        self.__source = source
+        self.__lag = lag
+        self.__sigmas = sigmas
+
+        # Previous averages, oldest first.
+        self.__history = []
+
+    def process(self, smpl):
+        """
+        Set the trend flag from the source stage's average.
+        """
+
+        srcRes = smpl[self.__source]
+
+        # We report the trend of the source's mode.
+        self.flags = setFlag(self.flags, f_mode, srcRes['flags'] & f_mode)
+
+        # Keep lag + 1 averages around.
+        self.__history.append(srcRes['cps'])
+        del self.__history[:-(self.__lag + 1)]
+
+        if len(self.__history) <= self.__lag:
+            # Not enough history yet.
+            self.flags = setFlag(self.flags, f_trend, f_trend_unk)
+
+        else:
+            # Counting error of the difference between two averages of n gates each.
+            diff = self.__history[-1] - self.__history[0]
+            sigma = math.sqrt(max(self.__history[-1] + self.__history[0], 1.0) / float(max(srcRes['n'], 1)))
+
+            if diff > (self.__sigmas * sigma):
+                self.flags = setFlag(self.flags, f_trend, f_trend_up)
+
+            elif diff < -(self.__sigmas * sigma):
+                self.flags = setFlag(self.flags, f_trend, f_trend_dn)
+
+            else:
+                self.flags = setFlag(self.flags, f_trend, f_trend_stable)
+
+        smpl[self.name] = {'source': self.__source, 'flags': self.flags}
+
+        return
+
+    def getState(self):
+        """
+        Save the average history and flags.
+        """
+
+        return {'history': self.__history, 'flags': self.flags}
+
+    def setState(self, state):
+        """
+        Restore the average history and flags.
+        """
+
+        self.__history = list(state['history'])
+        self.flags = state['flags']
+
+        return
+
+
+class sprtStage(pipelineStage):
+    def __init__(self, name = "sprt", alpha = 0.001, beta = 0.01, elevation = 1.5, learn = 22, bgWeight = 300, textOut = True):
+        """
+        Sequential probability ratio test for fast source search. Each gate's counts are tested against the counts the learned background rate b would give over the gate's length, with the alternative an elevated rate of elevation * b.
+        The log-likelihood ratio is summed gate by gate and we flag readings as elevated once it passes ln((1 - beta) / alpha), where alpha is the false alarm rate and beta the miss rate. We go back to background once it drops below ln(beta / (1 - alpha)).
+        The background is learned over the first learn gates and after that tracked with an exponential average over about bgWeight background gates. Time to detect is the length of the gates from the one the evidence started building in to the one it crossed the threshold in.
+        """
+
+        super(sprtStage, self).__init__(name)
+
+        # Decision thresholds.
+        self.__upper = math.log((1.0 - beta) / alpha)
+        self.__lower = math.log(beta / (1.0 - alpha))
+        self.__elevation = elevation
+
+        # Background learning.
+        self.__learn = learn
+        self.__bgWeight = float(bgWeight)
+        self.__bgSum = 0
+        self.__bgTime = 0.0
+        self.__gates = 0
+        self.__background = None
+
+        # Test state. The evidence time is how long the evidence has been building, or None if it isn't.
+        self.__llr = 0.0
+        self.__elevated = False
+        self.__evidenceTime = None
+
+        # Time to detect stats.
+        self.__detections = []
+        self.__textOut = textOut
+
+        # Set our mode.
+        self.flags = setFlag(self.flags, f_mode, f_mode_sprt)
+
+    def process(self, smpl):
+        """
+        Update the test with this gate's counts.
+        """
+
+        counts = smpl['counts']
+        gateLen = smpl.get('gateLen', 1.0)
+        self.__gates += 1
+        ttd = None
+
+        if self.__gates <= self.__learn:
+            # Still learning the background rate.
+            self.__bgSum += counts
+            self.__bgTime += gateLen
+            self.__background = float(self.__bgSum) / self.__bgTime
+
+            if self.__gates == self.__learn:
+                self.flags = setFlag(self.flags, f_accum, f_accum_complete)
+                self.flags = setFlag(self.flags, f_trend, f_trend_stable)
+
+            else:
+                self.flags = setFlag(self.flags, f_accum, f_accum_accum)
+
+        else:
+            # Counts expected over this gate, kept away from zero so the log stays finite.
+            bgCounts = max(self.__background * gateLen, 0.5)
+            elCounts = bgCounts * self.__elevation
+
+            # Poisson log-likelihood ratio of this gate for elevated vs. background.
+            self.__llr += (counts * math.log(elCounts / bgCounts)) - (elCounts - bgCounts)
+
+            if self.__elevated == False:
+                # Evidence for elevation starts building when we leave zero.
+                if self.__llr <= 0.0:
+                    self.__llr = 0.0
+                    self.__evidenceTime = None
+
+                elif self.__evidenceTime is None:
+                    self.__evidenceTime = gateLen
+
+                else:
+                    self.__evidenceTime += gateLen
+
+                # We're not elevated, so track the background. Every gate counts here, otherwise the estimate is biased low.
+                self.__background += ((counts / gateLen) - self.__background) / self.__bgWeight
+
+                if self.__llr >= self.__upper:
+                    # Elevated.
+                    self.__elevated = True
+                    self.flags = setFlag(self.flags, f_trend, f_trend_up)
+
+                    ttd = self.__evidenceTime
+                    self.__detections.append(ttd)
+
+                    # Now look for evidence of a return to background, starting from the upper bound.
+                    self.__llr = min(self.__llr, self.__upper)
+
+                    if self.__textOut == True:
+                        print("[%s] Elevated above %s CPM background, detected in %s sec." %(self.name, round(self.__background * 60.0, 3), round(ttd, 3)))
+
+            else:
+                # Don't let evidence pile up past the upper bound or it takes forever to come back down.
+                self.__llr = min(self.__llr, self.__upper)
+
+                if self.__llr <= self.__lower:
+                    # Back to background.
+                    self.__elevated = False
+                    self.__llr = 0.0
+                    self.__evidenceTime = None
+                    self.flags = setFlag(self.flags, f_trend, f_trend_stable)
+
+                    if self.__textOut == True:
+                        print("[%s] Back to background." %self.name)
+
+        cps = counts / gateLen
+
+        smpl[self.name] = {'cps': cps, 'cpm': cps * 60.0, 'avg': False, 'n': 1, 'elevated': self.__elevated, 'llr': self.__llr, 'background': self.__background * 60.0, 'ttd': ttd, 'flags': self.flags}
+
+        return
+
+    def getState(self):
+        """
+        Save the background estimate and test state.
+        """
+
+        return {'bgSum': self.__bgSum, 'bgTime': self.__bgTime, 'gates': self.__gates, 'background': self.__background, 'llr': self.__llr, 'elevated': self.__elevated, 'evidenceTime': self.__evidenceTime, 'detections': self.__detections, 'flags': self.flags}
+
+    def setState(self, state):
+        """
+        Restore the background estimate and test state. States saved before gate lengths were kept get one second gates.
+        """
+
+        self.__bgSum = state['bgSum']
+        self.__bgTime = state.get('bgTime', float(min(state['gates'], self.__learn)))
+        self.__gates = state['gates']
+        self.__background = state['background']
+        self.__llr = state['llr']
+        self.__elevated = state['elevated']
+
+        if 'evidenceTime' in state:
+            self.__evidenceTime = state['evidenceTime']
+
+        elif state['evidenceStart'] is not None:
+            self.__evidenceTime = float(state['gates'] - state['evidenceStart'] + 1)
+
+        else:
+            self.__evidenceTime = None
+        self.__detections = list(state['detections'])
+        self.flags = state['flags']
+
+        return
+
+    def finish(self, summary):
+        """
+        Report detections and time to detect.
+        """
+
+        if len(self.__detections) > 0:
+            summary[self.name] = {'detections': len(self.__detections), 'meanTtd': sum(self.__detections) / len(self.__detections), 'maxTtd': max(self.__detections)}
+
+            if self.__textOut == True:
+                print("[%s] %s detections, time to detect mean %s sec., max %s sec." %(self.name, summary[self.name]['detections'], round(summary[self.name]['meanTtd'], 3), round(summary[self.name]['maxTtd'], 3)))
+
+        return
+
+
+class outputStage(pipelineStage):
+    def __init__(self, sources, name = "output", cpsOn = False, flagsOn = False):
+        """
+        Print the results of the given source stages for each sample, in the same style as the single-mode output.
+        """
+
+        super(outputStage, self).__init__(name)
+
+        self.__sources = sources
+        self.__cpsOn = cpsOn
+        self.__flagsOn = flagsOn
+
+    def process(self, smpl):
+        """
+        Print this sample's results.
+        """
+
+        print("--")
+
+        for source in self.__sources:
+            # Skip stages that only report at the end of the run.
+            if source not in smpl:
+                continue
+
+            srcRes = smpl[source]
+
+            # If we want the flags dumped...
+            if self.__flagsOn == True:
+                print("[%s] Flags: %s (0x%x)" %(source, parseFlags(srcRes['flags']), srcRes['flags']))
+
+            # Value stages carry a reading that isn't a count.
+            if 'value' in srcRes:
+                print("[%s] %s" %(source, round(srcRes['value'], 3)))
+                continue
+
+            # Baseline stages carry an anomaly score.
+            if 'score' in srcRes:
+                if srcRes['ready'] == True:
+                    print("[%s] Score %s, expected %s CPM" %(source, round(srcRes['score'], 3), round(srcRes['expectedCpm'], 3)))
+
+                continue
+
+            # Dose stages carry a dose rate.
+            if 'usvh' in srcRes:
+                print("[%s] %s uSv/h%s" %(source, round(srcRes['usvh'], 4), " [Saturated]" if srcRes['saturated'] == True else ""))
+                continue
+
+            # Trend stages only carry flags.
+            if 'cpm' not in srcRes:
+                continue
+
+            # If we want CPS on...
+            if self.__cpsOn == True:
+                print("[%s] %s CPS" %(source, round(srcRes['cps'], 3)))
+
+            # Averaged results are tagged.
+            if srcRes['avg'] == True:
+                avgStr = " [Avg]"
+            else:
+                avgStr = ""
+
+            print("[%s] %s CPM%s" %(source, round(srcRes['cpm'], 3), avgStr))
+
+        return
+
+
+class storageStage(pipelineStage):
+    def __init__(self, source, stg, name = None, live = True, field = 'cpm', flagStages = None):
+        """
+        Store a source stage's results through a datalayer. If live is True every sample is stored, otherwise only the source's final result at the end of the run is stored.
+        If flagStages is a list of stage names, each live data point is stored with the source's flags combined with the flags of those stages, e.g. the health flag, and the hardware counter flags.
+        """
+
+        if name is None:
+            name = "store-%s" %source
+
+        super(storageStage, self).__init__(name)
+
+        self.__source = source
+        self.__stg = stg
+        self.__live = live
+        self.__field = field
+        self.__flagStages = flagStages
+
+    def __store(self, dataPoint):
+        """
+        Store one data point, reporting but not raising errors.
+        """
+
+        try:
+            self.__stg.storeDatapoint(dataPoint)
+        except:
+            print("Failed to store data point: %s" %traceback.format_exc())
+
+        return
+
+    def process(self, smpl):
+        """
+        Store this sample's result.
+        """
+
+        if (self.__live == True) and (self.__source in smpl):
+            dataPoint = [smpl['dts'], round(smpl[self.__source][self.__field], 3)]
+
+            # Add flags if we want them.
+            if self.__flagStages is not None:
+                flags = smpl[self.__source]['flags'] | smpl.get('counterFlags', 0)
+
+                for flagStage in self.__flagStages:
+                    if flagStage in smpl:
+                        flags = flags | smpl[flagStage]['flags']
+
+                dataPoint.append(flags)
+
+            self.__store(dataPoint)
+
+        return
+
+    def processBlock(self, blk):
+        """
+        Store a block's results with one call to the datalayer.
+        """
+
+        import numpy
+
+        if (self.__live == True) and (self.__source in blk):
+            values = numpy.round(numpy.asarray(blk[self.__source][self.__field], dtype = numpy.float64), 3)
+            flags = None
+
+            # Add flags if we want them.
+            if self.__flagStages is not None:
+                flags = numpy.asarray(blk[self.__source]['flags'], dtype = numpy.int64) | blk['counterFlags']
+
+                for flagStage in self.__flagStages:
+                    if flagStage in blk:
+                        flags = flags | numpy.asarray(blk[flagStage]['flags'], dtype = numpy.int64)
+
+            try:
+                self.__stg.storeBlock(blk['ts'], values, flags)
+            except:
+                print("Failed to store data points: %s" %traceback.format_exc())
+
+        return
+
+    def finish(self, summary):
+        """
+        Store the source's final result and flush the datalayer.
+        """
+
+        if (self.__live == False) and (self.__source in summary):
+            self.__store([summary[self.__source]['dts'], round(summary[self.__source][self.__field], 3)])
+
+        # Make sure it's all on disk.
+        try:
+            self.__stg.flush()
+        except:
+            print("Failed to flush data: %s" %traceback.format_exc())
+
+        return
+
+
+################
+### Pipeline ###
+################
+
+class pipeline(object):
+    def __init__(self, stages = None):
+        """
+        An ordered set of stages that all get the same hardware readings. An instance can be passed to geigerInterface.run() as the callback.
+        """
+
+        self.__stages = []
+
+        if stages is not None:
+            for stage in stages:
+                self.addStage(stage)
+
+    def addStage(self, stage):
+        """
+        Append a stage to the pipeline. Stage names must be unique.
+        """
+
+        if stage.name in [s.name for s in self.__stages]:
+            raise ValueError("Duplicate pipeline stage name %s." %stage.name)
+
+        self.__stages.append(stage)
+
+        return
+
+    def getStages(self):
+        """
+        Get the list of stages in order.
+        """
+
+        return list(self.__stages)
+
+    def process(self, smpl):
+        """
+        Pass a sample dictionary through every stage in order and return it.
+        """
+
+        for stage in self.__stages:
+            stage.process(smpl)
+
+        return smpl
+
+    def processBlock(self, blk):
+        """
+        Pass a block of gates from makeBlock() through every stage in order and return it. An instance's processBlock can be passed to geigerInterface.runBlocks() as the callback.
+        """
+
+        for stage in self.__stages:
+            stage.processBlock(blk)
+
+        return blk
+
+    def __call__(self, latestCount, gateTimes = None, counterFlags = 0, channels = None, events = None):
+        """
+        Build a sample from a hardware reading and run it through the stages. Besides the UTC timestamp, each sample gets the monotonic time it was read at in 'mono' for latency measurements.
+        gateTimes is the (start, end) of the gate as UNIX timestamps for hardware that keeps its own gate time. When it's given the sample is stamped with the end of the gate and gets 'gateStart' and 'gateEnd' too. 'gateLen' is the gate length in seconds, 1.0 without gateTimes.
+        counterFlags are the hardware's f_counter flags for the gate, kept in 'counterFlags'. channels and events are the hardware's getChannels() and getEvents() for the gate, kept in 'channels' and 'events' if given.
+        """
+
+        smpl = {'dts': datetime.datetime.utcnow(), 'mono': time.monotonic(), 'counts': latestCount, 'counterFlags': counterFlags, 'gateLen': 1.0}
+
+        if channels is not None:
+            smpl['channels'] = channels
+
+        if events is not None:
+            smpl['events'] = events
+
+        if gateTimes is not None:
+            smpl['gateStart'] = datetime.datetime.utcfromtimestamp(gateTimes[0])
+            smpl['gateEnd'] = datetime.datetime.utcfromtimestamp(gateTimes[1])
+            smpl['dts'] = smpl['gateEnd']
+
+            if gateTimes[1] > gateTimes[0]:
+                smpl['gateLen'] = float(gateTimes[1] - gateTimes[0])
+
+        return self.process(smpl)
+
+    def getState(self):
+        """
+        Get the checkpoint state of every stage that has any, by stage name.
+        """
+
+        retVal = {}
+
+        for stage in self.__stages:
+            stageState = stage.getState()
+
+            if stageState is not None:
+                retVal[stage.name] = stageState
+
+        return retVal
+
+    def setState(self, state):
+        """
+        Restore stage states returned by getState(). Stages missing from state are left alone.
+        """
+
+        for stage in self.__stages:
+            if stage.name in state:
+                stage.setState(state[stage.name])
+
+        return
+
+    def finish(self):
+        """
+        Let every stage wrap up at the end of a run, and return the shared summary.
+        """
+
+        summary = {}
+
+        for stage in self.__stages:
+            stage.finish(summary)
+
+        return summary
+
+
+def buildPipeline(stageNames, cpsOn = False, flagsOn = False, textOut = True, stgFactory = None, periods = None, baselineProps = None, calib = None, alarm = None):
+    """
+    Build a pipeline from a list of stage names as given on the command line: fast, slow, counter, scaler, sprt, value, health, periodic, baseline, dose and trend. Trend follows the first averaging stage before it, and baseline and dose work on the first averaging stage before them or the raw counts if there isn't one.
+    An output stage is added when textOut is True, and if stgFactory is given it is called with each data stage's name to get that stage's datalayer. periods are the periods in gates the periodic stage watches, if not its defaults, baselineProps are settings for the baseline stage, e.g. its stateFile, and calib is the calibration.calibration the dose stage uses.
+    alarm is an alarms.alarmStage to run after the named stages, ahead of the output and storage stages so its flag is printed and stored with the data. Raises ValueError if any of its rules watch a stage that isn't in the pipeline.
+    """
+
+    # Fast and slow windows as in the Ludlum model 3.
+    windows = {'fast': (4, f_mode_fast), 'slow': (22, f_mode_slow)}
+
+    dataStages = []
+    stages = []
+
+    for stageName in stageNames:
+        if stageName in windows:
+            stages.append(averagerStage(stageName, windows[stageName][0], windows[stageName][1]))
+            dataStages.append(stageName)
+
+        elif stageName == "counter":
+            stages.append(counterStage())
+            dataStages.append(stageName)
+
+        elif stageName == "scaler":
+            stages.append(scalerStage(textOut = textOut, cpsOn = cpsOn))
+            dataStages.append(stageName)
+
+        elif stageName == "value":
+            stages.append(valueStage())
+            dataStages.append(stageName)
+
+        elif stageName == "sprt":
+            stages.append(sprtStage(textOut = textOut))
+            dataStages.append(stageName)
+
+        elif stageName == "health":
+            # Imported here since health builds on this module.
+            import health
+            stages.append(health.healthStage(textOut = textOut))
+
+        elif stageName == "periodic":
+            # Likewise.
+            import periodicity
+
+            if periods is None:
+                stages.append(periodicity.periodicStage(textOut = textOut))
+            else:
+                stages.append(periodicity.periodicStage(periods, textOut = textOut))
+
+        elif stageName == "baseline":
+            # Likewise.
+            import baseline
+
+            avgStages = [s for s in dataStages if s in windows]
+
+            stages.append(baseline.baselineStage(source = avgStages[0] if len(avgStages) > 0 else None, textOut = textOut, **(baselineProps if baselineProps is not None else {})))
+            dataStages.append(stageName)
+
+        elif stageName == "dose":
+            # Likewise.
+            import calibration
+
+            if calib is None:
+                raise ValueError("The dose stage needs a calibration.")
+
+            avgStages = [s for s in dataStages if s in windows]
+
+            stages.append(calibration.doseStage(calib, source = avgStages[0] if len(avgStages) > 0 else None, textOut = textOut))
+            dataStages.append(stageName)
+
+        elif stageName == "trend":
+            # Trend needs an averaging stage ahead of it.
+            avgStages = [s for s in dataStages if s in windows]
+
+            if len(avgStages) == 0:
+                raise ValueError("The trend stage needs a fast or slow stage before it.")
+
+            stages.append(trendStage(avgStages[0]))
+
+        else:
+            raise ValueError("Unknown pipeline stage %s." %stageName)
+
+    if alarm is not None:
+        # Fail now rather than on the first sample if a rule watches a stage we haven't got.
+        alarm.checkSources([s.name for s in stages])
+        stages.append(alarm)
+
+    # Print results for everything that produces data, plus trend flags.
+    if textOut == True:
+        stages.append(outputStage([s.name for s in stages if s.name != "scaler"], cpsOn = cpsOn, flagsOn = flagsOn))
+
+    # Give each data stage its own storage, storing the health, periodic, anomaly, saturation and alarm flags with each data point if we're checking them.
+    if stgFactory is not None:
+        flagStages = [s for s in ("health", "periodic", "baseline", "dose") if s in stageNames]
+
+        if alarm is not None:
+            flagStages.append(alarm.name)
+
+        if len(flagStages) == 0:
+            flagStages = None
+
+        for stageName in dataStages:
+            stages.append(storageStage(stageName, stgFactory(stageName), live = (stageName != "scaler"), field = {'value': 'value', 'baseline': 'score', 'dose': 'usvh'}.get(stageName, 'cpm'), flagStages = flagStages))
+
+    return pipeline(stages)
@@ -0,0 +1,221 @@
+###############
+### Imports ###
+###############
+
+import struct
+from multiprocessing import shared_memory
+
+
+##############
+### Layout ###
+##############
+
+# Header: magic, layout version, capacity in records, record size, and the number of records ever written, padded to a cache line.
+hdrFormat = "<4sIIIQ"
+hdrMagic = b"GGRB"
+hdrVersion = 1
+hdrSize = 64
+hdrHeadOffset = 16
+
+# Records: sequence word, UNIX timestamp, gate counts and flags.
+# Record i's sequence word is 2i + 1 while it's being written and 2i + 2 once it's done, so a reader can tell a finished record from one that's half written or has been overwritten.
+recFormat = "<QdII"
+recSize = struct.calcsize(recFormat)
+
+
+def recordDtype():
+    """
+    Get a NumPy dtype matching the record layout.
+    """
+
+    import numpy
+
+    return numpy.dtype([('seq', '<u8'), ('ts', '<f8'), ('counts', '<u4'), ('flags', '<u4')])
+
+
+##############
+### Writer ###
+##############
+
+class shmRing(object):
+    def __init__(self, name, capacity = 3600):
+        """
+        Publish samples into a shared memory ring buffer called name, holding the latest capacity samples, for local readers using shmRingReader. Publishing is a few struct.pack_into() calls with no syscalls or locks, and readers never block the writer.
+        Readers check each record's sequence word before and after reading it, seqlock style, and retry if it changed. Python can't issue memory barriers, so this relies on the interpreter's own ordering between the writes, which holds in practice.
+        A segment with the same name left behind by a crash is replaced.
+        """
+
+        self.__capacity = capacity
+        size = hdrSize + (capacity * recSize)
+
+        try:
+            self.__shm = shared_memory.SharedMemory(name = name, create = True, size = size)
+
+        except FileExistsError:
+            # Left over from a crash.
+            old = shared_memory.SharedMemory(name = name)
+            old.close()
+            old.unlink()
+
+            self.__shm = shared_memory.SharedMemory(name = name, create = True, size = size)
+
+        self.__buf = self.__shm.buf
+
+        # Zero the records so no slot looks finished, then write the header.
+        self.__buf[:size] = bytes(size)
+        struct.pack_into(hdrFormat, self.__buf, 0, hdrMagic, hdrVersion, capacity, recSize, 0)
+
+        # Records written so far.
+        self.__head = 0
+
+    def getName(self):
+        """
+        Get the shared memory segment's name.
+        """
+
+        return self.__shm.name
+
+    def publish(self, ts, counts, flags = 0):
+        """
+        Add a sample, overwriting the oldest once the ring is full.
+        """
+
+        i = self.__head
+        offset = hdrSize + ((i % self.__capacity) * recSize)
+
+        # Mark the record as being written, fill it in, mark it done, then move the head on.
+        struct.pack_into("<Q", self.__buf, offset, (2 * i) + 1)
+        struct.pack_into("<dII", self.__buf, offset + 8, ts, counts, flags)
+        struct.pack_into("<Q", self.__buf, offset, (2 * i) + 2)
+        struct.pack_into("<Q", self.__buf, hdrHeadOffset, i + 1)
+
+        self.__head = i + 1
+
+        return
+
+    def close(self, unlink = True):
+        """
+        Stop publishing, and remove the segment unless unlink is False. Readers that already have it mapped keep their view.
+        """
+
+        self.__buf = None
+        self.__shm.close()
+
+        if unlink == True:
+            self.__shm.unlink()
+
+        return
+
+
+##############
+### Reader ###
+##############
+
+class shmRingReader(object):
+    def __init__(self, name):
+        """
+        Map a ring buffer published by shmRing. Mapping it is the only syscall; reads after that come straight out of shared memory.
+        """
+
+        try:
+            # Python 3.13 and up can leave the segment alone when we exit.
+            self.__shm = shared_memory.SharedMemory(name = name, track = False)
+
+        except TypeError:
+            self.__shm = shared_memory.SharedMemory(name = name)
+
+            # Older versions would unlink the writer's segment when we exit.
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(self.__shm._name, "shared_memory")
+
+        self.__buf = self.__shm.buf
+
+        magic, version, self.__capacity, size, head = struct.unpack_from(hdrFormat, self.__buf, 0)
+
+        if (magic != hdrMagic) or (version != hdrVersion) or (size != recSize):
+            self.close()
+            raise ValueError("%s isn't a geiger counter ring buffer we can read." %name)
+
+    def getCapacity(self):
+        """
+        Get the number of records the ring holds.
+        """
+
+        return self.__capacity
+
+    def getHead(self):
+        """
+        Get the number of records ever written. The newest is getHead() - 1.
+        """
+
+        return struct.unpack_from("<Q", self.__buf, hdrHeadOffset)[0]
+
+    def read(self, i, retries = 100):
+        """
+        Read record i as a (timestamp, counts, flags) tuple, or None if it hasn't been written yet or has been overwritten.
+        """
+
+        offset = hdrSize + ((i % self.__capacity) * recSize)
+        done = (2 * i) + 2
+
+        for attempt in range(retries):
+            seq = struct.unpack_from("<Q", self.__buf, offset)[0]
+
+            if seq == done - 1:
+                # Being written right now.
+                continue
+
+            if seq != done:
+                return None
+
+            retVal = struct.unpack_from("<dII", self.__buf, offset + 8)
+
+            # Make sure it didn't change under us.
+            if struct.unpack_from("<Q", self.__buf, offset)[0] == done:
+                return retVal
+
+        return None
+
+    def latest(self, n = 1):
+        """
+        Get up to the newest n records, oldest first, as (index, timestamp, counts, flags) tuples.
+        """
+
+        retVal = []
+        head = self.getHead()
+
+        for i in range(max(0, head - min(n, self.__capacity)), head):
+            rec = self.read(i)
+
+            if rec is not None:
+                retVal.append((i,) + rec)
+
+        return retVal
+
+    def since(self, i):
+        """
+        Get every record from index i on that's still in the ring, for following the stream. Pass the last index you saw plus one.
+        """
+
+        head = self.getHead()
+
+        return self.latest(head - i)
+
+    def getArray(self):
+        """
+        Get a NumPy structured array over the records in shared memory, with no copy. Slots aren't in time order, records may change while you look at them, and only records with an even, non-zero 'seq' are complete. Delete the array before calling close().
+        """
+
+        import numpy
+
+        return numpy.ndarray(shape = (self.__capacity,), dtype = recordDtype(), buffer = self.__buf, offset = hdrSize)
+
+    def close(self):
+        """
+        Unmap the ring buffer.
+        """
+
+        self.__buf = None
+        self.__shm.close()
+
+        return
@@ -0,0 +1,326 @@
+###############
+### Imports ###
+###############
+
+import time
+from hwInterface import counterIface
+
+
+#######################
+### Source profiles ###
+#######################
+
+def parseProfile(spec):
+	"""
+	Build a source profile segment from a command line spec: the kind followed by comma-separated key=value settings, with times in seconds from the start of the run and rates in counts per second.
+	step,start=S,rate=R[,end=E] adds R from S until E, or forever.
+	ramp,start=S,end=E,rate=R rises linearly from 0 at S to R at E, then holds at R.
+	"""
+	
+	parts = spec.split(',')
+	kind = parts[0]
+	
+	if kind not in ('step', 'ramp'):
+		raise ValueError("Unknown source profile %s." %kind)
+	
+	retVal = {'kind': kind, 'start': 0.0, 'end': None, 'rate': 0.0}
+	
+	for part in parts[1:]:
+		key, value = part.split('=', 1)
+		
+		if key not in retVal:
+			raise ValueError("Unknown source profile setting %s." %key)
+		
+		retVal[key] = float(value)
+	
+	if (kind == 'ramp') and ((retVal['end'] is None) or (retVal['end'] <= retVal['start'])):
+		raise ValueError("A ramp needs an end after its start.")
+	
+	return retVal
+
+
+def profileRate(np, profile, t):
+	"""
+	Get the source rate in counts per second of a list of profile segments at each time in the NumPy array t.
+	"""
+	
+	retVal = np.zeros(len(t))
+	
+	for seg in profile:
+		if seg['kind'] == 'step':
+			on = (t >= seg['start'])
+			
+			if seg['end'] is not None:
+				on &= (t < seg['end'])
+			
+			retVal += np.where(on, seg['rate'], 0.0)
+		
+		elif seg['kind'] == 'ramp':
+			frac = np.clip((t - seg['start']) / (seg['end'] - seg['start']), 0.0, 1.0)
+			retVal += frac * seg['rate']
+	
+	return retVal
+
+
+#########################
+### Poisson simulator ###
+#########################
+
+class simHardware(counterIface):
+	def setSimProps(self, background = 0.5, profile = None, deadTime = 0.0, faultRate = 0.0, seed = None, gateTime = 1.0, speed = 1.0, blockSize = 1000000, tubes = 1, showerRate = 0.0, events = False):
+		"""
+		Set simulator properties. background is the background rate in counts per second, and profile is a list of source segments from parseProfile() added on top of it. deadTime is the detector's non-paralyzable dead time in seconds.
+		faultRate is the chance per gate of a fault starting: a dropout reading zero, a noise burst, or the counter sticking on one value for a few gates.
+		seed makes runs reproducible. gateTime is the simulated gate length in seconds, and speed is how many times faster than real time to run, or 0 to run as fast as possible. blockSize gates are generated at a time.
+		tubes is the number of detectors. The first is the main reading and the rest see the same background and profile, without dead time or faults, and every tube's reading is in getChannels() as 'tube0', 'tube1' and so on. showerRate is the rate in counts per second of cosmic showers that hit every tube at once. With events the time of every pulse is made up too, for getEvents(). The other tubes and pulse times are only made up by poll(), not pollBlock().
+		"""
+		
+		self.__background = background
+		self.__profile = profile if profile is not None else []
+		self.__deadTime = deadTime
+		self.__faultRate = faultRate
+		self.__seed = seed
+		self.__gateTime = gateTime
+		self.__speed = speed
+		self.__blockSize = blockSize
+		self.__tubes = tubes
+		self.__showerRate = showerRate
+		self.__events = events
+		
+		if self._debug == True:
+			print("Simulator property set called: %s" %self.getConfig()['config'])
+		
+		return
+	
+	def setup(self):
+		"""
+		Set up the simulator and generate the first block of gates.
+		"""
+		
+		try:
+			import numpy
+			self.__np = numpy
+		
+		except:
+			raise RuntimeError("To use the simulator please ensure the python library numpy is installed.")
+		
+		try:
+			self.__background
+		
+		except AttributeError:
+			# Defaults.
+			self.setSimProps()
+		
+		self.__rng = self.__np.random.default_rng(self.__seed)
+		
+		# The other tubes and pulse times get their own generator so the main reading is the same with or without them.
+		self.__tubeRng = self.__np.random.default_rng(None if self.__seed is None else [self.__seed, 1])
+		self.__channels = None
+		self.__pulses = None
+		
+		# Gates generated so far, the current block and our place in it.
+		self.__generated = 0
+		self.__block = self.__np.zeros(0, dtype = self.__np.int64)
+		self.__showers = self.__np.zeros(0, dtype = self.__np.int64)
+		self.__pos = 0
+		
+		# Fault tallies.
+		self.faults = {'dropout': 0, 'burst': 0, 'stuck': 0}
+		
+		# Simulated gate k runs from start + k * gateTime on the host clock. Gate 0 is polled one gate from now.
+		self.__start = time.time()
+		self.__gate = 0
+		
+		return
+	
+	def getConfig(self):
+		"""
+		Get current config.
+		"""
+		
+		return {"desc": "NumPy Poisson simulator", "config": {"background": self.__background, "profile": self.__profile, "deadTime": self.__deadTime, "faultRate": self.__faultRate, "seed": self.__seed, "gateTime": self.__gateTime, "speed": self.__speed, "tubes": self.__tubes, "showerRate": self.__showerRate, "events": self.__events}}
+	
+	def __generate(self):
+		"""
+		Generate the next block of gates.
+		"""
+		
+		np = self.__np
+		
+		# Rate at the middle of each gate.
+		k = np.arange(self.__generated, self.__generated + self.__blockSize)
+		t = (k + 0.5) * self.__gateTime
+		rate = self.__background + profileRate(np, self.__profile, t)
+		
+		# True counts.
+		counts = self.__rng.poisson(rate * self.__gateTime)
+		
+		# Showers hit every tube, so they're kept to add to the other tubes' counts.
+		if self.__showerRate > 0.0:
+			self.__showers = self.__rng.poisson(self.__showerRate * self.__gateTime, self.__blockSize)
+			counts = counts + self.__showers
+		else:
+			self.__showers = np.zeros(self.__blockSize, dtype = np.int64)
+		
+		# Non-paralyzable dead time: each of n pulses in a gate survives with probability 1 / (1 + n * deadTime / gateTime).
+		if self.__deadTime > 0.0:
+			live = 1.0 / (1.0 + (counts * self.__deadTime / self.__gateTime))
+			counts = self.__rng.binomial(counts, live)
+		
+		# Faults. There aren't many, so these are done one at a time.
+		if self.__faultRate > 0.0:
+			faultAt = np.nonzero(self.__rng.random(self.__blockSize) < self.__faultRate)[0]
+			kinds = self.__rng.integers(0, 3, len(faultAt))
+			
+			for i, kind in zip(faultAt, kinds):
+				if kind == 0:
+					counts[i] = 0
+					self.faults['dropout'] += 1
+				
+				elif kind == 1:
+					# A burst about 50 times the rate.
+					counts[i] += self.__rng.poisson(50.0 * max(rate[i], 1.0) * self.__gateTime)
+					self.faults['burst'] += 1
+				
+				else:
+					# Stick on the last value for up to 10 gates.
+					if i > 0:
+						stuckFor = self.__rng.integers(1, 11)
+						counts[i:(i + stuckFor)] = counts[i - 1]
+						self.faults['stuck'] += 1
+		
+		self.__block = counts
+		self.__pos = 0
+		self.__generated += self.__blockSize
+		
+		return
+	
+	def poll(self):
+		"""
+		Serve the next gate.
+		"""
+		
+		if self.__pos >= len(self.__block):
+			try:
+				self.__generate()
+			
+			except:
+				raise
+		
+		retVal = int(self.__block[self.__pos])
+		
+		if (self.__tubes > 1) or (self.__events == True):
+			self.__tubeGate(retVal, int(self.__showers[self.__pos]))
+		
+		self.__pos += 1
+		self.__gate += 1
+		
+		return retVal
+	
+	def __tubeGate(self, mainCounts, showers):
+		"""
+		Make up the other tubes' counts and, if we want them, every tube's pulse times for the gate being polled, given the main tube's counts and the number of showers.
+		"""
+		
+		np = self.__np
+		rng = self.__tubeRng
+		
+		gateStart = self.__start + (self.__gate * self.__gateTime)
+		rate = self.__background + profileRate(np, self.__profile, np.array([(self.__gate + 0.5) * self.__gateTime]))[0]
+		
+		counts = [mainCounts] + [int(rng.poisson(rate * self.__gateTime)) + showers for tube in range(1, self.__tubes)]
+		
+		if self.__tubes > 1:
+			self.__channels = dict([("tube%s" %tube, counts[tube]) for tube in range(self.__tubes)])
+		
+		if self.__events == True:
+			# Showers arrive at every tube together, give or take the tubes' timing jitter. Dead time or faults may have cost the main tube some.
+			showerTimes = rng.random(showers) * self.__gateTime
+			self.__pulses = {}
+			
+			for tube in range(self.__tubes):
+				tubeShowers = min(showers, counts[tube])
+				pulses = np.concatenate((rng.random(counts[tube] - tubeShowers) * self.__gateTime, showerTimes[:tubeShowers] + rng.normal(0.0, 1e-6, tubeShowers)))
+				pulses = gateStart + np.clip(np.sort(pulses), 0.0, self.__gateTime)
+				
+				self.__pulses["tube%s" %tube if self.__tubes > 1 else 'counter'] = pulses
+		
+		return
+	
+	def getChannels(self):
+		"""
+		Get every tube's counts for the last poll, if we have more than one.
+		"""
+		
+		return self.__channels
+	
+	def getEvents(self):
+		"""
+		Get the pulse times for the last poll, if we're making them up.
+		"""
+		
+		return self.__pulses
+	
+	def getGateTimes(self):
+		"""
+		Get the simulated start and end of the last gate.
+		"""
+		
+		if self.__gate == 0:
+			return None
+		
+		return (self.__start + ((self.__gate - 1) * self.__gateTime), self.__start + (self.__gate * self.__gateTime))
+	
+	def getNextPoll(self):
+		"""
+		Poll on the simulated clock, sped up by our speed factor.
+		"""
+		
+		if self.__speed <= 0:
+			# As fast as we can.
+			return time.time()
+		
+		return self.__start + ((self.__gate + 1) * self.__gateTime / self.__speed)
+	
+	def getBufferSeconds(self):
+		"""
+		The simulated clock keeps every gate until it's polled.
+		"""
+		
+		return None
+	
+	def pollBlock(self):
+		"""
+		Serve every gate that has finished on the simulated clock since the last poll, or up to blockSize gates at a time when running as fast as possible, as NumPy arrays.
+		"""
+		
+		np = self.__np
+		
+		if self.__speed <= 0:
+			due = self.__blockSize
+		else:
+			due = int((time.time() - self.__start) * self.__speed / self.__gateTime) - self.__gate
+		
+		parts = []
+		
+		while due > 0:
+			if self.__pos >= len(self.__block):
+				self.__generate()
+			
+			part = self.__block[self.__pos:(self.__pos + due)]
+			parts.append(part)
+			
+			self.__pos += len(part)
+			due -= len(part)
+		
+		first = self.__gate
+		counts = np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype = np.int64)
+		
+		# No other tubes or pulse times for blocks.
+		self.__channels = None
+		self.__pulses = None
+		self.__gate += len(counts)
+		
+		ends = self.__start + (np.arange(first + 1, self.__gate + 1) * self.__gateTime)
+		
+		return (counts, ends, np.full(len(counts), self.__gateTime))
@@ -0,0 +1,351 @@
+###############
+### Imports ###
+###############
+
+import bisect
+import math
+
+
+###############
+### Welford ###
+###############
+
+class welford(object):
+    def __init__(self):
+        """
+        Running count, mean, variance, minimum and maximum in constant memory, using Welford's method so the variance doesn't lose precision over long runs.
+        """
+
+        self.n = 0
+        self.mean = 0.0
+        self.__m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        """
+        Add a value.
+        """
+
+        self.n += 1
+
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.__m2 += delta * (x - self.mean)
+
+        if (self.min is None) or (x < self.min):
+            self.min = x
+
+        if (self.max is None) or (x > self.max):
+            self.max = x
+
+        return
+
+    def addMany(self, values):
+        """
+        Add a NumPy array of values at once, merging its moments with ours using Chan's parallel update.
+        """
+
+        n = len(values)
+
+        if n == 0:
+            return
+
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.n + n
+        delta = mean - self.mean
+
+        self.mean += delta * n / total
+        self.__m2 += m2 + (delta * delta * self.n * n / total)
+        self.n = total
+
+        lo = values.min().item()
+        hi = values.max().item()
+
+        if (self.min is None) or (lo < self.min):
+            self.min = lo
+
+        if (self.max is None) or (hi > self.max):
+            self.max = hi
+
+        return
+
+    def variance(self):
+        """
+        Sample variance, or None with fewer than two values.
+        """
+
+        if self.n < 2:
+            return None
+
+        return self.__m2 / (self.n - 1)
+
+    def getState(self):
+        """
+        Get our state for a checkpoint.
+        """
+
+        return {'n': self.n, 'mean': self.mean, 'm2': self.__m2, 'min': self.min, 'max': self.max}
+
+    def setState(self, state):
+        """
+        Restore state from getState().
+        """
+
+        self.n = state['n']
+        self.mean = state['mean']
+        self.__m2 = state['m2']
+        self.min = state['min']
+        self.max = state['max']
+
+        return
+
+
+##########
+### P² ###
+##########
+
+class p2Quantile(object):
+    def __init__(self, p):
+        """
+        Streaming estimate of the p quantile, 0 < p < 1, using Jain and Chlamtac's P² algorithm: five markers whose heights are adjusted with piecewise-parabolic interpolation as values come in, so memory and time per value are constant.
+        """
+
+        self.p = p
+
+        # Marker heights, actual positions, desired positions and desired position increments.
+        self.__q = []
+        self.__pos = [0, 1, 2, 3, 4]
+        self.__want = [0.0, 2.0 * p, 4.0 * p, 2.0 + (2.0 * p), 4.0]
+        self.__step = [0.0, p / 2.0, p, (1.0 + p) / 2.0, 1.0]
+
+    def add(self, x):
+        """
+        Add a value.
+        """
+
+        q = self.__q
+        pos = self.__pos
+
+        # The first five values are the markers.
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+
+        # Find the cell x falls in, stretching the end markers if it's outside them.
+        if x < q[0]:
+            q[0] = x
+            k = 0
+
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+
+        else:
+            k = bisect.bisect_right(q, x, 0, 4) - 1
+
+        for i in range(k + 1, 5):
+            pos[i] += 1
+
+        for i in range(5):
+            self.__want[i] += self.__step[i]
+
+        # Move the middle markers towards where they should be.
+        for i in range(1, 4):
+            self.__adjust(i)
+
+        return
+
+    def __adjust(self, i):
+        """
+        Move middle marker i a place towards its desired position if it's at least a place away and there's room.
+        """
+
+        q = self.__q
+        pos = self.__pos
+        d = self.__want[i] - pos[i]
+
+        if ((d >= 1.0) and ((pos[i + 1] - pos[i]) > 1)) or ((d <= -1.0) and ((pos[i - 1] - pos[i]) < -1)):
+            d = int(math.copysign(1, d))
+
+            # Parabolic prediction, falling back to linear if it would overtake a neighbour.
+            qp = q[i] + (float(d) / (pos[i + 1] - pos[i - 1])) * ((((pos[i] - pos[i - 1] + d) * (q[i + 1] - q[i])) / float(pos[i + 1] - pos[i])) + (((pos[i + 1] - pos[i] - d) * (q[i] - q[i - 1])) / float(pos[i] - pos[i - 1])))
+
+            if not (q[i - 1] < qp < q[i + 1]):
+                qp = q[i] + (d * (q[i + d] - q[i]) / float(pos[i + d] - pos[i]))
+
+            q[i] = qp
+            pos[i] += d
+
+        return
+
+    def addMany(self, values):
+        """
+        Add a list of values. Gives the same result as add() for each in turn, with the per-value work cut down to the essentials, since P² can't skip any values.
+        """
+
+        first = 0
+
+        # The first five values are the markers.
+        while (len(self.__q) < 5) and (first < len(values)):
+            self.add(values[first])
+            first += 1
+
+        q = self.__q
+        pos = self.__pos
+        want = self.__want
+        step1, step2, step3 = self.__step[1:4]
+        bisectRight = bisect.bisect_right
+
+        for x in values[first:]:
+            # Find the cell x falls in, stretching the end markers if it's outside them.
+            if x < q[0]:
+                q[0] = x
+                k = 0
+
+            elif x >= q[4]:
+                q[4] = x
+                k = 3
+
+            else:
+                k = bisectRight(q, x, 0, 4) - 1
+
+            if k == 0:
+                pos[1] += 1
+                pos[2] += 1
+                pos[3] += 1
+
+            elif k == 1:
+                pos[2] += 1
+                pos[3] += 1
+
+            elif k == 2:
+                pos[3] += 1
+
+            pos[4] += 1
+
+            want[1] += step1
+            want[2] += step2
+            want[3] += step3
+            want[4] += 1.0
+
+            # Only markers a place or more away from where they should be can move.
+            for i in (1, 2, 3):
+                d = want[i] - pos[i]
+
+                if (d >= 1.0) or (d <= -1.0):
+                    self.__adjust(i)
+
+        return
+
+    def value(self):
+        """
+        Get the estimate, or None with no values. Exact with five values or fewer.
+        """
+
+        if len(self.__q) == 0:
+            return None
+
+        if self.__pos[4] < 5:
+            return self.__q[min(len(self.__q) - 1, int(round(self.p * (len(self.__q) - 1))))]
+
+        return self.__q[2]
+
+    def getState(self):
+        """
+        Get our state for a checkpoint.
+        """
+
+        return {'q': list(self.__q), 'pos': list(self.__pos), 'want': list(self.__want)}
+
+    def setState(self, state):
+        """
+        Restore state from getState().
+        """
+
+        self.__q = list(state['q'])
+        self.__pos = list(state['pos'])
+        self.__want = list(state['want'])
+
+        return
+
+
+####################
+### Stream stats ###
+####################
+
+class streamStats(object):
+    def __init__(self, quantiles = (0.5, 0.95, 0.99)):
+        """
+        Constant-memory statistics of a stream of values: count, mean, variance, min, max and the given quantiles.
+        """
+
+        self.__moments = welford()
+        self.__quantiles = [p2Quantile(p) for p in quantiles]
+
+    def add(self, x):
+        """
+        Add a value.
+        """
+
+        self.__moments.add(x)
+
+        for quantile in self.__quantiles:
+            quantile.add(x)
+
+        return
+
+    def addMany(self, values):
+        """
+        Add a NumPy array of values. The moments are updated for the whole array at once, but the quantile markers still take one value at a time.
+        """
+
+        self.__moments.addMany(values)
+
+        values = values.tolist()
+
+        for quantile in self.__quantiles:
+            quantile.addMany(values)
+
+        return
+
+    def getSummary(self):
+        """
+        Get the statistics as a JSON-serialisable dictionary. Quantiles are keyed by percentile, e.g. 'p50'.
+        """
+
+        variance = self.__moments.variance()
+
+        retVal = {
+            'n': self.__moments.n,
+            'mean': self.__moments.mean if self.__moments.n > 0 else None,
+            'variance': variance,
+            'stdDev': math.sqrt(variance) if variance is not None else None,
+            'min': self.__moments.min,
+            'max': self.__moments.max
+        }
+
+        for quantile in self.__quantiles:
+            retVal["p%g" %(quantile.p * 100.0)] = quantile.value()
+
+        return retVal
+
+    def getState(self):
+        """
+        Get our state for a checkpoint.
+        """
+
+        return {'moments': self.__moments.getState(), 'quantiles': [quantile.getState() for quantile in self.__quantiles]}
+
+    def setState(self, state):
+        """
+        Restore state from getState().
+        """
+
+        self.__moments.setState(state['moments'])
+
+        for quantile, quantileState in zip(self.__quantiles, state['quantiles']):
+            quantile.setState(quantileState)
+
+        return
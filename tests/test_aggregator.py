@@ -0,0 +1,144 @@
+###############
+### Imports ###
+###############
+
+import datetime
+import aggregator
+import pipeline
+
+
+###############
+### Helpers ###
+###############
+
+def newAggregator(lateness = 2):
+    """
+    Get an aggregator and the list its closed gates go to.
+    """
+
+    closed = []
+
+    return (aggregator.fleetAggregator(lateness = lateness, onGate = closed.append), closed)
+
+
+#############
+### Tests ###
+#############
+
+def test_mergeSites():
+    """
+    A closed gate has per-site and fleet sums, maxima and coverage.
+    """
+
+    agg, closed = newAggregator()
+
+    agg.ingest("north", "a", 1000.0, 5)
+    agg.ingest("north", "b", 1000.0, 7)
+    agg.ingest("south", "c", 1000.0, 3)
+    agg.flush()
+
+    assert len(closed) == 1
+    assert closed[0]['gate'] == 1000.0
+    assert closed[0]['sites']['north'] == {'sum': 12, 'max': 7, 'reporting': 2, 'coverage': 1.0, 'flags': 0}
+    assert closed[0]['fleet']['sum'] == 15
+    assert closed[0]['fleet']['max'] == 7
+    assert closed[0]['fleet']['coverage'] == 1.0
+
+
+def test_coverage():
+    """
+    Detectors we've heard from before but not this gate count against coverage.
+    """
+
+    agg, closed = newAggregator()
+
+    agg.ingest("north", "a", 1000.0, 5)
+    agg.ingest("north", "b", 1000.0, 7)
+    agg.ingest("north", "a", 1001.0, 5)
+    agg.flush()
+
+    assert closed[1]['sites']['north']['coverage'] == 0.5
+    assert closed[1]['fleet']['reporting'] == 1
+
+
+def test_watermark():
+    """
+    Gates close once they're lateness seconds behind the newest, and samples behind the watermark are dropped as late.
+    """
+
+    agg, closed = newAggregator(lateness = 2)
+
+    for gate in (1000.0, 1001.0, 1002.0, 1003.0):
+        agg.ingest("north", "a", gate, 1)
+
+    assert [res['gate'] for res in closed] == [1000.0]
+
+    agg.ingest("north", "b", 1000.0, 1)
+    agg.ingest("north", "b", 1001.0, 1)
+    agg.flush()
+
+    assert agg.stats['late'] == 1
+    assert closed[1]['sites']['north']['reporting'] == 2
+
+
+def test_futureAndDuplicate():
+    """
+    Samples too far ahead of our clock and repeats of a detector's gate are dropped and counted.
+    """
+
+    agg, closed = newAggregator()
+
+    agg.ingest("north", "a", 1000.0, 5)
+    agg.ingest("north", "a", 1000.0, 5)
+    agg.ingest("north", "a", aggregator.time.time() + 3600.0, 5)
+    agg.flush()
+
+    assert agg.stats['duplicate'] == 1
+    assert agg.stats['future'] == 1
+    assert closed[0]['fleet']['sum'] == 5
+
+
+def test_subSecondGates():
+    """
+    Gates shorter than a second are kept apart rather than merged as duplicates.
+    """
+
+    agg, closed = newAggregator(lateness = 0.5)
+
+    for i in range(8):
+        agg.ingest("north", "a", 1000.0 + (i * 0.25), i)
+
+    agg.flush()
+
+    assert agg.stats['duplicate'] == 0
+    assert [res['fleet']['sum'] for res in closed] == list(range(8))
+
+
+def test_flags():
+    """
+    Each site's flags combine its detectors', and the fleet's combine every site's.
+    """
+
+    agg, closed = newAggregator()
+
+    agg.ingest("north", "a", 1000.0, 5, pipeline.f_counter_wrap)
+    agg.ingest("north", "b", 1000.0, 5, pipeline.f_alarm)
+    agg.ingest("south", "c", 1000.0, 5)
+    agg.flush()
+
+    assert closed[0]['sites']['north']['flags'] == pipeline.f_counter_wrap | pipeline.f_alarm
+    assert closed[0]['sites']['south']['flags'] == 0
+    assert closed[0]['fleet']['flags'] == pipeline.f_counter_wrap | pipeline.f_alarm
+
+
+def test_wireFormat():
+    """
+    A datetime's gate survives the wire format to the millisecond.
+    """
+
+    dts = datetime.datetime(2024, 5, 1, 12, 0, 0, 250000)
+    gate = aggregator.gateOf(dts)
+    site, detector, wireGate, counts, flags = aggregator.formatRecord("north", "a", gate, 12, pipeline.f_alarm).split()
+
+    assert gate == aggregator.calendar.timegm(dts.utctimetuple()) + 0.25
+    assert (site, detector, float(wireGate), int(counts), int(flags)) == ("north", "a", gate, 12, pipeline.f_alarm)
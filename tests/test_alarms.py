@@ -0,0 +1,163 @@
+###############
+### Imports ###
+###############
+
+import datetime
+import threading
+import time
+import pytest
+import alarms
+import pipeline
+
+
+###############
+### Helpers ###
+###############
+
+def sample(cpm, counts = 0):
+    """
+    Get a sample with fast stage results of cpm.
+    """
+
+    return {'counts': counts, 'dts': datetime.datetime(2024, 5, 1), 'fast': {'cpm': cpm}}
+
+
+def states(rule, values):
+    """
+    Run a rule over fast stage values a second apart and get its state change for each.
+    """
+
+    return [rule.evaluate(sample(value), float(i)) for i, value in enumerate(values)]
+
+
+class slowNotifier(object):
+    def __init__(self, delay = 0.0):
+        """
+        Notifier that takes delay seconds and keeps the events it gets.
+        """
+
+        self.delay = delay
+        self.events = []
+
+    def notify(self, event):
+        """
+        Keep an event.
+        """
+
+        time.sleep(self.delay)
+        self.events.append(event)
+
+
+#############
+### Tests ###
+#############
+
+def test_thresholdHysteresis():
+    """
+    A threshold rule raises at its level and only clears below its clear level.
+    """
+
+    rule = alarms.thresholdRule("high", 100.0, clear = 80.0, source = "fast")
+
+    assert states(rule, [50, 100, 90, 85, 79, 120]) == [None, "raised", None, None, "cleared", "raised"]
+
+
+def test_holdoff():
+    """
+    A rule doesn't raise again until its hold-off has passed since it last raised.
+    """
+
+    rule = alarms.thresholdRule("high", 100.0, source = "fast", holdoff = 3.0)
+
+    assert states(rule, [120, 50, 120, 50, 120]) == ["raised", "cleared", None, None, "raised"]
+
+
+def test_rateRule():
+    """
+    A rate rule raises on a rise over its window.
+    """
+
+    rule = alarms.rateRule("rising", 30.0, window = 3, source = "fast")
+
+    assert states(rule, [10, 10, 10, 10, 20, 30, 40, 40, 40, 40]) == [None, None, None, None, None, None, "raised", None, "cleared", None]
+
+
+def test_sustainedRule():
+    """
+    A sustained rule only raises after its level has held for its duration.
+    """
+
+    rule = alarms.sustainedRule("steady", 100.0, duration = 3, source = "fast")
+
+    assert states(rule, [120, 120, 50, 120, 120, 120, 50]) == [None, None, None, None, None, "raised", "cleared"]
+
+
+def test_parseRule():
+    """
+    Command line specs build the right rule, defaulting the name and source.
+    """
+
+    rule = alarms.parseRule("threshold,source=fast,level=1000,clear=800,holdoff=60")
+
+    assert isinstance(rule, alarms.thresholdRule)
+    assert (rule.name, rule.source, rule.field, rule.level, rule.clear, rule.holdoff) == ("threshold", "fast", "cpm", 1000.0, 800.0, 60.0)
+    assert alarms.parseRule("rate,rise=300,window=10").source == "counter"
+    assert alarms.parseRule("sustained,name=steady,source=counts,level=5,duration=4").value(sample(0, counts = 7)) == 7.0
+
+    with pytest.raises(ValueError):
+        alarms.parseRule("siren,level=5")
+
+
+def test_sourcesChecked():
+    """
+    Rules watching stages that aren't in the pipeline are caught when it's built, including the default counter source.
+    """
+
+    alarms.checkSources([alarms.parseRule("threshold,source=counts,level=5")], ["fast"])
+
+    with pytest.raises(ValueError):
+        alarms.checkSources([alarms.parseRule("threshold,level=100")], ["fast"])
+
+    with pytest.raises(ValueError):
+        pipeline.buildPipeline(["fast"], textOut = False, alarm = alarms.alarmStage([alarms.parseRule("threshold,level=100")], textOut = False))
+
+    pipe = pipeline.buildPipeline(["fast"], textOut = False, alarm = alarms.alarmStage([alarms.parseRule("threshold,source=fast,level=100")], textOut = False))
+    pipe.finish()
+
+
+def test_stageFlagsAndNotifies():
+    """
+    The stage sets the alarm flag while a rule is raised and every notifier gets every event, a slow one not holding up the others.
+    """
+
+    fast = slowNotifier()
+    slow = slowNotifier(0.2)
+    seen = []
+
+    stage = alarms.alarmStage([alarms.thresholdRule("high", 100.0, source = "fast")], notifiers = [fast, slow, alarms.callbackNotifier(seen.append)], textOut = False)
+
+    smpl = sample(120)
+    stage.process(smpl)
+
+    assert smpl['alarm'] == {'active': ["high"], 'flags': pipeline.f_alarm}
+
+    smpl = sample(50)
+    stage.process(smpl)
+
+    assert smpl['alarm']['flags'] == 0
+
+    # The quick notifiers shouldn't wait on the slow one.
+    deadline = time.time() + 1.0
+
+    while ((len(fast.events) < 2) or (len(seen) < 2)) and (time.time() < deadline):
+        time.sleep(0.01)
+
+    assert [event['state'] for event in fast.events] == ["raised", "cleared"]
+    assert len(slow.events) < 2
+
+    summary = {}
+    stage.finish(summary)
+
+    assert [event['state'] for event in slow.events] == ["raised", "cleared"]
+    assert [event['state'] for event in seen] == ["raised", "cleared"]
+    assert summary['alarm']['count'] == 6
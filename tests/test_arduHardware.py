@@ -0,0 +1,176 @@
+###############
+### Imports ###
+###############
+
+import sys
+import types
+import arduHardware
+import pipeline
+
+
+###############
+### Helpers ###
+###############
+
+def fakeQuick2wire(monkeypatch, replies):
+    """
+    Put a stand-in quick2wire I2C library in place whose transactions return replies in turn, each a (32-bit total, gate sequence number) pair as the Arduino sends them.
+    """
+
+    replies = list(replies)
+
+    class I2CMaster(object):
+        def __init__(self, bus):
+            """
+            Stand-in I2C master.
+            """
+
+            self.bus = bus
+
+        def transaction(self, reading):
+            """
+            Return the next reply, or the last one again once they run out.
+            """
+
+            total, seq = replies.pop(0) if len(replies) > 1 else replies[0]
+
+            return [bytes([(total >> 24) & 0xff, (total >> 16) & 0xff, (total >> 8) & 0xff, total & 0xff, seq])]
+
+    i2c = types.ModuleType("quick2wire.i2c")
+    i2c.I2CMaster = I2CMaster
+    i2c.reading = lambda addr, n: (addr, n)
+
+    package = types.ModuleType("quick2wire")
+    package.i2c = i2c
+
+    monkeypatch.setitem(sys.modules, "quick2wire", package)
+    monkeypatch.setitem(sys.modules, "quick2wire.i2c", i2c)
+
+
+###################
+### wideCounter ###
+###################
+
+def test_wideCounterFirstReading():
+    """
+    The first reading only sets the starting point.
+    """
+
+    wide = arduHardware.wideCounter()
+
+    assert wide.update(12345) == (None, 0)
+    assert wide.total == 0
+
+
+def test_wideCounterWrap():
+    """
+    Counts across the 32-bit wrap come out right and are flagged as a wrap.
+    """
+
+    wide = arduHardware.wideCounter()
+    wide.update(0xfffffff0)
+
+    delta, flags = wide.update(0x10)
+
+    assert delta == 0x20
+    assert flags == pipeline.f_counter_wrap
+    assert wide.wraps == 1
+    assert wide.total == 0x20
+
+    # And carry on normally after.
+    assert wide.update(0x30) == (0x20, 0)
+    assert wide.total == 0x40
+
+
+def test_wideCounterOverflow():
+    """
+    A jump of half the range or more can't be told from a restart, so it's taken as one and flagged.
+    """
+
+    wide = arduHardware.wideCounter()
+    wide.update(1000)
+
+    delta, flags = wide.update(500)
+
+    assert delta == 500
+    assert flags == pipeline.f_counter_overflow
+    assert wide.overflows == 1
+
+
+def test_wideCounterNarrow():
+    """
+    Narrower counters wrap at their own width.
+    """
+
+    wide = arduHardware.wideCounter(bits = 8)
+    wide.update(250)
+
+    assert wide.update(4) == (10, pipeline.f_counter_wrap)
+
+
+#################
+### gateClock ###
+#################
+
+def test_gateClockDrift():
+    """
+    The loop locks onto a device clock running 100 ppm slow and reports the drift.
+    """
+
+    period = 1.0001
+    clock = arduHardware.gateClock(nominal = 1.0)
+
+    for i in range(2000):
+        start, end = clock.update(arrival = 1000.0 + (i * period), seq = i % 256)
+
+    assert abs(clock.getDriftPpm() - 100.0) < 1.0
+    assert abs(end - (1000.0 + (1999 * period))) < 1e-3
+    assert abs((end - start) - period) < 1e-5
+    assert clock.missed == 0
+
+
+def test_gateClockMissedAndRepeated():
+    """
+    Sequence numbers show gates we missed, wrapping at 256, and gates we've seen already.
+    """
+
+    clock = arduHardware.gateClock(nominal = 1.0)
+    clock.update(arrival = 1000.0, seq = 254)
+
+    assert clock.update(arrival = 1000.0, seq = 254) is None
+    assert clock.repeated == 1
+
+    clock.update(arrival = 1003.0, seq = 1)
+
+    assert clock.lastGates == 3
+    assert clock.missed == 2
+
+
+def test_gateClockFreeRun():
+    """
+    Without an arrival time the clock runs on its own estimate.
+    """
+
+    clock = arduHardware.gateClock(nominal = 2.0)
+    clock.update(arrival = 1000.0)
+
+    assert clock.update() == (1000.0, 1002.0)
+    assert clock.nextEdge() == 1004.0
+
+
+###########
+### I2C ###
+###########
+
+def test_i2cMissedGatesKeepRemainder(monkeypatch):
+    """
+    Counts over gates we missed are shared out without losing what doesn't divide evenly.
+    """
+
+    fakeQuick2wire(monkeypatch, [(1000, 5), (1100, 6), (1100, 6), (1200, 9)])
+
+    hw = arduHardware.arduI2cHardware()
+    hw.setup()
+
+    assert hw.poll() == 100
+    assert hw.poll() == 34
@@ -0,0 +1,188 @@
+###############
+### Imports ###
+###############
+
+import datetime
+import math
+import numpy as np
+import pytest
+import baseline
+import pipeline
+
+
+###############
+### Helpers ###
+###############
+
+def dailyRate(tod):
+    """
+    Get a rate in counts per second that's highest at midnight and lowest at noon, as radon builds up overnight.
+    """
+
+    return 0.5 + (0.3 * math.cos(2.0 * math.pi * tod / 86400.0))
+
+
+def feed(stage, days, start = datetime.datetime(2020, 1, 1), gateLen = 60.0, seed = 1, spike = None):
+    """
+    Feed stage days of gateLen second gates of Poisson counts at dailyRate() from start, with the rate multiplied by spike[2] from gate spike[0] up to gate spike[1] if given, and get the samples.
+    """
+
+    rng = np.random.default_rng(seed)
+    smpls = []
+
+    for i in range(int(days * 86400.0 / gateLen)):
+        dts = start + datetime.timedelta(seconds = i * gateLen)
+        rate = dailyRate((dts.hour * 3600.0) + (dts.minute * 60.0) + dts.second) * gateLen
+
+        if (spike is not None) and (spike[0] <= i < spike[1]):
+            rate *= spike[2]
+
+        smpl = {'dts': dts, 'counts': int(rng.poisson(rate)), 'gateLen': gateLen}
+        stage.process(smpl)
+        smpls.append(smpl)
+
+    return smpls
+
+
+#############
+### Tests ###
+#############
+
+def test_notReadyAtFirst():
+    """
+    Nothing is expected until the bins either side have seen minDays days of readings, wrapping round midnight.
+    """
+
+    bl = baseline.todBaseline(bins = 24, minDays = 1.0)
+    bl.add(1800.0, 5.0, duration = 3599.0)
+    bl.add(5400.0, 5.0, duration = 3600.0)
+
+    assert bl.expect(3600.0) is None
+
+    bl.add(1800.0, 5.0, duration = 1.0)
+
+    assert bl.expect(3600.0) == (5.0, 0.0)
+    assert bl.expect(0.0) is None
+
+
+def test_interpolates():
+    """
+    Expected values are interpolated between bin centres, wrapping round midnight.
+    """
+
+    bl = baseline.todBaseline(bins = 24, minDays = 0.0)
+
+    for hour in range(24):
+        bl.add(hour * 3600.0, float(hour), duration = 3600.0)
+
+    assert bl.expect(3600.0 * 3.5)[0] == pytest.approx(3.0)
+    assert bl.expect(3600.0 * 4.0)[0] == pytest.approx(3.5)
+    assert bl.expect(3600.0 * 23.75)[0] == pytest.approx(23.0 * 0.75)
+
+
+def test_learnsDailyPattern():
+    """
+    A few days of readings teach the baseline the daily pattern and its spread.
+    """
+
+    bl = baseline.todBaseline(bins = 24)
+    rng = np.random.default_rng(2)
+
+    for i in range(4 * 1440):
+        tod = (i % 1440) * 60.0
+        bl.add(tod, rng.poisson(dailyRate(tod) * 60.0) / 60.0, duration = 60.0)
+
+    for tod in (0.0, 21600.0, 43200.0):
+        mean, var = bl.expect(tod + 1800.0)
+
+        assert mean == pytest.approx(dailyRate(tod + 1800.0), abs = 0.03)
+        assert math.sqrt(var) == pytest.approx(math.sqrt(dailyRate(tod + 1800.0) / 60.0), rel = 0.3)
+
+
+def test_clipped():
+    """
+    With clipping, a run of outliers only pulls the mean a little way towards them.
+    """
+
+    clipped = baseline.todBaseline(bins = 24, minDays = 0.5)
+    plain = baseline.todBaseline(bins = 24, minDays = 0.5)
+    rng = np.random.default_rng(3)
+
+    for x in rng.normal(10.0, 1.0, 3600):
+        clipped.add(1800.0, x, clip = 4.0)
+        plain.add(1800.0, x)
+
+    for i in range(600):
+        clipped.add(1800.0, 1000.0, clip = 4.0)
+        plain.add(1800.0, 1000.0)
+
+    assert clipped.getState()['mean'][0] < 20.0
+    assert plain.getState()['mean'][0] > 100.0
+
+
+def test_state():
+    """
+    Bins restore from a saved state, and only into a baseline with as many bins.
+    """
+
+    bl = baseline.todBaseline(bins = 24, minDays = 0.0)
+    bl.add(100.0, 3.0, duration = 3600.0)
+
+    other = baseline.todBaseline(bins = 24, minDays = 0.0)
+    other.setState(bl.getState())
+
+    assert other.getState() == bl.getState()
+
+    with pytest.raises(ValueError):
+        baseline.todBaseline(bins = 96).setState(bl.getState())
+
+
+def test_stageFlagsAnomaly():
+    """
+    Once the baseline has learned the daily pattern, its ups and downs aren't anomalous, but a rise on top of it is, and is counted.
+    """
+
+    stage = baseline.baselineStage(bins = 24, textOut = False)
+
+    # Three days to learn, then a day with the rate tripled for half an hour at noon. Clipped readings still widen the bin's spread, so the flag doesn't last the whole half hour.
+    smpls = feed(stage, 4, spike = (4320 + 720, 4320 + 750, 3.0))
+    learnt = smpls[1440:4320]
+    spike = smpls[(4320 + 720):(4320 + 750)]
+
+    assert smpls[0]['baseline']['ready'] == False
+    assert sum([(smpl['baseline']['flags'] & pipeline.f_anomaly) != 0 for smpl in learnt]) < 5
+    assert sum([(smpl['baseline']['flags'] & pipeline.f_anomaly) != 0 for smpl in spike]) > 10
+    assert (smpls[-1]['baseline']['flags'] & pipeline.f_anomaly) == 0
+
+    summary = {}
+    stage.finish(summary)
+
+    assert summary['baseline']['anomalies'] > 10
+
+
+def test_stageSource():
+    """
+    With a source stage the baseline learns that stage's rate rather than the raw counts.
+    """
+
+    stage = baseline.baselineStage(source = "fast", bins = 24, textOut = False)
+    stage.process({'dts': datetime.datetime(2020, 1, 1), 'counts': 1000, 'gateLen': 1.0, 'fast': {'cps': 2.0}})
+
+    assert stage.getState()['baseline']['mean'][0] == 2.0
+
+
+def test_stageStateFile(tmp_path):
+    """
+    With a state file the baseline carries over from one run to the next.
+    """
+
+    stateFile = str(tmp_path / "baseline.json")
+
+    first = baseline.baselineStage(bins = 24, stateFile = stateFile, textOut = False)
+    feed(first, 2)
+    first.finish({})
+
+    second = baseline.baselineStage(bins = 24, stateFile = stateFile, textOut = False)
+    smpls = feed(second, 0.1, start = datetime.datetime(2020, 1, 3), seed = 4)
+
+    assert all([smpl['baseline']['ready'] for smpl in smpls])
@@ -0,0 +1,330 @@
+###############
+### Imports ###
+###############
+
+import numpy as np
+import pytest
+import calibration
+import coincidence
+import counter
+import pipeline
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+class recorder(object):
+    def __init__(self):
+        """
+        Stand-in datalayer that keeps what's stored as (timestamp, value, flags) rows.
+        """
+
+        self.rows = []
+
+    def storeDatapoint(self, dataPoint):
+        """
+        Keep one data point.
+        """
+
+        ts = (dataPoint[0] - pipeline.datetime.datetime(1970, 1, 1)).total_seconds()
+        self.rows.append((ts, dataPoint[1], dataPoint[2] if len(dataPoint) > 2 else None))
+
+    def storeBlock(self, ts, values, flags = None):
+        """
+        Keep a block of data points.
+        """
+
+        for i in range(len(ts)):
+            self.rows.append((float(ts[i]), float(values[i]), int(flags[i]) if flags is not None else None))
+
+    def flush(self):
+        """
+        Nothing to flush.
+        """
+
+        return
+
+
+def gates(n = 40, seed = 4):
+    """
+    Get a block of n gates with uneven gate lengths, a burst of high counts in the middle and the counter wrap flag set.
+    """
+
+    rnd = np.random.default_rng(seed)
+    gateLens = rnd.choice([0.5, 1.0, 2.0], n)
+    counts = rnd.poisson(30.0 * gateLens)
+    counts[(n // 2):((n // 2) + 3)] = 4000
+    ends = 1700000000.0 + np.cumsum(gateLens)
+
+    return pipeline.makeBlock(counts, ends, gateLens, pipeline.f_counter_wrap)
+
+
+def constantRate(n = 60, cps = 30.0, seed = 7):
+    """
+    Get a block of n gates of mixed lengths from a source giving exactly cps counts a second, so every rate should come out as cps.
+    """
+
+    gateLens = np.random.default_rng(seed).choice([0.5, 1.0, 2.0], n)
+    counts = (cps * gateLens).astype(np.int64)
+    ends = 1700000000.0 + np.cumsum(gateLens)
+
+    return pipeline.makeBlock(counts, ends, gateLens, 0)
+
+
+def runGates(stage, blk, before = None):
+    """
+    Run a block through a stage a gate at a time, after the stages in before, and return the stage's results as a block result, or None if it has none.
+    """
+
+    rows = []
+
+    for i in range(blk['n']):
+        smpl = pipeline.blockRow(blk, i)
+
+        for prev in (before or []):
+            prev.process(smpl)
+
+        stage.process(smpl)
+        rows.append(smpl.get(stage.name))
+
+    if all([row is None for row in rows]):
+        return None
+
+    return pipeline.blockResults(rows)
+
+
+def runBlock(stage, blk, before = None):
+    """
+    Run a block through a stage in one go, after the stages in before, and return the stage's results, or None if it has none.
+    """
+
+    blk = dict(blk)
+
+    for prev in (before or []):
+        prev.processBlock(blk)
+
+    stage.processBlock(blk)
+
+    return blk.get(stage.name)
+
+
+def assertSame(gateRes, blockRes):
+    """
+    Check every field of a stage's results agrees, gate for gate.
+    """
+
+    assert set(gateRes.keys()) == set(blockRes.keys())
+
+    for field in gateRes:
+        assert np.allclose(np.asarray(gateRes[field], dtype = np.float64), np.asarray(blockRes[field], dtype = np.float64)), field
+
+
+def assertSameState(gateState, blockState):
+    """
+    Check two stages' checkpoint states agree, allowing for floating point sums done in a different order.
+    """
+
+    if gateState is None:
+        assert blockState is None
+        return
+
+    assert set(gateState.keys()) == set(blockState.keys())
+
+    for key in gateState:
+        if isinstance(gateState[key], float):
+            assert blockState[key] == pytest.approx(gateState[key]), key
+        else:
+            assert blockState[key] == gateState[key], key
+
+
+def calib():
+    """
+    Get a calibration with enough dead time for the burst to saturate.
+    """
+
+    return calibration.calibration({'factor': 0.0057, 'deadTime': 0.0005})
+
+
+#############
+### Tests ###
+#############
+
+@pytest.mark.parametrize('makeStage', [
+    lambda: pipeline.counterStage(),
+    lambda: pipeline.averagerStage("fast", 4, pipeline.f_mode_fast),
+    lambda: pipeline.averagerStage("slow", 22, pipeline.f_mode_slow),
+    lambda: pipeline.scalerStage(textOut = False),
+    lambda: calibration.doseStage(calib(), textOut = False),
+], ids = ['counter', 'fast', 'slow', 'scaler', 'dose'])
+def test_stageBlockMatchesGates(makeStage):
+    """
+    Every stage with its own processBlock gives the same results as process() a gate at a time, across two blocks so state carries over.
+    """
+
+    blk = gates()
+    first = dict([(key, value[:25] if isinstance(value, np.ndarray) else value) for key, value in blk.items()])
+    first['n'] = 25
+    second = dict([(key, value[25:] if isinstance(value, np.ndarray) else value) for key, value in blk.items()])
+    second['n'] = blk['n'] - 25
+
+    gateStage = makeStage()
+    blockStage = makeStage()
+
+    for part in (first, second):
+        assertSame(runGates(gateStage, part), runBlock(blockStage, part))
+
+    assert gateStage.flags == blockStage.flags
+    assertSameState(gateStage.getState(), blockStage.getState())
+
+
+def test_doseOnSourceBlockMatchesGates():
+    """
+    The dose stage gives the same results on an averaging stage's rates either way.
+    """
+
+    blk = gates()
+
+    gateRes = runGates(calibration.doseStage(calib(), source = "fast", textOut = False), blk, [pipeline.averagerStage("fast", 4, pipeline.f_mode_fast)])
+    blockRes = runBlock(calibration.doseStage(calib(), source = "fast", textOut = False), blk, [pipeline.averagerStage("fast", 4, pipeline.f_mode_fast)])
+
+    assertSame(gateRes, blockRes)
+    assert blockRes['saturated'].any()
+
+
+def test_storageBlockMatchesGates():
+    """
+    The storage stage stores the same timestamps, values and flags either way.
+    """
+
+    blk = gates()
+    gateStg = recorder()
+    blockStg = recorder()
+
+    for stg, run in ((gateStg, runGates), (blockStg, runBlock)):
+        stages = [pipeline.averagerStage("fast", 4, pipeline.f_mode_fast), calibration.doseStage(calib(), source = "fast", textOut = False)]
+        run(pipeline.storageStage("fast", stg, flagStages = ["dose"]), blk, stages)
+
+    assert len(gateStg.rows) == blk['n']
+    assert [row[2] for row in gateStg.rows] == [row[2] for row in blockStg.rows]
+    assert np.allclose([row[0] for row in gateStg.rows], [row[0] for row in blockStg.rows])
+    assert np.allclose([row[1] for row in gateStg.rows], [row[1] for row in blockStg.rows])
+    assert all([(row[2] & pipeline.f_counter_wrap) != 0 for row in gateStg.rows])
+
+
+def test_pipelineBlockMatchesGates():
+    """
+    A whole pipeline built from the command line stage list stores the same data either way.
+    """
+
+    blk = gates()
+    stores = {}
+
+    for mode in ("gate", "block"):
+        stores[mode] = {}
+
+        def stgFactory(stageName):
+            stores[mode][stageName] = recorder()
+
+            return stores[mode][stageName]
+
+        pipe = pipeline.buildPipeline(['fast', 'slow', 'counter', 'scaler', 'health', 'dose', 'trend'], textOut = False, stgFactory = stgFactory, calib = calib())
+
+        if mode == "gate":
+            for i in range(blk['n']):
+                pipe.process(pipeline.blockRow(blk, i))
+
+        else:
+            pipe.processBlock(dict(blk))
+
+    for stageName in stores['gate']:
+        gateRows = stores['gate'][stageName].rows
+        blockRows = stores['block'][stageName].rows
+
+        assert [row[2] for row in gateRows] == [row[2] for row in blockRows], stageName
+        assert np.allclose([row[1] for row in gateRows], [row[1] for row in blockRows]), stageName
+
+
+def test_coincidenceRefusesBlocks():
+    """
+    The coincidence stage needs each gate's channel readings, which blocks don't have.
+    """
+
+    stage = coincidence.coincidenceStage(["tube0", "tube1"], textOut = False)
+
+    with pytest.raises(RuntimeError):
+        stage.processBlock(gates())
+
+
+@pytest.mark.parametrize('makeStage', [
+    lambda: pipeline.counterStage(),
+    lambda: pipeline.averagerStage("fast", 4, pipeline.f_mode_fast),
+    lambda: pipeline.averagerStage("slow", 22, pipeline.f_mode_slow),
+    lambda: pipeline.scalerStage(textOut = False),
+], ids = ['counter', 'fast', 'slow', 'scaler'])
+def test_constantRateMixedGates(makeStage):
+    """
+    A constant rate comes out constant over gates of different lengths, whether the window holds one length or several, gate at a time or in a block.
+    """
+
+    blk = constantRate()
+
+    for res in (runGates(makeStage(), blk), runBlock(makeStage(), blk)):
+        assert np.allclose(res['cps'], 30.0)
+        assert np.allclose(res['cpm'], 1800.0)
+
+
+def test_scalerGateTime():
+    """
+    The scaler's run time is the time its gates cover, not how many there were.
+    """
+
+    blk = constantRate()
+    stage = pipeline.scalerStage(textOut = False)
+    stage.processBlock(dict(blk))
+
+    summary = {}
+    stage.finish(summary)
+
+    assert summary['scaler']['liveTime'] == pytest.approx(float(blk['gateLen'].sum()))
+    assert summary['scaler']['n'] == blk['n']
+    assert summary['scaler']['cps'] == pytest.approx(30.0)
+
+
+def test_sprtMixedGates():
+    """
+    The sequential test learns a constant rate over mixed gate lengths without raising, and times detections by gate length.
+    """
+
+    blk = constantRate(200)
+    stage = pipeline.sprtStage(textOut = False)
+    res = runGates(stage, blk)
+
+    assert np.allclose(res['cps'], 30.0)
+    assert np.allclose(res['background'], 1800.0)
+    assert not res['elevated'].any()
+
+    # Triple the rate and it's spotted within a few seconds of gates.
+    hot = constantRate(20, cps = 90.0, seed = 8)
+    hotRes = runGates(stage, hot)
+    ttd = [t for t in hotRes['ttd'] if t is not None]
+
+    assert len(ttd) == 1
+    assert ttd[0] in np.cumsum(hot['gateLen']).tolist()
+    assert ttd[0] <= 4.0
+
+
+def test_counterScalerGateTime():
+    """
+    Scaler mode counts the time its gates cover, including when run a block at a time.
+    """
+
+    sim = simHardware.simHardware()
+    sim.setSimProps(background = 30.0, seed = 1, speed = 0, gateTime = 0.5, blockSize = 1000)
+
+    ctr = counter.geigerInterface(sim, mode = "scaler", quiet = True, time = 60)
+    ctr.runBlocks(ctr.dispatchBlock, interval = 0)
+
+    assert ctr.getStatus()['scaler']['time'] == 60.0
+    assert abs((ctr.getStatus()['scaler']['counts'] / 60.0) - 30.0) < 3.0
@@ -0,0 +1,197 @@
+###############
+### Imports ###
+###############
+
+import json
+import math
+import os
+import subprocess
+import sys
+import numpy as np
+import pytest
+import calibration
+import datalayer
+import journal
+import pipeline
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+def runCli(*args):
+    """
+    Run calibration.py from the repository root with args, and get what it printed.
+    """
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    return subprocess.run([sys.executable, os.path.join(root, "calibration.py")] + list(args), cwd = root, check = True, capture_output = True, text = True).stdout
+
+
+#############
+### Tests ###
+#############
+
+def test_nonParalyzable():
+    """
+    Rates a non-paralyzable tube measures, n / (1 + n * tau), are corrected back to the true rates.
+    """
+
+    calib = calibration.calibration({'factor': 1.0, 'deadTime': 1e-4})
+    n = np.array([0.0, 10.0, 1000.0, 50000.0])
+
+    assert np.allclose(calib.trueRate(n / (1.0 + (n * 1e-4))), n)
+    assert calib.saturated(n / (1.0 + (n * 1e-4))).tolist() == [False, False, False, False]
+
+
+def test_paralyzable():
+    """
+    Rates a paralyzable tube measures, n * exp(-n * tau), are corrected back to the true rates below 1 / tau, where the measured rate peaks.
+    """
+
+    calib = calibration.calibration({'factor': 1.0, 'deadTime': 1e-4, 'deadTimeModel': "paralyzable"})
+    n = np.array([0.0, 10.0, 1000.0, 5000.0, 9000.0])
+
+    assert np.allclose(calib.trueRate(n * np.exp(-n * 1e-4)), n, rtol = 1e-6)
+
+
+def test_saturation():
+    """
+    Rates past what can be corrected are flagged and held at the highest rate that can be, for either model.
+    """
+
+    nonPar = calibration.calibration({'factor': 1.0, 'deadTime': 1e-4})
+    par = calibration.calibration({'factor': 1.0, 'deadTime': 1e-4, 'deadTimeModel': "paralyzable"})
+
+    assert nonPar.saturated([9800.0, 9950.0]).tolist() == [False, True]
+    assert nonPar.trueRate(20000.0) == pytest.approx(nonPar.trueRate(9900.0))
+
+    peak = 1.0 / (math.e * 1e-4)
+
+    assert par.saturated([peak * 0.999, peak * 1.001]).tolist() == [False, True]
+    assert par.trueRate(peak * 2.0) == pytest.approx(1e4, rel = 1e-3)
+
+
+def test_simulatedDeadTime():
+    """
+    Correcting the simulator's dead time counts gets the simulated background back.
+    """
+
+    sim = simHardware.simHardware()
+    sim.setSimProps(background = 2000.0, deadTime = 2e-4, seed = 1, speed = 0, blockSize = 1000)
+    sim.setup()
+
+    counts, ends, gateLens = sim.pollBlock()
+    calib = calibration.calibration({'factor': 1.0, 'deadTime': 2e-4})
+
+    assert abs(np.mean(counts) - (2000.0 / 1.4)) < 5.0
+    assert abs(np.mean(calib.trueRate(counts)) - 2000.0) < 10.0
+
+
+def test_responses():
+    """
+    Linear, piecewise and table responses turn true CPM less background into uSv/h, with energy compensation on top.
+    """
+
+    linear = calibration.calibration({'factor': 0.01, 'background': 6.0, 'energyFactor': 2.0})
+
+    assert np.allclose(linear.doseRate([0.05, 1.0]), [0.0, 1.08])
+
+    piecewise = calibration.calibration({'response': {'type': "piecewise", 'breaks': [0.0, 100.0], 'factors': [0.01, 0.02]}})
+
+    assert np.allclose(piecewise.response([50.0, 100.0, 200.0]), [0.5, 2.0, 4.0])
+
+    table = calibration.calibration({'response': {'type': "table", 'cpm': [10.0, 20.0, 40.0], 'usvh': [0.1, 0.3, 0.5]}})
+
+    assert np.allclose(table.response([0.0, 15.0, 30.0, 60.0]), [-0.1, 0.2, 0.4, 0.7])
+
+
+def test_badProfiles():
+    """
+    Profiles that can't be used are refused.
+    """
+
+    for profile in (
+        {'factor': 1.0, 'deadTime': -1e-4},
+        {'factor': 1.0, 'deadTimeModel': "extendable"},
+        {'deadTime': 1e-4},
+        {'response': {'type': "cubic"}},
+        {'response': {'type': "piecewise", 'breaks': [10.0, 0.0], 'factors': [1.0, 2.0]}},
+        {'response': {'type': "table", 'cpm': [10.0], 'usvh': [0.1]}},
+    ):
+        with pytest.raises(ValueError):
+            calibration.calibration(profile)
+
+
+def test_loadProfiles(tmp_path):
+    """
+    A lone profile is the default, and detectors without their own calibration get it.
+    """
+
+    fileName = str(tmp_path / "profiles.json")
+
+    with open(fileName, 'w') as profileFile:
+        json.dump({'factor': 0.0057, 'deadTime': 1e-4}, profileFile)
+
+    calibs = calibration.loadProfiles(fileName)
+
+    assert list(calibs.keys()) == ["default"]
+    assert calibration.getCalibration(calibs, "counter1") is calibs['default']
+
+    with pytest.raises(ValueError):
+        calibration.getCalibration({'tube0': calibs['default']}, "tube1")
+
+
+def test_convertSeries():
+    """
+    Stored CPM and counts per gate convert to the same dose rates.
+    """
+
+    calib = calibration.calibration({'factor': 0.01, 'deadTime': 1e-4})
+
+    cpmRates, cpmSat = calibration.convertSeries(calib, [600.0, 1200.0])
+    countRates, countSat = calibration.convertSeries(calib, [20.0, 40.0], gateLen = 2.0, units = 'counts')
+
+    assert np.allclose(cpmRates, countRates)
+    assert cpmSat.tolist() == [False, False]
+
+    with pytest.raises(ValueError):
+        calibration.convertSeries(calib, [1.0], units = 'cps')
+
+
+def test_convertFiles(tmp_path):
+    """
+    Converting a stored series keeps its format, told by the journal's frame magic rather than the file names, keeps flags and flags saturated readings.
+    """
+
+    profiles = str(tmp_path / "profiles.json")
+
+    with open(profiles, 'w') as profileFile:
+        json.dump({'factor': 0.01, 'deadTime': 1e-3}, profileFile)
+
+    # A journal that isn't called .journal, with one saturated reading.
+    jnl = journal.journal(str(tmp_path / "rates.jnl"), commitInterval = 1e9, blockSize = 512)
+    jnl.appendMany(np.array([1000.0, 1001.0]), np.array([600.0, 60000.0]), np.array([pipeline.f_anomaly, 0]))
+    jnl.close()
+
+    runCli(profiles, str(tmp_path / "rates.jnl"), "--out", str(tmp_path / "dose.csv"))
+
+    assert journal.isJournal(str(tmp_path / "dose.csv")) == True
+
+    ts, usvh, flags = datalayer.loadSeries(str(tmp_path / "dose.csv"))
+
+    assert usvh[0] == pytest.approx(0.01 * 600.0 / 0.99, abs = 1e-6)
+    assert flags.tolist() == [pipeline.f_anomaly, pipeline.f_saturated]
+
+    # And a CSV file stays CSV whatever the output's called.
+    stg = datalayer.datalayer("csv", None)
+    stg.setStorageProps({'fileName': str(tmp_path / "rates.csv")})
+    stg.storeBlock(np.array([1000.0]), np.array([600.0]), None)
+    stg.close()
+
+    runCli(profiles, str(tmp_path / "rates.csv"), "--out", str(tmp_path / "dose.journal"))
+
+    assert journal.isJournal(str(tmp_path / "dose.journal")) == False
+    assert datalayer.loadSeries(str(tmp_path / "dose.journal"))[1].tolist() == [pytest.approx(0.01 * 600.0 / 0.99, abs = 1e-6)]
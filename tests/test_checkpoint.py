@@ -0,0 +1,112 @@
+###############
+### Imports ###
+###############
+
+import os
+import datetime
+import pytest
+import checkpoint
+import counter
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+def sim():
+    """
+    Get a repeatable simulator running as fast as it can.
+    """
+
+    hw = simHardware.simHardware()
+    hw.setSimProps(background = 10.0, seed = 1, speed = 0)
+
+    return hw
+
+
+#############
+### Tests ###
+#############
+
+def test_saveLoad(tmp_path):
+    """
+    A saved state loads back the same, with no temporary file left behind, and a missing checkpoint loads as None.
+    """
+
+    ckpt = checkpoint.checkpoint(str(tmp_path / "state.json"))
+
+    assert ckpt.load() is None
+
+    ckpt.save({'mode': "counter", 'samples': [1, 2, 3]})
+    ckpt.save({'mode': "counter", 'samples': [4, 5, 6]})
+
+    assert ckpt.load() == {'mode': "counter", 'samples': [4, 5, 6]}
+    assert ckpt.saves == 2
+    assert os.listdir(str(tmp_path)) == ["state.json"]
+
+
+def test_timestamps(tmp_path):
+    """
+    Timestamps survive the checkpoint string form to the microsecond.
+    """
+
+    ckpt = checkpoint.checkpoint(str(tmp_path / "state.json"))
+    dts = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456)
+
+    assert ckpt.fromStr(ckpt.toStr(dts)) == dts
+
+
+def test_resumeContinues(tmp_path):
+    """
+    A resumed run carries on the saved measurement, keeping its start time and recording the gap.
+    """
+
+    ckpt = checkpoint.checkpoint(str(tmp_path / "state.json"))
+
+    first = counter.geigerInterface(sim(), mode = "counter", quiet = True, time = 5)
+    first.setCheckpoint(ckpt, interval = 2)
+    first.run(lambda reading: None)
+
+    saved = ckpt.load()
+
+    assert saved['runtime'] == 5
+    assert saved['gaps'] == []
+
+    second = counter.geigerInterface(sim(), mode = "counter", quiet = True, time = 3)
+    second.setCheckpoint(ckpt, interval = 2)
+
+    assert second.resume() == True
+
+    second.run(lambda reading: None)
+    state = second.getState()
+
+    assert state['dtsStart'] == saved['dtsStart']
+    assert state['runtime'] > saved['runtime']
+    assert state['measCts'] > saved['measCts']
+    assert len(state['gaps']) == 1
+    assert state['gaps'][0][0] == saved['saved']
+
+
+def test_resumeChecks(tmp_path):
+    """
+    Resuming with no checkpoint file starts afresh, and resuming a different mode's checkpoint or without a checkpoint raises.
+    """
+
+    ckpt = checkpoint.checkpoint(str(tmp_path / "state.json"))
+
+    ctr = counter.geigerInterface(sim(), mode = "counter", quiet = True, time = 2)
+    ctr.setCheckpoint(ckpt)
+
+    assert ctr.resume() == False
+
+    ctr.run(lambda reading: None)
+
+    other = counter.geigerInterface(sim(), mode = "scaler", quiet = True, time = 2)
+    other.setCheckpoint(ckpt)
+
+    with pytest.raises(RuntimeError):
+        other.resume()
+
+    with pytest.raises(RuntimeError):
+        counter.geigerInterface(sim(), mode = "counter", quiet = True, time = 2).resume()
@@ -0,0 +1,202 @@
+###############
+### Imports ###
+###############
+
+import numpy as np
+import pytest
+import coincidence
+import counter
+import pipeline
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+def gateSample(**fields):
+    """
+    Get a one second gate's sample with the given channel readings or pulse times.
+    """
+
+    smpl = {'dts': None, 'mono': 0.0, 'counts': 0, 'gateLen': 1.0}
+    smpl.update(fields)
+
+    return smpl
+
+
+class keeper(pipeline.pipelineStage):
+    def __init__(self):
+        """
+        Pipeline stage that keeps every sample it sees.
+        """
+
+        super(keeper, self).__init__("keeper")
+
+        self.samples = []
+
+    def process(self, smpl):
+        """
+        Keep the sample.
+        """
+
+        self.samples.append(smpl)
+
+
+def runSim(stage, seconds, **props):
+    """
+    Run a quiet counter mode measurement of seconds gates through a pipeline ending in stage, on a simulator with two tubes and any other properties, and get the run summary.
+    """
+
+    sim = simHardware.simHardware()
+    sim.setSimProps(seed = 1, speed = 0, blockSize = 1000, tubes = 2, **props)
+
+    ctr = counter.geigerInterface(sim, mode = "counter", quiet = True, time = seconds)
+    pipe = pipeline.pipeline([pipeline.counterStage(), stage])
+    summary = {}
+
+    ctr.runPipeline(pipe)
+    stage.finish(summary)
+
+    return summary[stage.name]
+
+
+#############
+### Tests ###
+#############
+
+def test_findCoincidences():
+    """
+    Pulses within the window of each other are grouped, chains of close pulses are one group, and pulses alone in their group are anti-coincidences.
+    """
+
+    pulses = [np.array([0.0, 1.0, 5.0]), np.array([0.000005, 3.0]), np.array([1.000008, 1.000016])]
+
+    assert coincidence.findCoincidences(pulses, 1e-5) == (2, [1, 1, 0])
+    assert coincidence.findCoincidences(pulses, 1e-5, minFold = 3) == (0, [1, 1, 0])
+    assert coincidence.findCoincidences([np.zeros(0), np.zeros(0)], 1e-5) == (0, [0, 0])
+
+
+def test_gateCoincidences():
+    """
+    Gates where enough tubes counted are coincident, and counts in gates only one tube counted in are anti-coincidences.
+    """
+
+    coinc, anti = coincidence.gateCoincidences([[1, 0, 2, 0], [3, 0, 0, 1], [0, 0, 1, 0]])
+
+    assert coinc.tolist() == [True, False, True, False]
+    assert anti.tolist() == [[0, 0, 0, 0], [0, 0, 0, 1], [0, 0, 0, 0]]
+    assert coincidence.gateCoincidences([[1, 0, 2], [3, 0, 0], [0, 0, 1]], minFold = 3)[0].tolist() == [False, False, False]
+
+
+def test_accidentals():
+    """
+    The accidental rates match what uncorrelated pulses and gates give.
+    """
+
+    assert coincidence.accidentalRate([100.0, 200.0], 1e-5) == pytest.approx(0.4)
+    assert coincidence.accidentalRate([100.0, 200.0, 300.0], 1e-5, minFold = 3) == pytest.approx(3.0 * 1e-10 * 6e6)
+
+    # Two tubes counting at 1 CPS in one second gates.
+    p = 1.0 - np.exp(-1.0)
+
+    assert coincidence.gateAccidentalProb([1.0, 1.0], 1.0) == pytest.approx(p * p)
+    assert coincidence.gateAccidentalProb([1.0, 1.0, 1.0], 1.0) == pytest.approx((3.0 * p * p * (1.0 - p)) + (p ** 3))
+
+    rng = np.random.default_rng(5)
+    pulses = [np.sort(rng.uniform(0.0, 10000.0, rng.poisson(rate * 10000.0))) for rate in (50.0, 80.0)]
+    coinc, anti = coincidence.findCoincidences(pulses, 1e-4)
+
+    assert abs(coinc - (coincidence.accidentalRate([50.0, 80.0], 1e-4) * 10000.0)) < 4.0 * np.sqrt(coinc)
+
+
+def test_pulseTimeShowers():
+    """
+    With pulse times, showers hitting both tubes stand out over the accidentals, and plain background doesn't.
+    """
+
+    showers = runSim(coincidence.coincidenceStage(["tube0", "tube1"], textOut = False), 600, background = 5.0, showerRate = 0.5, events = True)
+    plain = runSim(coincidence.coincidenceStage(["tube0", "tube1"], textOut = False), 600, background = 5.0, events = True)
+
+    assert showers['pulseTimes'] == True
+    assert abs(showers['excess'] - 300.0) < 4.0 * np.sqrt(300.0)
+    assert showers['significance'] > 10.0
+    assert plain['coinc'] < 5
+    assert plain['singlesCpm']['tube0'] == pytest.approx(300.0, rel = 0.1)
+
+
+def test_gateShowers():
+    """
+    Without pulse times, delayed coincidences between gates estimate the accidentals, so only the showers are in excess.
+    """
+
+    showers = runSim(coincidence.coincidenceStage(["tube0", "tube1"], textOut = False), 2000, background = 0.2, showerRate = 0.1)
+    plain = runSim(coincidence.coincidenceStage(["tube0", "tube1"], textOut = False), 2000, background = 0.2)
+
+    # A tube counts in a gate with probability 1 - exp(-0.3), so gates coincide by chance 6.7% of the time going by the singles, and really 9.5% + 90.5% * 3.3% = 12.5% of the time, showers included.
+    assert showers['pulseTimes'] == False
+    assert abs(showers['excess'] - 116.0) < 40.0
+    assert showers['significance'] > 5.0
+    assert abs(plain['excess']) < 40.0
+
+
+def test_derivedPipeline():
+    """
+    Each gate's coincidences go on to their own pipeline.
+    """
+
+    seen = keeper()
+    stage = coincidence.coincidenceStage(["a", "b"], pipe = pipeline.pipeline([pipeline.counterStage(), seen]), textOut = False)
+
+    for a, b in ((1, 1), (0, 2), (3, 4)):
+        smpl = gateSample(channels = {'a': a, 'b': b})
+        stage.process(smpl)
+
+    assert [smpl['counts'] for smpl in seen.samples] == [1, 0, 1]
+    assert smpl['coinc']['anti'] == {'a': 0, 'b': 0}
+
+
+def test_state():
+    """
+    A stage restored from another's state carries on with its totals.
+    """
+
+    first = coincidence.coincidenceStage(["a", "b"], textOut = False)
+    second = coincidence.coincidenceStage(["a", "b"], textOut = False)
+    both = coincidence.coincidenceStage(["a", "b"], textOut = False)
+    gates = [(1, 1), (0, 2), (3, 4), (1, 0), (2, 2)]
+
+    for a, b in gates[:3]:
+        first.process(gateSample(channels = {'a': a, 'b': b}))
+
+    second.setState(first.getState())
+
+    for a, b in gates[3:]:
+        second.process(gateSample(channels = {'a': a, 'b': b}))
+
+    for a, b in gates:
+        both.process(gateSample(channels = {'a': a, 'b': b}))
+
+    resumed = {}
+    straight = {}
+    second.finish(resumed)
+    both.finish(straight)
+
+    assert resumed == straight
+
+
+def test_refused():
+    """
+    Too few channels, gates without the channels' readings and blocks are refused.
+    """
+
+    with pytest.raises(ValueError):
+        coincidence.coincidenceStage(["a", "b"], minFold = 3)
+
+    stage = coincidence.coincidenceStage(["a", "b"], textOut = False)
+
+    with pytest.raises(RuntimeError):
+        stage.process(gateSample(channels = {'a': 1}))
+
+    with pytest.raises(RuntimeError):
+        stage.processBlock(pipeline.makeBlock(np.ones(3), np.arange(3.0), np.ones(3), 0))
@@ -0,0 +1,136 @@
+###############
+### Imports ###
+###############
+
+import asyncio
+import os
+import signal
+import pytest
+import counter
+import daemon
+import hwInterface
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+def newCounter(mode = "fast", adapter = False):
+    """
+    Get a quiet geigerInterface on a simulator doing 50 gates a second, wrapped for asyncio if adapter is True.
+    """
+
+    sim = simHardware.simHardware()
+    sim.setSimProps(background = 10.0, seed = 1, speed = 50)
+
+    return counter.geigerInterface(hwInterface.asyncHwAdapter(sim) if adapter else sim, mode = mode, quiet = True)
+
+
+async def waitFor(path, timeout = 5.0):
+    """
+    Wait for a file to turn up.
+    """
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    while (not os.path.exists(path)) and (loop.time() < deadline):
+        await asyncio.sleep(0.01)
+
+
+#############
+### Tests ###
+#############
+
+def test_commands(tmp_path):
+    """
+    Commands change the counter's mode, windows, scaler and storage, and bad ones raise.
+    """
+
+    ctr = newCounter()
+    ctrl = daemon.controlServer(ctr, textOut = False)
+
+    assert ctrl.command("state")['mode'] == "fast"
+    assert ctrl.command("mode slow")['mode'] == "slow"
+
+    ctrl.command("window fast 6")
+    assert ctrl.command("state")['windows']['fast'] == 6
+
+    ctrl.command("reset")
+    assert ctrl.command("state")['scaler'] == {'counts': 0, 'time': 0}
+
+    ctrl.command("store start %s" %(tmp_path / "out.csv"))
+    assert ctrl.command("state")['storing'] == True
+
+    ctrl.command("store stop")
+    assert ctrl.command("state")['storing'] == False
+
+    for line in ("", "warp 9", "window medium 5", "store pause", "history"):
+        with pytest.raises(ValueError):
+            ctrl.command(line)
+
+
+def test_daemonSocket(tmp_path):
+    """
+    The daemon answers commands on its socket while counting, switches modes without stopping, and cleans up its socket when told to stop.
+    """
+
+    sockPath = str(tmp_path / "ctl.sock")
+    ctr = newCounter(adapter = True)
+
+    async def client():
+        await waitFor(sockPath)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + 10.0
+
+        # Wait for the first gate.
+        while True:
+            state = await loop.run_in_executor(None, daemon.sendCommand, sockPath, "state")
+
+            if (state['result']['lastReading'] is not None) or (loop.time() > deadline):
+                break
+
+            await asyncio.sleep(0.05)
+
+        replies = [state]
+
+        for line in ("mode scaler", "warp 9", "stop"):
+            replies.append(await loop.run_in_executor(None, daemon.sendCommand, sockPath, line))
+
+        return replies
+
+    async def both():
+        return (await asyncio.gather(daemon.runDaemon(ctr, sockPath, textOut = False), client()))[1]
+
+    replies = asyncio.run(both())
+
+    assert replies[0]['ok'] == True
+    assert replies[0]['result']['lastReading'] is not None
+    assert replies[1]['result']['mode'] == "scaler"
+    assert replies[2]['ok'] == False
+    assert replies[3]['ok'] == True
+    assert not os.path.exists(sockPath)
+
+
+def test_daemonSigterm(tmp_path):
+    """
+    SIGTERM stops the daemon cleanly, removing its socket.
+    """
+
+    sockPath = str(tmp_path / "ctl.sock")
+    ctr = newCounter(adapter = True)
+
+    async def terminate():
+        await waitFor(sockPath)
+        await asyncio.sleep(0.1)
+
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    async def both():
+        await asyncio.wait_for(asyncio.gather(daemon.runDaemon(ctr, sockPath, textOut = False), terminate()), 10.0)
+
+    asyncio.run(both())
+
+    assert not os.path.exists(sockPath)
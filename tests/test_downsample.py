@@ -0,0 +1,160 @@
+###############
+### Imports ###
+###############
+
+import numpy as np
+import pytest
+import downsample
+import history
+
+
+###############
+### Helpers ###
+###############
+
+def spiky(n = 100000, seed = 3):
+    """
+    Get a noisy series with one tall spike and one deep dip, and their indices.
+    """
+
+    rnd = np.random.default_rng(seed)
+    ts = 1000.0 + np.arange(n, dtype = np.float64)
+    values = rnd.poisson(20, n).astype(np.float64)
+
+    spike = int(n * 0.31)
+    dip = int(n * 0.78)
+
+    values[spike] = 5000.0
+    values[dip] = -5000.0
+
+    return (ts, values, spike, dip)
+
+
+#############
+### Tests ###
+#############
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+def test_keepsSpikes(method):
+    """
+    Both methods keep the spike and the dip, in time order.
+    """
+
+    ts, values, spike, dip = spiky()
+    keep = downsample.methods[method](ts, values, 500)
+
+    assert spike in keep
+    assert dip in keep
+    assert len(keep) <= 500
+    assert (np.diff(keep) > 0).all()
+
+
+def test_lttbEnds():
+    """
+    LTTB keeps the first and last points and exactly points points.
+    """
+
+    ts, values, spike, dip = spiky(10000)
+    keep = downsample.lttb(ts, values, 300)
+
+    assert len(keep) == 300
+    assert keep[0] == 0
+    assert keep[-1] == 9999
+
+
+def test_minMaxBuckets():
+    """
+    Each bucket's minimum and maximum survive.
+    """
+
+    ts, values, spike, dip = spiky(1000)
+    keep = set(downsample.minMax(ts, values, 100).tolist())
+
+    for b in range(50):
+        bucket = values[(b * 20):((b + 1) * 20)]
+
+        assert (b * 20) + int(bucket.argmin()) in keep
+        assert (b * 20) + int(bucket.argmax()) in keep
+
+
+def test_shortSeries():
+    """
+    Series already short enough come back whole.
+    """
+
+    ts, values, spike, dip = spiky(100)
+
+    assert downsample.lttb(ts, values, 200).tolist() == list(range(100))
+    assert downsample.minMax(ts, values, 200).tolist() == list(range(100))
+
+
+def test_historyQueryKeepsSpike():
+    """
+    A downsampler over a history store keeps a one-gate spike.
+    """
+
+    store = history.historyStore(capacity = 4096, blockSize = 64)
+
+    for i in range(4000):
+        store.append(1000.0 + i, 5000 if i == 1234 else 20)
+
+    ds = downsample.downsampler()
+    ds.addHistory("counts", store)
+
+    for method in ('lttb', 'minmax'):
+        res = ds.query("counts", points = 100, method = method)
+
+        assert 5000 in list(res['values'])
+
+
+def test_cacheKeepsClosedRanges():
+    """
+    New data only throws out cached results for ranges it could fall in.
+    """
+
+    store = history.historyStore(capacity = 4096, blockSize = 64)
+
+    for i in range(2000):
+        store.append(1000.0 + i, 20)
+
+    ds = downsample.downsampler()
+    ds.addHistory("counts", store)
+
+    assert ds.query("counts", 1000.0, 1500.0, points = 50)['cached'] == False
+    assert ds.query("counts", 1000.0, 1500.0, points = 50)['cached'] == True
+
+    ds.query("counts", points = 50)
+    ds.query("counts", 2500.0, 3000.0, points = 50)
+
+    for i in range(2000, 2100):
+        store.append(1000.0 + i, 20)
+
+    assert ds.query("counts", 1000.0, 1500.0, points = 50)['cached'] == True
+    assert ds.query("counts", points = 50)['cached'] == False
+    assert ds.query("counts", 2500.0, 3000.0, points = 50)['cached'] == False
+    assert ds.getStats() == {'entries': 3, 'hits': 2, 'misses': 5}
+
+
+def test_archiveJournal(tmp_path):
+    """
+    A journal archive is served whatever it's called, and reread when it grows.
+    """
+
+    import journal
+
+    fileName = str(tmp_path / "counts.jnl")
+    jnl = journal.journal(fileName, commitInterval = 1e9, blockSize = 512)
+    jnl.appendMany(1000.0 + np.arange(100.0), np.full(100, 20.0))
+    jnl.commit()
+
+    ds = downsample.downsampler()
+    ds.addArchive("counts", fileName)
+
+    assert ds.query("counts", points = 500)['n'] == 100
+
+    jnl.appendMany(1100.0 + np.arange(50.0), np.full(50, 20.0))
+    jnl.close()
+
+    res = ds.query("counts", points = 500)
+
+    assert (res['n'], res['cached']) == (150, False)
@@ -0,0 +1,113 @@
+###############
+### Imports ###
+###############
+
+import numpy as np
+import health
+import pipeline
+
+
+###############
+### Helpers ###
+###############
+
+def run(stage, counts):
+    """
+    Run gate counts through a stage and get its last results.
+    """
+
+    for count in counts:
+        smpl = {'counts': int(count)}
+        stage.process(smpl)
+
+    return smpl[stage.name]
+
+
+#############
+### Tests ###
+#############
+
+def test_histogramWindow():
+    """
+    A sliding histogram only covers its window, and its mean and variance match the gates in it.
+    """
+
+    hist = health.countHistogram(4)
+
+    for count in [9, 9, 1, 2, 3, 4]:
+        hist.add(count)
+
+    assert hist.bins == {1: 1, 2: 1, 3: 1, 4: 1}
+    assert hist.mean() == 2.5
+    assert abs(hist.variance() - np.var([1, 2, 3, 4], ddof = 1)) < 1e-9
+
+
+def test_poissonOk():
+    """
+    Poisson counts are flagged as healthy.
+    """
+
+    res = run(health.healthStage(textOut = False), np.random.default_rng(1).poisson(20, 600))
+
+    assert res['health'] == "ok"
+    assert (res['flags'] & pipeline.f_health) == pipeline.f_health_ok
+    assert abs(res['dispersion'] - 1.0) < 0.3
+
+
+def test_burstyFlagged():
+    """
+    Counts with occasional bursts are flagged as bursty.
+    """
+
+    rnd = np.random.default_rng(2)
+    counts = rnd.poisson(20, 600)
+    counts[::25] += 200
+
+    res = run(health.healthStage(textOut = False), counts)
+
+    assert res['health'] == "bursty"
+    assert (res['flags'] & pipeline.f_health) == pipeline.f_health_bursty
+
+
+def test_stuckFlagged():
+    """
+    A counter stuck on nearly the same value is flagged as stuck.
+    """
+
+    res = run(health.healthStage(textOut = False), [20, 21] * 300)
+
+    assert res['health'] == "stuck"
+    assert (res['flags'] & pipeline.f_health) == pipeline.f_health_stuck
+
+
+def test_untestedAndRecovery():
+    """
+    Health is unknown until the first test, and a detector that stops bursting goes back to ok once the bursts leave the window.
+    """
+
+    stage = health.healthStage(window = 300, interval = 60, textOut = False)
+
+    assert run(stage, [20] * 59)['health'] == "unknown"
+
+    rnd = np.random.default_rng(3)
+    bursty = rnd.poisson(20, 300)
+    bursty[::25] += 200
+
+    assert run(stage, bursty)['health'] == "bursty"
+    assert run(stage, rnd.poisson(20, 360))['health'] == "ok"
+
+
+def test_stateRoundTrip():
+    """
+    A stage restored from another's state tests the same from there on.
+    """
+
+    counts = np.random.default_rng(4).poisson(20, 400)
+
+    first = health.healthStage(textOut = False)
+    run(first, counts[:250])
+
+    second = health.healthStage(textOut = False)
+    second.setState(first.getState())
+
+    assert run(second, counts[250:]) == run(first, counts[250:])
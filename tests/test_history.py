@@ -0,0 +1,96 @@
+###############
+### Imports ###
+###############
+
+import history
+
+
+###############
+### Helpers ###
+###############
+
+def filled(n, capacity = 64, blockSize = 8):
+    """
+    Get a history store holding n samples, one a second from 1000, with counts of i % 10.
+    """
+
+    store = history.historyStore(capacity = capacity, blockSize = blockSize)
+
+    for i in range(n):
+        store.append(1000.0 + i, i % 10)
+
+    return store
+
+
+#############
+### Tests ###
+#############
+
+def test_queryMatchesExact():
+    """
+    Queries answered from block summaries agree with the raw samples on n, min, max and mean, and exact percentiles are right.
+    """
+
+    store = filled(40)
+
+    for start, end in ((None, None), (1003.0, 1030.0), (1008.0, 1016.0), (1005.5, 1006.5)):
+        fast = store.query(start, end)
+        exact = store.query(start, end, exact = True)
+
+        counts = [i % 10 for i in range(40) if ((start is None) or (1000.0 + i >= start)) and ((end is None) or (1000.0 + i < end))]
+
+        assert fast['n'] == exact['n'] == len(counts)
+        assert fast['min'] == exact['min'] == min(counts)
+        assert fast['max'] == exact['max'] == max(counts)
+        assert abs(fast['mean'] - (float(sum(counts)) / len(counts))) < 1e-9
+
+    assert store.query(exact = True)['percentiles'][50] == 5
+
+
+def test_emptyWindow():
+    """
+    A window with no samples in it has n of 0 and no statistics.
+    """
+
+    store = filled(10)
+
+    assert store.query(2000.0, 3000.0) == {'n': 0, 'min': None, 'max': None, 'mean': None, 'percentiles': {}}
+
+
+def test_wrapDropsOldestBlock():
+    """
+    Once the buffer wraps, the oldest samples go a block at a time and queries only see what's left.
+    """
+
+    store = filled(70)
+    res = store.query(exact = True)
+
+    # 70 samples in 64 slots of 8-sample blocks: samples 0 to 7 are gone.
+    assert res['n'] == 62
+    assert store.get(0)[0] == 1008.0
+    assert store.latest(2) == [(1068.0, 8, 0), (1069.0, 9, 0)]
+
+
+def test_arraysMatchLatest():
+    """
+    arrays() gives the same samples as get().
+    """
+
+    store = filled(20)
+    ts, counts, flags = store.arrays(1005.0, 1010.0)
+
+    assert ts.tolist() == [1005.0, 1006.0, 1007.0, 1008.0, 1009.0]
+    assert counts.tolist() == [5, 6, 7, 8, 9]
+
+
+def test_clockStepBack():
+    """
+    A clock stepping backwards doesn't raise, and samples stay in time order.
+    """
+
+    store = filled(10)
+    store.append(500.0, 3)
+    store.append(1010.0, 4)
+
+    assert store.latest(3) == [(1009.0, 9, 0), (1009.0, 3, 0), (1010.0, 4, 0)]
+    assert store.query(1009.0, 1011.0)['n'] == 3
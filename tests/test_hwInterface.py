@@ -0,0 +1,148 @@
+###############
+### Imports ###
+###############
+
+import asyncio
+import threading
+import time
+import counter
+import hwInterface
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+class slowHardware(hwInterface.counterIface):
+    def __init__(self):
+        """
+        Hardware whose polls take a while and note how many run at once and on which thread.
+        """
+
+        super(slowHardware, self).__init__()
+
+        self.active = 0
+        self.maxActive = 0
+        self.threads = set()
+        self.polls = 0
+
+    def poll(self):
+        """
+        Take 20 ms to count a gate.
+        """
+
+        self.active += 1
+        self.maxActive = max(self.maxActive, self.active)
+        self.threads.add(threading.get_ident())
+
+        time.sleep(0.02)
+
+        self.active -= 1
+        self.polls += 1
+
+        return self.polls
+
+    def getGateTimes(self):
+        """
+        A fixed one second gate.
+        """
+
+        return (1000.0, 1001.0)
+
+    def getSerial(self):
+        """
+        A hook counterIface doesn't have.
+        """
+
+        return "SN-1"
+
+
+#############
+### Tests ###
+#############
+
+def test_adapterPollsOffTheLoop():
+    """
+    Blocking calls are awaitable and run on an executor thread, not the event loop's.
+    """
+
+    hw = slowHardware()
+    adapter = hwInterface.asyncHwAdapter(hw)
+
+    async def pollOnce():
+        return await adapter.poll()
+
+    assert asyncio.run(pollOnce()) == 1
+    assert threading.get_ident() not in hw.threads
+
+
+def test_adapterSerialisesCalls():
+    """
+    Concurrent awaits on one device run one at a time.
+    """
+
+    hw = slowHardware()
+    adapter = hwInterface.asyncHwAdapter(hw)
+
+    async def pollMany():
+        return await asyncio.gather(*[adapter.poll() for i in range(8)])
+
+    assert sorted(asyncio.run(pollMany())) == list(range(1, 9))
+    assert hw.maxActive == 1
+
+
+def test_adapterPassesHooksThrough():
+    """
+    Non-blocking hooks, including ones the interface doesn't know about, are the wrapped object's own.
+    """
+
+    hw = slowHardware()
+    adapter = hwInterface.asyncHwAdapter(hw)
+
+    assert adapter.getGateTimes() == (1000.0, 1001.0)
+    assert adapter.getCounterFlags() == 0
+    assert adapter.getBufferSeconds() == 0.0
+    assert adapter.getSerial() == "SN-1"
+
+
+def test_adapterPollBlock():
+    """
+    pollBlock() is awaitable and gives the wrapped hardware's default one-gate block.
+    """
+
+    adapter = hwInterface.asyncHwAdapter(slowHardware())
+
+    async def pollBlock():
+        return await adapter.pollBlock()
+
+    assert asyncio.run(pollBlock()) == ([1], [1001.0], [1.0])
+
+
+def test_asyncTemplatePollBlock():
+    """
+    The async template's pollBlock() awaits its own poll().
+    """
+
+    class hw(hwInterface.asyncCounterIface):
+        async def poll(self):
+            return 7
+
+    assert asyncio.run(hw().pollBlock())[0] == [7]
+
+
+def test_arunWithAdapter():
+    """
+    geigerInterface.arun() runs a wrapped simulator to its time limit, a gate per callback.
+    """
+
+    sim = simHardware.simHardware()
+    sim.setSimProps(background = 600.0, seed = 1, speed = 0)
+
+    ctr = counter.geigerInterface(hwInterface.asyncHwAdapter(sim), mode = "counter", quiet = True, time = 5)
+    readings = []
+
+    asyncio.run(ctr.arun(readings.append))
+
+    assert len(readings) == 5
+    assert sum(readings) > 0
@@ -0,0 +1,160 @@
+###############
+### Imports ###
+###############
+
+import os
+import journal
+
+
+###############
+### Helpers ###
+###############
+
+def writeFrames(fileName, frames, blockSize = 512):
+    """
+    Write a journal with one committed frame per list of values, timestamped from 1000.
+    """
+
+    jnl = journal.journal(fileName, commitInterval = 1e9, blockSize = blockSize)
+    ts = 1000.0
+
+    for values in frames:
+        for value in values:
+            jnl.append(ts, value, 0)
+            ts += 1.0
+
+        jnl.commit()
+
+    jnl.close()
+
+    return
+
+
+#############
+### Tests ###
+#############
+
+def test_roundTrip(tmp_path):
+    """
+    Committed records read back in order, with flags.
+    """
+
+    fileName = str(tmp_path / "a.journal")
+    writeFrames(fileName, [[1.0, 2.0], [3.0]])
+
+    recs, skipped = journal.readJournal(fileName)
+
+    assert skipped == 0
+    assert recs['value'].tolist() == [1.0, 2.0, 3.0]
+    assert recs['ts'].tolist() == [1000.0, 1001.0, 1002.0]
+    assert recs['flags'].tolist() == [0, 0, 0]
+
+
+def test_tornTailIsCutOff(tmp_path):
+    """
+    A frame cut short by a power cut is dropped on reopening, and new frames carry on after the last good one.
+    """
+
+    fileName = str(tmp_path / "b.journal")
+    writeFrames(fileName, [[1.0, 2.0], [3.0, 4.0]])
+
+    fullSize = os.path.getsize(fileName)
+
+    # Lose the end of the last frame.
+    with open(fileName, 'r+b') as jnlFile:
+        jnlFile.truncate(fullSize - 100)
+
+    jnl = journal.journal(fileName, commitInterval = 1e9, blockSize = 512)
+    stats = jnl.getStats()
+
+    assert stats['recoveredFrames'] == 1
+    assert stats['recoveredRecords'] == 2
+    assert stats['discardedBytes'] == fullSize - 100 - 512
+
+    jnl.append(2000.0, 5.0)
+    jnl.close()
+
+    recs, skipped = journal.readJournal(fileName)
+
+    assert skipped == 0
+    assert recs['value'].tolist() == [1.0, 2.0, 5.0]
+    assert recs['flags'].tolist() == [0, 0, -1]
+
+
+def test_badCrcTailIsCutOff(tmp_path):
+    """
+    A complete last frame whose records don't match its checksum is dropped on reopening.
+    """
+
+    fileName = str(tmp_path / "c.journal")
+    writeFrames(fileName, [[1.0], [2.0]])
+
+    # Flip a bit in the second frame's first record.
+    with open(fileName, 'r+b') as jnlFile:
+        jnlFile.seek(512 + journal.frameHdrSize + 8)
+        byte = jnlFile.read(1)
+        jnlFile.seek(512 + journal.frameHdrSize + 8)
+        jnlFile.write(bytes([byte[0] ^ 0x01]))
+
+    # Read as it is, the bad frame is skipped.
+    recs, skipped = journal.readJournal(fileName)
+
+    assert skipped == 1
+    assert recs['value'].tolist() == [1.0]
+
+    # Reopening cuts it off.
+    jnl = journal.journal(fileName, commitInterval = 1e9, blockSize = 512)
+    stats = jnl.getStats()
+    jnl.close()
+
+    assert stats['recoveredFrames'] == 1
+    assert stats['discardedBytes'] == 512
+    assert os.path.getsize(fileName) == 512
+
+
+def test_garbageTailIsCutOff(tmp_path):
+    """
+    Bytes after the last frame that aren't a frame header are dropped on reopening.
+    """
+
+    fileName = str(tmp_path / "d.journal")
+    writeFrames(fileName, [[1.0, 2.0]])
+
+    with open(fileName, 'ab') as jnlFile:
+        jnlFile.write(b"GGJ1 not really a frame")
+
+    jnl = journal.journal(fileName, commitInterval = 1e9, blockSize = 512)
+    jnl.close()
+
+    recs, skipped = journal.readJournal(fileName)
+
+    assert os.path.getsize(fileName) == 512
+    assert recs['value'].tolist() == [1.0, 2.0]
+
+
+def test_loadSeriesByMagic(tmp_path):
+    """
+    Series loading spots a journal by its frame magic whatever it's called, and a CSV file with a .journal name is still read as CSV.
+    """
+
+    import datalayer
+
+    fileName = str(tmp_path / "j-fast.jnl")
+    writeFrames(fileName, [[1.0, 2.0]])
+
+    ts, values, flags = datalayer.loadSeries(fileName)
+
+    assert journal.isJournal(fileName) == True
+    assert ts.tolist() == [1000.0, 1001.0]
+    assert values.tolist() == [1.0, 2.0]
+
+    csvName = str(tmp_path / "misnamed.journal")
+
+    with open(csvName, 'w') as csvFile:
+        csvFile.write('"2020-01-01 00:00:00", 3.0, 0x0\n')
+
+    ts, values, flags = datalayer.loadSeries(csvName)
+
+    assert journal.isJournal(csvName) == False
+    assert values.tolist() == [3.0]
+    assert flags.tolist() == [0]
@@ -0,0 +1,137 @@
+###############
+### Imports ###
+###############
+
+import math
+import numpy as np
+import periodicity
+import pipeline
+
+
+###############
+### Helpers ###
+###############
+
+def counts(n, period = None, amplitude = 0.0, mean = 30.0, seed = 6):
+    """
+    Get n gates of Poisson counts, with a sinusoidal rate of period gates and amplitude counts per gate on top if period is given.
+    """
+
+    rate = np.full(n, mean)
+
+    if period is not None:
+        rate += amplitude * np.sin(2.0 * np.pi * np.arange(n) / period)
+
+    return np.random.default_rng(seed).poisson(rate)
+
+
+#############
+### Tests ###
+#############
+
+def test_goertzelMatchesFft():
+    """
+    A block's power ratio is the FFT power in the period's bin over what white noise would give.
+    """
+
+    x = counts(1800, 60, 5.0).astype(np.float64)
+    det = periodicity.goertzel(60)
+
+    assert det.blockSize == 1800
+    assert [det.add(v) for v in x][-1] == True
+
+    power = np.abs(np.fft.fft(x)[30]) ** 2
+
+    assert abs(det.ratio - (power / (len(x) * x.var(ddof = 1)))) < 1e-6 * det.ratio
+
+
+def test_goertzelBlockSize():
+    """
+    Blocks are whole periods, at least 4 of them and at least minBlock gates.
+    """
+
+    assert periodicity.goertzel(10).blockSize == 1800
+    assert periodicity.goertzel(900).blockSize == 3600
+    assert periodicity.goertzel(7, minBlock = 100).blockSize == 105
+
+
+def test_goertzelDetects():
+    """
+    A weak component at the period is significant and plain counting noise or a constant isn't.
+    """
+
+    for period in (10, 60, 300):
+        noisy = periodicity.goertzel(period)
+        clean = periodicity.goertzel(period)
+
+        for x in counts(noisy.blockSize, period, 2.0):
+            noisy.add(x)
+
+        for x in counts(clean.blockSize, seed = period):
+            clean.add(x)
+
+        assert noisy.significant == True, period
+        assert clean.significant == False, period
+
+    flat = periodicity.goertzel(60)
+
+    for i in range(flat.blockSize):
+        flat.add(30)
+
+    assert (flat.ratio, flat.significant) == (0.0, False)
+
+
+def test_periodicStage():
+    """
+    The stage flags interference at a watched period once a block has seen it, names the period and clears once it's gone.
+    """
+
+    stage = periodicity.periodicStage(periods = (10, 60), textOut = False)
+    interfered = counts(1800, 60, 3.0)
+    quiet = counts(1800, seed = 9)
+
+    for x in interfered:
+        smpl = {'counts': int(x)}
+        stage.process(smpl)
+
+    assert smpl['periodic']['periodic'] == [60]
+    assert (smpl['periodic']['flags'] & pipeline.f_periodic) == pipeline.f_periodic
+
+    for x in quiet:
+        smpl = {'counts': int(x)}
+        stage.process(smpl)
+
+    assert (smpl['periodic']['flags'] & pipeline.f_periodic) == 0
+
+    summary = {}
+    stage.finish(summary)
+
+    assert summary['periodic']['maxRatio'][60] > 9.2
+
+
+def test_welchFindsPeak():
+    """
+    The offline spectrum finds a 300 second component in a day of one second gates.
+    """
+
+    x = counts(86400, 300, 1.5).astype(np.float64)
+    freqs, psd, nSeg = periodicity.welch(x, segment = 4096)
+    peaks = periodicity.findPeaks(freqs, psd, nSeg)
+
+    assert len(peaks) >= 1
+    assert abs(peaks[0]['period'] - 300.0) < 5.0
+
+
+def test_regularize():
+    """
+    Gaps are filled with the mean on the most common spacing.
+    """
+
+    ts = np.array([0.0, 2.0, 4.0, 8.0, 10.0])
+    values = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+
+    grid, gateTime, coverage = periodicity.regularize(ts, values)
+
+    assert gateTime == 2.0
+    assert grid.tolist() == [1.0, 2.0, 3.0, 3.0, 4.0, 5.0]
+    assert math.isclose(coverage, 5.0 / 6.0)
@@ -0,0 +1,144 @@
+###############
+### Imports ###
+###############
+
+import pytest
+import counter
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+class summaryRecorder(object):
+    def __init__(self):
+        """
+        Stand-in datalayer that keeps the data points and the run summary.
+        """
+
+        self.points = []
+        self.summary = None
+
+    def storeDatapoint(self, dataPoint):
+        """
+        Keep a data point.
+        """
+
+        self.points.append(dataPoint)
+
+    def storeSummary(self, summary):
+        """
+        Keep the run summary.
+        """
+
+        self.summary = summary
+
+    def flush(self):
+        """
+        Nothing to flush.
+        """
+
+        return
+
+    def close(self):
+        """
+        Nothing to close.
+        """
+
+        return
+
+
+def runFor(gateTime = 1.0, background = 10.0, blocks = False, **kwargs):
+    """
+    Run a quiet counter mode measurement on a simulator with the given gate time, as fast as it'll go, and get the readings and the stored run summary.
+    """
+
+    sim = simHardware.simHardware()
+    sim.setSimProps(background = background, seed = 1, speed = 0, gateTime = gateTime, blockSize = 1000)
+
+    stg = summaryRecorder()
+    ctr = counter.geigerInterface(sim, mode = "counter", quiet = True, stg = stg, **kwargs)
+    readings = []
+
+    if blocks == True:
+        ctr.runBlocks(lambda blk: readings.extend(blk['counts'].tolist()), interval = 0)
+    else:
+        ctr.run(readings.append)
+
+    return (readings, stg.summary)
+
+
+#############
+### Tests ###
+#############
+
+@pytest.mark.parametrize('timeArg, gates', [
+    (30, 3),
+    ("90", 9),
+    ("1m", 6),
+    ("1m30", 9),
+    ("1h", 360),
+    (" 0.5 M ", 3),
+])
+def test_timeLimits(timeArg, gates):
+    """
+    Time limits in seconds, or with units, stop after the right number of 10 second gates.
+    """
+
+    readings, summary = runFor(gateTime = 10.0, time = timeArg)
+
+    assert len(readings) == gates
+    assert summary['liveTime'] == gates * 10.0
+    assert summary['stopReason'].startswith("Time limit")
+
+
+@pytest.mark.parametrize('timeArg', ["1.2.3", "m5", "5x", "1 2", "5mm", "h", ""])
+def test_badTimes(timeArg):
+    """
+    Anything that isn't numbers with units is refused.
+    """
+
+    with pytest.raises(ValueError):
+        counter.geigerInterface(simHardware.simHardware(), mode = "counter", quiet = True, time = timeArg)
+
+
+def test_blockTimeLimit():
+    """
+    A run a block at a time stops at the same gate as one a gate at a time.
+    """
+
+    readings, summary = runFor(time = "2m", blocks = True)
+
+    assert len(readings) == 120
+    assert summary['liveTime'] == 120.0
+
+
+def test_presetCounts():
+    """
+    A preset count stops the run at the first gate that reaches it.
+    """
+
+    readings, summary = runFor(presetCounts = 200)
+
+    assert sum(readings) >= 200
+    assert sum(readings[:-1]) < 200
+    assert summary['counts'] == sum(readings)
+    assert summary['stopReason'] == "Preset count of 200 reached."
+
+
+def test_presetPrecision():
+    """
+    A preset precision stops the run once the mean rate is known well enough, and the time limit still applies if that comes first.
+    """
+
+    readings, summary = runFor(presetPrecision = 0.05, time = "1h")
+
+    assert summary['relUncertainty'] <= 0.05
+    assert summary['stopReason'].startswith("Preset precision")
+    assert len(readings) < 3600
+
+    readings, summary = runFor(presetPrecision = 0.001, time = 60)
+
+    assert len(readings) == 60
+    assert summary['stopReason'].startswith("Time limit")
@@ -0,0 +1,175 @@
+###############
+### Imports ###
+###############
+
+import os
+import struct
+import sys
+import threading
+import pytest
+import shmRing
+from multiprocessing import resource_tracker, shared_memory
+
+
+###############
+### Helpers ###
+###############
+
+def ringName(tag):
+    """
+    Get a segment name no other test run is using.
+    """
+
+    return "ggtest-%s-%s" %(os.getpid(), tag)
+
+
+def openReader(name):
+    """
+    Map a ring in the process that's writing it. Before Python 3.13 readers take the segment off the resource tracker, which here takes the writer's registration with it, so it goes back on for the writer's unlink.
+    """
+
+    reader = shmRing.shmRingReader(name)
+
+    if sys.version_info < (3, 13):
+        resource_tracker.register("/%s" %name, "shared_memory")
+
+    return reader
+
+
+#############
+### Tests ###
+#############
+
+def test_publishAndRead():
+    """
+    Published samples read back in order with their indices.
+    """
+
+    ring = shmRing.shmRing(ringName("read"), capacity = 8)
+    reader = openReader(ring.getName())
+
+    try:
+        assert reader.getHead() == 0
+        assert reader.read(0) is None
+
+        for i in range(5):
+            ring.publish(1000.0 + i, 10 + i, i)
+
+        assert reader.getCapacity() == 8
+        assert reader.getHead() == 5
+        assert reader.read(2) == (1002.0, 12, 2)
+        assert reader.latest(2) == [(3, 1003.0, 13, 3), (4, 1004.0, 14, 4)]
+        assert [rec[0] for rec in reader.since(1)] == [1, 2, 3, 4]
+
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_wrap():
+    """
+    Once the ring wraps, overwritten records read as None and latest() only covers what's left.
+    """
+
+    ring = shmRing.shmRing(ringName("wrap"), capacity = 4)
+    reader = openReader(ring.getName())
+
+    try:
+        for i in range(10):
+            ring.publish(1000.0 + i, i)
+
+        assert reader.read(5) is None
+        assert reader.read(6) == (1006.0, 6, 0)
+        assert [rec[0] for rec in reader.latest(100)] == [6, 7, 8, 9]
+        assert [rec[0] for rec in reader.since(0)] == [6, 7, 8, 9]
+
+        arr = reader.getArray()
+        assert sorted(arr['counts'].tolist()) == [6, 7, 8, 9]
+        del arr
+
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_halfWritten():
+    """
+    A record whose sequence word says it's being written isn't returned.
+    """
+
+    ring = shmRing.shmRing(ringName("half"), capacity = 4)
+    reader = openReader(ring.getName())
+    raw = shared_memory.SharedMemory(name = ring.getName())
+
+    try:
+        ring.publish(1000.0, 5)
+
+        # Record 0 started being written again as record 4, and never finished.
+        struct.pack_into("<Q", raw.buf, shmRing.hdrSize, (2 * 4) + 1)
+
+        assert reader.read(0) is None
+        assert reader.read(4, retries = 5) is None
+
+    finally:
+        raw.close()
+        reader.close()
+        ring.close()
+
+
+def test_concurrentReadsConsistent():
+    """
+    Reads racing the writer only ever see whole records.
+    """
+
+    ring = shmRing.shmRing(ringName("race"), capacity = 16)
+    reader = openReader(ring.getName())
+    done = threading.Event()
+
+    def write():
+        for i in range(20000):
+            ring.publish(float(i), i, i & 0xffff)
+
+        done.set()
+
+    writer = threading.Thread(target = write)
+    writer.start()
+
+    try:
+        seen = 0
+
+        while not done.is_set():
+            for i, ts, counts, flags in reader.latest(16):
+                assert (ts, counts, flags) == (float(i), i, i & 0xffff)
+                seen += 1
+
+        assert seen > 0
+
+    finally:
+        writer.join()
+        reader.close()
+        ring.close()
+
+
+def test_notARing():
+    """
+    A segment that isn't a ring buffer is refused, and a crashed writer's segment is replaced.
+    """
+
+    name = ringName("other")
+    other = shared_memory.SharedMemory(name = name, create = True, size = 4096)
+
+    try:
+        with pytest.raises(ValueError):
+            shmRing.shmRingReader(name)
+
+        # Take it over as if it was left behind by a crash.
+        ring = shmRing.shmRing(name, capacity = 4)
+        ring.publish(1000.0, 1)
+
+        reader = openReader(name)
+        assert reader.read(0) == (1000.0, 1, 0)
+        reader.close()
+        ring.close()
+
+    finally:
+        other.close()
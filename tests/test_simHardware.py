@@ -0,0 +1,132 @@
+###############
+### Imports ###
+###############
+
+import numpy as np
+import pytest
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+def newSim(**props):
+    """
+    Get a set up simulator running as fast as it can with small blocks and a fixed seed, plus any other properties.
+    """
+
+    settings = {'seed': 1, 'speed': 0, 'blockSize': 1000}
+    settings.update(props)
+
+    sim = simHardware.simHardware()
+    sim.setSimProps(**settings)
+    sim.setup()
+
+    return sim
+
+
+#############
+### Tests ###
+#############
+
+def test_parseProfile():
+    """
+    Profile specs are parsed, and unknown kinds or settings and ramps without an end are refused.
+    """
+
+    assert simHardware.parseProfile("step,start=10,rate=50") == {'kind': 'step', 'start': 10.0, 'end': None, 'rate': 50.0}
+    assert simHardware.parseProfile("ramp,start=0,end=60,rate=5")['end'] == 60.0
+
+    for spec in ("spike,rate=5", "step,rate=5,width=2", "ramp,start=10,rate=5", "ramp,start=10,end=5,rate=5"):
+        with pytest.raises(ValueError):
+            simHardware.parseProfile(spec)
+
+
+def test_profileRate():
+    """
+    Steps switch on and off and ramps rise linearly then hold.
+    """
+
+    profile = [simHardware.parseProfile("step,start=10,end=20,rate=50"), simHardware.parseProfile("ramp,start=0,end=100,rate=10")]
+    rate = simHardware.profileRate(np, profile, np.array([5.0, 15.0, 50.0, 200.0]))
+
+    assert np.allclose(rate, [0.5, 51.5, 5.0, 10.0])
+
+
+def test_backgroundRate():
+    """
+    Counts average out at the background rate times the gate time.
+    """
+
+    sim = newSim(background = 20.0, gateTime = 0.5)
+    counts = [sim.poll() for i in range(4000)]
+
+    assert abs(np.mean(counts) - 10.0) < 0.3
+    assert sim.getGateTimes()[1] - sim.getGateTimes()[0] == 0.5
+
+
+def test_repeatable():
+    """
+    The same seed gives the same counts, whether polled a gate at a time or in blocks.
+    """
+
+    single = newSim(background = 5.0)
+    block = newSim(background = 5.0)
+
+    gates = [single.poll() for i in range(2500)]
+    counts, ends, gateLens = block.pollBlock()
+
+    while len(counts) < 2500:
+        more = block.pollBlock()
+        counts = np.concatenate((counts, more[0]))
+
+    assert gates == counts[:2500].tolist()
+    assert np.allclose(np.diff(ends), 1.0)
+    assert (gateLens == 1.0).all()
+
+
+def test_deadTime():
+    """
+    Non-paralyzable dead time cuts the observed rate to n / (1 + n * tau).
+    """
+
+    sim = newSim(background = 1000.0, deadTime = 0.001)
+    counts = [sim.poll() for i in range(2000)]
+
+    assert abs(np.mean(counts) - 500.0) < 5.0
+
+
+def test_faults():
+    """
+    Faults happen at about the rate asked for and are counted by kind.
+    """
+
+    sim = newSim(background = 20.0, faultRate = 0.05)
+
+    for i in range(4000):
+        sim.poll()
+
+    assert 100 < sum(sim.faults.values()) < 300
+    assert min(sim.faults.values()) > 0
+
+
+def test_tubesAndEvents():
+    """
+    Extra tubes get their own counts, showers hit every tube, and every counted pulse gets a time inside its gate.
+    """
+
+    sim = newSim(background = 5.0, tubes = 3, showerRate = 2.0, events = True)
+
+    for i in range(200):
+        counts = sim.poll()
+        channels = sim.getChannels()
+        events = sim.getEvents()
+        start, end = sim.getGateTimes()
+
+        assert sorted(channels.keys()) == ["tube0", "tube1", "tube2"]
+        assert channels['tube0'] == counts
+
+        for tube in channels:
+            assert len(events[tube]) == channels[tube]
+            assert ((events[tube] >= start) & (events[tube] <= end)).all()
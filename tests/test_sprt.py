@@ -0,0 +1,103 @@
+###############
+### Imports ###
+###############
+
+import numpy as np
+import pipeline
+
+
+###############
+### Helpers ###
+###############
+
+def run(stage, counts):
+    """
+    Run a list of gate counts through a stage and get its results for each.
+    """
+
+    results = []
+
+    for count in counts:
+        smpl = {'counts': int(count)}
+        stage.process(smpl)
+        results.append(smpl[stage.name])
+
+    return results
+
+
+def source(bg = 10.0, elevated = 30.0, learn = 22, quiet = 40, hot = 20, after = 60, seed = 5):
+    """
+    Get Poisson gate counts: background while learning and for quiet gates, elevated for hot gates, then background again.
+    """
+
+    rnd = np.random.default_rng(seed)
+
+    return np.concatenate([rnd.poisson(bg, learn + quiet), rnd.poisson(elevated, hot), rnd.poisson(bg, after)])
+
+
+#############
+### Tests ###
+#############
+
+def test_learnsBackground():
+    """
+    The background is the mean of the learning gates, flagged as accumulating until it's learned.
+    """
+
+    stage = pipeline.sprtStage(learn = 4, textOut = False)
+    results = run(stage, [8, 10, 12, 10])
+
+    assert results[-1]['background'] == 600.0
+    assert (results[0]['flags'] & pipeline.f_accum) == pipeline.f_accum_accum
+    assert (results[-1]['flags'] & pipeline.f_accum) == pipeline.f_accum_complete
+    assert not any([res['elevated'] for res in results])
+
+
+def test_detectsAndReturns():
+    """
+    A tripled rate is flagged as elevated within a few gates, and the test goes back to background once it's gone.
+    """
+
+    stage = pipeline.sprtStage(textOut = False)
+    results = run(stage, source())
+
+    elevated = [i for i, res in enumerate(results) if res['elevated']]
+    detections = [res['ttd'] for res in results if res['ttd'] is not None]
+
+    assert len(detections) == 1
+    assert 62 <= elevated[0] <= 66
+    assert detections[0] <= 5.0
+    assert results[-1]['elevated'] == False
+    assert (results[-1]['flags'] & pipeline.f_trend) == pipeline.f_trend_stable
+    assert (results[elevated[0]]['flags'] & pipeline.f_trend) == pipeline.f_trend_up
+
+    summary = {}
+    stage.finish(summary)
+
+    assert summary['sprt']['detections'] == 1
+
+
+def test_quietBackground():
+    """
+    Plain background doesn't raise false alarms.
+    """
+
+    stage = pipeline.sprtStage(textOut = False)
+    results = run(stage, source(elevated = 10.0, quiet = 500))
+
+    assert not any([res['elevated'] for res in results])
+
+
+def test_stateRoundTrip():
+    """
+    A stage restored from another's state gives the same results from there on.
+    """
+
+    counts = source()
+    first = pipeline.sprtStage(textOut = False)
+    run(first, counts[:64])
+
+    second = pipeline.sprtStage(textOut = False)
+    second.setState(first.getState())
+
+    assert run(second, counts[64:]) == run(first, counts[64:])
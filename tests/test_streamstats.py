@@ -0,0 +1,117 @@
+###############
+### Imports ###
+###############
+
+import random
+import numpy as np
+import streamstats
+
+
+###############
+### Helpers ###
+###############
+
+def values(n = 5000, seed = 1):
+    """
+    Get a repeatable list of skewed values with ties, like gate counts.
+    """
+
+    rnd = random.Random(seed)
+
+    return [float(int(rnd.expovariate(0.1))) for i in range(n)]
+
+
+#############
+### Tests ###
+#############
+
+def test_welfordAddMany():
+    """
+    Adding values in chunks with addMany() gives the same moments as add() one at a time.
+    """
+
+    data = values()
+    one = streamstats.welford()
+    many = streamstats.welford()
+
+    for x in data:
+        one.add(x)
+
+    for i in range(0, len(data), 777):
+        many.addMany(np.asarray(data[i:(i + 777)]))
+
+    assert many.n == one.n
+    assert abs(many.mean - one.mean) < 1e-9
+    assert abs(many.variance() - one.variance()) < 1e-6
+    assert (many.min, many.max) == (one.min, one.max)
+
+
+def test_welfordMoments():
+    """
+    The moments match the textbook ones.
+    """
+
+    data = values(100)
+    stats = streamstats.welford()
+    stats.addMany(np.asarray(data))
+
+    mean = sum(data) / len(data)
+
+    assert abs(stats.mean - mean) < 1e-9
+    assert abs(stats.variance() - (sum([(x - mean) ** 2 for x in data]) / (len(data) - 1))) < 1e-6
+
+
+def test_p2AddMany():
+    """
+    P² gives exactly the same markers from addMany() as from add(), including when the first chunk is shorter than the five starting markers.
+    """
+
+    data = values()
+
+    for p in (0.5, 0.95, 0.99):
+        one = streamstats.p2Quantile(p)
+        many = streamstats.p2Quantile(p)
+
+        for x in data:
+            one.add(x)
+
+        many.addMany(data[:3])
+
+        for i in range(3, len(data), 500):
+            many.addMany(data[i:(i + 500)])
+
+        assert many.getState() == one.getState()
+        assert many.value() == one.value()
+
+
+def test_p2Estimate():
+    """
+    P²'s median of a long uniform series is close to the true one.
+    """
+
+    rnd = random.Random(2)
+    quantile = streamstats.p2Quantile(0.5)
+    quantile.addMany([rnd.uniform(0.0, 100.0) for i in range(20000)])
+
+    assert abs(quantile.value() - 50.0) < 2.0
+
+
+def test_streamStatsAddMany():
+    """
+    The combined summary is the same either way.
+    """
+
+    data = values()
+    one = streamstats.streamStats()
+    many = streamstats.streamStats()
+
+    for x in data:
+        one.add(x)
+
+    many.addMany(np.asarray(data))
+
+    oneSummary = one.getSummary()
+    manySummary = many.getSummary()
+
+    for key in oneSummary:
+        assert abs(manySummary[key] - oneSummary[key]) < 1e-6
@@ -0,0 +1,177 @@
+###############
+### Imports ###
+###############
+
+import asyncio
+import sys
+import time
+import counter
+import hwInterface
+import simHardware
+
+
+###############
+### Helpers ###
+###############
+
+class shallowSim(simHardware.simHardware):
+    def __init__(self, bufferSeconds):
+        """
+        Simulator that claims to only hold bufferSeconds of finished gates.
+        """
+
+        super(shallowSim, self).__init__()
+
+        self.__bufferSeconds = bufferSeconds
+
+    def getBufferSeconds(self):
+        """
+        Get the pretend buffer length.
+        """
+
+        return self.__bufferSeconds
+
+
+class writeCounter(object):
+    def __init__(self):
+        """
+        Stand-in for stdout that keeps each write separately.
+        """
+
+        self.writes = []
+
+    def write(self, text):
+        """
+        Keep a write.
+        """
+
+        self.writes.append(text)
+
+        return len(text)
+
+    def flush(self):
+        """
+        Nothing to flush.
+        """
+
+        return
+
+
+def runTickless(hw, interval, gates = 100, tickless = True, callBack = None):
+    """
+    Run a quiet counter mode measurement a block at a time on hw, running at 200 gates a second, until at least gates gates are in, and get the counter, the number of gates in each block and every gate's end time.
+    """
+
+    import numpy as np
+
+    hw.setSimProps(background = 10.0, seed = 1, speed = 200, blockSize = 1000)
+
+    ctr = counter.geigerInterface(hw, mode = "counter", quiet = True)
+    sizes = []
+    ends = []
+
+    def onBlock(blk):
+        sizes.append(blk['n'])
+        ends.extend(blk['ts'].tolist())
+
+        if callBack is not None:
+            callBack(blk)
+
+        if sum(sizes) >= gates:
+            ctr.stop()
+
+    ctr.runBlocks(onBlock, interval, tickless = tickless)
+
+    return (ctr, sizes, np.diff(ends))
+
+
+#############
+### Tests ###
+#############
+
+def test_budgetKept():
+    """
+    A tickless run wakes about once per budget, fetching the gates that finished meanwhile together, and every gate is still read.
+    """
+
+    ctr, sizes, steps = runTickless(simHardware.simHardware(), 0.2)
+    wakeups = ctr.getWakeups()
+
+    assert (steps == 1.0).all()
+    assert wakeups['wakeups'] <= 5
+    assert max(sizes) >= 30
+    assert wakeups['perHour'] > 0.0
+
+
+def test_budgetCutToBuffer():
+    """
+    Hardware that can't hold gates for the whole budget is woken as often as it needs, and hardware that holds none for every gate.
+    """
+
+    start = time.monotonic()
+    ctr, sizes, steps = runTickless(shallowSim(0.05), 60.0)
+
+    assert time.monotonic() - start < 5.0
+    assert (steps == 1.0).all()
+    assert ctr.getWakeups()['wakeups'] >= 5
+
+    ctr, sizes, steps = runTickless(shallowSim(0.0), 60.0, gates = 20)
+
+    assert (steps == 1.0).all()
+    assert max(sizes[1:]) <= 3
+
+
+def test_outputHeld(monkeypatch):
+    """
+    What's printed for a block is written out in one go in a tickless run, and line by line otherwise.
+    """
+
+    def report(blk):
+        for i in range(3):
+            print("Gates %s" %blk['n'])
+
+    out = writeCounter()
+    monkeypatch.setattr(sys, 'stdout', out)
+    ctr, sizes, steps = runTickless(simHardware.simHardware(), 0.2, callBack = report)
+
+    assert len(out.writes) == len(sizes)
+    assert [text.count("\n") for text in out.writes] == [3] * len(sizes)
+
+    out = writeCounter()
+    monkeypatch.setattr(sys, 'stdout', out)
+    ctr, sizes, steps = runTickless(simHardware.simHardware(), 0.2, tickless = False, callBack = report)
+
+    assert len(out.writes) > len(sizes)
+
+
+def test_bufferHooks():
+    """
+    Hardware holds no finished gates unless it says otherwise, the simulator holds them all, and the asyncio adapter asks the hardware it wraps.
+    """
+
+    assert hwInterface.counterIface().getBufferSeconds() == 0.0
+    assert simHardware.simHardware().getBufferSeconds() is None
+    assert hwInterface.asyncHwAdapter(shallowSim(2.5)).getBufferSeconds() == 2.5
+
+
+def test_asyncBudgetKept():
+    """
+    The asyncio block loop keeps to the budget too.
+    """
+
+    hw = simHardware.simHardware()
+    hw.setSimProps(background = 10.0, seed = 1, speed = 200, blockSize = 1000)
+
+    ctr = counter.geigerInterface(hwInterface.asyncHwAdapter(hw), mode = "counter", quiet = True)
+    sizes = []
+
+    def onBlock(blk):
+        sizes.append(blk['n'])
+
+        if sum(sizes) >= 100:
+            ctr.stop()
+
+    asyncio.run(ctr.arunBlocks(onBlock, 0.2, tickless = True))
+
+    assert ctr.getWakeups()['wakeups'] <= 5
+    assert max(sizes) >= 30
@@ -0,0 +1,179 @@
+###############
+### Imports ###
+###############
+
+import time
+import types
+import pytest
+import counter
+import fakeU3
+import pipeline
+import u3Hardware
+
+
+###############
+### Helpers ###
+###############
+
+def withDevice(dev):
+    """
+    Get a stand-in for the u3 module that hands out dev, so tests can look at it.
+    """
+
+    return types.SimpleNamespace(U3 = lambda: dev, Counter0 = fakeU3.Counter0, Counter1 = fakeU3.Counter1, AIN = fakeU3.AIN)
+
+
+class keeper(pipeline.pipelineStage):
+    def __init__(self):
+        """
+        Pipeline stage that keeps every sample it sees.
+        """
+
+        super(keeper, self).__init__("keeper")
+
+        self.samples = []
+
+    def process(self, smpl):
+        """
+        Keep the sample.
+        """
+
+        self.samples.append(smpl)
+
+
+def newHardware(dev, **props):
+    """
+    Get a set up U3 on dev with the given properties.
+    """
+
+    hw = u3Hardware.u3Hardware()
+    hw.setU3Props(u3Module = withDevice(dev), **props)
+    hw.setup()
+
+    return hw
+
+
+#############
+### Tests ###
+#############
+
+def test_badCounters():
+    """
+    Only counters 0 and 1 exist, and at least one is needed.
+    """
+
+    for counters in ((2,), (0, 3), ()):
+        with pytest.raises(ValueError):
+            u3Hardware.u3Hardware().setU3Props(counters = counters)
+
+
+def test_channelNames():
+    """
+    The temperature sensor is 'temp' and other inputs go by number.
+    """
+
+    assert u3Hardware.channelName(30) == "temp"
+    assert u3Hardware.channelName(2) == "ain2"
+
+
+def test_oneFeedbackPerPoll():
+    """
+    Both counters, scaled analog inputs and the temperature come back from one getFeedback() call per poll, with the first counter as the reading.
+    """
+
+    dev = fakeU3.U3(rates = {0: 20000.0, 1: 60000.0}, volts = {2: 1.5}, tempK = 300.15, seed = 1)
+    hw = newHardware(dev, counters = (0, 1), ain = (2, 30), scales = {2: 100.0})
+
+    assert hw.getConfig()['channels'] == ["counter0", "counter1", "ain2", "temp"]
+
+    time.sleep(0.1)
+    reading = hw.poll()
+    channels = hw.getChannels()
+
+    assert dev.feedbackCalls == 1
+    assert reading == channels['counter0']
+    assert 1.5 < (channels['counter1'] / float(channels['counter0'])) < 4.5
+    assert channels['ain2'] == pytest.approx(150.0, abs = 0.01)
+    assert channels['temp'] == pytest.approx(27.0, abs = 0.05)
+
+
+def test_countersReset():
+    """
+    Counters are reset as they're read, so each poll only has the counts since the last one.
+    """
+
+    dev = fakeU3.U3(rates = {0: 1000.0}, seed = 2)
+    hw = newHardware(dev)
+
+    time.sleep(0.2)
+    first = hw.poll()
+    second = hw.poll()
+
+    assert first > 50
+    assert second < first
+
+
+def test_secondCounterFirst():
+    """
+    With only counter 1 enabled its counts are the reading.
+    """
+
+    dev = fakeU3.U3(rates = {1: 5000.0}, seed = 3)
+    hw = newHardware(dev, counters = (1,))
+
+    time.sleep(0.05)
+
+    assert hw.poll() > 0
+    assert list(hw.getChannels().keys()) == ["counter1"]
+
+
+def test_highVoltageInputs():
+    """
+    On a U3-HV the first four inputs read the high voltage range and the rest the low.
+    """
+
+    dev = fakeU3.U3(volts = {0: -5.0, 4: 2.0}, isHV = True, seed = 4)
+    hw = newHardware(dev, ain = (0, 4))
+    hw.poll()
+
+    assert hw.getChannels()['ain0'] == pytest.approx(-5.0, abs = 0.001)
+    assert hw.getChannels()['ain4'] == pytest.approx(2.0, abs = 0.001)
+
+
+def test_channelPipelines():
+    """
+    A run feeds the second counter and an analog input to their own pipelines each gate, alongside the main reading, from one getFeedback() call per gate.
+    """
+
+    dev = fakeU3.U3(rates = {0: 10.0, 1: 500.0}, volts = {2: 1.25}, seed = 6)
+    hw = u3Hardware.u3Hardware()
+    hw.setU3Props(counters = (0, 1), ain = (2,), u3Module = withDevice(dev))
+
+    ctr = counter.geigerInterface(hw, mode = "counter", quiet = True, time = 2)
+    second = keeper()
+    volts = keeper()
+
+    ctr.addChannelPipeline("counter1", pipeline.pipeline([pipeline.counterStage(), second]))
+    ctr.addChannelPipeline("ain2", pipeline.pipeline([pipeline.valueStage(), volts]))
+
+    readings = []
+    ctr.run(readings.append)
+
+    assert len(readings) == 2
+    assert dev.feedbackCalls == 2
+    assert len(second.samples) == 2
+    assert all([smpl['counter']['cps'] > 100.0 for smpl in second.samples])
+    assert [smpl['value']['value'] for smpl in volts.samples] == pytest.approx([1.25, 1.25], abs = 0.001)
+    assert dev.closed == True
+
+
+def test_cleanupCloses():
+    """
+    Cleaning up closes the device.
+    """
+
+    dev = fakeU3.U3(seed = 5)
+    hw = newHardware(dev)
+    hw.cleanup()
+
+    assert dev.closed == True
@@ -2,7 +2,6 @@
 ### Imports ###
 ###############
 
-import u3
 import traceback
 from hwInterface import counterIface
 
@@ -11,15 +10,72 @@ from hwInterface import counterIface
 ### LabJack U3 hareware abstraction ###
 #######################################
 
+# Analog input channel of the U3's internal temperature sensor.
+u3TempChannel = 30
+
+
+def channelName(ain):
+	"""
+	Get the name an analog input channel's readings go by: 'temp' for the internal temperature sensor, otherwise 'ain' and the channel number.
+	"""
+	
+	if ain == u3TempChannel:
+		return "temp"
+	
+	return "ain%s" %ain
+
+
 class u3Hardware(counterIface):
+	def setU3Props(self, counters = (0,), ain = (), scales = None, pinOffset = 4, fioAnalog = 15, u3Module = None):
+		"""
+		Set LabJack U3 properties. counters are the counters to enable, 0 and/or 1, and the first one is the one poll() returns. ain are analog input channels to read each gate too, with 30 for the internal temperature sensor. scales maps analog channels to a factor their voltages are multiplied by, e.g. the ratio of a high voltage divider.
+		pinOffset is the FIO line the first counter is on, and fioAnalog the mask of FIO lines used as analog inputs. u3Module is the module providing the U3 driver, LabJackPython's u3 by default, or a stand-in such as fakeU3.
+		Everything is read with one getFeedback() command per gate, so a poll is one USB round trip however many channels there are.
+		"""
+		
+		for counter in counters:
+			if counter not in (0, 1):
+				raise ValueError("The U3 only has counters 0 and 1, not %s." %counter)
+		
+		if len(counters) == 0:
+			raise ValueError("At least one U3 counter is needed.")
+		
+		self.__counters = list(counters)
+		self.__ain = list(ain)
+		self.__scales = scales if scales is not None else {}
+		self.__pinOffset = pinOffset
+		self.__fioAnalog = fioAnalog
+		self.__u3Module = u3Module
+		
+		if self._debug == True:
+			print("U3 property set called. Counters %s, analog inputs %s, scales %s." %(self.__counters, self.__ain, self.__scales))
+		
+		return
+	
 	def setup(self):
 		"""
 		Set up and configure counter hardware interface
 		"""
 		
-		# LabJack U3 settings..
-		u3CounterOffset = 4
-		u3FIOAnalog = 15
+		try:
+			self.__counters
+		
+		except AttributeError:
+			# Defaults.
+			self.setU3Props()
+		
+		u3 = self.__u3Module
+		
+		if u3 is None:
+			try:
+				import u3
+			except:
+				raise RuntimeError("To interface with the LabJack U3 please ensure the python library LabJackPython is installed.")
+		
+		self.__u3Lib = u3
+		
+		if self._debug == True:
+			print("Set up LabJack U3 with counters %s, counter offset of %s and FIOAnalog of %s..." %(self.__counters, self.__pinOffset, self.__fioAnalog))
 		
 		try:
 			# Create LabJack U3 object and set debugging.
@@ -28,16 +84,20 @@ class u3Hardware(counterIface):
 		except:
 			raise
 		
-		if self._debug == True:
-			print("Set up LabJack U3 with counter offset of %s and FIOAnalog of %s..." %(u3CounterOffset, u3FIOAnalog))
-		
 		try:
 			# Configure LabJack U3
-			self.__u3.configIO(EnableCounter0 = True, TimerCounterPinOffset = u3CounterOffset, FIOAnalog = u3FIOAnalog)
+			self.__u3.configIO(EnableCounter0 = (0 in self.__counters), EnableCounter1 = (1 in self.__counters), TimerCounterPinOffset = self.__pinOffset, FIOAnalog = self.__fioAnalog)
 		
 		except:
 			raise
 		
+		# Build the feedback command list once: counters first, reset as they're read, then the analog inputs.
+		self.__commands = [getattr(u3, "Counter%s" %counter)(Reset = True) for counter in self.__counters]
+		self.__commands += [u3.AIN(ain) for ain in self.__ain]
+		
+		# Latest reading of every channel.
+		self.__channels = None
+		
 		return
 	
 	def getConfig(self):
@@ -54,11 +114,27 @@ class u3Hardware(counterIface):
 		except:
 			raise
 		
+		retVal['channels'] = ["counter%s" %counter for counter in self.__counters] + [channelName(ain) for ain in self.__ain]
+		
 		return retVal
 	
+	def __convert(self, ain, bits):
+		"""
+		Convert an analog reading to volts, scaled if we have a scale for the channel, or degrees C for the temperature sensor.
+		"""
+		
+		if ain == u3TempChannel:
+			return self.__u3.binaryToCalibratedAnalogTemperature(bits) - 273.15
+		
+		# On the U3-HV the first four inputs are the high voltage ones.
+		isLowVoltage = not (getattr(self.__u3, 'isHV', False) and (ain < 4))
+		volts = self.__u3.binaryToCalibratedAnalogVoltage(bits, isLowVoltage = isLowVoltage, isSingleEnded = True, isSpecialSetting = False, channelNumber = ain)
+		
+		return volts * self.__scales.get(ain, 1.0)
+	
 	def poll(self):
 		"""
-		Poll Counter0 on LabJack U3. Returns counts as an integer.
+		Read every channel in one getFeedback() command. Returns the first counter's counts as an integer, and the rest are available from getChannels().
 		"""
 		
 		# Return value.
@@ -69,13 +145,32 @@ class u3Hardware(counterIface):
 		
 		try:
 			# Get results.
-			retVal = self.__u3.getFeedback(u3.Counter0(Reset = True))[0]
+			results = self.__u3.getFeedback(*self.__commands)
 		
 		except:
 			raise
 		
+		nCounters = len(self.__counters)
+		
+		self.__channels = {}
+		
+		for counter, counts in zip(self.__counters, results[:nCounters]):
+			self.__channels["counter%s" %counter] = counts
+		
+		for ain, bits in zip(self.__ain, results[nCounters:]):
+			self.__channels[channelName(ain)] = self.__convert(ain, bits)
+		
+		retVal = results[0]
+		
 		return retVal
 	
+	def getChannels(self):
+		"""
+		Get the last poll's reading of every channel: 'counter0' and 'counter1' counts, and analog inputs by channelName().
+		"""
+		
+		return self.__channels
+	
 	def cleanup(self):
 		"""
 		Do any necessary cleanup on the LabJack U3 before shutting down.